@@ -0,0 +1,29 @@
+import hmac
+import os
+from typing import Optional
+
+from fastapi import Header, HTTPException
+
+from app import profiling
+
+# Token de las rutas /admin que exponen datos sensibles (SQL con sus parámetros, perfiles)
+# o cambian el estado del servicio (vaciar la caché). Se envía en la cabecera X-Admin-Token
+# o como "Authorization: Bearer <token>". Si no se define se usa PERFILADO_TOKEN; sin
+# ninguno de los dos esas rutas quedan cerradas (403).
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", profiling.PERFILADO_TOKEN)
+
+CABECERA = "X-Admin-Token"
+
+
+def requerir_admin(
+    x_admin_token: Optional[str] = Header(None),
+    authorization: Optional[str] = Header(None),
+):
+    """Dependencia de las rutas de administración protegidas"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Rutas de administración desactivadas: defina ADMIN_TOKEN")
+    token = x_admin_token
+    if token is None and authorization and authorization.lower().startswith("bearer "):
+        token = authorization[7:].strip()
+    if token is None or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Token de administración inválido", headers={"WWW-Authenticate": "Bearer"})
@@ -0,0 +1,49 @@
+import importlib
+import logging
+import time
+
+# Medición del arranque en frío: tiempo de importación de cada módulo y tiempo
+# hasta que el proceso queda listo y entrega su primera respuesta correcta.
+# Los tiempos son relativos a la importación de este módulo, que main hace primero.
+
+INICIO = time.perf_counter()
+
+_importaciones = {}
+_hitos = {}
+
+
+def _ms(instante):
+    return round((instante - INICIO) * 1000, 1)
+
+
+def precargar(modulos):
+    """
+    Importa los módulos en orden y registra el costo incremental de cada uno
+    (sin contar lo que ya importaron los anteriores).
+    """
+    for nombre in modulos:
+        t0 = time.perf_counter()
+        importlib.import_module(nombre)
+        _importaciones[nombre] = round((time.perf_counter() - t0) * 1000, 1)
+
+
+def marcar(hito):
+    """Registra un hito del arranque (solo la primera vez)"""
+    if hito not in _hitos:
+        _hitos[hito] = _ms(time.perf_counter())
+
+
+def registrar_respuesta(status_code):
+    """La llama el middleware en cada respuesta; solo cuenta la primera sin error de servidor"""
+    if "primera_respuesta" not in _hitos and status_code < 500:
+        marcar("primera_respuesta")
+        logging.info(f"Arranque en frío: {reporte()}")
+
+
+def reporte():
+    importaciones = dict(sorted(_importaciones.items(), key=lambda item: item[1], reverse=True))
+    return {
+        "importaciones_ms": importaciones,
+        "importacion_total_ms": round(sum(importaciones.values()), 1),
+        "hitos_ms": dict(_hitos),
+    }
@@ -0,0 +1,518 @@
+import math
+from datetime import datetime, date, time, timedelta
+
+import numpy as np
+
+from app import columnar_store, parquet_store, query_planner, request_context
+from app.query_planner import FUENTE_CRUDA
+
+# Motor único de series temporales para los gráficos.
+# Recibe un rango [inicio, fin), un tamaño de cubeta, filtros y una dimensión
+# opcional para separar series; ejecuta una sola consulta agrupada y pivota
+# el resultado sobre matrices NumPy preasignadas (los huecos quedan en cero).
+
+COLORES = [
+    "#4f46e5", "#7c3aed", "#0891b2", "#15803d", "#ca8a04",
+    "#dc2626", "#ea580c", "#db2777", "#8b5cf6", "#84cc16"
+]
+COLOR_TOTAL = "#6366f1"
+
+MESES_NOMBRES = ['Ene', 'Feb', 'Mar', 'Abr', 'May', 'Jun',
+                 'Jul', 'Ago', 'Sep', 'Oct', 'Nov', 'Dic']
+DIAS_SEMANA = ['Lun', 'Mar', 'Mié', 'Jue', 'Vie', 'Sáb', 'Dom']
+
+# Límite de cubetas por gráfico (p. ej. un año en cubetas de 15 minutos son 35.040)
+MAX_CUBETAS = 50000
+
+# Dimensiones por las que se pueden separar las series
+DIMENSIONES = {
+    "sentido": "sentido_lectura",
+    "ubicacion": "id_ubicacion",
+    "comuna": "comuna",
+}
+
+
+# --- Etiquetas ---
+def generar_etiquetas_horas():
+    """Genera etiquetas para agrupación por hora"""
+    return [f"{h:02d}:00 - {h:02d}:59" for h in range(24)]
+
+def generar_etiquetas_dias(fecha_inicio, fecha_fin):
+    """Genera etiquetas para agrupación por día"""
+    try:
+        inicio = datetime.strptime(fecha_inicio, '%Y-%m-%d').date()
+        fin = datetime.strptime(fecha_fin, '%Y-%m-%d').date()
+        etiquetas = []
+        fecha_actual = inicio
+        while fecha_actual <= fin:
+            etiquetas.append(fecha_actual.strftime('%d-%m'))
+            fecha_actual += timedelta(days=1)
+        return etiquetas
+    except:
+        return []
+
+def generar_etiquetas_semanas(fecha_inicio, fecha_fin):
+    """Genera etiquetas para agrupación por semana"""
+    try:
+        inicio = datetime.strptime(fecha_inicio, '%Y-%m-%d').date()
+        fin = datetime.strptime(fecha_fin, '%Y-%m-%d').date()
+        etiquetas = []
+
+        # Encontrar el lunes de la primera semana
+        fecha_actual = inicio - timedelta(days=inicio.weekday())
+
+        while fecha_actual <= fin:
+            # Calcular el domingo de la semana
+            fin_semana = fecha_actual + timedelta(days=6)
+
+            # Obtener número de semana ISO
+            semana_iso = fecha_actual.isocalendar()[1]
+
+            # Formatear rango de fechas
+            rango = f"{fecha_actual.strftime('%d-%m')} al {fin_semana.strftime('%d-%m')}"
+            etiqueta = f"Semana {semana_iso} ({rango})"
+
+            etiquetas.append(etiqueta)
+            fecha_actual += timedelta(days=7)
+
+        return etiquetas
+    except:
+        return []
+
+def generar_etiquetas_meses(fecha_inicio, fecha_fin):
+    """Genera etiquetas para agrupación por mes"""
+    try:
+        inicio = datetime.strptime(fecha_inicio, '%Y-%m-%d').date()
+        fin = datetime.strptime(fecha_fin, '%Y-%m-%d').date()
+
+        etiquetas = []
+        fecha_actual = inicio.replace(day=1)  # Primer día del mes
+
+        while fecha_actual <= fin:
+            etiquetas.append(MESES_NOMBRES[fecha_actual.month - 1])
+            fecha_actual = _sumar_meses(fecha_actual, 1)
+
+        return etiquetas
+    except:
+        return []
+
+def generar_etiquetas_minutos(inicio, fin, minutos):
+    """Genera etiquetas para cubetas de `minutos` minutos entre inicio y fin"""
+    un_dia = fin - inicio <= timedelta(days=1)
+    formato = '%H:%M' if un_dia else '%d-%m %H:%M'
+    paso = timedelta(minutes=minutos)
+    etiquetas = []
+    actual = inicio
+    while actual < fin:
+        etiquetas.append(actual.strftime(formato))
+        actual += paso
+    return etiquetas
+
+
+def _sumar_meses(fecha, meses):
+    indice = fecha.year * 12 + fecha.month - 1 + meses
+    return fecha.replace(year=indice // 12, month=indice % 12 + 1, day=1)
+
+def _a_datetime(fecha):
+    return datetime.combine(fecha, time.min)
+
+
+# --- Cubetas ---
+class Cubeta:
+    """
+    Tamaño de cubeta de un gráfico:
+    - 'minutos': cubetas de `minutos` minutos desde el inicio del rango
+    - 'dia', 'semana' (lunes a domingo), 'mes': cubetas de calendario
+    - 'hora_del_dia': perfil de 24 horas sumando todos los días del rango
+    """
+
+    def __init__(self, tipo, minutos=None):
+        if tipo not in ("minutos", "dia", "semana", "mes", "hora_del_dia"):
+            raise ValueError(f"Tipo de cubeta no soportado: {tipo}")
+        if tipo == "minutos" and (not minutos or minutos <= 0):
+            raise ValueError("Las cubetas por minutos requieren un tamaño positivo")
+        self.tipo = tipo
+        self.minutos = minutos
+
+    def origen(self, inicio):
+        """Instante desde el que se numeran las cubetas"""
+        if self.tipo == "semana":
+            lunes = inicio.date() - timedelta(days=inicio.weekday())
+            return _a_datetime(lunes)
+        if self.tipo == "mes":
+            return _a_datetime(inicio.date().replace(day=1))
+        return inicio
+
+    def cantidad(self, inicio, fin):
+        """Número de cubetas necesarias para cubrir [inicio, fin)"""
+        if self.tipo == "hora_del_dia":
+            return 24
+        if fin <= inicio:
+            return 0
+        origen = self.origen(inicio)
+        ultimo = fin - timedelta(microseconds=1)
+        if self.tipo == "minutos":
+            return math.ceil((fin - origen).total_seconds() / (self.minutos * 60))
+        if self.tipo == "dia":
+            return (ultimo.date() - origen.date()).days + 1
+        if self.tipo == "semana":
+            return (ultimo.date() - origen.date()).days // 7 + 1
+        return (ultimo.year - origen.year) * 12 + ultimo.month - origen.month + 1
+
+    def expresion_sql(self, inicio, columna="fecha_lectura"):
+        """Expresión SQL que calcula el índice de cubeta de cada fila, con sus parámetros"""
+        origen = self.origen(inicio)
+        if self.tipo == "minutos":
+            return f"FLOOR(TIMESTAMPDIFF(SECOND, %s, {columna}) / %s)", [origen, self.minutos * 60]
+        if self.tipo == "dia":
+            return f"DATEDIFF({columna}, %s)", [origen.date()]
+        if self.tipo == "semana":
+            return f"FLOOR(DATEDIFF({columna}, %s) / 7)", [origen.date()]
+        if self.tipo == "mes":
+            return f"PERIOD_DIFF(EXTRACT(YEAR_MONTH FROM {columna}), %s)", [origen.year * 100 + origen.month]
+        return f"HOUR({columna})", []
+
+    def indices(self, instantes, inicio):
+        """Índice de cubeta de un arreglo NumPy de instantes (datetime64[s])"""
+        if self.tipo == "hora_del_dia":
+            return ((instantes - instantes.astype('datetime64[D]')) // np.timedelta64(1, 'h')).astype(np.int64)
+        origen = np.datetime64(self.origen(inicio), 's')
+        if self.tipo == "minutos":
+            return ((instantes - origen) // np.timedelta64(self.minutos * 60, 's')).astype(np.int64)
+        dias = (instantes.astype('datetime64[D]') - origen.astype('datetime64[D]')).astype(np.int64)
+        if self.tipo == "dia":
+            return dias
+        if self.tipo == "semana":
+            return dias // 7
+        meses = instantes.astype('datetime64[M]').astype(np.int64)
+        return meses - origen.astype('datetime64[M]').astype(np.int64)
+
+    def etiquetas(self, inicio, fin):
+        """Etiquetas por defecto para las cubetas de [inicio, fin)"""
+        if self.tipo == "hora_del_dia":
+            return generar_etiquetas_horas()
+        if self.tipo == "minutos":
+            return generar_etiquetas_minutos(inicio, fin, self.minutos)
+        fecha_inicio = inicio.strftime('%Y-%m-%d')
+        fecha_fin = (fin - timedelta(microseconds=1)).strftime('%Y-%m-%d')
+        if self.tipo == "dia":
+            return generar_etiquetas_dias(fecha_inicio, fecha_fin)
+        if self.tipo == "semana":
+            return generar_etiquetas_semanas(fecha_inicio, fecha_fin)
+        return generar_etiquetas_meses(fecha_inicio, fecha_fin)
+
+
+# --- Planificación de períodos ---
+class PlanGrafico:
+    """Rango, cubeta y etiquetas de un gráfico"""
+
+    def __init__(self, inicio, fin, cubeta, etiquetas=None, hora_inicio=None, hora_fin=None):
+        self.inicio = inicio
+        self.fin = fin
+        self.cubeta = cubeta
+        self.num_cubetas = cubeta.cantidad(inicio, fin)
+        if self.num_cubetas > MAX_CUBETAS:
+            raise ValueError(f"El gráfico tendría {self.num_cubetas} cubetas (máximo {MAX_CUBETAS})")
+        self.etiquetas = etiquetas if etiquetas is not None else cubeta.etiquetas(inicio, fin)
+        self.hora_inicio = hora_inicio
+        self.hora_fin = hora_fin
+
+
+def planificar_periodo(periodo, fecha_inicio=None, fecha_fin=None, agrupar_por="auto",
+                       intervalo_minutos=None, hora_inicio=None, hora_fin=None, hoy=None):
+    """
+    Traduce los parámetros de los endpoints de gráficos a un PlanGrafico.
+    Devuelve None si el período personalizado no trae fechas.
+    `intervalo_minutos` fuerza cubetas de ese tamaño para cualquier período.
+    """
+    hoy = hoy or datetime.now().date()
+
+    if periodo == "mes":
+        inicio = _a_datetime(hoy.replace(day=1))
+        fin = _a_datetime(_sumar_meses(hoy, 1))
+        cubeta = Cubeta("semana")
+        etiquetas = None
+        if not intervalo_minutos:
+            etiquetas = [
+                f"Semana {(cubeta.origen(inicio) + timedelta(days=7 * i)).isocalendar()[1]}"
+                for i in range(cubeta.cantidad(inicio, fin))
+            ]
+
+    elif periodo == "anio":
+        inicio = _a_datetime(date(hoy.year, 1, 1))
+        fin = _a_datetime(date(hoy.year + 1, 1, 1))
+        cubeta = Cubeta("mes")
+        etiquetas = list(MESES_NOMBRES)
+
+    elif periodo == "semana":
+        inicio_semana = hoy - timedelta(days=hoy.weekday())
+        fin_semana = inicio_semana + timedelta(days=6)
+        inicio = _a_datetime(inicio_semana)
+        fin = _a_datetime(fin_semana + timedelta(days=1))
+        cubeta = Cubeta("dia")
+        # Incluir el número de semana ISO y rango de fechas en la primera etiqueta
+        semana_iso = inicio_semana.isocalendar()[1]
+        rango_fechas = f"{inicio_semana.strftime('%d-%m')} al {fin_semana.strftime('%d-%m')}"
+        etiquetas = list(DIAS_SEMANA)
+        etiquetas[0] = f"Semana {semana_iso} ({rango_fechas}) - {etiquetas[0]}"
+
+    elif periodo == "personalizado":
+        if not fecha_inicio or not fecha_fin:
+            return None
+        inicio = datetime.strptime(fecha_inicio, '%Y-%m-%d')
+        fin = datetime.strptime(fecha_fin, '%Y-%m-%d') + timedelta(days=1)
+        dias_diferencia = (fin - inicio).days
+
+        agrupar_por_param = agrupar_por if agrupar_por in ("hora", "dia", "semana", "mes") else "dia"
+        # La agrupación por hora solo aplica para rangos ≤ 7 días
+        if agrupar_por_param == "hora" and dias_diferencia > 7:
+            agrupar_por_param = "dia"
+
+        cubeta = Cubeta("hora_del_dia" if agrupar_por_param == "hora" else agrupar_por_param)
+        etiquetas = None
+
+    else:
+        # Período HOY: 24 franjas horarias
+        inicio = _a_datetime(hoy)
+        fin = inicio + timedelta(days=1)
+        cubeta = Cubeta("minutos", 60)
+        etiquetas = generar_etiquetas_horas()
+
+    if intervalo_minutos:
+        cubeta = Cubeta("minutos", intervalo_minutos)
+        etiquetas = None
+
+    if periodo != "personalizado":
+        hora_inicio = hora_fin = None
+
+    return PlanGrafico(inicio, fin, cubeta, etiquetas, hora_inicio, hora_fin)
+
+
+# --- Filtros ---
+class Filtros:
+    """Filtros de las consultas de conteo, ya resueltos a valores de columna"""
+
+    def __init__(self, comunas=None, ubicaciones=None, sentidos_valores=None, sensores=None):
+        self.comunas = comunas
+        self.ubicaciones = ubicaciones
+        self.sentidos_valores = sentidos_valores
+        self.sensores = sensores
+
+    def clausulas(self, hora_inicio=None, hora_fin=None, fuente=FUENTE_CRUDA):
+        """Condiciones SQL adicionales y sus parámetros, con las columnas de `fuente`"""
+        condiciones, params = fuente.condiciones_horas(hora_inicio, hora_fin)
+        for columna, valores in (
+            ("comuna", self.comunas),
+            ("id_ubicacion", self.ubicaciones),
+            ("sentido_lectura", self.sentidos_valores),
+            ("id_sensor", self.sensores),
+        ):
+            if valores:
+                placeholders = ", ".join(["%s"] * len(valores))
+                condiciones.append(f"{fuente.columnas[columna]} IN ({placeholders})")
+                params.extend(valores)
+        return condiciones, params
+
+
+def nombres_comunas(cursor):
+    """Comunas en el orden en que los endpoints las indexan con comuna_id"""
+    cursor.execute("SELECT DISTINCT comuna FROM UBICACIONES ORDER BY comuna")
+    return [row['comuna'] for row in cursor.fetchall()]
+
+def valores_sentidos(cursor, sentidos):
+    """Valores de sentido_lectura para una lista de IDs de SENTIDOS_SENSOR separada por coma"""
+    sentidos_list = [int(s.strip()) for s in sentidos.split(',') if s.strip().isdigit()]
+    if not sentidos_list:
+        return []
+    placeholders = ", ".join(["%s"] * len(sentidos_list))
+    cursor.execute(f"""
+        SELECT sentido_lectura
+        FROM SENTIDOS_SENSOR
+        WHERE id IN ({placeholders})
+    """, sentidos_list)
+    return [row['sentido_lectura'] for row in cursor.fetchall()]
+
+def resolver_filtros(cursor, comuna_id=None, ubicacion_id=None, sentidos=None):
+    """Resuelve los parámetros de filtro de los endpoints a valores de columna"""
+    filtros = Filtros()
+    if comuna_id is not None:
+        comunas = nombres_comunas(cursor)
+        if 0 <= comuna_id < len(comunas):
+            filtros.comunas = [comunas[comuna_id]]
+    if ubicacion_id is not None:
+        filtros.ubicaciones = [ubicacion_id]
+    if sentidos:
+        filtros.sentidos_valores = valores_sentidos(cursor, sentidos) or None
+    return filtros
+
+
+# --- Resultado ---
+class ResultadoSeries:
+    """Conteos pivotados: una fila por clave de la dimensión y una columna por cubeta"""
+
+    def __init__(self, etiquetas, claves, matriz, totales):
+        self.etiquetas = etiquetas
+        self.claves = claves
+        self.matriz = matriz
+        self.totales = totales
+
+    def resumen(self):
+        """Forma de ResumenResponse"""
+        datos = self.totales.tolist()
+        return {
+            "etiquetas": self.etiquetas,
+            "datos": datos,
+            "total": int(self.totales.sum())
+        }
+
+    def detallado(self):
+        """Forma de GraficoDetalladoResponse: serie Total seguida de una serie por clave"""
+        series = [{"nombre": "Total", "datos": self.totales.tolist(), "color": COLOR_TOTAL}]
+        for idx, (clave, fila) in enumerate(zip(self.claves, self.matriz)):
+            series.append({
+                "nombre": str(clave),
+                "datos": fila.tolist(),
+                "color": COLORES[idx % len(COLORES)]
+            })
+        return {
+            "etiquetas": self.etiquetas,
+            "series": series,
+            "total": int(self.totales.sum())
+        }
+
+
+def pivotar(plan, filas, sin_clave="Sin sentido", claves=None):
+    """
+    Construye un ResultadoSeries desde filas (cubeta, clave, total) de una consulta agrupada.
+    Las claves vacías (NULL, '' o 0, como las guardan los rollups) van a `sin_clave`.
+    Si se indican `claves`, se usa ese orden (incluidas las claves sin datos)
+    y se descartan las filas de otras claves.
+    """
+    num_cubetas = plan.num_cubetas
+    if claves is None:
+        claves = sorted({f[1] or sin_clave for f in filas}, key=str)
+    else:
+        claves = list(claves)
+        conocidas = set(claves)
+        filas = [f for f in filas if (f[1] or sin_clave) in conocidas]
+    posicion = {clave: i for i, clave in enumerate(claves)}
+
+    matriz = np.zeros((len(claves), num_cubetas), dtype=np.int64)
+    if filas:
+        cubetas = np.fromiter((int(f[0]) for f in filas), dtype=np.int64, count=len(filas))
+        indices = np.fromiter(
+            (posicion[f[1] or sin_clave] for f in filas),
+            dtype=np.int64, count=len(filas)
+        )
+        totales = np.fromiter((int(f[2]) for f in filas), dtype=np.int64, count=len(filas))
+        validas = (cubetas >= 0) & (cubetas < num_cubetas)
+        np.add.at(matriz, (indices[validas], cubetas[validas]), totales[validas])
+
+    etiquetas = plan.etiquetas
+    if len(etiquetas) != num_cubetas:
+        etiquetas = (list(etiquetas) + [""] * num_cubetas)[:num_cubetas]
+
+    return ResultadoSeries(etiquetas, claves, matriz, matriz.sum(axis=0))
+
+
+def _consulta_segmento(plan, segmento, filtros, columna_dimension):
+    """SELECT agrupado por (cubeta, clave) de un segmento del plan de consulta"""
+    fuente = segmento.fuente
+    expresion, params = plan.cubeta.expresion_sql(plan.inicio, fuente.columna_tiempo)
+    columna = fuente.columnas[columna_dimension] if columna_dimension else "NULL"
+
+    condiciones = [f"{fuente.columna_tiempo} >= %s", f"{fuente.columna_tiempo} < %s"]
+    params += [segmento.inicio, segmento.fin]
+    extra, params_extra = filtros.clausulas(plan.hora_inicio, plan.hora_fin, fuente)
+    condiciones += extra
+    params += params_extra
+
+    sql = f"""
+        SELECT {expresion} AS cubeta, {columna} AS clave, {fuente.conteo} AS total
+        FROM {fuente.tabla}
+        WHERE {" AND ".join(condiciones)}
+        GROUP BY cubeta, clave
+    """
+    return sql, params
+
+
+def calcular_series(cursor, plan, filtros, dimension=None, sin_clave="Sin sentido", claves=None):
+    """
+    Ejecuta una única consulta agrupada por (cubeta, dimensión) y devuelve
+    el ResultadoSeries con los huecos rellenados en cero.
+    Los días ya exportados al almacén Parquet se cuentan con DuckDB; del resto del rango,
+    si cae en la ventana del almacén columnar se calcula en memoria y si no, el
+    planificador decide si cada tramo se lee de los rollups o de LECTURAS y los
+    tramos se unen en la misma consulta.
+    `dimension` es una clave de DIMENSIONES o None para una sola serie;
+    `claves` fija el orden y el conjunto de series (ver pivotar).
+    """
+    columna_dimension = DIMENSIONES[dimension] if dimension else None
+    inicio = plan.inicio
+    filas = []
+    planes = []
+
+    # Días cerrados en el almacén Parquet: MySQL solo cuenta desde el corte
+    historico = parquet_store.almacen
+    corte = historico.corte(plan.inicio, plan.fin) if historico is not None else None
+    if corte is not None:
+        filas_historicas = historico.series(plan, filtros, columna_dimension, plan.inicio, corte)
+        if filas_historicas is not None:
+            planes.append(f"parquet[{plan.inicio.strftime('%Y-%m-%d')},{corte.strftime('%Y-%m-%d')})")
+            filas += filas_historicas
+            inicio = corte
+
+    if inicio < plan.fin:
+        almacen = columnar_store.almacen
+        if almacen is not None and almacen.cubre(inicio):
+            # Rango dentro de la ventana del almacén en memoria: sin SQL
+            planes.append(f"memoria[{inicio.strftime('%Y-%m-%d %H:%M')},{plan.fin.strftime('%Y-%m-%d %H:%M')})")
+            filas += almacen.series(plan, filtros, columna_dimension, inicio)
+        else:
+            plan_consulta = query_planner.planificar(
+                plan.cubeta, inicio, plan.fin, plan.hora_inicio, plan.hora_fin,
+                query_planner.obtener_marcas(cursor), origen=plan.inicio
+            )
+            planes.append(plan_consulta.descripcion())
+            filas += _filas_consulta(cursor, plan, plan_consulta, filtros, columna_dimension)
+    request_context.registrar_plan(" + ".join(planes) or "vacio")
+
+    if dimension is None:
+        filas = [(cubeta, "Total", total) for cubeta, _, total in filas]
+    return pivotar(plan, filas, sin_clave, claves)
+
+
+def _filas_consulta(cursor, plan, plan_consulta, filtros, columna_dimension):
+    """Filas (cubeta, clave, total) de los segmentos del plan de consulta, en un solo SELECT"""
+    consultas = [
+        _consulta_segmento(plan, segmento, filtros, columna_dimension)
+        for segmento in plan_consulta.segmentos
+    ]
+    if not consultas:
+        return []
+
+    if len(consultas) == 1:
+        sql, params = consultas[0]
+    else:
+        sql = f"""
+            SELECT cubeta, clave, SUM(total) AS total
+            FROM ({" UNION ALL ".join(f"({consulta})" for consulta, _ in consultas)}) AS tramos
+            GROUP BY cubeta, clave
+        """
+        params = [param for _, params_consulta in consultas for param in params_consulta]
+
+    cursor.execute(sql, params)
+    return [(row['cubeta'], row['clave'], row['total']) for row in cursor.fetchall()]
+
+
+def conteos_diarios(cursor, desde, hasta, filtros=None):
+    """Conteo de lecturas por día para las fechas [desde, hasta] (arreglo NumPy)"""
+    if hasta < desde:
+        return np.zeros(0, dtype=np.int64)
+    plan = PlanGrafico(_a_datetime(desde), _a_datetime(hasta + timedelta(days=1)), Cubeta("dia"), etiquetas=[])
+    return calcular_series(cursor, plan, filtros or Filtros()).totales
+
+
+def conteo_total(cursor, desde, hasta, filtros=None):
+    """Total de lecturas para las fechas [desde, hasta]"""
+    return int(conteos_diarios(cursor, desde, hasta, filtros).sum())
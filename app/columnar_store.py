@@ -0,0 +1,327 @@
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from app import compact_store
+from app.database import api_pool
+from app.query_planner import normalizar_hora
+
+# Almacén columnar en memoria de las lecturas recientes (opcional).
+# Guarda los instantes de lectura en un arreglo datetime64 ordenado y, en paralelo,
+# códigos enteros pequeños para ubicación, sensor, comuna y sentido. Los gráficos e
+# indicadores cuyo rango cae dentro de la ventana se calculan con np.bincount sobre
+# estos arreglos en lugar de consultar MySQL.
+# Se carga al arrancar, la ingestión MQTT de este proceso le agrega cada lectura
+# confirmada y se recorta una vez al día. Solo es exacto si toda la ingestión pasa
+# por este proceso.
+
+# Días de la ventana (0 desactiva el almacén) y máximo de filas en memoria
+ALMACEN_COLUMNAR_DIAS = int(os.getenv("ALMACEN_COLUMNAR_DIAS", "0"))
+ALMACEN_COLUMNAR_MAX_FILAS = int(os.getenv("ALMACEN_COLUMNAR_MAX_FILAS", "20000000"))
+ALMACEN_COLUMNAR_LOTE_CARGA = int(os.getenv("ALMACEN_COLUMNAR_LOTE_CARGA", "100000"))
+
+CAPACIDAD_INICIAL = 65536
+
+# Columna lógica → (columna de LECTURAS, tipo de los códigos)
+COLUMNAS = {
+    "id_ubicacion": ("ID_UBICACION", np.int32),
+    "id_sensor": ("ID_SENSOR", np.int32),
+    "comuna": ("COMUNA", np.int16),
+    "sentido_lectura": ("SENTIDO_LECTURA", np.int16),
+}
+
+
+class Diccionario:
+    """Codificación valor → entero pequeño de una columna; el código 0 es NULL"""
+
+    def __init__(self):
+        self.valores = [None]
+        self.codigos = {None: 0}
+
+    def codificar(self, valor):
+        codigo = self.codigos.get(valor)
+        if codigo is None:
+            codigo = len(self.valores)
+            self.codigos[valor] = codigo
+            self.valores.append(valor)
+        return codigo
+
+    def codigos_de(self, valores):
+        """Códigos conocidos de una lista de valores (los desconocidos no coinciden con nada)"""
+        return [self.codigos[valor] for valor in valores if valor in self.codigos]
+
+
+class AlmacenColumnar:
+    def __init__(self, dias, max_filas):
+        self.dias = dias
+        self.max_filas = max_filas
+        self._lock = threading.Lock()
+        self.diccionarios = {columna: Diccionario() for columna in COLUMNAS}
+        self._reservar(min(CAPACIDAD_INICIAL, self.max_filas))
+        self.filas = 0
+        self.desde = None
+        self.listo = False
+        self._cargando = False
+        self._pendientes = []
+        self._corte_carga = None
+        self.ultimo_recorte = None
+
+    # --- Arreglos ---
+    def _reservar(self, capacidad):
+        self.instantes = np.zeros(capacidad, dtype='datetime64[s]')
+        self.codigos = {
+            columna: np.zeros(capacidad, dtype=tipo)
+            for columna, (_, tipo) in COLUMNAS.items()
+        }
+
+    @property
+    def capacidad(self):
+        return len(self.instantes)
+
+    def _crecer(self, necesarias):
+        """Duplica la capacidad (hasta max_filas); si no alcanza, recorta los días más antiguos"""
+        nuevas = necesarias - self.filas
+        if necesarias > self.capacidad and self.capacidad < self.max_filas:
+            capacidad = min(max(self.capacidad * 2, necesarias), self.max_filas)
+            instantes, codigos = self.instantes, self.codigos
+            self._reservar(capacidad)
+            self.instantes[:self.filas] = instantes[:self.filas]
+            for columna in COLUMNAS:
+                self.codigos[columna][:self.filas] = codigos[columna][:self.filas]
+        while necesarias > self.capacidad and self.filas:
+            # Descarta al menos el 10% más antiguo, hasta el siguiente cambio de día
+            limite = self.instantes[self.filas // 10].astype('datetime64[D]') + np.timedelta64(1, 'D')
+            self._descartar_hasta(limite.astype(datetime))
+            necesarias = self.filas + nuevas
+
+    def _descartar_hasta(self, desde):
+        """Elimina las filas anteriores a `desde` y mueve el inicio de la ventana"""
+        desde = datetime.combine(desde, datetime.min.time()) if not isinstance(desde, datetime) else desde
+        corte = int(np.searchsorted(self.instantes[:self.filas], np.datetime64(desde, 's')))
+        if corte:
+            # Arreglos nuevos: las instantáneas de los lectores siguen viendo los anteriores
+            restantes = self.filas - corte
+            instantes, codigos = self.instantes, self.codigos
+            self._reservar(self.capacidad)
+            self.instantes[:restantes] = instantes[corte:self.filas]
+            for columna in COLUMNAS:
+                self.codigos[columna][:restantes] = codigos[columna][corte:self.filas]
+            self.filas = restantes
+        if self.desde is None or desde > self.desde:
+            self.desde = desde
+
+    def _agregar_filas(self, instantes, valores_por_columna):
+        """Agrega filas ya ordenadas por instante (con el lock tomado)"""
+        cantidad = len(instantes)
+        if not cantidad:
+            return
+        if cantidad > self.max_filas:
+            # Un lote mayor que el almacén completo: solo caben las más recientes
+            instantes = instantes[-self.max_filas:]
+            valores_por_columna = {c: v[-self.max_filas:] for c, v in valores_por_columna.items()}
+            cantidad = self.max_filas
+        self._crecer(self.filas + cantidad)
+        fin = self.filas + cantidad
+        self.instantes[self.filas:fin] = instantes
+        for columna, valores in valores_por_columna.items():
+            diccionario = self.diccionarios[columna]
+            self.codigos[columna][self.filas:fin] = [diccionario.codificar(v) for v in valores]
+        self.filas = fin
+
+    # --- Carga, ingestión y recorte ---
+    def cargar(self, conn, ahora=None):
+        """Carga desde LECTURAS las lecturas de la ventana, por lotes"""
+        ahora = ahora or datetime.now()
+        desde = datetime.combine(ahora.date() - timedelta(days=self.dias), datetime.min.time())
+        with self._lock:
+            self._reservar(min(CAPACIDAD_INICIAL, self.max_filas))
+            self.filas = 0
+            self.desde = desde
+            self.listo = False
+            self._cargando = True
+            self._pendientes = []
+            self._corte_carga = ahora
+
+        columnas_sql = ", ".join(columna for columna, _ in COLUMNAS.values())
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"""
+                SELECT FECHA_LECTURA, {columnas_sql}, {compact_store.cantidad()}
+                FROM {compact_store.ORIGEN} AS crudas
+                WHERE FECHA_LECTURA >= %s AND FECHA_LECTURA < %s
+                ORDER BY FECHA_LECTURA
+            """, (desde, ahora))
+            while True:
+                lote = cursor.fetchmany(ALMACEN_COLUMNAR_LOTE_CARGA)
+                if not lote:
+                    break
+                if compact_store.compacto():
+                    # Una fila por bicicleta, como las que agrega la ingestión
+                    lote = [fila for fila in lote for _ in range(int(fila[-1]))]
+                instantes = np.array([fila[0] for fila in lote], dtype='datetime64[s]')
+                valores = {
+                    columna: [fila[i + 1] for fila in lote]
+                    for i, columna in enumerate(COLUMNAS)
+                }
+                with self._lock:
+                    self._agregar_filas(instantes, valores)
+        except Exception:
+            with self._lock:
+                self._cargando = False
+                self._pendientes = []
+            raise
+        finally:
+            cursor.close()
+
+        with self._lock:
+            # Lecturas ingeridas mientras se cargaba
+            pendientes = sorted(self._pendientes, key=lambda p: p[0])
+            self._pendientes = []
+            self._cargando = False
+            if pendientes:
+                self._agregar_filas(
+                    np.array([p[0] for p in pendientes], dtype='datetime64[s]'),
+                    {columna: [p[i + 1] for p in pendientes] for i, columna in enumerate(COLUMNAS)}
+                )
+            self.ultimo_recorte = ahora.date()
+            self.listo = True
+        logging.info(f"Almacén columnar cargado: {self.filas} lecturas desde {desde}")
+
+    def agregar(self, momento, id_ubicacion, id_sensor, comuna, sentido_lectura):
+        """Registra una lectura confirmada por la ingestión"""
+        fila = (momento, id_ubicacion, id_sensor, comuna, sentido_lectura)
+        with self._lock:
+            if self._cargando:
+                if momento >= self._corte_carga:
+                    self._pendientes.append(fila)
+                return
+            if not self.listo:
+                return
+            instante = np.datetime64(momento, 's')
+            # Mantener el orden aunque el reloj retroceda
+            if self.filas and instante < self.instantes[self.filas - 1]:
+                instante = self.instantes[self.filas - 1]
+            self._agregar_filas(
+                np.array([instante]),
+                {columna: [fila[i + 1]] for i, columna in enumerate(COLUMNAS)}
+            )
+            if self.ultimo_recorte != momento.date():
+                self._recortar(momento)
+
+    def _recortar(self, ahora):
+        desde = datetime.combine(ahora.date() - timedelta(days=self.dias), datetime.min.time())
+        self._descartar_hasta(desde)
+        self.ultimo_recorte = ahora.date()
+
+    def recortar(self, ahora=None):
+        """Descarta las lecturas que salieron de la ventana"""
+        with self._lock:
+            if self.listo:
+                self._recortar(ahora or datetime.now())
+
+    # --- Consultas ---
+    def cubre(self, inicio):
+        """Indica si las lecturas desde `inicio` están completas en memoria"""
+        return self.listo and self.desde is not None and inicio >= self.desde
+
+    def _instantanea(self):
+        with self._lock:
+            filas = self.filas
+            return self.instantes[:filas], {c: a[:filas] for c, a in self.codigos.items()}
+
+    def series(self, plan, filtros, columna_dimension=None, inicio=None):
+        """
+        Filas (cubeta, clave, total) del plan, como las devolvería la consulta agrupada.
+        `columna_dimension` es una de las columnas de COLUMNAS o None; `inicio` limita
+        el conteo a [inicio, plan.fin) cuando el tramo anterior se cuenta en otra fuente.
+        """
+        instantes, codigos = self._instantanea()
+        i0, i1 = np.searchsorted(instantes, [np.datetime64(inicio or plan.inicio, 's'), np.datetime64(plan.fin, 's')])
+        instantes = instantes[i0:i1]
+        codigos = {columna: arreglo[i0:i1] for columna, arreglo in codigos.items()}
+
+        mascara = np.ones(len(instantes), dtype=bool)
+        if plan.hora_inicio or plan.hora_fin:
+            segundos = ((instantes - instantes.astype('datetime64[D]')) // np.timedelta64(1, 's')).astype(np.int64)
+            if plan.hora_inicio:
+                mascara &= segundos >= _segundos_del_dia(normalizar_hora(plan.hora_inicio))
+            if plan.hora_fin:
+                mascara &= segundos <= _segundos_del_dia(normalizar_hora(plan.hora_fin, fin=True))
+        for columna, valores in (
+            ("comuna", filtros.comunas),
+            ("id_ubicacion", filtros.ubicaciones),
+            ("sentido_lectura", filtros.sentidos_valores),
+            ("id_sensor", filtros.sensores),
+        ):
+            if valores:
+                mascara &= np.isin(codigos[columna], self.diccionarios[columna].codigos_de(valores))
+
+        num_cubetas = plan.num_cubetas
+        cubetas = plan.cubeta.indices(instantes[mascara], plan.inicio)
+        validas = (cubetas >= 0) & (cubetas < num_cubetas)
+        cubetas = cubetas[validas]
+
+        if columna_dimension is None:
+            conteos = np.bincount(cubetas, minlength=num_cubetas)
+            return [(cubeta, None, int(total)) for cubeta, total in enumerate(conteos) if total]
+
+        claves = codigos[columna_dimension][mascara][validas].astype(np.int64)
+        valores = self.diccionarios[columna_dimension].valores
+        conteos = np.bincount(claves * num_cubetas + cubetas, minlength=len(valores) * num_cubetas)
+        filas = []
+        for posicion in np.flatnonzero(conteos):
+            codigo, cubeta = divmod(int(posicion), num_cubetas)
+            filas.append((cubeta, valores[codigo], int(conteos[posicion])))
+        return filas
+
+    def estadisticas(self):
+        with self._lock:
+            bytes_arreglos = self.instantes.nbytes + sum(a.nbytes for a in self.codigos.values())
+            return {
+                "activo": True,
+                "listo": self.listo,
+                "dias": self.dias,
+                "desde": self.desde.isoformat() if self.desde else None,
+                "filas": self.filas,
+                "capacidad": self.capacidad,
+                "max_filas": self.max_filas,
+                "memoria_bytes": int(bytes_arreglos),
+                "cardinalidades": {c: len(d.valores) - 1 for c, d in self.diccionarios.items()},
+            }
+
+
+def _segundos_del_dia(hora):
+    horas, minutos, segundos = (int(parte) for parte in hora.split(":"))
+    return horas * 3600 + minutos * 60 + segundos
+
+
+almacen = AlmacenColumnar(ALMACEN_COLUMNAR_DIAS, ALMACEN_COLUMNAR_MAX_FILAS) if ALMACEN_COLUMNAR_DIAS > 0 else None
+
+
+def activo():
+    return almacen is not None
+
+
+def cargar_desde_pool():
+    """Carga inicial del almacén con una conexión del pool de la API"""
+    if almacen is None:
+        return
+    conn = api_pool.get_connection()
+    try:
+        almacen.cargar(conn)
+    finally:
+        conn.close()
+
+
+def registrar_lectura(momento, id_ubicacion, id_sensor, comuna, sentido_lectura):
+    if almacen is not None:
+        almacen.agregar(momento, id_ubicacion, id_sensor, comuna, sentido_lectura)
+
+
+def estadisticas():
+    if almacen is None:
+        return {"activo": False}
+    return almacen.estadisticas()
@@ -0,0 +1,100 @@
+import os
+import threading
+
+# Modo de almacenamiento de las lecturas crudas.
+# 'filas' (por omisión): LECTURAS guarda una fila por bicicleta, con sensor, comuna,
+# ubicación, dirección y sentido repetidos como texto.
+# 'conteos': la ingestión acumula en LECTURAS_MINUTO una fila por (minuto, ubicación,
+# sensor, sentido) con claves enteras y la cantidad de bicicletas de ese minuto; los
+# textos se resuelven con las tablas de dimensiones al leer. Los conteos pasan de
+# COUNT(*) a SUM(CANTIDAD) y se leen muchas menos filas.
+# Todos los lectores de filas crudas (planificador, rollups, /consulta, /lecturas, almacenes,
+# registro de sensores) usan ORIGEN, CONTEO y cantidad() en lugar de nombrar LECTURAS.
+# En modo conteos la hora es la del minuto de recepción (FECHA_REAL/HORA_REAL no se guardan),
+# y comuna y sentido son los vigentes en UBICACIONES y SENTIDOS_SENSOR, no los del momento
+# de la lectura. benchmarks/compactar.py pasa el histórico de LECTURAS a LECTURAS_MINUTO.
+
+LECTURAS_MODO = os.getenv("LECTURAS_MODO", "filas")
+
+TABLA_CONTEOS = "LECTURAS_MINUTO"
+# Marca de ROLLUP_ESTADO: hasta dónde se compactó el histórico de LECTURAS
+MARCA_COMPACTACION = "compactado"
+
+DDL = f"""
+    CREATE TABLE IF NOT EXISTS {TABLA_CONTEOS} (
+        MINUTO DATETIME NOT NULL,
+        ID_UBICACION INT NOT NULL,
+        ID_SENSOR INT NOT NULL,
+        ID_SENTIDO INT NOT NULL,
+        CANTIDAD INT NOT NULL,
+        PRIMARY KEY (MINUTO, ID_UBICACION, ID_SENSOR, ID_SENTIDO),
+        KEY idx_conteos_ubicacion (ID_UBICACION, MINUTO)
+    )
+"""
+
+# Vista de LECTURAS_MINUTO con las columnas de LECTURAS más CANTIDAD. Sin agregación,
+# MySQL la funde con la consulta exterior y los filtros de FECHA_LECTURA usan la clave primaria.
+_ORIGEN_CONTEOS = f"""(
+    SELECT
+        c.MINUTO AS FECHA_LECTURA,
+        NULLIF(c.ID_UBICACION, 0) AS ID_UBICACION,
+        NULLIF(c.ID_SENSOR, 0) AS ID_SENSOR,
+        s.NOMBRE_SENSOR,
+        u.COMUNA,
+        u.UBICACION_ENDPOINT,
+        ss.DIRECCION,
+        ss.SENTIDO_LECTURA,
+        c.CANTIDAD
+    FROM {TABLA_CONTEOS} c
+    LEFT JOIN UBICACIONES u ON u.ID_UBICACION = c.ID_UBICACION
+    LEFT JOIN SENSORES s ON s.ID_SENSOR = c.ID_SENSOR
+    LEFT JOIN SENTIDOS_SENSOR ss ON ss.ID = c.ID_SENTIDO
+)"""
+
+
+def compacto():
+    return LECTURAS_MODO == "conteos"
+
+
+# Tabla (o tabla derivada) de las lecturas crudas y cómo se cuentan
+ORIGEN = _ORIGEN_CONTEOS if compacto() else "LECTURAS"
+CONTEO = "SUM(CANTIDAD)" if compacto() else "COUNT(*)"
+
+
+def cantidad(alias=None):
+    """Expresión SQL de las bicicletas que representa una fila de ORIGEN"""
+    if not compacto():
+        return "1"
+    return f"{alias}.CANTIDAD" if alias else "CANTIDAD"
+
+
+# --- Ingestión ---
+_tabla_lista = False
+_tabla_lock = threading.Lock()
+
+
+def crear_tabla(cursor):
+    cursor.execute(DDL)
+
+
+def asegurar_tabla(conn):
+    """Crea LECTURAS_MINUTO una vez por proceso; se llama fuera de la transacción de ingestión"""
+    global _tabla_lista
+    with _tabla_lock:
+        if _tabla_lista:
+            return
+        cursor = conn.cursor()
+        try:
+            crear_tabla(cursor)
+        finally:
+            cursor.close()
+        _tabla_lista = True
+
+
+def registrar(cursor, id_ubicacion, id_sensor, id_sentido):
+    """Suma una bicicleta al minuto actual de (ubicación, sensor, sentido), en la transacción del cursor"""
+    cursor.execute(f"""
+        INSERT INTO {TABLA_CONTEOS} (MINUTO, ID_UBICACION, ID_SENSOR, ID_SENTIDO, CANTIDAD)
+        VALUES (DATE_FORMAT(NOW(), '%Y-%m-%d %H:%i:00'), %s, %s, %s, 1)
+        ON DUPLICATE KEY UPDATE CANTIDAD = CANTIDAD + 1
+    """, (id_ubicacion or 0, id_sensor or 0, id_sentido or 0))
@@ -1,9 +1,18 @@
 import os
+import itertools
+import logging
+import threading
+import time
+import anyio
 import mysql.connector
-from mysql.connector import pooling
+from mysql.connector import errorcode
+from mysql.connector.errors import PoolError
 from dotenv import load_dotenv
-from fastapi import Depends
-from typing import Generator
+from fastapi import Depends, HTTPException, Request
+from typing import AsyncGenerator
+
+from app import metrics
+from app.db_pool import PoolConexiones
 
 # Cargar variables de entorno desde .env
 load_dotenv("/home/ubuntu/FastAPI_BICICLA/.env")
@@ -15,10 +24,25 @@ MYSQL_USER = os.getenv("MYSQL_USER", "root")
 MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD", "")
 MYSQL_DB = os.getenv("MYSQL_DB", "BICICLA")
 
-# Configuración del pool de conexiones
-connection_pool = pooling.MySQLConnectionPool(
-    pool_name="bicicletas_pool",
-    pool_size=5,
+# Tiempo máximo (segundos) que una petición espera por una conexión
+DB_WAIT_TIMEOUT = float(os.getenv("DB_WAIT_TIMEOUT", "5"))
+
+# Reintentos al precalentar los pools en el arranque y espera inicial entre ellos (s)
+DB_INICIO_REINTENTOS = int(os.getenv("DB_INICIO_REINTENTOS", "5"))
+DB_INICIO_ESPERA = float(os.getenv("DB_INICIO_ESPERA", "0.5"))
+
+# Configuración común de los pools
+MYSQL_POOL_RECYCLE = int(os.getenv("MYSQL_POOL_RECYCLE", "3600"))        # Antigüedad máxima de una conexión (s)
+MYSQL_POOL_PING_INTERVAL = int(os.getenv("MYSQL_POOL_PING_INTERVAL", "60"))  # Ping a conexiones ociosas (s)
+
+# Pools separados para la API y la ingesta MQTT, para que una ráfaga de lecturas
+# no deje sin conexiones a los dashboards ni al revés
+MYSQL_API_POOL_SIZE = int(os.getenv("MYSQL_API_POOL_SIZE", os.getenv("MYSQL_POOL_SIZE", "5")))
+MYSQL_API_POOL_OVERFLOW = int(os.getenv("MYSQL_API_POOL_OVERFLOW", "5"))
+MYSQL_INGESTA_POOL_SIZE = int(os.getenv("MYSQL_INGESTA_POOL_SIZE", "2"))
+MYSQL_INGESTA_POOL_OVERFLOW = int(os.getenv("MYSQL_INGESTA_POOL_OVERFLOW", "2"))
+
+_config_mysql = dict(
     host=MYSQL_HOST,
     port=MYSQL_PORT,
     user=MYSQL_USER,
@@ -27,16 +51,360 @@ connection_pool = pooling.MySQLConnectionPool(
     autocommit=True  # Recomendado para operaciones de lectura
 )
 
+# Los pools no abren conexiones al importarse; iniciar_pools() las precalienta
+api_pool = PoolConexiones(
+    "api",
+    tamano=MYSQL_API_POOL_SIZE,
+    desborde=MYSQL_API_POOL_OVERFLOW,
+    timeout=DB_WAIT_TIMEOUT,
+    reciclar_segundos=MYSQL_POOL_RECYCLE,
+    intervalo_ping=MYSQL_POOL_PING_INTERVAL,
+    **_config_mysql
+)
+
+ingesta_pool = PoolConexiones(
+    "ingesta",
+    tamano=MYSQL_INGESTA_POOL_SIZE,
+    desborde=MYSQL_INGESTA_POOL_OVERFLOW,
+    timeout=DB_WAIT_TIMEOUT,
+    reciclar_segundos=MYSQL_POOL_RECYCLE,
+    intervalo_ping=MYSQL_POOL_PING_INTERVAL,
+    **_config_mysql
+)
+
+# Réplicas de lectura (opcional). Formato: "host:puerto,host:puerto"
+MYSQL_REPLICA_HOSTS = os.getenv("MYSQL_REPLICA_HOSTS", "")
+MYSQL_REPLICA_USER = os.getenv("MYSQL_REPLICA_USER", MYSQL_USER)
+MYSQL_REPLICA_PASSWORD = os.getenv("MYSQL_REPLICA_PASSWORD", MYSQL_PASSWORD)
+MYSQL_REPLICA_POOL_SIZE = int(os.getenv("MYSQL_REPLICA_POOL_SIZE", "5"))
+MYSQL_REPLICA_POOL_OVERFLOW = int(os.getenv("MYSQL_REPLICA_POOL_OVERFLOW", "5"))
+
+# Retraso máximo de replicación (segundos) antes de volver al primario,
+# y cada cuánto se vuelve a medir usando la fila de heartbeat que escribe la ingesta
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", "5"))
+REPLICA_LAG_CACHE = float(os.getenv("REPLICA_LAG_CACHE", "2"))
+# Segundos que una réplica que no dio conexión queda descartada antes de volver a intentarla
+REPLICA_REINTENTO = float(os.getenv("REPLICA_REINTENTO", "30"))
+
+# Rutas de lectura que deben leer siempre del primario (prefijos separados por coma).
+# Por omisión la auditoría de sensores, que se consulta justo después de PUT /sensors/update
+DB_RUTAS_PRIMARIO = [
+    r.strip() for r in os.getenv("DB_RUTAS_PRIMARIO", "/sensors/auditoria").split(",") if r.strip()
+]
+
+TABLA_HEARTBEAT = "HEARTBEAT_REPLICACION"
+
+def _parsear_replicas(valor):
+    replicas = []
+    for entrada in valor.split(","):
+        entrada = entrada.strip()
+        if not entrada:
+            continue
+        host, _, puerto = entrada.partition(":")
+        replicas.append((host, int(puerto) if puerto else MYSQL_PORT))
+    return replicas
+
+replica_pools = [
+    PoolConexiones(
+        f"replica-{i}",
+        tamano=MYSQL_REPLICA_POOL_SIZE,
+        desborde=MYSQL_REPLICA_POOL_OVERFLOW,
+        timeout=DB_WAIT_TIMEOUT,
+        reciclar_segundos=MYSQL_POOL_RECYCLE,
+        intervalo_ping=MYSQL_POOL_PING_INTERVAL,
+        **dict(_config_mysql, host=host, port=puerto, user=MYSQL_REPLICA_USER, password=MYSQL_REPLICA_PASSWORD)
+    )
+    for i, (host, puerto) in enumerate(_parsear_replicas(MYSQL_REPLICA_HOSTS))
+]
+
+# Alias de compatibilidad
+connection_pool = api_pool
+
+def pools():
+    return [api_pool, ingesta_pool] + replica_pools
+
+# Todas las consultas hechas con conexiones de los pools quedan medidas en /metrics
+for _pool in pools():
+    _pool.envolver_cursor = metrics.envolver_cursor
+
+def replicas_configuradas():
+    return bool(replica_pools)
+
+def iniciar_pools(reintentos=None, espera=None):
+    """
+    Precalienta las conexiones de cada pool y arranca su mantenimiento.
+    Si el primario no responde se reintenta hasta `reintentos` veces con espera
+    creciente; después los pools quedan abriendo conexiones bajo demanda.
+    Devuelve True si el pool de la API abrió al menos una conexión.
+    """
+    reintentos = DB_INICIO_REINTENTOS if reintentos is None else reintentos
+    espera = DB_INICIO_ESPERA if espera is None else espera
+
+    disponible = False
+    for intento in range(reintentos + 1):
+        if api_pool.calentar() or api_pool.estadisticas()["abiertas"]:
+            disponible = True
+            break
+        if intento < reintentos:
+            logging.warning(f"Base de datos no disponible al iniciar, reintento {intento + 1}/{reintentos} en {espera:.1f}s")
+            time.sleep(espera)
+            espera *= 2
+
+    for pool in pools():
+        if pool is not api_pool and disponible:
+            pool.calentar()
+        pool.iniciar_mantenimiento()
+        logging.info(f"Pool '{pool.nombre}' iniciado con {pool.estadisticas()['abiertas']}/{pool.tamano} conexiones")
+    return disponible
+
+def cerrar_pools():
+    for pool in pools():
+        pool.cerrar()
+
+def estadisticas_pools():
+    estadisticas = [pool.estadisticas() for pool in pools()]
+    for entrada in estadisticas:
+        if entrada["nombre"] in _retraso_replicas:
+            retraso, _ = _retraso_replicas[entrada["nombre"]]
+            entrada["retraso_replicacion_s"] = retraso
+        if entrada["nombre"].startswith("replica-"):
+            entrada["caida"] = _replica_caida(entrada["nombre"])
+    return estadisticas
+
+# --- Heartbeat de replicación ---
+def escribir_heartbeat(conn):
+    """
+    Escribe la marca de tiempo de heartbeat en el primario (la llama la ingesta).
+    La tabla se crea solo la primera vez que falta, no en cada latido.
+    """
+    cursor = conn.cursor()
+    try:
+        sentencia = f"REPLACE INTO {TABLA_HEARTBEAT} (ID, MARCA) VALUES (1, UTC_TIMESTAMP(6))"
+        try:
+            cursor.execute(sentencia)
+        except mysql.connector.Error as e:
+            if e.errno != errorcode.ER_NO_SUCH_TABLE:
+                raise
+            cursor.execute(f"""
+                CREATE TABLE IF NOT EXISTS {TABLA_HEARTBEAT} (
+                    ID TINYINT NOT NULL PRIMARY KEY,
+                    MARCA DATETIME(6) NOT NULL
+                )
+            """)
+            cursor.execute(sentencia)
+        if conn.in_transaction:
+            conn.commit()
+    finally:
+        cursor.close()
+
+def medir_retraso(conn):
+    """Segundos de retraso de una réplica según su fila de heartbeat, o None si no se puede medir"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            SELECT TIMESTAMPDIFF(MICROSECOND, MARCA, UTC_TIMESTAMP(6)) / 1000000
+            FROM {TABLA_HEARTBEAT}
+            WHERE ID = 1
+        """)
+        fila = cursor.fetchone()
+        return float(fila[0]) if fila and fila[0] is not None else None
+    except mysql.connector.Error:
+        return None
+    finally:
+        cursor.close()
+
+# nombre de pool -> (retraso en segundos o None, momento de la medición)
+_retraso_replicas = {}
+_retraso_lock = threading.Lock()
+_turno_replica = itertools.count()
+# nombre de pool -> momento (monotónico) hasta el que la réplica se considera caída
+_replicas_caidas = {}
+
+def _replica_caida(nombre):
+    with _retraso_lock:
+        return _replicas_caidas.get(nombre, 0) > time.monotonic()
+
+def _marcar_caida(nombre):
+    with _retraso_lock:
+        _replicas_caidas[nombre] = time.monotonic() + REPLICA_REINTENTO
+
+def _replica_al_dia(pool, conn):
+    """Indica si la réplica está dentro de REPLICA_MAX_LAG, midiendo como mucho cada REPLICA_LAG_CACHE segundos"""
+    ahora = time.monotonic()
+    with _retraso_lock:
+        medicion = _retraso_replicas.get(pool.nombre)
+    if medicion is None or ahora - medicion[1] > REPLICA_LAG_CACHE:
+        retraso = medir_retraso(conn)
+        with _retraso_lock:
+            _retraso_replicas[pool.nombre] = (retraso, ahora)
+    else:
+        retraso = medicion[0]
+    return retraso is not None and retraso <= REPLICA_MAX_LAG
+
+# --- Préstamo de conexiones ---
+# Limitador de concurrencia del tamaño de cada pool (incluido el desborde). Las peticiones que no alcanzan
+# conexión esperan en cola (FIFO) en el event loop en vez de ocupar un hilo
+# y fallar con PoolError dentro del handler.
+# Se crean de forma diferida porque necesitan un event loop en ejecución.
+_limitadores = {}
+
+def get_limitador(pool=None) -> anyio.CapacityLimiter:
+    pool = pool or api_pool
+    limitador = _limitadores.get(pool.nombre)
+    if limitador is None:
+        limitador = anyio.CapacityLimiter(pool.capacidad)
+        _limitadores[pool.nombre] = limitador
+    return limitador
+
+class SinConexion(Exception):
+    """No se obtuvo conexión del pool dentro del plazo"""
+
+def _cerrar_conexion(conn):
+    # Siempre se devuelve al pool; el pool descarta las conexiones caídas
+    conn.close()
+
+async def _adquirir(pool):
+    """Espera turno y presta una conexión de `pool`. Devuelve la conexión y la función para liberarla."""
+    limitador = get_limitador(pool)
+    turno = object()
+    inicio = time.perf_counter()
+    try:
+        with anyio.fail_after(DB_WAIT_TIMEOUT):
+            await limitador.acquire_on_behalf_of(turno)
+    except TimeoutError:
+        metrics.contar_sin_conexion(pool.nombre)
+        raise SinConexion(pool.nombre)
+
+    try:
+        conn = await anyio.to_thread.run_sync(pool.get_connection)
+    except PoolError:
+        limitador.release_on_behalf_of(turno)
+        metrics.contar_sin_conexion(pool.nombre)
+        raise SinConexion(pool.nombre)
+    except BaseException:
+        limitador.release_on_behalf_of(turno)
+        raise
+    metrics.observar_espera_pool(pool.nombre, time.perf_counter() - inicio)
+
+    async def liberar():
+        try:
+            await anyio.to_thread.run_sync(_cerrar_conexion, conn)
+        finally:
+            limitador.release_on_behalf_of(turno)
+
+    return conn, liberar
+
+def _servicio_saturado():
+    return HTTPException(
+        status_code=503,
+        detail="Servicio saturado: no hay conexiones de base de datos disponibles",
+        headers={"Retry-After": "1"}
+    )
+
+async def _adquirir_primario():
+    try:
+        return await _adquirir(api_pool)
+    except SinConexion:
+        raise _servicio_saturado()
+
+async def _adquirir_replica():
+    """Intenta una réplica al día (en turno rotativo); devuelve None si ninguna sirve"""
+    inicio = next(_turno_replica)
+    for i in range(len(replica_pools)):
+        pool = replica_pools[(inicio + i) % len(replica_pools)]
+        if _replica_caida(pool.nombre):
+            continue
+        try:
+            conn, liberar = await _adquirir(pool)
+        except SinConexion:
+            # Réplica saturada, no caída: se vuelve a probar en la próxima petición
+            logging.warning(f"Réplica '{pool.nombre}' sin conexiones libres")
+            continue
+        except Exception as e:
+            # No se pudo conectar: se descarta por REPLICA_REINTENTO segundos en vez de redialar en cada petición
+            logging.warning(f"Réplica '{pool.nombre}' no disponible, se descarta por {REPLICA_REINTENTO:.0f}s: {e}")
+            _marcar_caida(pool.nombre)
+            continue
+        try:
+            al_dia = await anyio.to_thread.run_sync(_replica_al_dia, pool, conn)
+        except Exception:
+            al_dia = False
+        if al_dia:
+            return conn, liberar
+        await liberar()
+    return None
+
 # Función para obtener una conexión del pool
-def get_db() -> Generator[mysql.connector.connection.MySQLConnection, None, None]:
+async def get_db() -> AsyncGenerator[mysql.connector.connection.MySQLConnection, None]:
     """
-    Provee una conexión de base de datos desde el pool.
+    Provee una conexión al primario desde el pool de la API.
+    Si no hay conexión disponible dentro de DB_WAIT_TIMEOUT segundos responde 503.
     La conexión se cierra automáticamente después de su uso.
     """
-    conn = None
+    conn, liberar = await _adquirir_primario()
+    try:
+        yield conn
+    finally:
+        await liberar()
+
+def _forzado_primario(ruta):
+    return any(ruta.startswith(prefijo) for prefijo in DB_RUTAS_PRIMARIO)
+
+async def _adquirir_lectura(ruta):
+    """Réplica al día si hay alguna (salvo rutas en DB_RUTAS_PRIMARIO); si no, el primario"""
+    adquirida = None
+    if replica_pools and not _forzado_primario(ruta):
+        adquirida = await _adquirir_replica()
+    if adquirida is None:
+        adquirida = await _adquirir_primario()
+    return adquirida
+
+async def get_db_lectura(request: Request) -> AsyncGenerator[mysql.connector.connection.MySQLConnection, None]:
+    """
+    Provee una conexión para consultas de solo lectura.
+    Usa una réplica si hay alguna configurada y su retraso no supera REPLICA_MAX_LAG;
+    en otro caso, o si la ruta está en DB_RUTAS_PRIMARIO, usa el primario.
+    """
+    conn, liberar = await _adquirir_lectura(request.url.path)
+    try:
+        yield conn
+    finally:
+        await liberar()
+
+class ConexionDiferida:
+    """
+    Conexión de lectura que se pide al pool recién cuando el endpoint la usa por primera vez.
+    Sirve a los endpoints con caché: un acierto, o una petición que espera el resultado de
+    otra idéntica en curso, no ocupa una conexión del pool. Solo se usa desde endpoints
+    síncronos (corren en el threadpool de anyio y desde ahí piden la conexión al event loop).
+    """
+
+    def __init__(self, ruta):
+        self._ruta = ruta
+        self._adquirida = None
+
+    def _conexion(self):
+        if self._adquirida is None:
+            self._adquirida = anyio.from_thread.run(_adquirir_lectura, self._ruta)
+        return self._adquirida[0]
+
+    def __getattr__(self, nombre):
+        return getattr(self._conexion(), nombre)
+
+    @property
+    def adquirida(self):
+        return self._adquirida is not None
+
+    async def liberar(self):
+        if self._adquirida is not None:
+            _, liberar = self._adquirida
+            self._adquirida = None
+            await liberar()
+
+async def get_db_lectura_diferida(request: Request) -> AsyncGenerator[mysql.connector.connection.MySQLConnection, None]:
+    """Como get_db_lectura, pero la conexión se adquiere al primer uso (ver ConexionDiferida)"""
+    conn = ConexionDiferida(request.url.path)
     try:
-        conn = connection_pool.get_connection()
         yield conn
     finally:
-        if conn is not None and conn.is_connected():
-            conn.close()
+        await conn.liberar()
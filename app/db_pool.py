@@ -0,0 +1,300 @@
+import logging
+import threading
+import time
+from collections import deque
+
+import mysql.connector
+from mysql.connector.errors import PoolError
+
+# Pool de conexiones MySQL con desborde, espera acotada, validación de conexiones
+# ociosas (ping), reciclaje por antigüedad y métricas de uso.
+
+
+class ConexionPool:
+    """
+    Conexión prestada por un PoolConexiones. Se comporta como la conexión MySQL
+    original, pero close() la devuelve al pool en vez de cerrarla.
+    """
+
+    __slots__ = ("_pool", "_conn", "_creada_en", "_devuelta")
+
+    def __init__(self, pool, conn, creada_en):
+        self._pool = pool
+        self._conn = conn
+        self._creada_en = creada_en
+        self._devuelta = False
+
+    def __getattr__(self, nombre):
+        return getattr(self._conn, nombre)
+
+    def cursor(self, *args, **kwargs):
+        cursor = self._conn.cursor(*args, **kwargs)
+        envolver = self._pool.envolver_cursor
+        return envolver(cursor, self) if envolver is not None else cursor
+
+    def close(self):
+        if not self._devuelta:
+            self._devuelta = True
+            self._pool._devolver(self._conn, self._creada_en)
+
+
+class PoolConexiones:
+    """
+    Pool de conexiones MySQL.
+
+    - `tamano` conexiones permanentes, precalentadas con calentar()
+    - hasta `desborde` conexiones extra bajo carga, que se cierran al devolverse
+      si ya hay `tamano` conexiones libres
+    - get_connection() espera como máximo `timeout` segundos y luego lanza PoolError
+    - un hilo de mantenimiento hace ping a las conexiones ociosas y recicla
+      las que superan `reciclar_segundos` de antigüedad
+    """
+
+    def __init__(self, nombre, tamano=5, desborde=0, timeout=5.0,
+                 reciclar_segundos=3600, intervalo_ping=60, **config_mysql):
+        self.nombre = nombre
+        self.tamano = tamano
+        self.desborde = desborde
+        self.timeout = timeout
+        self.reciclar_segundos = reciclar_segundos
+        self.intervalo_ping = intervalo_ping
+        self._config = config_mysql
+        # Función opcional (cursor, conexión) -> cursor para instrumentar las consultas
+        self.envolver_cursor = None
+
+        self._cond = threading.Condition()
+        # Conexiones libres: [conexión, creada_en, último_uso]; se reutiliza la más reciente
+        self._libres = deque()
+        self._total = 0
+        self._en_uso = 0
+        self._hilo = None
+        self._detener = threading.Event()
+
+        # Métricas
+        self._checkouts = 0
+        self._espera_total = 0.0
+        self._espera_max = 0.0
+        self._timeouts = 0
+        self._creadas = 0
+        self._recicladas = 0
+        self._descartadas = 0
+        self._max_en_uso = 0
+
+    @property
+    def capacidad(self):
+        return self.tamano + self.desborde
+
+    # --- Creación y cierre de conexiones ---
+    def _crear(self):
+        conn = mysql.connector.connect(**self._config)
+        with self._cond:
+            self._creadas += 1
+        return conn
+
+    def _cerrar_silencioso(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _liberar_cupo(self):
+        with self._cond:
+            self._total -= 1
+            self._cond.notify()
+
+    # --- Préstamo y devolución ---
+    def get_connection(self, timeout=None):
+        """Presta una conexión del pool, esperando como máximo `timeout` segundos"""
+        timeout = self.timeout if timeout is None else timeout
+        inicio = time.monotonic()
+        limite = inicio + timeout
+
+        with self._cond:
+            while True:
+                if self._libres:
+                    conn, creada_en, ultimo_uso = self._libres.pop()
+                    crear = False
+                    break
+                if self._total < self.capacidad:
+                    self._total += 1
+                    conn, creada_en, ultimo_uso = None, None, None
+                    crear = True
+                    break
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    self._timeouts += 1
+                    raise PoolError(f"Pool '{self.nombre}' agotado: sin conexiones libres tras {timeout}s")
+                self._cond.wait(restante)
+
+            self._en_uso += 1
+            self._max_en_uso = max(self._max_en_uso, self._en_uso)
+
+        try:
+            ahora = time.monotonic()
+            if not crear:
+                if ahora - creada_en > self.reciclar_segundos:
+                    self._cerrar_silencioso(conn)
+                    with self._cond:
+                        self._recicladas += 1
+                    crear = True
+                elif ahora - ultimo_uso > self.intervalo_ping and not self._ping(conn):
+                    self._cerrar_silencioso(conn)
+                    with self._cond:
+                        self._descartadas += 1
+                    crear = True
+            if crear:
+                conn = self._crear()
+                creada_en = time.monotonic()
+        except Exception:
+            with self._cond:
+                self._en_uso -= 1
+                self._total -= 1
+                self._cond.notify()
+            raise
+
+        espera = time.monotonic() - inicio
+        with self._cond:
+            self._checkouts += 1
+            self._espera_total += espera
+            self._espera_max = max(self._espera_max, espera)
+
+        return ConexionPool(self, conn, creada_en)
+
+    def _devolver(self, conn, creada_en):
+        sana = True
+        try:
+            if not conn.is_connected():
+                sana = False
+            elif conn.in_transaction:
+                conn.rollback()
+        except Exception:
+            sana = False
+
+        with self._cond:
+            self._en_uso -= 1
+            sobrante = len(self._libres) >= self.tamano
+            if sana and not sobrante:
+                self._libres.append([conn, creada_en, time.monotonic()])
+                self._cond.notify()
+                return
+            self._total -= 1
+            if not sana:
+                self._descartadas += 1
+            self._cond.notify()
+
+        self._cerrar_silencioso(conn)
+
+    def _ping(self, conn):
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    # --- Ciclo de vida ---
+    def calentar(self):
+        """Abre las conexiones permanentes por adelantado. Devuelve cuántas se abrieron."""
+        abiertas = 0
+        while True:
+            with self._cond:
+                if self._total >= self.tamano:
+                    break
+                self._total += 1
+            try:
+                conn = self._crear()
+            except Exception as e:
+                self._liberar_cupo()
+                logging.warning(f"Pool '{self.nombre}': no se pudo precalentar conexión: {e}")
+                break
+            ahora = time.monotonic()
+            with self._cond:
+                self._libres.append([conn, ahora, ahora])
+                self._cond.notify()
+            abiertas += 1
+        return abiertas
+
+    def iniciar_mantenimiento(self):
+        """Arranca el hilo que valida conexiones ociosas y recicla las antiguas"""
+        if self._hilo is not None and self._hilo.is_alive():
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(
+            target=self._bucle_mantenimiento,
+            name=f"pool-{self.nombre}-mantenimiento",
+            daemon=True
+        )
+        self._hilo.start()
+
+    def _bucle_mantenimiento(self):
+        while not self._detener.wait(self.intervalo_ping):
+            try:
+                self._mantener()
+            except Exception as e:
+                logging.error(f"Pool '{self.nombre}': error en mantenimiento: {e}")
+
+    def _mantener(self):
+        ahora = time.monotonic()
+        revisar = []
+        with self._cond:
+            conservar = deque()
+            for entrada in self._libres:
+                if ahora - entrada[2] >= self.intervalo_ping or ahora - entrada[1] > self.reciclar_segundos:
+                    revisar.append(entrada)
+                else:
+                    conservar.append(entrada)
+            self._libres = conservar
+            # Las conexiones en revisión siguen contando en _total
+
+        for conn, creada_en, ultimo_uso in revisar:
+            if ahora - creada_en > self.reciclar_segundos:
+                self._cerrar_silencioso(conn)
+                with self._cond:
+                    self._recicladas += 1
+                conn = None
+            elif not self._ping(conn):
+                self._cerrar_silencioso(conn)
+                with self._cond:
+                    self._descartadas += 1
+                conn = None
+
+            if conn is None:
+                try:
+                    conn = self._crear()
+                    creada_en = time.monotonic()
+                except Exception as e:
+                    logging.warning(f"Pool '{self.nombre}': no se pudo reponer conexión: {e}")
+                    self._liberar_cupo()
+                    continue
+
+            with self._cond:
+                self._libres.appendleft([conn, creada_en, time.monotonic()])
+                self._cond.notify()
+
+    def cerrar(self):
+        """Detiene el mantenimiento y cierra las conexiones libres"""
+        self._detener.set()
+        with self._cond:
+            libres = list(self._libres)
+            self._libres.clear()
+            self._total -= len(libres)
+        for conn, _, _ in libres:
+            self._cerrar_silencioso(conn)
+
+    def estadisticas(self):
+        with self._cond:
+            return {
+                "nombre": self.nombre,
+                "tamano": self.tamano,
+                "desborde": self.desborde,
+                "abiertas": self._total,
+                "libres": len(self._libres),
+                "en_uso": self._en_uso,
+                "max_en_uso": self._max_en_uso,
+                "checkouts": self._checkouts,
+                "espera_promedio_ms": round(self._espera_total / self._checkouts * 1000, 3) if self._checkouts else 0,
+                "espera_max_ms": round(self._espera_max * 1000, 3),
+                "timeouts": self._timeouts,
+                "creadas": self._creadas,
+                "recicladas": self._recicladas,
+                "descartadas": self._descartadas
+            }
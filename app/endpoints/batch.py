@@ -0,0 +1,174 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi import params as fastapi_params
+from typing import Any, Dict, List
+import inspect
+import json
+import logging
+import mysql.connector
+from mysql.connector.connection import MySQLConnection
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, create_model
+
+from app.database import get_db_lectura
+from app.endpoints import readings, stats, dashboard, sensors
+
+# Crear router para el endpoint de lotes
+router = APIRouter()
+
+MAX_PETICIONES = 50
+
+# Rutas de solo lectura que se pueden pedir dentro de un lote
+RUTAS_LOTE = {
+    "/comunas": readings.obtener_comunas,
+    "/ubicaciones": readings.obtener_ubicaciones,
+    "/sentidos": readings.obtener_sentidos,
+    "/consulta": readings.consultar_lecturas,
+    "/grafico": readings.obtener_datos_grafico,
+    "/grafico_detallado": readings.obtener_datos_grafico_detallado,
+    "/resumen": readings.obtener_resumen,
+    "/readings/comunas": readings.obtener_comunas,
+    "/readings/ubicaciones": readings.obtener_ubicaciones,
+    "/readings/sentidos": readings.obtener_sentidos,
+    "/readings/consulta": readings.consultar_lecturas,
+    "/readings/grafico": readings.obtener_datos_grafico,
+    "/readings/grafico_detallado": readings.obtener_datos_grafico_detallado,
+    "/readings/comparar": readings.comparar_entidades,
+    "/readings/resumen": readings.obtener_resumen,
+    "/readings/summary": readings.obtener_resumen,
+    "/stats/today": stats.get_stats_today,
+    "/stats/daily-average": stats.get_stats_daily_average,
+    "/stats/monthly": stats.get_stats_monthly,
+    "/stats/weekly-trend": stats.get_weekly_trend,
+    "/dashboard/summary": dashboard.get_dashboard_summary,
+    "/sensors/list": sensors.get_sensors,
+    "/sensors/actividad": sensors.get_sensor_activity,
+    "/sensors/map": sensors.get_map_sensors,
+    "/sensors/estados": sensors.get_estados,
+}
+
+class SubPeticion(BaseModel):
+    nombre: str = Field(..., description="Nombre con el que se devuelve el resultado")
+    ruta: str = Field(..., description="Ruta del endpoint, p. ej. /readings/grafico")
+    params: Dict[str, Any] = Field(default_factory=dict, description="Parámetros de consulta del endpoint")
+
+class LoteRequest(BaseModel):
+    peticiones: List[SubPeticion] = Field(..., max_length=MAX_PETICIONES)
+
+class ResultadoLote(BaseModel):
+    status: int
+    data: Any = None
+    error: Any = None
+
+class LoteResponse(BaseModel):
+    resultados: Dict[str, ResultadoLote]
+    consultas_ejecutadas: int
+
+
+class _Invocable:
+    """Endpoint invocable dentro de un lote, con el esquema de parámetros de su firma"""
+
+    def __init__(self, funcion):
+        self.funcion = funcion
+        self.parametro_conexion = None
+        campos = {}
+        for nombre, parametro in inspect.signature(funcion).parameters.items():
+            if isinstance(parametro.default, fastapi_params.Depends):
+                self.parametro_conexion = nombre
+                continue
+            anotacion = parametro.annotation if parametro.annotation is not inspect.Parameter.empty else Any
+            default = parametro.default if parametro.default is not inspect.Parameter.empty else ...
+            campos[nombre] = (anotacion, default)
+        self.modelo = create_model(
+            f"Params_{funcion.__name__}",
+            __config__=ConfigDict(extra="forbid"),
+            **campos
+        )
+
+    def validar(self, params):
+        return self.modelo(**params).model_dump()
+
+    def ejecutar(self, params_validados, conn):
+        return self.funcion(**params_validados, **{self.parametro_conexion: conn})
+
+
+_invocables = {}
+
+def _invocable(funcion):
+    if funcion not in _invocables:
+        _invocables[funcion] = _Invocable(funcion)
+    return _invocables[funcion]
+
+def _sanear_conexion(conn):
+    """
+    Deja la conexión compartida usable tras una sub-petición fallida: descarta resultados
+    sin leer y deshace una transacción abierta; si no se puede, reconecta.
+    """
+    try:
+        if getattr(conn, "unread_result", False):
+            conn.consume_results()
+        if getattr(conn, "in_transaction", False):
+            conn.rollback()
+    except Exception as e:
+        logging.warning(f"Lote: conexión inconsistente tras un error, se reconecta: {e}")
+        try:
+            conn.reconnect(attempts=1)
+        except mysql.connector.Error as e:
+            # Las sub-peticiones siguientes fallarán una por una con su propio error
+            logging.error(f"Lote: no se pudo reconectar: {e}")
+
+
+def invocar(funcion, params, conn):
+    """Valida `params` con la firma del endpoint y lo ejecuta con la conexión dada"""
+    invocable = _invocable(funcion)
+    return invocable.ejecutar(invocable.validar(params), conn)
+
+
+@router.post("", response_model=LoteResponse)
+def ejecutar_lote(
+    lote: LoteRequest,
+    conn: MySQLConnection = Depends(get_db_lectura)
+):
+    """
+    Ejecuta varias consultas de gráficos e indicadores en una sola petición.
+    Todas comparten una conexión, y las sub-peticiones idénticas
+    (misma ruta y parámetros) se ejecutan una sola vez.
+    """
+    nombres = [p.nombre for p in lote.peticiones]
+    if len(set(nombres)) != len(nombres):
+        raise HTTPException(status_code=400, detail="Los nombres de las sub-peticiones deben ser únicos")
+
+    resultados = {}
+    ejecutadas = {}
+
+    for peticion in lote.peticiones:
+        funcion = RUTAS_LOTE.get(peticion.ruta.rstrip("/") or "/")
+        if funcion is None:
+            resultados[peticion.nombre] = {"status": 404, "error": f"Ruta no soportada en lotes: {peticion.ruta}"}
+            continue
+
+        invocable = _invocable(funcion)
+        try:
+            params = invocable.validar(peticion.params)
+        except ValidationError as e:
+            resultados[peticion.nombre] = {"status": 422, "error": jsonable_encoder(e.errors())}
+            continue
+
+        clave = (funcion, json.dumps(params, sort_keys=True, default=str))
+        if clave not in ejecutadas:
+            try:
+                ejecutadas[clave] = {"status": 200, "data": jsonable_encoder(invocable.ejecutar(params, conn))}
+            except HTTPException as e:
+                ejecutadas[clave] = {"status": e.status_code, "error": e.detail}
+                _sanear_conexion(conn)
+            except mysql.connector.Error as e:
+                logging.error(f"Error de base de datos en lote ({peticion.ruta}): {e}")
+                ejecutadas[clave] = {"status": 500, "error": f"Error de base de datos: {str(e)}"}
+                _sanear_conexion(conn)
+            except Exception as e:
+                # Un error inesperado solo falla su propia sub-petición
+                logging.exception(f"Error en sub-petición de lote ({peticion.ruta})")
+                ejecutadas[clave] = {"status": 500, "error": f"Error interno: {str(e)}"}
+                _sanear_conexion(conn)
+        resultados[peticion.nombre] = ejecutadas[clave]
+
+    return {"resultados": resultados, "consultas_ejecutadas": len(ejecutadas)}
@@ -6,7 +6,10 @@ import mysql.connector
 from mysql.connector.connection import MySQLConnection
 
 # Importar nuestra conexión a la base de datos
-from app.database import get_db
+from app.database import get_db_lectura_diferida
+from app import response_cache, sensor_registry
+from app.fast_response import ruta_rapida
+from app.chart_engine import Cubeta, Filtros, PlanGrafico, calcular_series, conteos_diarios
 
 # Crear router para los endpoints de dashboard
 router = APIRouter()
@@ -16,9 +19,10 @@ router = APIRouter()
 def test_endpoint():
     return {"status": "ok", "message": "Endpoint de prueba para dashboard"}
 
-@router.get("/summary")
+@ruta_rapida(router.get("/summary"))
+@response_cache.cacheado("dashboard_summary", response_cache.CACHE_TTL_GRAFICOS, por_dia=True)
 def get_dashboard_summary(
-    conn: MySQLConnection = Depends(get_db)
+    conn: MySQLConnection = Depends(get_db_lectura_diferida)
 ):
     """
     Obtiene un resumen de datos para el dashboard principal.
@@ -30,19 +34,31 @@ def get_dashboard_summary(
         yesterday = today - timedelta(days=1)
         first_day_current_month = today.replace(day=1)
         
+        last_day_prev_month = first_day_current_month - timedelta(days=1)
+        first_day_prev_month = last_day_prev_month.replace(day=1)
+        start_of_week = today - timedelta(days=7)
+        start_of_prev_week = start_of_week - timedelta(days=7)
+        start_of_current_week = today - timedelta(days=today.weekday())
+        end_of_current_week = start_of_current_week + timedelta(days=6)
+        
+        # Conteos diarios de todo el rango que usan los indicadores, en una sola consulta
+        desde = min(first_day_prev_month, start_of_prev_week)
+        hasta = max(today, end_of_current_week)
+        conteos = conteos_diarios(cursor, desde, hasta)
+        
+        def tramo(inicio, fin):
+            """Conteos diarios de [inicio, fin)"""
+            return conteos[(inicio - desde).days:(fin - desde).days]
+        
+        def promedio_dias_con_datos(valores):
+            con_datos = valores[valores > 0]
+            return float(con_datos.sum()) / len(con_datos) if len(con_datos) else 0
+        
         # 1. Conteo total de hoy
-        cursor.execute(
-            "SELECT COUNT(*) as total FROM LECTURAS WHERE DATE(FECHA_LECTURA) = %s",
-            (today,)
-        )
-        total_today = cursor.fetchone()['total'] or 0
+        total_today = int(tramo(today, today + timedelta(days=1)).sum())
         
         # 2. Conteo total de ayer (para calcular variación)
-        cursor.execute(
-            "SELECT COUNT(*) as total FROM LECTURAS WHERE DATE(FECHA_LECTURA) = %s",
-            (yesterday,)
-        )
-        total_yesterday = cursor.fetchone()['total'] or 0
+        total_yesterday = int(tramo(yesterday, today).sum())
         
         # Calcular variación porcentual diaria
         if total_yesterday > 0:
@@ -51,40 +67,10 @@ def get_dashboard_summary(
             variacion_diaria = 0
         
         # 3. Promedio diario de la última semana
-        start_of_week = today - timedelta(days=7)
-        cursor.execute("""
-            SELECT DATE(FECHA_LECTURA) as fecha, COUNT(*) as total
-            FROM LECTURAS
-            WHERE DATE(FECHA_LECTURA) >= %s AND DATE(FECHA_LECTURA) < %s
-            GROUP BY DATE(FECHA_LECTURA)
-        """, (start_of_week, today))
-        
-        results_week = cursor.fetchall()
-        
-        if results_week:
-            total_dias = len(results_week)
-            total_ciclistas_semana = sum(r['total'] for r in results_week)
-            promedio_semanal = total_ciclistas_semana / total_dias
-        else:
-            promedio_semanal = 0
+        promedio_semanal = promedio_dias_con_datos(tramo(start_of_week, today))
         
         # 4. Promedio diario de la semana anterior (para calcular variación)
-        start_of_prev_week = start_of_week - timedelta(days=7)
-        cursor.execute("""
-            SELECT DATE(FECHA_LECTURA) as fecha, COUNT(*) as total
-            FROM LECTURAS
-            WHERE DATE(FECHA_LECTURA) >= %s AND DATE(FECHA_LECTURA) < %s
-            GROUP BY DATE(FECHA_LECTURA)
-        """, (start_of_prev_week, start_of_week))
-        
-        results_prev_week = cursor.fetchall()
-        
-        if results_prev_week:
-            total_dias_prev = len(results_prev_week)
-            total_ciclistas_semana_prev = sum(r['total'] for r in results_prev_week)
-            promedio_semanal_prev = total_ciclistas_semana_prev / total_dias_prev
-        else:
-            promedio_semanal_prev = 0
+        promedio_semanal_prev = promedio_dias_con_datos(tramo(start_of_prev_week, start_of_week))
         
         # Calcular variación porcentual semanal
         if promedio_semanal_prev > 0:
@@ -93,25 +79,10 @@ def get_dashboard_summary(
             variacion_semanal = 0
         
         # 5. Conteo total del mes actual
-        cursor.execute("""
-            SELECT COUNT(*) as total
-            FROM LECTURAS
-            WHERE DATE(FECHA_LECTURA) >= %s AND DATE(FECHA_LECTURA) <= %s
-        """, (first_day_current_month, today))
-        
-        total_current_month = cursor.fetchone()['total'] or 0
+        total_current_month = int(tramo(first_day_current_month, today + timedelta(days=1)).sum())
         
         # 6. Conteo total del mes anterior (para calcular variación)
-        last_day_prev_month = first_day_current_month - timedelta(days=1)
-        first_day_prev_month = last_day_prev_month.replace(day=1)
-        
-        cursor.execute("""
-            SELECT COUNT(*) as total
-            FROM LECTURAS
-            WHERE DATE(FECHA_LECTURA) >= %s AND DATE(FECHA_LECTURA) <= %s
-        """, (first_day_prev_month, last_day_prev_month))
-        
-        total_prev_month = cursor.fetchone()['total'] or 0
+        total_prev_month = int(tramo(first_day_prev_month, first_day_current_month).sum())
         
         # Calcular variación porcentual mensual
         if total_prev_month > 0:
@@ -121,109 +92,71 @@ def get_dashboard_summary(
         
         # 7. Conteo de sensores
         cursor.execute("""
-            SELECT COUNT(DISTINCT NOMBRE_SENSOR) as total
+            SELECT DISTINCT NOMBRE_SENSOR
             FROM SENSORES
+            WHERE NOMBRE_SENSOR IS NOT NULL
         """)
-        total_sensores = cursor.fetchone()['total'] or 0
-        
-        # Sensores activos (con lecturas en las últimas 3 horas)
-        three_hours_ago = datetime.now() - timedelta(hours=3)
+        nombres_sensores = [row['NOMBRE_SENSOR'] for row in cursor.fetchall()]
+        total_sensores = len(nombres_sensores)
         
-        # Usar NOMBRE_SENSOR en lugar de ID_SENSOR
-        query_activos = """
-            SELECT COUNT(DISTINCT s.NOMBRE_SENSOR) as total
-            FROM SENSORES s
-            JOIN LECTURAS l ON s.NOMBRE_SENSOR = l.NOMBRE_SENSOR
-            WHERE l.FECHA_LECTURA >= %s
-        """
-        
-        cursor.execute(query_activos, (three_hours_ago,))
-        sensores_activos = cursor.fetchone()['total'] or 0
+        # Sensores activos (con lecturas en las últimas 3 horas), según el registro de sensores
+        sensor_registry.asegurar_cargado(conn)
+        ahora = datetime.now()
+        inactivos = sensor_registry.sensores_inactivos(nombres_sensores, 3, ahora)
         
         # Sensores inactivos
-        sensores_inactivos = total_sensores - sensores_activos
+        sensores_inactivos = len(inactivos)
+        sensores_activos = total_sensores - sensores_inactivos
         
         # 8. Obtener datos para el gráfico de tendencia semanal
-        today = datetime.now().date()
-        start_of_week = today - timedelta(days=today.weekday())
-        end_of_week = start_of_week + timedelta(days=6)
-        
-        cursor.execute("""
-            SELECT DATE(FECHA_LECTURA) as fecha, COUNT(*) as total
-            FROM LECTURAS
-            WHERE DATE(FECHA_LECTURA) >= %s AND DATE(FECHA_LECTURA) <= %s
-            GROUP BY DATE(FECHA_LECTURA)
-        """, (start_of_week, end_of_week))
-        
-        results = cursor.fetchall()
+        semana = tramo(start_of_current_week, end_of_current_week + timedelta(days=1))
         
         # Crear un diccionario con todas las fechas de la semana
         dias_semana = ["Lun", "Mar", "Mié", "Jue", "Vie", "Sáb", "Dom"]
         datos_diarios = []
         
         for i in range(7):
-            fecha = start_of_week + timedelta(days=i)
-            # Buscar si hay datos para esta fecha
-            total = 0
-            for r in results:
-                if r['fecha'] == fecha:
-                    total = r['total']
-                    break
-            
+            fecha = start_of_current_week + timedelta(days=i)
             datos_diarios.append({
                 "dia": dias_semana[i],
                 "fecha": fecha.isoformat(),
-                "total": total
+                "total": int(semana[i])
             })
         
         # 9. Obtener las comunas con más ciclistas
-        cursor.execute("""
-            SELECT COMUNA, COUNT(*) as total
-            FROM LECTURAS
-            WHERE DATE(FECHA_LECTURA) = %s
-            GROUP BY COMUNA
-            ORDER BY total DESC
-            LIMIT 5
-        """, (today,))
-        
-        top_comunas = cursor.fetchall()
-        
-        # 10. Obtener los sensores más activos
-        query_sensores_top = """
-            SELECT 
-                s.NOMBRE_SENSOR as nombre,
-                COUNT(l.FECHA_LECTURA) as conteo_hoy
-            FROM SENSORES s
-            LEFT JOIN LECTURAS l ON s.NOMBRE_SENSOR = l.NOMBRE_SENSOR AND DATE(l.FECHA_LECTURA) = %s
-            GROUP BY s.NOMBRE_SENSOR
-            ORDER BY conteo_hoy DESC
-            LIMIT 5
-        """
-        
-        cursor.execute(query_sensores_top, (today,))
-        sensores_top_result = cursor.fetchall()
+        plan_hoy = PlanGrafico(
+            datetime.combine(today, datetime.min.time()),
+            datetime.combine(today + timedelta(days=1), datetime.min.time()),
+            Cubeta("dia"), etiquetas=[]
+        )
+        por_comuna = calcular_series(cursor, plan_hoy, Filtros(), dimension="comuna", sin_clave=None)
+        top_comunas = sorted(
+            (
+                {"COMUNA": comuna, "total": int(fila.sum())}
+                for comuna, fila in zip(por_comuna.claves, por_comuna.matriz)
+            ),
+            key=lambda item: item["total"], reverse=True
+        )[:5]
+        
+        # 10. Obtener los sensores más activos desde el registro de sensores
+        estados = sensor_registry.estados()
+        conteos = []
+        for nombre_sensor in nombres_sensores:
+            estado_registro = estados.get(nombre_sensor)
+            conteos.append((nombre_sensor, estado_registro.conteo_de_hoy(ahora) if estado_registro else 0))
+        conteos.sort(key=lambda item: item[1], reverse=True)
         
         # Determinar el estado de cada sensor top
         sensores_top = []
-        for sensor in sensores_top_result:
-            nombre_sensor = sensor['nombre']
-            
-            # Obtener la última lectura del sensor
-            ultima_lectura_query = """
-                SELECT MAX(FECHA_LECTURA) as ultima_fecha
-                FROM LECTURAS
-                WHERE NOMBRE_SENSOR = %s
-            """
-            cursor.execute(ultima_lectura_query, (nombre_sensor,))
-            ultima_lectura_result = cursor.fetchone()
-            ultima_lectura = ultima_lectura_result['ultima_fecha'] if ultima_lectura_result and ultima_lectura_result['ultima_fecha'] else None
+        for nombre_sensor, conteo_hoy in conteos[:5]:
+            estado_registro = estados.get(nombre_sensor)
             
             # Determinar el estado del sensor
             estado_sensor = "active"
             
-            if not ultima_lectura or (datetime.now() - ultima_lectura).total_seconds() > 3600 * 3:
+            if not estado_registro or not estado_registro.activo(3, ahora):
                 estado_sensor = "inactive"
-            elif sensor['conteo_hoy'] < 10:  # Umbral bajo de lecturas
+            elif conteo_hoy < 10:  # Umbral bajo de lecturas
                 estado_sensor = "warning"
             
             # Generar un ID basado en el nombre del sensor (ya que ID_SENSOR podría no estar disponible)
@@ -232,7 +165,7 @@ def get_dashboard_summary(
             sensores_top.append({
                 "id": sensor_id,
                 "nombre": nombre_sensor,
-                "conteo_hoy": sensor['conteo_hoy'],
+                "conteo_hoy": conteo_hoy,
                 "estado": estado_sensor
             })
         
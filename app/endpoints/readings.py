@@ -2,97 +2,21 @@ from fastapi import APIRouter, Depends, HTTPException, Query
 from typing import List, Optional, Dict, Any
 from datetime import datetime, date, time, timedelta
 import mysql.connector
-from app.database import get_db
+from app.database import get_db_lectura, get_db_lectura_diferida
 from pydantic import BaseModel
 import json
 from hashlib import md5  # Importación para usar md5
 
-router = APIRouter()
-
-# Función auxiliar para calcular diferencia en días
-def calcular_diferencia_dias(fecha_inicio, fecha_fin):
-    """Calcula la diferencia en días entre dos fechas"""
-    if not fecha_inicio or not fecha_fin:
-        return 0
-    try:
-        inicio = datetime.strptime(fecha_inicio, '%Y-%m-%d').date()
-        fin = datetime.strptime(fecha_fin, '%Y-%m-%d').date()
-        return (fin - inicio).days + 1
-    except:
-        return 0
-
-# Función auxiliar para generar etiquetas por hora
-def generar_etiquetas_horas():
-    """Genera etiquetas para agrupación por hora"""
-    return [f"{h:02d}:00 - {h:02d}:59" for h in range(24)]
-
-# Función auxiliar para generar etiquetas por día
-def generar_etiquetas_dias(fecha_inicio, fecha_fin):
-    """Genera etiquetas para agrupación por día"""
-    try:
-        inicio = datetime.strptime(fecha_inicio, '%Y-%m-%d').date()
-        fin = datetime.strptime(fecha_fin, '%Y-%m-%d').date()
-        etiquetas = []
-        fecha_actual = inicio
-        while fecha_actual <= fin:
-            etiquetas.append(fecha_actual.strftime('%d-%m'))
-            fecha_actual += timedelta(days=1)
-        return etiquetas
-    except:
-        return []
-
-# Función auxiliar para generar etiquetas por semana
-def generar_etiquetas_semanas(fecha_inicio, fecha_fin):
-    """Genera etiquetas para agrupación por semana"""
-    try:
-        inicio = datetime.strptime(fecha_inicio, '%Y-%m-%d').date()
-        fin = datetime.strptime(fecha_fin, '%Y-%m-%d').date()
-        etiquetas = []
-
-        # Encontrar el lunes de la primera semana
-        fecha_actual = inicio - timedelta(days=inicio.weekday())
-
-        while fecha_actual <= fin:
-            # Calcular el domingo de la semana
-            fin_semana = fecha_actual + timedelta(days=6)
-
-            # Obtener número de semana ISO
-            semana_iso = fecha_actual.isocalendar()[1]
-
-            # Formatear rango de fechas
-            rango = f"{fecha_actual.strftime('%d-%m')} al {fin_semana.strftime('%d-%m')}"
-            etiqueta = f"Semana {semana_iso} ({rango})"
+from fastapi.responses import StreamingResponse
 
-            etiquetas.append(etiqueta)
-            fecha_actual += timedelta(days=7)
+from app import compact_store, query_planner, response_cache, retention, rollups
+from app.fast_response import arreglo_json, ruta_rapida
+from app.chart_engine import (
+    planificar_periodo, resolver_filtros, calcular_series, conteos_diarios,
+    nombres_comunas, COLORES
+)
 
-        return etiquetas
-    except:
-        return []
-
-# Función auxiliar para generar etiquetas por mes
-def generar_etiquetas_meses(fecha_inicio, fecha_fin):
-    """Genera etiquetas para agrupación por mes"""
-    try:
-        inicio = datetime.strptime(fecha_inicio, '%Y-%m-%d').date()
-        fin = datetime.strptime(fecha_fin, '%Y-%m-%d').date()
-        meses_nombres = ['Ene', 'Feb', 'Mar', 'Abr', 'May', 'Jun',
-                        'Jul', 'Ago', 'Sep', 'Oct', 'Nov', 'Dic']
-
-        etiquetas = []
-        fecha_actual = inicio.replace(day=1)  # Primer día del mes
-
-        while fecha_actual <= fin:
-            etiquetas.append(meses_nombres[fecha_actual.month - 1])
-            # Ir al siguiente mes
-            if fecha_actual.month == 12:
-                fecha_actual = fecha_actual.replace(year=fecha_actual.year + 1, month=1)
-            else:
-                fecha_actual = fecha_actual.replace(month=fecha_actual.month + 1)
-
-        return etiquetas
-    except:
-        return []
+router = APIRouter()
 
 # Modelos de respuesta
 class LecturaBase(BaseModel):
@@ -141,36 +65,24 @@ class GraficoDetalladoResponse(BaseModel):
     series: List[SerieDatos]
     total: int
 
-# Función auxiliar para calcular semana ISO
-def obtener_semana_iso(fecha):
-    """Obtiene el número de semana ISO para una fecha dada"""
-    return fecha.isocalendar()[1]
-
-# Función auxiliar para obtener todas las semanas del mes actual
-def obtener_semanas_mes_actual():
-    """Obtiene todas las semanas ISO que tocan el mes actual"""
-    hoy = datetime.now().date()
-    primer_dia_mes = hoy.replace(day=1)
-
-    # Último día del mes
-    if hoy.month == 12:
-        ultimo_dia_mes = date(hoy.year + 1, 1, 1) - timedelta(days=1)
-    else:
-        ultimo_dia_mes = date(hoy.year, hoy.month + 1, 1) - timedelta(days=1)
-
-    # Obtener semanas que tocan el mes
-    semanas = set()
-    fecha_actual = primer_dia_mes
-    while fecha_actual <= ultimo_dia_mes:
-        semanas.add(obtener_semana_iso(fecha_actual))
-        fecha_actual += timedelta(days=1)
+# Modelos para comparación entre ubicaciones o comunas
+class SerieComparacion(BaseModel):
+    id: int
+    nombre: str
+    datos: List[int]
+    total: int
+    color: Optional[str] = None
 
-    return sorted(list(semanas)), primer_dia_mes, ultimo_dia_mes
+class ComparacionResponse(BaseModel):
+    etiquetas: List[str]
+    series: List[SerieComparacion]
+    total: int
 
 # Endpoint para obtener comunas
 @router.get("/comunas", response_model=List[ComunaResponse])
+@response_cache.cacheado("comunas", response_cache.CACHE_TTL_CATALOGOS)
 def obtener_comunas(
-    db: mysql.connector.connection.MySQLConnection = Depends(get_db)
+    db: mysql.connector.connection.MySQLConnection = Depends(get_db_lectura_diferida)
 ):
     """Obtiene la lista de comunas disponibles."""
     try:
@@ -196,14 +108,17 @@ def obtener_comunas(
             })
 
         return resultado
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al obtener comunas: {str(e)}")
 
 # Endpoint para obtener ubicaciones
 @router.get("/ubicaciones", response_model=List[UbicacionResponse])
+@response_cache.cacheado("ubicaciones", response_cache.CACHE_TTL_CATALOGOS)
 def obtener_ubicaciones(
     comuna_id: Optional[int] = None,
-    db: mysql.connector.connection.MySQLConnection = Depends(get_db)
+    db: mysql.connector.connection.MySQLConnection = Depends(get_db_lectura_diferida)
 ):
     """Obtiene la lista de ubicaciones disponibles, opcionalmente filtradas por comuna."""
     try:
@@ -255,14 +170,17 @@ def obtener_ubicaciones(
             })
 
         return resultado
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al obtener ubicaciones: {str(e)}")
 
 # Endpoint para obtener sentidos
 @router.get("/sentidos", response_model=List[SentidoResponse])
+@response_cache.cacheado("sentidos", response_cache.CACHE_TTL_CATALOGOS)
 def obtener_sentidos(
     ubicacion_id: Optional[int] = None,
-    db: mysql.connector.connection.MySQLConnection = Depends(get_db)
+    db: mysql.connector.connection.MySQLConnection = Depends(get_db_lectura_diferida)
 ):
     """Obtiene los sentidos de lectura disponibles, opcionalmente filtrados por ubicación."""
     try:
@@ -297,11 +215,119 @@ def obtener_sentidos(
         cursor.close()
 
         return sentidos
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al obtener sentidos: {str(e)}")
 
+def rango_consulta(periodo, fecha_inicio=None, fecha_fin=None, hoy=None):
+    """
+    Rango [inicio, fin) de FECHA_LECTURA de un período de /consulta; cualquiera de los
+    dos extremos es None si el período personalizado no lo acota.
+    """
+    hoy = hoy or datetime.now().date()
+
+    if periodo == "personalizado":
+        inicio = datetime.strptime(fecha_inicio, '%Y-%m-%d') if fecha_inicio else None
+        fin = datetime.strptime(fecha_fin, '%Y-%m-%d') + timedelta(days=1) if fecha_fin else None
+        return inicio, fin
+
+    if periodo == "semana":
+        # Desde el lunes hasta el domingo inclusive
+        desde = hoy - timedelta(days=hoy.weekday())
+        hasta = desde + timedelta(days=7)
+    elif periodo == "mes":
+        desde = date(hoy.year, hoy.month, 1)
+        hasta = date(hoy.year + 1, 1, 1) if hoy.month == 12 else date(hoy.year, hoy.month + 1, 1)
+    elif periodo == "anio":
+        desde = date(hoy.year, 1, 1)
+        hasta = date(hoy.year + 1, 1, 1)
+    elif periodo == "hoy":
+        desde = hoy
+        hasta = hoy + timedelta(days=1)
+    else:
+        return None, None
+    return datetime.combine(desde, time.min), datetime.combine(hasta, time.min)
+
+def _origen_consulta(db, periodo, fecha_inicio, fecha_fin):
+    """LECTURAS, o su unión con el archivo si el período empieza antes de la marca de archivo"""
+    inicio, _ = rango_consulta(periodo, fecha_inicio, fecha_fin)
+    cursor = db.cursor()
+    try:
+        corte = query_planner.obtener_marcas(cursor).get(rollups.MARCA_ARCHIVO)
+    finally:
+        cursor.close()
+    return retention.origen_lecturas(corte, inicio)
+
+def _filtros_consulta(db, comuna_id, ubicacion_id, sentidos, periodo, fecha_inicio, fecha_fin, hora_inicio, hora_fin):
+    """
+    Condiciones (sobre LECTURAS l) y parámetros de los filtros de /consulta,
+    compartidos con la proyección de compatibilidad de /lecturas.
+    """
+    condiciones = ""
+    params = []
+
+    # Aplicar filtros
+    if comuna_id is not None:
+        # Obtener el nombre de la comuna desde el ID
+        comunas_cursor = db.cursor(dictionary=True)
+        comunas_cursor.execute("SELECT DISTINCT comuna FROM UBICACIONES ORDER BY comuna")
+        comunas = comunas_cursor.fetchall()
+        comunas_cursor.close()
+
+        if 0 <= comuna_id < len(comunas):
+            condiciones += " AND l.comuna = %s"
+            params.append(comunas[comuna_id]['comuna'])
+
+    if ubicacion_id is not None:
+        condiciones += " AND l.id_ubicacion = %s"
+        params.append(ubicacion_id)
+
+    if sentidos:
+        sentidos_list = [int(s.strip()) for s in sentidos.split(',') if s.strip().isdigit()]
+        if sentidos_list:
+            # Obtener los valores de sentido_lectura correspondientes a los IDs
+            sentidos_placeholders = ", ".join(["%s"] * len(sentidos_list))
+            sentidos_query = f"""
+                SELECT sentido_lectura
+                FROM SENTIDOS_SENSOR
+                WHERE id IN ({sentidos_placeholders})
+            """
+            sentidos_cursor = db.cursor(dictionary=True)
+            sentidos_cursor.execute(sentidos_query, sentidos_list)
+            sentidos_valores = [row['sentido_lectura'] for row in sentidos_cursor.fetchall()]
+            sentidos_cursor.close()
+
+            if sentidos_valores:
+                sentidos_valores_placeholders = ", ".join(["%s"] * len(sentidos_valores))
+                condiciones += f" AND l.sentido_lectura IN ({sentidos_valores_placeholders})"
+                params.extend(sentidos_valores)
+
+    # Filtros de tiempo según período: rangos sobre la columna, sin DATE(), para que
+    # MySQL use el índice de fecha y descarte las particiones mensuales fuera del período
+    inicio, fin = rango_consulta(periodo, fecha_inicio, fecha_fin)
+    if inicio is not None:
+        condiciones += " AND l.fecha_lectura >= %s"
+        params.append(inicio)
+    if fin is not None:
+        condiciones += " AND l.fecha_lectura < %s"
+        params.append(fin)
+
+    if periodo == "personalizado":
+        # Filtros de hora
+        if hora_inicio:
+            condiciones += " AND TIME(l.fecha_lectura) >= %s"
+            params.append(hora_inicio)
+
+        if hora_fin:
+            condiciones += " AND TIME(l.fecha_lectura) <= %s"
+            params.append(hora_fin)
+
+    return condiciones, params
+
+
 # Endpoint para consultar lecturas
-@router.get("/consulta", response_model=LecturaResponse)
+@ruta_rapida(router.get("/consulta", response_model=LecturaResponse))
 def consultar_lecturas(
     comuna_id: Optional[int] = None,
     ubicacion_id: Optional[int] = None,
@@ -311,120 +337,33 @@ def consultar_lecturas(
     fecha_fin: Optional[str] = Query(None, description="Fecha de fin (YYYY-MM-DD)"),
     hora_inicio: Optional[str] = Query(None, description="Hora de inicio (HH:MM)"),
     hora_fin: Optional[str] = Query(None, description="Hora de fin (HH:MM)"),
-    db: mysql.connector.connection.MySQLConnection = Depends(get_db)
+    db: mysql.connector.connection.MySQLConnection = Depends(get_db_lectura)
 ):
     """
     Obtiene las lecturas de bicicletas según los criterios de filtrado especificados.
     """
     try:
+        origen = _origen_consulta(db, periodo, fecha_inicio, fecha_fin)
         cursor = db.cursor(dictionary=True)
 
         # Construir la query base - MODIFICADA para usar 1 como cantidad
-        query = """
+        query = f"""
             SELECT
                 l.fecha_lectura,
                 l.comuna,
                 l.ubicacion_endpoint as ubicacion,
                 l.sentido_lectura as sentido,
-                1 as cantidad
-            FROM LECTURAS l
+                {compact_store.cantidad("l")} as cantidad
+            FROM {origen} l
             JOIN UBICACIONES u ON l.id_ubicacion = u.id_ubicacion
             WHERE 1=1
         """
 
-        params = []
-
-        # Aplicar filtros
-        if comuna_id is not None:
-            # Obtener el nombre de la comuna desde el ID
-            comunas_cursor = db.cursor(dictionary=True)
-            comunas_cursor.execute("SELECT DISTINCT comuna FROM UBICACIONES ORDER BY comuna")
-            comunas = comunas_cursor.fetchall()
-            comunas_cursor.close()
-
-            if 0 <= comuna_id < len(comunas):
-                query += " AND l.comuna = %s"
-                params.append(comunas[comuna_id]['comuna'])
-
-        if ubicacion_id is not None:
-            query += " AND l.id_ubicacion = %s"
-            params.append(ubicacion_id)
-
-        if sentidos:
-            sentidos_list = [int(s.strip()) for s in sentidos.split(',') if s.strip().isdigit()]
-            if sentidos_list:
-                # Obtener los valores de sentido_lectura correspondientes a los IDs
-                sentidos_placeholders = ", ".join(["%s"] * len(sentidos_list))
-                sentidos_query = f"""
-                    SELECT sentido_lectura
-                    FROM SENTIDOS_SENSOR
-                    WHERE id IN ({sentidos_placeholders})
-                """
-                sentidos_cursor = db.cursor(dictionary=True)
-                sentidos_cursor.execute(sentidos_query, sentidos_list)
-                sentidos_valores = [row['sentido_lectura'] for row in sentidos_cursor.fetchall()]
-                sentidos_cursor.close()
-
-                if sentidos_valores:
-                    sentidos_valores_placeholders = ", ".join(["%s"] * len(sentidos_valores))
-                    query += f" AND l.sentido_lectura IN ({sentidos_valores_placeholders})"
-                    params.extend(sentidos_valores)
-
-        # Filtros de tiempo según período
-        hoy = datetime.now().date()
-
-        if periodo == "hoy":
-            query += " AND DATE(l.fecha_lectura) = %s"
-            params.append(hoy.strftime('%Y-%m-%d'))
-
-        elif periodo == "semana":
-            # Primer día de la semana (lunes)
-            dia_semana = hoy.weekday()
-            inicio_semana = hoy - timedelta(days=dia_semana)
-            fin_semana = inicio_semana + timedelta(days=6)
-
-            query += " AND DATE(l.fecha_lectura) >= %s AND DATE(l.fecha_lectura) <= %s"
-            params.append(inicio_semana.strftime('%Y-%m-%d'))
-            params.append(fin_semana.strftime('%Y-%m-%d'))
-
-        elif periodo == "mes":
-            # Primer y último día del mes actual
-            primer_dia_mes = date(hoy.year, hoy.month, 1)
-            if hoy.month == 12:
-                ultimo_dia_mes = date(hoy.year + 1, 1, 1) - timedelta(days=1)
-            else:
-                ultimo_dia_mes = date(hoy.year, hoy.month + 1, 1) - timedelta(days=1)
-
-            query += " AND DATE(l.fecha_lectura) >= %s AND DATE(l.fecha_lectura) <= %s"
-            params.append(primer_dia_mes.strftime('%Y-%m-%d'))
-            params.append(ultimo_dia_mes.strftime('%Y-%m-%d'))
-
-        elif periodo == "anio":
-            # Primer y último día del año actual
-            primer_dia_anio = date(hoy.year, 1, 1)
-            ultimo_dia_anio = date(hoy.year, 12, 31)
-
-            query += " AND DATE(l.fecha_lectura) >= %s AND DATE(l.fecha_lectura) <= %s"
-            params.append(primer_dia_anio.strftime('%Y-%m-%d'))
-            params.append(ultimo_dia_anio.strftime('%Y-%m-%d'))
-
-        elif periodo == "personalizado":
-            if fecha_inicio:
-                query += " AND DATE(l.fecha_lectura) >= %s"
-                params.append(fecha_inicio)
-
-            if fecha_fin:
-                query += " AND DATE(l.fecha_lectura) <= %s"
-                params.append(fecha_fin)
-
-            # Filtros de hora
-            if hora_inicio:
-                query += " AND TIME(l.fecha_lectura) >= %s"
-                params.append(hora_inicio)
-
-            if hora_fin:
-                query += " AND TIME(l.fecha_lectura) <= %s"
-                params.append(hora_fin)
+        condiciones, params = _filtros_consulta(
+            db, comuna_id, ubicacion_id, sentidos, periodo,
+            fecha_inicio, fecha_fin, hora_inicio, hora_fin
+        )
+        query += condiciones
 
         # Ordenar por fecha
         query += " ORDER BY l.fecha_lectura DESC"
@@ -442,14 +381,14 @@ def consultar_lecturas(
             lecturas.append({
                 "fecha": fecha_hora.strftime('%d/%m/%Y'),
                 "hora": fecha_hora.strftime('%H:%M'),
-                "comuna": row['comuna'],
-                "ubicacion": row['ubicacion'],
+                "comuna": row['comuna'] or "",
+                "ubicacion": row['ubicacion'] or "",
                 "sentido": row['sentido'],  # Ahora puede ser None
-                "cantidad": row['cantidad']  # Ahora es 1 para cada registro
+                "cantidad": row['cantidad']  # 1 por registro, o las bicicletas del minuto en modo conteos
             })
 
-        # Obtener el total - MODIFICADO para contar registros
-        total = len(results)
+        # Obtener el total de bicicletas de los registros devueltos
+        total = sum(row['cantidad'] for row in results)
 
         cursor.close()
         return {"lecturas": lecturas, "total": total}
@@ -462,7 +401,130 @@ def consultar_lecturas(
         # Si ocurre un error, devolvemos un resultado vacío
         return {"lecturas": [], "total": 0}
 
-@router.get("/grafico", response_model=ResumenResponse)
+# Proyección de /lecturas (compatibilidad): lee cada fecha_lectura una sola vez y emite
+# directamente el esquema antiguo, con la marca de tiempo completa (incluye segundos).
+LECTURAS_COMPAT_LIMITE = 1000
+LECTURAS_COMPAT_LOTE = 200
+
+
+def abrir_lecturas_compat(db, comuna_id, ubicacion_id, sentidos, periodo,
+                          fecha_inicio, fecha_fin, hora_inicio, hora_fin):
+    """Ejecuta la consulta de /lecturas y devuelve el cursor listo para leer"""
+    condiciones, params = _filtros_consulta(
+        db, comuna_id, ubicacion_id, sentidos, periodo,
+        fecha_inicio, fecha_fin, hora_inicio, hora_fin
+    )
+    origen = _origen_consulta(db, periodo, fecha_inicio, fecha_fin)
+    cursor = db.cursor()
+    cursor.execute(f"""
+        SELECT l.fecha_lectura, l.comuna, l.ubicacion_endpoint, l.sentido_lectura, {compact_store.cantidad("l")}
+        FROM {origen} l
+        JOIN UBICACIONES u ON l.id_ubicacion = u.id_ubicacion
+        WHERE 1=1{condiciones}
+        ORDER BY l.fecha_lectura DESC
+        LIMIT {LECTURAS_COMPAT_LIMITE}
+    """, params)
+    return cursor
+
+
+def iterar_lecturas_compat(cursor, ubicacion_id, lote=LECTURAS_COMPAT_LOTE):
+    """Genera por lotes las lecturas en el esquema antiguo de /lecturas y cierra el cursor al terminar"""
+    sensor_id = ubicacion_id or 1
+    nombre_sensor = f"Sensor {sensor_id}"
+    siguiente_id = 1
+    try:
+        while True:
+            filas = cursor.fetchmany(lote)
+            if not filas:
+                break
+            yield [
+                {
+                    "id": siguiente_id + i,
+                    "sensor_id": sensor_id,
+                    "nombre_sensor": nombre_sensor,
+                    "ubicacion": ubicacion or "",
+                    "comuna": comuna or "",
+                    "fecha_hora": fecha_lectura.isoformat(),
+                    "cantidad": int(cantidad),
+                    "sentido": sentido,
+                }
+                for i, (fecha_lectura, comuna, ubicacion, sentido, cantidad) in enumerate(filas)
+            ]
+            siguiente_id += len(filas)
+    finally:
+        cursor.close()
+
+# Exportación de lecturas crudas por rango de días, incluidas las ya archivadas
+EXPORTAR_MAX_DIAS = 366
+EXPORTAR_LOTE = 1000
+
+
+@router.get("/exportar")
+def exportar_lecturas(
+    fecha_inicio: str = Query(..., description="Fecha de inicio (YYYY-MM-DD)"),
+    fecha_fin: str = Query(..., description="Fecha de fin (YYYY-MM-DD), inclusive"),
+    ubicacion_id: Optional[int] = None,
+    db: mysql.connector.connection.MySQLConnection = Depends(get_db_lectura)
+):
+    """
+    Lecturas crudas de un rango de días (una por bicicleta, o una por minuto y sentido con
+    su cantidad en modo conteos), transmitidas por lotes.
+    Si el rango es anterior a la marca de retención se leen también de LECTURAS_ARCHIVO.
+    """
+    try:
+        inicio, fin = rango_consulta("personalizado", fecha_inicio, fecha_fin)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Las fechas deben tener formato YYYY-MM-DD")
+    if fin <= inicio or (fin - inicio).days > EXPORTAR_MAX_DIAS:
+        raise HTTPException(status_code=400, detail=f"El rango debe tener entre 1 y {EXPORTAR_MAX_DIAS} días")
+
+    condiciones = "l.fecha_lectura >= %s AND l.fecha_lectura < %s"
+    params = [inicio, fin]
+    if ubicacion_id is not None:
+        condiciones += " AND l.id_ubicacion = %s"
+        params.append(ubicacion_id)
+
+    try:
+        origen = _origen_consulta(db, "personalizado", fecha_inicio, fecha_fin)
+        cursor = db.cursor()
+        cursor.execute(f"""
+            SELECT l.fecha_lectura, l.nombre_sensor, l.id_ubicacion, l.id_sensor, l.comuna,
+                   l.ubicacion_endpoint, l.direccion, l.sentido_lectura, {compact_store.cantidad("l")}
+            FROM {origen} l
+            WHERE {condiciones}
+            ORDER BY l.fecha_lectura
+        """, params)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al exportar lecturas: {str(e)}")
+
+    return StreamingResponse(arreglo_json(_iterar_exportacion(cursor)), media_type="application/json")
+
+
+def _iterar_exportacion(cursor, lote=EXPORTAR_LOTE):
+    try:
+        while True:
+            filas = cursor.fetchmany(lote)
+            if not filas:
+                break
+            yield [
+                {
+                    "fecha_hora": fecha_lectura.isoformat(),
+                    "sensor": sensor,
+                    "id_ubicacion": id_ubicacion,
+                    "id_sensor": id_sensor,
+                    "comuna": comuna,
+                    "ubicacion": ubicacion,
+                    "direccion": direccion,
+                    "sentido": sentido,
+                    "cantidad": int(cantidad),
+                }
+                for fecha_lectura, sensor, id_ubicacion, id_sensor, comuna, ubicacion, direccion, sentido, cantidad in filas
+            ]
+    finally:
+        cursor.close()
+
+@ruta_rapida(router.get("/grafico", response_model=ResumenResponse))
+@response_cache.cacheado("grafico", response_cache.CACHE_TTL_GRAFICOS, por_dia=True)
 def obtener_datos_grafico(
     comuna_id: Optional[int] = None,
     ubicacion_id: Optional[int] = None,
@@ -474,489 +536,51 @@ def obtener_datos_grafico(
     hora_fin: Optional[str] = Query(None, description="Hora de fin (HH:MM)"),
     agrupar_por: str = Query("auto", description="Campo por el cual agrupar: auto, hora, dia, semana, mes"),
     agrupar: bool = Query(False, description="Indica si los datos deben agruparse"),
-    db: mysql.connector.connection.MySQLConnection = Depends(get_db)
+    db: mysql.connector.connection.MySQLConnection = Depends(get_db_lectura_diferida),
+    intervalo_minutos: Optional[int] = Query(None, ge=1, description="Tamaño de cubeta en minutos (p. ej. 15); reemplaza a agrupar_por")
 ):
     """
     Obtiene datos agrupados para mostrar en gráficos, asegurando que no se duplique el conteo por sentidos.
     Agrupa por hora, día, semana o mes según el período y filtros proporcionados.
     """
     try:
-        cursor = db.cursor(dictionary=True)
-
-        # NUEVA LÓGICA ESPECÍFICA PARA PERÍODO MES
-        if periodo == "mes":
-            # Obtener información del mes actual
-            semanas_mes, primer_dia_mes, ultimo_dia_mes = obtener_semanas_mes_actual()
-
-            # Consulta SQL para agrupar por semana ISO
-            query = """
-                SELECT
-                    WEEK(fecha_lectura, 1) AS semana_iso,
-                    COUNT(*) AS total_lecturas
-                FROM LECTURAS
-                WHERE DATE(fecha_lectura) BETWEEN %s AND %s
-            """
-
-            params = [primer_dia_mes.strftime('%Y-%m-%d'), ultimo_dia_mes.strftime('%Y-%m-%d')]
-
-            # Aplicar filtros adicionales si existen
-            if comuna_id is not None:
-                cursor.execute("SELECT DISTINCT comuna FROM UBICACIONES ORDER BY comuna")
-                comunas = cursor.fetchall()
-                if comunas and 0 <= comuna_id < len(comunas):
-                    query += " AND comuna = %s"
-                    params.append(comunas[comuna_id]['comuna'])
-
-            if ubicacion_id is not None:
-                query += " AND id_ubicacion = %s"
-                params.append(ubicacion_id)
-
-            if sentidos:
-                sentidos_list = [int(s.strip()) for s in sentidos.split(',') if s.strip().isdigit()]
-                if sentidos_list:
-                    # Obtener los valores de sentido_lectura correspondientes a los IDs
-                    sentidos_placeholders = ", ".join(["%s"] * len(sentidos_list))
-                    sentidos_query = f"""
-                        SELECT sentido_lectura
-                        FROM SENTIDOS_SENSOR
-                        WHERE id IN ({sentidos_placeholders})
-                    """
-                    sentidos_cursor = db.cursor(dictionary=True)
-                    sentidos_cursor.execute(sentidos_query, sentidos_list)
-                    sentidos_valores = [row['sentido_lectura'] for row in sentidos_cursor.fetchall()]
-                    sentidos_cursor.close()
-
-                    if sentidos_valores:
-                        sentidos_valores_placeholders = ", ".join(["%s"] * len(sentidos_valores))
-                        query += f" AND sentido_lectura IN ({sentidos_valores_placeholders})"
-                        params.extend(sentidos_valores)
-
-            # Finalizar consulta
-            query += " GROUP BY WEEK(fecha_lectura, 1) ORDER BY WEEK(fecha_lectura, 1)"
-
-            cursor.execute(query, params)
-            resultados = cursor.fetchall()
-
-            # Preparar datos en formato adecuado
-            datos_por_semana = {}
-            for row in resultados:
-                semana = row['semana_iso']
-                cantidad = row['total_lecturas']
-                datos_por_semana[semana] = cantidad
-
-            # Crear etiquetas y datos para todas las semanas del mes
-            etiquetas = []
-            datos = []
-            total = 0
-
-            for semana in semanas_mes:
-                etiquetas.append(f"Semana {semana}")
-                cantidad = datos_por_semana.get(semana, 0)
-                datos.append(cantidad)
-                total += cantidad
-
-            cursor.close()
-            return {
-                "etiquetas": etiquetas,
-                "datos": datos,
-                "total": total
-            }
-
-        # NUEVA LÓGICA ESPECÍFICA PARA PERÍODO AÑO
-        if periodo == "anio":
-            # Obtener el año actual
-            hoy = datetime.now().date()
-            año_actual = hoy.year
-
-            # Consulta SQL para agrupar por mes
-            query = """
-                SELECT
-                    MONTH(fecha_lectura) AS mes,
-                    COUNT(*) AS total_lecturas
-                FROM LECTURAS
-                WHERE YEAR(fecha_lectura) = %s
-            """
-
-            params = [año_actual]
-
-            # Aplicar filtros adicionales si existen
-            if comuna_id is not None:
-                cursor.execute("SELECT DISTINCT comuna FROM UBICACIONES ORDER BY comuna")
-                comunas = cursor.fetchall()
-                if comunas and 0 <= comuna_id < len(comunas):
-                    query += " AND comuna = %s"
-                    params.append(comunas[comuna_id]['comuna'])
-
-            if ubicacion_id is not None:
-                query += " AND id_ubicacion = %s"
-                params.append(ubicacion_id)
-
-            if sentidos:
-                sentidos_list = [int(s.strip()) for s in sentidos.split(',') if s.strip().isdigit()]
-                if sentidos_list:
-                    # Obtener los valores de sentido_lectura correspondientes a los IDs
-                    sentidos_placeholders = ", ".join(["%s"] * len(sentidos_list))
-                    sentidos_query = f"""
-                        SELECT sentido_lectura
-                        FROM SENTIDOS_SENSOR
-                        WHERE id IN ({sentidos_placeholders})
-                    """
-                    sentidos_cursor = db.cursor(dictionary=True)
-                    sentidos_cursor.execute(sentidos_query, sentidos_list)
-                    sentidos_valores = [row['sentido_lectura'] for row in sentidos_cursor.fetchall()]
-                    sentidos_cursor.close()
-
-                    if sentidos_valores:
-                        sentidos_valores_placeholders = ", ".join(["%s"] * len(sentidos_valores))
-                        query += f" AND sentido_lectura IN ({sentidos_valores_placeholders})"
-                        params.extend(sentidos_valores)
-
-            # Finalizar consulta
-            query += " GROUP BY MONTH(fecha_lectura) ORDER BY MONTH(fecha_lectura)"
-
-            cursor.execute(query, params)
-            resultados = cursor.fetchall()
-
-            # Preparar datos en formato adecuado
-            meses_nombres = ['Ene', 'Feb', 'Mar', 'Abr', 'May', 'Jun',
-                           'Jul', 'Ago', 'Sep', 'Oct', 'Nov', 'Dic']
-
-            # Inicializar datos con ceros para todos los 12 meses
-            datos_por_mes = [0] * 12
-
-            # Llenar con los datos reales
-            for row in resultados:
-                mes_num = row['mes']  # 1-12 desde MySQL
-                if 1 <= mes_num <= 12:
-                    datos_por_mes[mes_num - 1] = row['total_lecturas']  # Convertir a índice 0-11
-
-            # Mostrar todos los 12 meses del año
-            etiquetas = meses_nombres  # Todos los 12 meses
-            datos = datos_por_mes      # Todos los 12 meses (con 0 si no hay datos)
-            total = sum(datos)
-
-            cursor.close()
-            return {
-                "etiquetas": etiquetas,
-                "datos": datos,
-                "total": total
-            }
-
-        # Manejo específico para período SEMANA (código original)
-        if periodo == "semana":
-            # Primer día de la semana (lunes)
-            hoy = datetime.now().date()
-            dia_semana = hoy.weekday()
-            inicio_semana = hoy - timedelta(days=dia_semana)
-            fin_semana = inicio_semana + timedelta(days=6)
-
-            # Calcular número de semana ISO
-            semana_iso = inicio_semana.isocalendar()[1]
-
-            # Formatear el rango de fechas para el título del gráfico
-            rango_fechas = f"{inicio_semana.strftime('%d-%m')} al {fin_semana.strftime('%d-%m')}"
-
-            # Consulta SQL para agrupar por día de la semana
-            query = """
-                SELECT
-                    DATE_FORMAT(fecha_lectura, '%w') AS dia_semana_num,
-                    DAYNAME(fecha_lectura) AS nombre_dia,
-                    COUNT(*) AS total_lecturas
-                FROM LECTURAS
-                WHERE DATE(fecha_lectura) BETWEEN %s AND %s
-            """
-
-            params = [inicio_semana.strftime('%Y-%m-%d'), fin_semana.strftime('%Y-%m-%d')]
-
-            # Aplicar filtros adicionales si existen
-            if comuna_id is not None:
-                cursor.execute("SELECT DISTINCT comuna FROM UBICACIONES ORDER BY comuna")
-                comunas = cursor.fetchall()
-                if comunas and 0 <= comuna_id < len(comunas):
-                    query += " AND comuna = %s"
-                    params.append(comunas[comuna_id]['comuna'])
-
-            if ubicacion_id is not None:
-                query += " AND id_ubicacion = %s"
-                params.append(ubicacion_id)
-
-            if sentidos:
-                sentidos_list = [int(s.strip()) for s in sentidos.split(',') if s.strip().isdigit()]
-                if sentidos_list:
-                    # Obtener los valores de sentido_lectura correspondientes a los IDs
-                    sentidos_placeholders = ", ".join(["%s"] * len(sentidos_list))
-                    sentidos_query = f"""
-                        SELECT sentido_lectura
-                        FROM SENTIDOS_SENSOR
-                        WHERE id IN ({sentidos_placeholders})
-                    """
-                    sentidos_cursor = db.cursor(dictionary=True)
-                    sentidos_cursor.execute(sentidos_query, sentidos_list)
-                    sentidos_valores = [row['sentido_lectura'] for row in sentidos_cursor.fetchall()]
-                    sentidos_cursor.close()
-
-                    if sentidos_valores:
-                        sentidos_valores_placeholders = ", ".join(["%s"] * len(sentidos_valores))
-                        query += f" AND sentido_lectura IN ({sentidos_valores_placeholders})"
-                        params.extend(sentidos_valores)
-
-            # Finalizar consulta
-            query += """
-                GROUP BY DATE_FORMAT(fecha_lectura, '%w'), DAYNAME(fecha_lectura)
-                ORDER BY DATE_FORMAT(fecha_lectura, '%w')
-            """
-
-            cursor.execute(query, params)
-            resultados = cursor.fetchall()
-
-            # Preparar datos en formato adecuado
-            dias_semana = ['Lun', 'Mar', 'Mié', 'Jue', 'Vie', 'Sáb', 'Dom']
-            datos = [0] * 7  # Un espacio para cada día de la semana
-            etiquetas = dias_semana.copy()
-
-            # Mapear resultados a los días correspondientes
-            for row in resultados:
-                # MySQL DATE_FORMAT('%w') devuelve 0=Dom, 1=Lun, ..., 6=Sáb
-                # Ajustamos al formato Lun, Mar, ..., Dom
-                dia_num = int(row['dia_semana_num'])
-                indice = dia_num if dia_num > 0 else 6  # Convertir 0 (domingo) a 6
-                indice = indice - 1  # Ajustar para nuestro array (0=Lun, 1=Mar, etc.)
-                datos[indice] = row['total_lecturas']
-
-            # Incluir el número de semana ISO y rango de fechas en la primera etiqueta
-            etiquetas[0] = f"Semana {semana_iso} ({rango_fechas}) - {etiquetas[0]}"
+        plan = planificar_periodo(periodo, fecha_inicio, fecha_fin, agrupar_por, intervalo_minutos, hora_inicio, hora_fin)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-            cursor.close()
+    try:
+        if plan is None:
             return {
-                "etiquetas": etiquetas,
-                "datos": datos,
-                "total": sum(datos),
-                "series": [  # Agregar las series necesarias
-                    {
-                        "nombre": "Total",
-                        "datos": datos,
-                        "color": "#6366f1"
-                    }
-                ]
+                "etiquetas": [],
+                "datos": [],
+                "total": 0
             }
 
-        # NUEVA LÓGICA ESPECÍFICA PARA PERÍODO PERSONALIZADO CON AGRUPACIÓN FLEXIBLE
-        elif periodo == "personalizado":
-            # Obtener parámetro de agrupación (por defecto 'dia')
-            agrupar_por_param = agrupar_por if agrupar_por else 'dia'
-
-            # Validar fechas
-            if not fecha_inicio or not fecha_fin:
-                cursor.close()
-                return {
-                    "etiquetas": [],
-                    "datos": [],
-                    "total": 0
-                }
-
-            # Calcular diferencia de días para validaciones
-            dias_diferencia = calcular_diferencia_dias(fecha_inicio, fecha_fin)
-
-            # Validar agrupación por hora (solo para rangos ≤ 7 días)
-            if agrupar_por_param == 'hora' and dias_diferencia > 7:
-                agrupar_por_param = 'dia'  # Cambiar a día si el rango es muy grande
-
-            # Construir consulta base
-            query_base = """
-                SELECT
-                    fecha_lectura,
-                    COUNT(*) AS total_lecturas
-                FROM LECTURAS
-                WHERE DATE(fecha_lectura) >= %s AND DATE(fecha_lectura) <= %s
-            """
-            params = [fecha_inicio, fecha_fin]
-
-            # Añadir filtros de hora si existen
-            if hora_inicio:
-                query_base += " AND TIME(fecha_lectura) >= %s"
-                params.append(hora_inicio)
-            if hora_fin:
-                query_base += " AND TIME(fecha_lectura) <= %s"
-                params.append(hora_fin)
-
-            # Aplicar filtros adicionales
-            if comuna_id is not None:
-                cursor.execute("SELECT DISTINCT comuna FROM UBICACIONES ORDER BY comuna")
-                comunas = cursor.fetchall()
-                if comunas and 0 <= comuna_id < len(comunas):
-                    query_base += " AND comuna = %s"
-                    params.append(comunas[comuna_id]['comuna'])
-
-            if ubicacion_id is not None:
-                query_base += " AND id_ubicacion = %s"
-                params.append(ubicacion_id)
-
-            if sentidos:
-                sentidos_list = [int(s.strip()) for s in sentidos.split(',') if s.strip().isdigit()]
-                if sentidos_list:
-                    sentidos_placeholders = ", ".join(["%s"] * len(sentidos_list))
-                    sentidos_query = f"""
-                        SELECT sentido_lectura
-                        FROM SENTIDOS_SENSOR
-                        WHERE id IN ({sentidos_placeholders})
-                    """
-                    sentidos_cursor = db.cursor(dictionary=True)
-                    sentidos_cursor.execute(sentidos_query, sentidos_list)
-                    sentidos_valores = [row['sentido_lectura'] for row in sentidos_cursor.fetchall()]
-                    sentidos_cursor.close()
-
-                    if sentidos_valores:
-                        sentidos_valores_placeholders = ", ".join(["%s"] * len(sentidos_valores))
-                        query_base += f" AND sentido_lectura IN ({sentidos_valores_placeholders})"
-                        params.extend(sentidos_valores)
-
-            # Aplicar agrupación según el parámetro
-            if agrupar_por_param == 'hora':
-                query = query_base + " GROUP BY HOUR(fecha_lectura) ORDER BY HOUR(fecha_lectura)"
-                cursor.execute(query, params)
-                resultados = cursor.fetchall()
-
-                etiquetas = generar_etiquetas_horas()
-                datos = [0] * 24
-
-                for row in resultados:
-                    hora = datetime.fromisoformat(str(row['fecha_lectura'])).hour
-                    datos[hora] = row['total_lecturas']
-
-            elif agrupar_por_param == 'dia':
-                query = query_base + " GROUP BY DATE(fecha_lectura) ORDER BY DATE(fecha_lectura)"
-                cursor.execute(query, params)
-                resultados = cursor.fetchall()
-
-                etiquetas = generar_etiquetas_dias(fecha_inicio, fecha_fin)
-                datos = [0] * len(etiquetas)
-
-                # Crear mapa de fechas para indexación rápida
-                fecha_to_index = {}
-                fecha_actual = datetime.strptime(fecha_inicio, '%Y-%m-%d').date()
-                for i, _ in enumerate(etiquetas):
-                    fecha_to_index[fecha_actual.strftime('%d-%m')] = i
-                    fecha_actual += timedelta(days=1)
-
-                for row in resultados:
-                    fecha = datetime.fromisoformat(str(row['fecha_lectura'])).date()
-                    fecha_str = fecha.strftime('%d-%m')
-                    if fecha_str in fecha_to_index:
-                        datos[fecha_to_index[fecha_str]] = row['total_lecturas']
-
-            elif agrupar_por_param == 'semana':
-                query = query_base + " GROUP BY YEARWEEK(fecha_lectura, 1) ORDER BY YEARWEEK(fecha_lectura, 1)"
-                cursor.execute(query, params)
-                resultados = cursor.fetchall()
-
-                etiquetas = generar_etiquetas_semanas(fecha_inicio, fecha_fin)
-                datos = [0] * len(etiquetas)
-
-                # Mapear resultados por semana
-                for i, row in enumerate(resultados):
-                    if i < len(datos):
-                        datos[i] = row['total_lecturas']
-
-            elif agrupar_por_param == 'mes':
-                query = query_base + " GROUP BY YEAR(fecha_lectura), MONTH(fecha_lectura) ORDER BY YEAR(fecha_lectura), MONTH(fecha_lectura)"
-                cursor.execute(query, params)
-                resultados = cursor.fetchall()
-
-                etiquetas = generar_etiquetas_meses(fecha_inicio, fecha_fin)
-                datos = [0] * len(etiquetas)
-
-                # Mapear resultados por mes
-                for i, row in enumerate(resultados):
-                    if i < len(datos):
-                        datos[i] = row['total_lecturas']
-
-            else:
-                # Por defecto usar agrupación por día
-                etiquetas = generar_etiquetas_dias(fecha_inicio, fecha_fin)
-                datos = [0] * len(etiquetas)
-
-            total = sum(datos)
-
+        cursor = db.cursor(dictionary=True)
+        try:
+            filtros = resolver_filtros(cursor, comuna_id, ubicacion_id, sentidos)
+            return calcular_series(cursor, plan, filtros).resumen()
+        finally:
             cursor.close()
-            return {
-                "etiquetas": etiquetas,
-                "datos": datos,
-                "total": total
-            }
-
-        # Procesamiento original para período HOY
-        etiquetas = [f"{h:02d}:00 - {h:02d}:59" for h in range(24)]  # etiquetas fijas por hora
-        datos = [0] * 24
-        total = 0
-
-        filtros = ["DATE(fecha_lectura) = CURDATE()"]
-        params = []
-
-        if comuna_id is not None:
-            cursor.execute("SELECT DISTINCT comuna FROM UBICACIONES ORDER BY comuna")
-            comunas = cursor.fetchall()
-            if comunas and 0 <= comuna_id < len(comunas):
-                filtros.append("comuna = %s")
-                params.append(comunas[comuna_id]['comuna'])
-
-        if ubicacion_id is not None:
-            filtros.append("id_ubicacion = %s")
-            params.append(ubicacion_id)
-
-        if sentidos:
-            sentidos_ids = [int(s) for s in sentidos.split(',') if s.strip().isdigit()]
-            if sentidos_ids:
-                placeholders = ', '.join(['%s'] * len(sentidos_ids))
-                cursor.execute(f"SELECT sentido_lectura FROM SENTIDOS_SENSOR WHERE id IN ({placeholders})", sentidos_ids)
-                sentidos_texto = [row['sentido_lectura'] for row in cursor.fetchall()]
-                if sentidos_texto:
-                    placeholders_texto = ', '.join(['%s'] * len(sentidos_texto))
-                    filtros.append(f"sentido_lectura IN ({placeholders_texto})")
-                    params.extend(sentidos_texto)
-
-        where_clause = " AND ".join(filtros)
-
-        query = f"""
-            SELECT
-                HOUR(fecha_lectura) AS hora,
-                COUNT(*) AS total
-            FROM LECTURAS
-            WHERE {where_clause}
-            GROUP BY HOUR(fecha_lectura)
-            ORDER BY HOUR(fecha_lectura)
-        """
-
-        cursor.execute(query, params)
-        resultados = cursor.fetchall()
-
-        for row in resultados:
-            hora = row['hora']
-            cantidad = row['total']
-            datos[hora] = cantidad
-            total += cantidad
-
-        cursor.close()
-
-        return {
-            "etiquetas": etiquetas,
-            "datos": datos,
-            "total": total
-        }
 
+    except HTTPException:
+        # Sin conexión (503 de get_db_lectura_diferida): no se responde con un gráfico vacío
+        raise
     except Exception as e:
         import traceback
         print(f"Error al obtener datos para gráfico: {str(e)}")
         print(traceback.format_exc())
-        return {
+        # Gráfico vacío como respuesta, pero sin que la caché lo guarde como resultado
+        raise response_cache.Degradado({
             "etiquetas": [],
             "datos": [],
             "total": 0
-        }
+        }, e)
 
 # Endpoint para obtener resumen de lecturas
 @router.get("/resumen")
 def obtener_resumen(
-    db: mysql.connector.connection.MySQLConnection = Depends(get_db)
+    db: mysql.connector.connection.MySQLConnection = Depends(get_db_lectura)
 ):
     """
     Obtiene un resumen estadístico de las lecturas (total hoy, total mes, variación, etc.)
@@ -983,46 +607,23 @@ def obtener_resumen(
             primer_dia_mes_anterior = date(hoy.year, hoy.month - 1, 1)
             ultimo_dia_mes_anterior = primer_dia_mes - timedelta(days=1)
 
-        # Total hoy - MODIFICADO para usar COUNT(*)
-        cursor.execute(
-            "SELECT COUNT(*) as total FROM LECTURAS WHERE DATE(fecha_lectura) = %s",
-            (hoy.strftime('%Y-%m-%d'),)
-        )
-        total_hoy = cursor.fetchone()['total'] or 0
+        # Conteos diarios desde el mes anterior hasta fin de mes, en una sola consulta
+        conteos = conteos_diarios(cursor, primer_dia_mes_anterior, ultimo_dia_mes)
 
-        # Total ayer - MODIFICADO para usar COUNT(*)
-        cursor.execute(
-            "SELECT COUNT(*) as total FROM LECTURAS WHERE DATE(fecha_lectura) = %s",
-            (ayer.strftime('%Y-%m-%d'),)
-        )
-        total_ayer = cursor.fetchone()['total'] or 0
+        def total_entre(desde, hasta):
+            """Total de las fechas [desde, hasta]"""
+            return int(conteos[(desde - primer_dia_mes_anterior).days:(hasta - primer_dia_mes_anterior).days + 1].sum())
+
+        total_hoy = total_entre(hoy, hoy)
+        total_ayer = total_entre(ayer, ayer)
 
         # Variación porcentual diaria
         variacion_diaria = 0
         if total_ayer > 0:
             variacion_diaria = ((total_hoy - total_ayer) / total_ayer) * 100
 
-        # Total mes actual - MODIFICADO para usar COUNT(*)
-        cursor.execute(
-            """
-            SELECT COUNT(*) as total
-            FROM LECTURAS
-            WHERE DATE(fecha_lectura) >= %s AND DATE(fecha_lectura) <= %s
-            """,
-            (primer_dia_mes.strftime('%Y-%m-%d'), ultimo_dia_mes.strftime('%Y-%m-%d'))
-        )
-        total_mes = cursor.fetchone()['total'] or 0
-
-        # Total mes anterior - MODIFICADO para usar COUNT(*)
-        cursor.execute(
-            """
-            SELECT COUNT(*) as total
-            FROM LECTURAS
-            WHERE DATE(fecha_lectura) >= %s AND DATE(fecha_lectura) <= %s
-            """,
-            (primer_dia_mes_anterior.strftime('%Y-%m-%d'), ultimo_dia_mes_anterior.strftime('%Y-%m-%d'))
-        )
-        total_mes_anterior = cursor.fetchone()['total'] or 0
+        total_mes = total_entre(primer_dia_mes, ultimo_dia_mes)
+        total_mes_anterior = total_entre(primer_dia_mes_anterior, ultimo_dia_mes_anterior)
 
         # Variación porcentual mensual
         variacion_mensual = 0
@@ -1078,12 +679,12 @@ def obtener_resumen(
         }
 
 @router.get("/summary")
-def resumen_alias(db: mysql.connector.connection.MySQLConnection = Depends(get_db)):
+def resumen_alias(db: mysql.connector.connection.MySQLConnection = Depends(get_db_lectura)):
     return obtener_resumen(db)
 
 
 
-@router.get("/grafico_detallado", response_model=GraficoDetalladoResponse)
+@ruta_rapida(router.get("/grafico_detallado", response_model=GraficoDetalladoResponse))
 def obtener_datos_grafico_detallado(
     comuna_id: Optional[int] = None,
     ubicacion_id: Optional[int] = None,
@@ -1095,616 +696,118 @@ def obtener_datos_grafico_detallado(
     hora_fin: Optional[str] = Query(None, description="Hora de fin (HH:MM)"),
     agrupar_por: str = Query("auto", description="Campo por el cual agrupar: auto, hora, dia, semana, mes"),
     agrupar: bool = Query(False, description="Indica si los datos deben agruparse"),
-    db: mysql.connector.connection.MySQLConnection = Depends(get_db)
+    db: mysql.connector.connection.MySQLConnection = Depends(get_db_lectura),
+    intervalo_minutos: Optional[int] = Query(None, ge=1, description="Tamaño de cubeta en minutos (p. ej. 15); reemplaza a agrupar_por")
 ):
     """
     Devuelve los datos detallados por sentido de lectura y la serie Total sumada por franja horaria.
     Aplica para cualquier período.
     """
     try:
-        cursor = db.cursor(dictionary=True)
-
-        # NUEVA LÓGICA ESPECÍFICA PARA PERÍODO MES EN GRÁFICO DETALLADO
-        if periodo == "mes":
-            # Obtener información del mes actual
-            semanas_mes, primer_dia_mes, ultimo_dia_mes = obtener_semanas_mes_actual()
-
-            # Consulta SQL mejorada para agrupar por semana ISO y sentido
-            query = """
-                SELECT
-                    WEEK(fecha_lectura, 1) AS semana_iso,
-                    sentido_lectura,
-                    COUNT(*) AS total_lecturas
-                FROM LECTURAS
-                WHERE DATE(fecha_lectura) BETWEEN %s AND %s
-            """
-
-            params = [primer_dia_mes.strftime('%Y-%m-%d'), ultimo_dia_mes.strftime('%Y-%m-%d')]
-
-            # Aplicar filtros adicionales si existen
-            if comuna_id is not None:
-                cursor.execute("SELECT DISTINCT comuna FROM UBICACIONES ORDER BY comuna")
-                comunas = cursor.fetchall()
-                if comunas and 0 <= comuna_id < len(comunas):
-                    query += " AND comuna = %s"
-                    params.append(comunas[comuna_id]['comuna'])
-
-            if ubicacion_id is not None:
-                query += " AND id_ubicacion = %s"
-                params.append(ubicacion_id)
-
-            if sentidos:
-                sentidos_list = [int(s.strip()) for s in sentidos.split(',') if s.strip().isdigit()]
-                if sentidos_list:
-                    # Obtener los valores de sentido_lectura correspondientes a los IDs
-                    sentidos_placeholders = ", ".join(["%s"] * len(sentidos_list))
-                    sentidos_query = f"""
-                        SELECT sentido_lectura
-                        FROM SENTIDOS_SENSOR
-                        WHERE id IN ({sentidos_placeholders})
-                    """
-                    sentidos_cursor = db.cursor(dictionary=True)
-                    sentidos_cursor.execute(sentidos_query, sentidos_list)
-                    sentidos_valores = [row['sentido_lectura'] for row in sentidos_cursor.fetchall()]
-                    sentidos_cursor.close()
-
-                    if sentidos_valores:
-                        sentidos_valores_placeholders = ", ".join(["%s"] * len(sentidos_valores))
-                        query += f" AND sentido_lectura IN ({sentidos_valores_placeholders})"
-                        params.extend(sentidos_valores)
-
-            # Finalizar consulta
-            query += """
-                GROUP BY WEEK(fecha_lectura, 1), sentido_lectura
-                ORDER BY WEEK(fecha_lectura, 1), sentido_lectura
-            """
-
-            cursor.execute(query, params)
-            resultados = cursor.fetchall()
-
-            # Preparar datos en formato adecuado
-            datos_por_sentido = {}
-
-            for row in resultados:
-                semana = row['semana_iso']
-                sentido = row['sentido_lectura'] or 'Sin sentido'
-                cantidad = row['total_lecturas']
-
-                # Si no existe el sentido, inicializarlo con ceros para todas las semanas
-                if sentido not in datos_por_sentido:
-                    datos_por_sentido[sentido] = {}
-
-                # Asignar la cantidad a la semana correspondiente
-                datos_por_sentido[sentido][semana] = cantidad
-
-            # Preparar las series para la respuesta
-            series = []
-            colores = [
-                "#4f46e5", "#7c3aed", "#0891b2", "#15803d", "#ca8a04",
-                "#dc2626", "#ea580c", "#db2777", "#8b5cf6", "#84cc16"
-            ]
-
-            # Calcular el total por semana
-            total_por_semana = {}
-
-            for idx, (sentido, datos_semanas) in enumerate(datos_por_sentido.items()):
-                # Crear array de datos para todas las semanas del mes
-                datos_array = []
-                for semana in semanas_mes:
-                    cantidad = datos_semanas.get(semana, 0)
-                    datos_array.append(cantidad)
-
-                    # Sumar al total por semana
-                    if semana not in total_por_semana:
-                        total_por_semana[semana] = 0
-                    total_por_semana[semana] += cantidad
-
-                series.append(SerieDatos(
-                    nombre=sentido,
-                    datos=datos_array,
-                    color=colores[idx % len(colores)]
-                ))
-
-            # Crear array de totales ordenado
-            total_array = [total_por_semana.get(semana, 0) for semana in semanas_mes]
-
-            # Crear etiquetas
-            etiquetas = [f"Semana {semana}" for semana in semanas_mes]
-
-            # Agregar la serie de "Total" al inicio
-            series.insert(0, SerieDatos(
-                nombre="Total",
-                datos=total_array,
-                color="#6366f1"
-            ))
-
-            cursor.close()
-            return GraficoDetalladoResponse(
-                etiquetas=etiquetas,
-                series=series,
-                total=sum(total_array)
-            )
-
-        # NUEVA LÓGICA ESPECÍFICA PARA PERÍODO AÑO EN GRÁFICO DETALLADO
-        if periodo == "anio":
-            # Obtener el año actual
-            hoy = datetime.now().date()
-            año_actual = hoy.year
-
-            # Consulta SQL mejorada para agrupar por mes y sentido
-            query = """
-                SELECT
-                    MONTH(fecha_lectura) AS mes,
-                    sentido_lectura,
-                    COUNT(*) AS total_lecturas
-                FROM LECTURAS
-                WHERE YEAR(fecha_lectura) = %s
-            """
-
-            params = [año_actual]
-
-            # Aplicar filtros adicionales si existen
-            if comuna_id is not None:
-                cursor.execute("SELECT DISTINCT comuna FROM UBICACIONES ORDER BY comuna")
-                comunas = cursor.fetchall()
-                if comunas and 0 <= comuna_id < len(comunas):
-                    query += " AND comuna = %s"
-                    params.append(comunas[comuna_id]['comuna'])
-
-            if ubicacion_id is not None:
-                query += " AND id_ubicacion = %s"
-                params.append(ubicacion_id)
-
-            if sentidos:
-                sentidos_list = [int(s.strip()) for s in sentidos.split(',') if s.strip().isdigit()]
-                if sentidos_list:
-                    # Obtener los valores de sentido_lectura correspondientes a los IDs
-                    sentidos_placeholders = ", ".join(["%s"] * len(sentidos_list))
-                    sentidos_query = f"""
-                        SELECT sentido_lectura
-                        FROM SENTIDOS_SENSOR
-                        WHERE id IN ({sentidos_placeholders})
-                    """
-                    sentidos_cursor = db.cursor(dictionary=True)
-                    sentidos_cursor.execute(sentidos_query, sentidos_list)
-                    sentidos_valores = [row['sentido_lectura'] for row in sentidos_cursor.fetchall()]
-                    sentidos_cursor.close()
-
-                    if sentidos_valores:
-                        sentidos_valores_placeholders = ", ".join(["%s"] * len(sentidos_valores))
-                        query += f" AND sentido_lectura IN ({sentidos_valores_placeholders})"
-                        params.extend(sentidos_valores)
-
-            # Finalizar consulta
-            query += """
-                GROUP BY MONTH(fecha_lectura), sentido_lectura
-                ORDER BY MONTH(fecha_lectura), sentido_lectura
-            """
-
-            cursor.execute(query, params)
-            resultados = cursor.fetchall()
-
-            # Preparar datos en formato adecuado
-            meses_nombres = ['Ene', 'Feb', 'Mar', 'Abr', 'May', 'Jun',
-                           'Jul', 'Ago', 'Sep', 'Oct', 'Nov', 'Dic']
-
-            # Mostrar todos los 12 meses del año
-            etiquetas = meses_nombres  # Todos los 12 meses
-
-            datos_por_sentido = {}
-
-            for row in resultados:
-                mes_num = row['mes']  # 1-12 desde MySQL
-                sentido = row['sentido_lectura'] or 'Sin sentido'
-                cantidad = row['total_lecturas']
-
-                # Procesar todos los meses (1-12)
-                if 1 <= mes_num <= 12:
-                    # Si no existe el sentido, inicializarlo con ceros para todos los 12 meses
-                    if sentido not in datos_por_sentido:
-                        datos_por_sentido[sentido] = [0] * 12
-
-                    # Asignar la cantidad al mes correspondiente (convertir 1-12 a 0-11)
-                    datos_por_sentido[sentido][mes_num - 1] = cantidad
-
-            # Preparar las series para la respuesta
-            series = []
-            colores = [
-                "#4f46e5", "#7c3aed", "#0891b2", "#15803d", "#ca8a04",
-                "#dc2626", "#ea580c", "#db2777", "#8b5cf6", "#84cc16"
-            ]
-
-            # Calcular el total por mes (todos los 12 meses)
-            total_por_mes = [0] * 12
-
-            for idx, (sentido, datos_meses) in enumerate(datos_por_sentido.items()):
-                series.append(SerieDatos(
-                    nombre=sentido,
-                    datos=datos_meses,
-                    color=colores[idx % len(colores)]
-                ))
-
-                # Sumar al total por mes
-                total_por_mes = [a + b for a, b in zip(total_por_mes, datos_meses)]
-
-            # Agregar la serie de "Total" al inicio
-            series.insert(0, SerieDatos(
-                nombre="Total",
-                datos=total_por_mes,
-                color="#6366f1"
-            ))
-
-            cursor.close()
-            return GraficoDetalladoResponse(
-                etiquetas=etiquetas,
-                series=series,
-                total=sum(total_por_mes)
-            )
-
-        # Tratamiento específico para período SEMANA (código original)
-        if periodo == "semana":
-            # Primer día de la semana (lunes)
-            hoy = datetime.now().date()
-            dia_semana = hoy.weekday()
-            inicio_semana = hoy - timedelta(days=dia_semana)
-            fin_semana = inicio_semana + timedelta(days=6)
-
-            # Calcular número de semana ISO
-            semana_iso = inicio_semana.isocalendar()[1]
-
-            # Formatear el rango de fechas para el título del gráfico
-            rango_fechas = f"{inicio_semana.strftime('%d-%m')} al {fin_semana.strftime('%d-%m')}"
-
-            # Consulta SQL mejorada para agrupar por día de la semana y sentido
-            query = """
-                SELECT
-                    DATE_FORMAT(fecha_lectura, '%w') AS dia_semana_num,
-                    sentido_lectura,
-                    COUNT(*) AS total_lecturas
-                FROM LECTURAS
-                WHERE DATE(fecha_lectura) BETWEEN %s AND %s
-            """
-
-            params = [inicio_semana.strftime('%Y-%m-%d'), fin_semana.strftime('%Y-%m-%d')]
-
-            # Aplicar filtros adicionales si existen
-            if comuna_id is not None:
-                cursor.execute("SELECT DISTINCT comuna FROM UBICACIONES ORDER BY comuna")
-                comunas = cursor.fetchall()
-                if comunas and 0 <= comuna_id < len(comunas):
-                    query += " AND comuna = %s"
-                    params.append(comunas[comuna_id]['comuna'])
-
-            if ubicacion_id is not None:
-                query += " AND id_ubicacion = %s"
-                params.append(ubicacion_id)
-
-            if sentidos:
-                sentidos_list = [int(s.strip()) for s in sentidos.split(',') if s.strip().isdigit()]
-                if sentidos_list:
-                    # Obtener los valores de sentido_lectura correspondientes a los IDs
-                    sentidos_placeholders = ", ".join(["%s"] * len(sentidos_list))
-                    sentidos_query = f"""
-                        SELECT sentido_lectura
-                        FROM SENTIDOS_SENSOR
-                        WHERE id IN ({sentidos_placeholders})
-                    """
-                    sentidos_cursor = db.cursor(dictionary=True)
-                    sentidos_cursor.execute(sentidos_query, sentidos_list)
-                    sentidos_valores = [row['sentido_lectura'] for row in sentidos_cursor.fetchall()]
-                    sentidos_cursor.close()
-
-                    if sentidos_valores:
-                        sentidos_valores_placeholders = ", ".join(["%s"] * len(sentidos_valores))
-                        query += f" AND sentido_lectura IN ({sentidos_valores_placeholders})"
-                        params.extend(sentidos_valores)
-
-            # Finalizar consulta
-            query += """
-                GROUP BY DATE_FORMAT(fecha_lectura, '%w'), sentido_lectura
-                ORDER BY DATE_FORMAT(fecha_lectura, '%w'), sentido_lectura
-            """
-
-            cursor.execute(query, params)
-            resultados = cursor.fetchall()
-
-            # Preparar datos en formato adecuado
-            dias_semana = ['Lun', 'Mar', 'Mié', 'Jue', 'Vie', 'Sáb', 'Dom']
-            datos_por_sentido = {}
-
-            for row in resultados:
-                # MySQL DATE_FORMAT('%w') devuelve 0=Dom, 1=Lun, ..., 6=Sáb
-                dia_num = int(row['dia_semana_num'])
-                indice = dia_num if dia_num > 0 else 6  # Convertir 0 (domingo) a 6
-                indice = indice - 1  # Ajustar para nuestro array (0=Lun, 1=Mar, etc.)
+        plan = planificar_periodo(periodo, fecha_inicio, fecha_fin, agrupar_por, intervalo_minutos, hora_inicio, hora_fin)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-                sentido = row['sentido_lectura'] or 'Sin sentido'
-                cantidad = row['total_lecturas']
-
-                # Si no existe el sentido, inicializarlo con ceros
-                if sentido not in datos_por_sentido:
-                    datos_por_sentido[sentido] = [0] * 7
-
-                # Asignar la cantidad al día correspondiente
-                datos_por_sentido[sentido][indice] = cantidad
-
-            # Preparar las series para la respuesta
-            series = []
-            colores = [
-                "#4f46e5", "#7c3aed", "#0891b2", "#15803d", "#ca8a04",
-                "#dc2626", "#ea580c", "#db2777", "#8b5cf6", "#84cc16"
-            ]
-
-            # Calcular el total por día
-            total_por_dia = [0] * 7
-
-            for idx, (sentido, datos_dias) in enumerate(datos_por_sentido.items()):
-                series.append(SerieDatos(
-                    nombre=sentido,
-                    datos=datos_dias,
-                    color=colores[idx % len(colores)]
-                ))
-
-                # Sumar al total por día
-                total_por_dia = [a + b for a, b in zip(total_por_dia, datos_dias)]
-
-            # Formatar las etiquetas de días
-            etiquetas = dias_semana.copy()
-
-            # Incluir el número de semana ISO y rango de fechas en la primera etiqueta
-            etiquetas[0] = f"Semana {semana_iso} ({rango_fechas}) - {etiquetas[0]}"
-
-            # Agregar la serie de "Total" al inicio
-            series.insert(0, SerieDatos(
-                nombre="Total",
-                datos=total_por_dia,
-                color="#6366f1"
-            ))
+    try:
+        if plan is None:
+            return {"etiquetas": [], "series": [], "total": 0}
 
+        cursor = db.cursor(dictionary=True)
+        try:
+            filtros = resolver_filtros(cursor, comuna_id, ubicacion_id, sentidos)
+            return calcular_series(cursor, plan, filtros, dimension="sentido").detallado()
+        finally:
             cursor.close()
-            return GraficoDetalladoResponse(
-                etiquetas=etiquetas,
-                series=series,
-                total=sum(total_por_dia)
-            )
 
-        # NUEVA LÓGICA ESPECÍFICA PARA PERÍODO PERSONALIZADO EN GRÁFICO DETALLADO
-        elif periodo == "personalizado":
-            # Obtener parámetro de agrupación (por defecto 'dia')
-            agrupar_por_param = agrupar_por if agrupar_por else 'dia'
-
-            # Validar fechas
-            if not fecha_inicio or not fecha_fin:
-                cursor.close()
-                return GraficoDetalladoResponse(etiquetas=[], series=[], total=0)
-
-            # Calcular diferencia de días para validaciones
-            dias_diferencia = calcular_diferencia_dias(fecha_inicio, fecha_fin)
-
-            # Validar agrupación por hora (solo para rangos ≤ 7 días)
-            if agrupar_por_param == 'hora' and dias_diferencia > 7:
-                agrupar_por_param = 'dia'  # Cambiar a día si el rango es muy grande
-
-            # Construir consulta base
-            query_base = """
-                SELECT
-                    fecha_lectura,
-                    sentido_lectura,
-                    COUNT(*) AS total_lecturas
-                FROM LECTURAS
-                WHERE DATE(fecha_lectura) >= %s AND DATE(fecha_lectura) <= %s
-            """
-            params = [fecha_inicio, fecha_fin]
-
-            # Añadir filtros de hora si existen
-            if hora_inicio:
-                query_base += " AND TIME(fecha_lectura) >= %s"
-                params.append(hora_inicio)
-            if hora_fin:
-                query_base += " AND TIME(fecha_lectura) <= %s"
-                params.append(hora_fin)
-
-            # Aplicar filtros adicionales
-            if comuna_id is not None:
-                cursor.execute("SELECT DISTINCT comuna FROM UBICACIONES ORDER BY comuna")
-                comunas = cursor.fetchall()
-                if comunas and 0 <= comuna_id < len(comunas):
-                    query_base += " AND comuna = %s"
-                    params.append(comunas[comuna_id]['comuna'])
-
-            if ubicacion_id is not None:
-                query_base += " AND id_ubicacion = %s"
-                params.append(ubicacion_id)
-
-            if sentidos:
-                sentidos_list = [int(s.strip()) for s in sentidos.split(',') if s.strip().isdigit()]
-                if sentidos_list:
-                    sentidos_placeholders = ", ".join(["%s"] * len(sentidos_list))
-                    sentidos_query = f"""
-                        SELECT sentido_lectura
-                        FROM SENTIDOS_SENSOR
-                        WHERE id IN ({sentidos_placeholders})
-                    """
-                    sentidos_cursor = db.cursor(dictionary=True)
-                    sentidos_cursor.execute(sentidos_query, sentidos_list)
-                    sentidos_valores = [row['sentido_lectura'] for row in sentidos_cursor.fetchall()]
-                    sentidos_cursor.close()
-
-                    if sentidos_valores:
-                        sentidos_valores_placeholders = ", ".join(["%s"] * len(sentidos_valores))
-                        query_base += f" AND sentido_lectura IN ({sentidos_valores_placeholders})"
-                        params.extend(sentidos_valores)
-
-            # Aplicar agrupación según el parámetro
-            if agrupar_por_param == 'hora':
-                query = query_base + " GROUP BY HOUR(fecha_lectura), sentido_lectura ORDER BY HOUR(fecha_lectura), sentido_lectura"
-                etiquetas = generar_etiquetas_horas()
-                num_elementos = 24
-
-            elif agrupar_por_param == 'dia':
-                query = query_base + " GROUP BY DATE(fecha_lectura), sentido_lectura ORDER BY DATE(fecha_lectura), sentido_lectura"
-                etiquetas = generar_etiquetas_dias(fecha_inicio, fecha_fin)
-                num_elementos = len(etiquetas)
-
-            elif agrupar_por_param == 'semana':
-                query = query_base + " GROUP BY YEARWEEK(fecha_lectura, 1), sentido_lectura ORDER BY YEARWEEK(fecha_lectura, 1), sentido_lectura"
-                etiquetas = generar_etiquetas_semanas(fecha_inicio, fecha_fin)
-                num_elementos = len(etiquetas)
-
-            elif agrupar_por_param == 'mes':
-                query = query_base + " GROUP BY YEAR(fecha_lectura), MONTH(fecha_lectura), sentido_lectura ORDER BY YEAR(fecha_lectura), MONTH(fecha_lectura), sentido_lectura"
-                etiquetas = generar_etiquetas_meses(fecha_inicio, fecha_fin)
-                num_elementos = len(etiquetas)
-
-            else:
-                # Por defecto usar agrupación por día
-                query = query_base + " GROUP BY DATE(fecha_lectura), sentido_lectura ORDER BY DATE(fecha_lectura), sentido_lectura"
-                etiquetas = generar_etiquetas_dias(fecha_inicio, fecha_fin)
-                num_elementos = len(etiquetas)
-
-            cursor.execute(query, params)
-            resultados = cursor.fetchall()
-
-            # Procesar resultados por sentido
-            datos_por_sentido = {}
-
-            for row in resultados:
-                sentido = row['sentido_lectura'] or 'Sin sentido'
-                fecha_lectura = row['fecha_lectura']
-                cantidad = row['total_lecturas']
-
-                # Inicializar sentido si no existe
-                if sentido not in datos_por_sentido:
-                    datos_por_sentido[sentido] = [0] * num_elementos
-
-                # Determinar índice según el tipo de agrupación
-                if agrupar_por_param == 'hora':
-                    indice = datetime.fromisoformat(str(fecha_lectura)).hour
-                elif agrupar_por_param == 'dia':
-                    fecha = datetime.fromisoformat(str(fecha_lectura)).date()
-                    fecha_inicio_dt = datetime.strptime(fecha_inicio, '%Y-%m-%d').date()
-                    indice = (fecha - fecha_inicio_dt).days
-                elif agrupar_por_param == 'semana':
-                    # Calcular índice de semana (simplificado)
-                    fecha = datetime.fromisoformat(str(fecha_lectura)).date()
-                    fecha_inicio_dt = datetime.strptime(fecha_inicio, '%Y-%m-%d').date()
-                    indice = (fecha - fecha_inicio_dt).days // 7
-                elif agrupar_por_param == 'mes':
-                    fecha = datetime.fromisoformat(str(fecha_lectura)).date()
-                    fecha_inicio_dt = datetime.strptime(fecha_inicio, '%Y-%m-%d').date()
-                    indice = (fecha.year - fecha_inicio_dt.year) * 12 + (fecha.month - fecha_inicio_dt.month)
-                else:
-                    indice = 0
-
-                # Asignar cantidad si el índice es válido
-                if 0 <= indice < num_elementos:
-                    datos_por_sentido[sentido][indice] = cantidad
-
-            # Preparar las series para la respuesta
-            series = []
-            colores = [
-                "#4f46e5", "#7c3aed", "#0891b2", "#15803d", "#ca8a04",
-                "#dc2626", "#ea580c", "#db2777", "#8b5cf6", "#84cc16"
-            ]
+    except Exception as e:
+        import traceback
+        print("Error:", str(e))
+        print(traceback.format_exc())
+        return {"etiquetas": [], "series": [], "total": 0}
+
+
+def _lista_ids(valor):
+    """Convierte '1, 2,3' en [1, 2, 3] conservando el orden y sin repetidos"""
+    ids = []
+    for parte in (valor or "").split(","):
+        parte = parte.strip()
+        if parte.isdigit() and int(parte) not in ids:
+            ids.append(int(parte))
+    return ids
+
+@ruta_rapida(router.get("/comparar", response_model=ComparacionResponse))
+def comparar_entidades(
+    ubicaciones: Optional[str] = Query(None, description="IDs de ubicaciones separados por coma"),
+    comunas: Optional[str] = Query(None, description="IDs de comunas separados por coma (se ignora si se indican ubicaciones)"),
+    sentidos: Optional[str] = Query(None, description="IDs de sentidos separados por coma"),
+    periodo: str = Query("hoy", description="Período: hoy, semana, mes, anio, personalizado"),
+    fecha_inicio: Optional[str] = Query(None, description="Fecha de inicio (YYYY-MM-DD)"),
+    fecha_fin: Optional[str] = Query(None, description="Fecha de fin (YYYY-MM-DD)"),
+    hora_inicio: Optional[str] = Query(None, description="Hora de inicio (HH:MM)"),
+    hora_fin: Optional[str] = Query(None, description="Hora de fin (HH:MM)"),
+    agrupar_por: str = Query("auto", description="Campo por el cual agrupar: auto, hora, dia, semana, mes"),
+    intervalo_minutos: Optional[int] = Query(None, ge=1, description="Tamaño de cubeta en minutos (p. ej. 15); reemplaza a agrupar_por"),
+    db: mysql.connector.connection.MySQLConnection = Depends(get_db_lectura)
+):
+    """
+    Compara varias ubicaciones o comunas en el mismo período y agrupación.
+    Devuelve una serie por entidad, calculadas todas con una sola consulta agrupada.
+    """
+    ids_ubicaciones = _lista_ids(ubicaciones)
+    ids_comunas = _lista_ids(comunas)
+    if not ids_ubicaciones and not ids_comunas:
+        raise HTTPException(status_code=400, detail="Indique al menos una ubicación o comuna a comparar")
 
-            # Calcular el total por elemento
-            total_por_elemento = [0] * num_elementos
+    try:
+        plan = planificar_periodo(periodo, fecha_inicio, fecha_fin, agrupar_por, intervalo_minutos, hora_inicio, hora_fin)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if plan is None:
+        return {"etiquetas": [], "series": [], "total": 0}
 
-            for idx, (sentido, datos_elementos) in enumerate(datos_por_sentido.items()):
-                series.append(SerieDatos(
-                    nombre=sentido,
-                    datos=datos_elementos,
-                    color=colores[idx % len(colores)]
-                ))
+    cursor = db.cursor(dictionary=True)
+    try:
+        filtros = resolver_filtros(cursor, sentidos=sentidos)
 
-                # Sumar al total por elemento
-                total_por_elemento = [a + b for a, b in zip(total_por_elemento, datos_elementos)]
+        if ids_ubicaciones:
+            placeholders = ", ".join(["%s"] * len(ids_ubicaciones))
+            cursor.execute(f"""
+                SELECT id_ubicacion, COALESCE(nombre_formal, ubicacion_endpoint) as nombre
+                FROM UBICACIONES
+                WHERE id_ubicacion IN ({placeholders})
+            """, ids_ubicaciones)
+            nombres = {row['id_ubicacion']: row['nombre'] for row in cursor.fetchall()}
+            entidades = [(i, i, nombres.get(i) or f"Ubicación {i}") for i in ids_ubicaciones if i in nombres]
+            filtros.ubicaciones = [clave for _, clave, _ in entidades]
+            dimension = "ubicacion"
+        else:
+            todas = nombres_comunas(cursor)
+            entidades = [(i, todas[i], todas[i]) for i in ids_comunas if 0 <= i < len(todas)]
+            filtros.comunas = [clave for _, clave, _ in entidades]
+            dimension = "comuna"
 
-            # Agregar la serie de "Total" al inicio
-            series.insert(0, SerieDatos(
-                nombre="Total",
-                datos=total_por_elemento,
-                color="#6366f1"
-            ))
+        if not entidades:
+            return {"etiquetas": plan.etiquetas, "series": [], "total": 0}
 
-            cursor.close()
-            return GraficoDetalladoResponse(
-                etiquetas=etiquetas,
-                series=series,
-                total=sum(total_por_elemento)
-            )
+        resultado = calcular_series(cursor, plan, filtros, dimension=dimension,
+                                    claves=[clave for _, clave, _ in entidades])
 
-        # Procesamiento original para período HOY
-        etiquetas = [f"{h:02d}:00 - {h:02d}:59" for h in range(24)]
         series = []
-        total = 0
-
-        query = """
-            SELECT
-                HOUR(fecha_lectura) AS hora,
-                sentido_lectura,
-                COUNT(*) AS total
-            FROM LECTURAS
-            WHERE DATE(fecha_lectura) = CURDATE()
-        """
-        params = []
-
-        if comuna_id is not None:
-            cursor.execute("SELECT DISTINCT comuna FROM UBICACIONES ORDER BY comuna")
-            comunas = cursor.fetchall()
-            if comunas and 0 <= comuna_id < len(comunas):
-                query += " AND comuna = %s"
-                params.append(comunas[comuna_id]['comuna'])
-
-        if ubicacion_id is not None:
-            query += " AND id_ubicacion = %s"
-            params.append(ubicacion_id)
-
-        query += """
-            GROUP BY sentido_lectura, HOUR(fecha_lectura)
-            ORDER BY sentido_lectura, HOUR(fecha_lectura)
-        """
-
-        cursor.execute(query, params)
-        resultados = cursor.fetchall()
-
-        datos_por_sentido = {}
-        for row in resultados:
-            sentido = row['sentido_lectura']
-            hora = int(row['hora'])
-            cantidad = row['total']
-            if sentido not in datos_por_sentido:
-                datos_por_sentido[sentido] = [0] * 24
-            datos_por_sentido[sentido][hora] = cantidad
-
-        colores = [
-            "#4f46e5", "#7c3aed", "#0891b2", "#15803d", "#ca8a04",
-            "#dc2626", "#ea580c", "#db2777", "#8b5cf6", "#84cc16"
-        ]
-
-        total_por_hora = [0] * 24
-
-        for idx, (sentido, datos_horas) in enumerate(datos_por_sentido.items()):
-            series.append(SerieDatos(
-                nombre=sentido,
-                datos=datos_horas,
-                color=colores[idx % len(colores)]
-            ))
-            total_por_hora = [a + b for a, b in zip(total_por_hora, datos_horas)]
-
-        total = sum(total_por_hora)
-
-        series.insert(0, SerieDatos(nombre="Total", datos=total_por_hora, color="#6366f1"))
+        for idx, ((id_entidad, _, nombre), fila) in enumerate(zip(entidades, resultado.matriz)):
+            series.append({
+                "id": id_entidad,
+                "nombre": nombre,
+                "datos": fila.tolist(),
+                "total": int(fila.sum()),
+                "color": COLORES[idx % len(COLORES)]
+            })
 
+        return {
+            "etiquetas": resultado.etiquetas,
+            "series": series,
+            "total": int(resultado.totales.sum())
+        }
+    except mysql.connector.Error as e:
+        raise HTTPException(status_code=500, detail=f"Error al comparar: {str(e)}")
+    finally:
         cursor.close()
-
-        return GraficoDetalladoResponse(
-            etiquetas=etiquetas,
-            series=series,
-            total=total
-        )
-    except Exception as e:
-        import traceback
-        print("Error:", str(e))
-        print(traceback.format_exc())
-        return GraficoDetalladoResponse(etiquetas=[], series=[], total=0)
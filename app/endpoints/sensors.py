@@ -6,7 +6,9 @@ import mysql.connector
 from mysql.connector.connection import MySQLConnection
 from pydantic import BaseModel
 
-from app.database import get_db
+from app.database import get_db, get_db_lectura, get_db_lectura_diferida
+from app import response_cache, sensor_registry
+from app.fast_response import ruta_rapida
 
 router = APIRouter()
 
@@ -19,15 +21,14 @@ class SensorUpdate(BaseModel):
     estado: str
     usuario: Optional[str] = "sistema"
 
-@router.get("/list")
+@ruta_rapida(router.get("/list"))
 def get_sensors(
     ubicacion_id: Optional[int] = None,
     estado: Optional[str] = None,
-    conn: MySQLConnection = Depends(get_db)
+    conn: MySQLConnection = Depends(get_db_lectura)
 ):
     cursor = conn.cursor(dictionary=True)
     try:
-        today = datetime.now().date()
         query = """
         SELECT vsu.*, e.DESCRIPCION_ESTADO
         FROM BICICLA.VISTA_SENSORES_UBICACIONES vsu
@@ -43,24 +44,19 @@ def get_sensors(
         sensores = cursor.fetchall()
         result = []
 
+        # Conteo de hoy y última lectura desde el registro mantenido por la ingesta,
+        # así el costo no crece con el número de sensores ni recorre LECTURAS
+        sensor_registry.asegurar_cargado(conn)
+        ahora = datetime.now()
+
         for sensor in sensores:
             nombre_sensor = sensor.get('NOMBRE_SENSOR')
             if not nombre_sensor:
                 continue
 
-            cursor.execute("""
-                SELECT COUNT(*) as conteo
-                FROM LECTURAS
-                WHERE NOMBRE_SENSOR = %s AND DATE(FECHA_LECTURA) = %s
-            """, (nombre_sensor, today))
-            conteo_hoy = cursor.fetchone()['conteo']
-
-            cursor.execute("""
-                SELECT MAX(FECHA_LECTURA) as ultima_fecha
-                FROM LECTURAS
-                WHERE NOMBRE_SENSOR = %s
-            """, (nombre_sensor,))
-            ultima_lectura = cursor.fetchone()['ultima_fecha']
+            estado_registro = sensor_registry.obtener(nombre_sensor)
+            conteo_hoy = estado_registro.conteo_de_hoy(ahora) if estado_registro else 0
+            ultima_lectura = estado_registro.ultima_lectura if estado_registro else None
 
             result.append({
                 "id": sensor.get('ID_SENSOR'),
@@ -90,8 +86,43 @@ def get_sensors(
     finally:
         cursor.close()
 
+@router.get("/actividad")
+def get_sensor_activity(
+    horas: int = Query(3, ge=1, description="Ventana en horas para considerar un sensor activo"),
+    conn: MySQLConnection = Depends(get_db_lectura)
+):
+    """Sensores activos e inactivos según su última lectura, resuelto desde el registro de sensores."""
+    cursor = conn.cursor(dictionary=True)
+    try:
+        sensor_registry.asegurar_cargado(conn)
+
+        cursor.execute("SELECT DISTINCT NOMBRE_SENSOR FROM SENSORES WHERE NOMBRE_SENSOR IS NOT NULL")
+        nombres = [row['NOMBRE_SENSOR'] for row in cursor.fetchall()]
+
+        ahora = datetime.now()
+        inactivos = set(sensor_registry.sensores_inactivos(nombres, horas, ahora))
+        estados = sensor_registry.estados()
+
+        def detalle(nombre):
+            estado = estados.get(nombre)
+            if estado is None:
+                return {"nombre_sensor": nombre, "ultima_lectura": None, "conteo_hoy": 0, "conteo_ultima_hora": 0}
+            return estado.como_dict(ahora)
+
+        return {
+            "horas": horas,
+            "activos": [detalle(nombre) for nombre in sorted(nombres) if nombre not in inactivos],
+            "inactivos": [detalle(nombre) for nombre in sorted(inactivos)]
+        }
+
+    except mysql.connector.Error as err:
+        logging.error(f"Error de base de datos en get_sensor_activity: {err}")
+        raise HTTPException(status_code=500, detail=f"Error de base de datos: {str(err)}")
+    finally:
+        cursor.close()
+
 @router.get("/map")
-def get_map_sensors(conn: MySQLConnection = Depends(get_db)):
+def get_map_sensors(conn: MySQLConnection = Depends(get_db_lectura)):
     cursor = conn.cursor(dictionary=True)
     try:
         cursor.execute("""
@@ -132,7 +163,7 @@ def get_map_sensors(conn: MySQLConnection = Depends(get_db)):
         cursor.close()
 
 @router.get("/detail/{sensor_id}")
-def get_sensor_detail(sensor_id: int, conn: MySQLConnection = Depends(get_db)):
+def get_sensor_detail(sensor_id: int, conn: MySQLConnection = Depends(get_db_lectura)):
     cursor = conn.cursor(dictionary=True)
     try:
         cursor.execute("""
@@ -179,7 +210,7 @@ def get_sensor_detail(sensor_id: int, conn: MySQLConnection = Depends(get_db)):
         cursor.close()
 
 @router.get("/auditoria/{sensor_id}")
-def get_sensor_auditoria(sensor_id: int, conn: MySQLConnection = Depends(get_db)):
+def get_sensor_auditoria(sensor_id: int, conn: MySQLConnection = Depends(get_db_lectura)):
     cursor = conn.cursor(dictionary=True)
     try:
         cursor.execute("""
@@ -195,7 +226,8 @@ def get_sensor_auditoria(sensor_id: int, conn: MySQLConnection = Depends(get_db)
         cursor.close()
 
 @router.get("/estados")
-def get_estados(conn: MySQLConnection = Depends(get_db)):
+@response_cache.cacheado("estados", response_cache.CACHE_TTL_CATALOGOS)
+def get_estados(conn: MySQLConnection = Depends(get_db_lectura_diferida)):
     cursor = conn.cursor(dictionary=True)
     try:
         cursor.execute("SELECT CODIGO_ESTADO as codigo, DESCRIPCION_ESTADO as descripcion FROM BICICLA.ESTADOS")
@@ -5,7 +5,8 @@ import mysql.connector
 from mysql.connector.connection import MySQLConnection
 
 # Importar nuestra conexión a la base de datos
-from app.database import get_db
+from app.database import get_db_lectura
+from app.chart_engine import Filtros, conteos_diarios
 
 # Crear router para los endpoints de estadísticas
 router = APIRouter()
@@ -45,12 +46,24 @@ class WeeklyTrend:
         self.periodo = periodo
         self.datos = datos
 
+def _filtros(ubicacion_id=None, sensor_id=None):
+    """Filtros opcionales por ubicación o sensor de los endpoints de estadísticas"""
+    return Filtros(
+        ubicaciones=[ubicacion_id] if ubicacion_id else None,
+        sensores=[sensor_id] if sensor_id else None
+    )
+
+def _promedio_dias_con_datos(conteos):
+    """Promedio de los días con lecturas (los días sin datos no cuentan)"""
+    con_datos = conteos[conteos > 0]
+    return float(con_datos.sum()) / len(con_datos) if len(con_datos) else 0
+
 # Endpoints para estadísticas generales
 @router.get("/today", response_model=dict)
 def get_stats_today(
     ubicacion_id: Optional[int] = None,
     sensor_id: Optional[int] = None,
-    conn: MySQLConnection = Depends(get_db)
+    conn: MySQLConnection = Depends(get_db_lectura)
 ):
     """
     Obtiene el conteo total de ciclistas para el día actual.
@@ -61,45 +74,11 @@ def get_stats_today(
         today = datetime.now().date()
         yesterday = today - timedelta(days=1)
         
-        # Consulta para el total de hoy
-        query_today = """
-            SELECT COUNT(*) as total
-            FROM LECTURAS
-            WHERE DATE(FECHA_LECTURA) = %s
-        """
-        params_today = [today]
-        
-        if ubicacion_id:
-            query_today += " AND ID_UBICACION = %s"
-            params_today.append(ubicacion_id)
-        
-        if sensor_id:
-            query_today += " AND ID_SENSOR = %s"
-            params_today.append(sensor_id)
-        
-        cursor.execute(query_today, params_today)
-        result_today = cursor.fetchone()
-        total_today = result_today['total'] if result_today else 0
-        
-        # Consulta para el total de ayer
-        query_yesterday = """
-            SELECT COUNT(*) as total
-            FROM LECTURAS
-            WHERE DATE(FECHA_LECTURA) = %s
-        """
-        params_yesterday = [yesterday]
-        
-        if ubicacion_id:
-            query_yesterday += " AND ID_UBICACION = %s"
-            params_yesterday.append(ubicacion_id)
-        
-        if sensor_id:
-            query_yesterday += " AND ID_SENSOR = %s"
-            params_yesterday.append(sensor_id)
+        filtros = _filtros(ubicacion_id, sensor_id)
         
-        cursor.execute(query_yesterday, params_yesterday)
-        result_yesterday = cursor.fetchone()
-        total_yesterday = result_yesterday['total'] if result_yesterday else 0
+        # Totales de ayer y de hoy en una sola consulta
+        conteos = conteos_diarios(cursor, yesterday, today, filtros)
+        total_yesterday, total_today = int(conteos[0]), int(conteos[1])
         
         # Calcular variación porcentual
         if total_yesterday > 0:
@@ -122,7 +101,7 @@ def get_stats_daily_average(
     periodo: str = "semana",
     ubicacion_id: Optional[int] = None,
     sensor_id: Optional[int] = None,
-    conn: MySQLConnection = Depends(get_db)
+    conn: MySQLConnection = Depends(get_db_lectura)
 ):
     """
     Obtiene el promedio diario de ciclistas para un período especificado.
@@ -144,61 +123,13 @@ def get_stats_daily_average(
         else:
             raise HTTPException(status_code=400, detail="Período no válido. Use 'semana' o 'mes'.")
         
-        # Consulta para el promedio del período actual
-        query_current = """
-            SELECT DATE(FECHA_LECTURA) as fecha, COUNT(*) as total
-            FROM LECTURAS
-            WHERE DATE(FECHA_LECTURA) >= %s AND DATE(FECHA_LECTURA) <= %s
-        """
-        params_current = [start_date, today]
-        
-        if ubicacion_id:
-            query_current += " AND ID_UBICACION = %s"
-            params_current.append(ubicacion_id)
-        
-        if sensor_id:
-            query_current += " AND ID_SENSOR = %s"
-            params_current.append(sensor_id)
-        
-        query_current += " GROUP BY DATE(FECHA_LECTURA)"
-        
-        cursor.execute(query_current, params_current)
-        results_current = cursor.fetchall()
-        
-        if results_current:
-            total_dias = len(results_current)
-            total_ciclistas = sum(r['total'] for r in results_current)
-            promedio_actual = total_ciclistas / total_dias
-        else:
-            promedio_actual = 0
-        
-        # Consulta para el promedio del período anterior
-        query_prev = """
-            SELECT DATE(FECHA_LECTURA) as fecha, COUNT(*) as total
-            FROM LECTURAS
-            WHERE DATE(FECHA_LECTURA) >= %s AND DATE(FECHA_LECTURA) < %s
-        """
-        params_prev = [prev_start_date, start_date]
-        
-        if ubicacion_id:
-            query_prev += " AND ID_UBICACION = %s"
-            params_prev.append(ubicacion_id)
+        filtros = _filtros(ubicacion_id, sensor_id)
         
-        if sensor_id:
-            query_prev += " AND ID_SENSOR = %s"
-            params_prev.append(sensor_id)
-        
-        query_prev += " GROUP BY DATE(FECHA_LECTURA)"
-        
-        cursor.execute(query_prev, params_prev)
-        results_prev = cursor.fetchall()
-        
-        if results_prev:
-            total_dias_prev = len(results_prev)
-            total_ciclistas_prev = sum(r['total'] for r in results_prev)
-            promedio_anterior = total_ciclistas_prev / total_dias_prev
-        else:
-            promedio_anterior = 0
+        # Conteos diarios del período anterior y del actual en una sola consulta
+        conteos = conteos_diarios(cursor, prev_start_date, today, filtros)
+        corte = (start_date - prev_start_date).days
+        promedio_anterior = _promedio_dias_con_datos(conteos[:corte])
+        promedio_actual = _promedio_dias_con_datos(conteos[corte:])
         
         # Calcular variación porcentual
         if promedio_anterior > 0:
@@ -220,7 +151,7 @@ def get_stats_daily_average(
 def get_stats_monthly(
     ubicacion_id: Optional[int] = None,
     sensor_id: Optional[int] = None,
-    conn: MySQLConnection = Depends(get_db)
+    conn: MySQLConnection = Depends(get_db_lectura)
 ):
     """
     Obtiene el conteo total de ciclistas para el mes actual.
@@ -233,45 +164,13 @@ def get_stats_monthly(
         last_day_prev_month = first_day_current_month - timedelta(days=1)
         first_day_prev_month = last_day_prev_month.replace(day=1)
         
-        # Consulta para el total del mes actual
-        query_current = """
-            SELECT COUNT(*) as total
-            FROM LECTURAS
-            WHERE DATE(FECHA_LECTURA) >= %s AND DATE(FECHA_LECTURA) <= %s
-        """
-        params_current = [first_day_current_month, today]
-        
-        if ubicacion_id:
-            query_current += " AND ID_UBICACION = %s"
-            params_current.append(ubicacion_id)
-        
-        if sensor_id:
-            query_current += " AND ID_SENSOR = %s"
-            params_current.append(sensor_id)
-        
-        cursor.execute(query_current, params_current)
-        result_current = cursor.fetchone()
-        total_current = result_current['total'] if result_current else 0
-        
-        # Consulta para el total del mes anterior
-        query_prev = """
-            SELECT COUNT(*) as total
-            FROM LECTURAS
-            WHERE DATE(FECHA_LECTURA) >= %s AND DATE(FECHA_LECTURA) <= %s
-        """
-        params_prev = [first_day_prev_month, last_day_prev_month]
+        filtros = _filtros(ubicacion_id, sensor_id)
         
-        if ubicacion_id:
-            query_prev += " AND ID_UBICACION = %s"
-            params_prev.append(ubicacion_id)
-        
-        if sensor_id:
-            query_prev += " AND ID_SENSOR = %s"
-            params_prev.append(sensor_id)
-        
-        cursor.execute(query_prev, params_prev)
-        result_prev = cursor.fetchone()
-        total_prev = result_prev['total'] if result_prev else 0
+        # Conteos diarios del mes anterior y del actual en una sola consulta
+        conteos = conteos_diarios(cursor, first_day_prev_month, today, filtros)
+        corte = (first_day_current_month - first_day_prev_month).days
+        total_prev = int(conteos[:corte].sum())
+        total_current = int(conteos[corte:].sum())
         
         # Calcular variación porcentual
         if total_prev > 0:
@@ -300,7 +199,7 @@ def get_stats_monthly(
 def get_weekly_trend(
     ubicacion_id: Optional[int] = None,
     sensor_id: Optional[int] = None,
-    conn: MySQLConnection = Depends(get_db)
+    conn: MySQLConnection = Depends(get_db_lectura)
 ):
     """
     Obtiene los datos para el gráfico de tendencia semanal.
@@ -313,26 +212,8 @@ def get_weekly_trend(
         start_of_week = today - timedelta(days=today.weekday())
         end_of_week = start_of_week + timedelta(days=6)
         
-        # Consulta para obtener datos diarios
-        query = """
-            SELECT DATE(FECHA_LECTURA) as fecha, COUNT(*) as total
-            FROM LECTURAS
-            WHERE DATE(FECHA_LECTURA) >= %s AND DATE(FECHA_LECTURA) <= %s
-        """
-        params = [start_of_week, end_of_week]
-        
-        if ubicacion_id:
-            query += " AND ID_UBICACION = %s"
-            params.append(ubicacion_id)
-        
-        if sensor_id:
-            query += " AND ID_SENSOR = %s"
-            params.append(sensor_id)
-        
-        query += " GROUP BY DATE(FECHA_LECTURA)"
-        
-        cursor.execute(query, params)
-        results = cursor.fetchall()
+        # Conteos diarios de la semana
+        conteos = conteos_diarios(cursor, start_of_week, end_of_week, _filtros(ubicacion_id, sensor_id))
         
         # Crear un diccionario con todas las fechas de la semana
         dias_semana = ["Lun", "Mar", "Mié", "Jue", "Vie", "Sáb", "Dom"]
@@ -343,17 +224,10 @@ def get_weekly_trend(
             # Convertir fecha a formato ISO para JSON
             fecha_str = fecha.isoformat()
             
-            # Buscar si hay datos para esta fecha
-            total = 0
-            for r in results:
-                if r['fecha'] == fecha:
-                    total = r['total']
-                    break
-            
             datos_diarios.append({
                 "dia": dias_semana[i],
                 "fecha": fecha_str,
-                "total": total
+                "total": int(conteos[i])
             })
         
         # Retornar respuesta formateada
@@ -0,0 +1,89 @@
+import datetime
+import decimal
+import functools
+import json
+
+import numpy as np
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+from app.profiling import perfilable
+
+try:
+    import orjson
+except ImportError:  # orjson es opcional; sin él se usa json de la biblioteca estándar
+    orjson = None
+
+# Ruta rápida de serialización para respuestas grandes (gráficos, consulta, sensores, dashboard).
+# Los endpoints ya arman estructuras planas que cumplen su response_model, así que la
+# ruta registrada devuelve directamente una RespuestaRapida: FastAPI no vuelve a validar
+# ni a recorrer el contenido con jsonable_encoder, y el response_model sigue documentando
+# el esquema en OpenAPI. Las funciones del endpoint siguen devolviendo estructuras planas
+# para quienes las llaman directamente (/batch, rutas de compatibilidad, precalentamiento).
+
+
+def _convertir(obj):
+    """Tipos que no son JSON nativo, con la misma forma que produce jsonable_encoder"""
+    if isinstance(obj, decimal.Decimal):
+        return int(obj) if obj == obj.to_integral_value() else float(obj)
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, datetime.timedelta):
+        return obj.total_seconds()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json")
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    raise TypeError(f"Tipo no serializable a JSON: {type(obj).__name__}")
+
+
+def dumps(contenido):
+    """Serializa a bytes JSON (UTF-8, sin espacios)"""
+    if orjson is not None:
+        return orjson.dumps(contenido, default=_convertir, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(
+        contenido, default=_convertir, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+class RespuestaRapida(JSONResponse):
+    """JSONResponse que serializa con orjson (o json) sin pasar por jsonable_encoder"""
+
+    def render(self, content):
+        return dumps(content)
+
+
+def ruta_rapida(registrar):
+    """
+    Registra el endpoint con `registrar` (p. ej. router.get(...)) envolviendo su resultado
+    en una RespuestaRapida, y devuelve la función original sin envolver.
+    La ruta registrada es perfilable (ver app.profiling), serialización incluida.
+    """
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            return RespuestaRapida(funcion(*args, **kwargs))
+
+        registrar(perfilable(envoltura))
+        return funcion
+    return decorador
+
+
+def arreglo_json(lotes):
+    """
+    Genera en bytes un arreglo JSON a partir de lotes (listas) de elementos, para
+    StreamingResponse: cada lote se serializa de una vez y se emite sin esperar al resto.
+    """
+    yield b"["
+    primero = True
+    for lote in lotes:
+        if not lote:
+            continue
+        cuerpo = dumps(lote)[1:-1]
+        yield cuerpo if primero else b"," + cuerpo
+        primero = False
+    yield b"]"
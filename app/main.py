@@ -1,7 +1,37 @@
-from fastapi import FastAPI, Depends, Query
+from app import arranque
+
+# Importar en orden los módulos pesados para medir el costo de cada uno en el arranque en frío
+arranque.precargar([
+    "fastapi",
+    "numpy",
+    "mysql.connector",
+    "app.metrics",
+    "app.profiling",
+    "app.admin",
+    "app.db_pool",
+    "app.database",
+    "app.rollups",
+    "app.partitions",
+    "app.query_planner",
+    "app.columnar_store",
+    "app.retention",
+    "app.parquet_store",
+    "app.chart_engine",
+    "app.sensor_registry",
+    "app.endpoints.stats",
+    "app.endpoints.sensors",
+    "app.endpoints.readings",
+    "app.endpoints.dashboard",
+    "app.endpoints.batch",
+    "app.warmup",
+    "app.slow_queries",
+])
+
+from fastapi import FastAPI, Depends, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
 import asyncio
-import importlib
 import os
 import sys
 import logging
@@ -9,23 +39,41 @@ import time
 from dotenv import load_dotenv
 from typing import List, Optional
 import mysql.connector
-from app.database import get_db
+from app.database import get_db_lectura, get_db_lectura_diferida, iniciar_pools, cerrar_pools, estadisticas_pools
+from app import admin, columnar_store, metrics, parquet_store, partitions, profiling, request_context, response_cache, retention, rollups, query_planner, sensor_registry, slow_queries, warmup
+from app.endpoints import stats, sensors, readings, dashboard, batch
+from app.fast_response import arreglo_json, ruta_rapida
 
 # Cargar variables de entorno
 load_dotenv("/home/ubuntu/FastAPI_BICICLA/.env")
-# Configurar logging
-LOG_DIR = "logs"
-os.makedirs(LOG_DIR, exist_ok=True)
-logging.basicConfig(
-    filename=os.path.join(LOG_DIR, "app.log"),
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s"
-)
+
+LOG_DIR = os.getenv("LOG_DIR", "logs")
+
+def configurar_logging():
+    """Configura el log de la aplicación (se llama al arrancar, no al importar)"""
+    os.makedirs(LOG_DIR, exist_ok=True)
+    logging.basicConfig(
+        filename=os.path.join(LOG_DIR, "app.log"),
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(message)s"
+    )
+
+# Startup y shutdown
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await iniciar_servicios()
+    arranque.marcar("listo")
+    try:
+        yield
+    finally:
+        await detener_servicios()
+
 # Crear la app
 app = FastAPI(
     title="API de Sensores de Bicicletas",
     description="API para consultar datos de sensores de conteo de bicicletas",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 # Middleware CORS
 app.add_middleware(
@@ -35,6 +83,35 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Contexto por petición: expone en X-Query-Plan las fuentes elegidas por el planificador
+@app.middleware("http")
+async def contexto_peticion(request: Request, call_next):
+    contexto = request_context.iniciar(request.url.path, request.scope)
+    motivo_perfil = profiling.solicitado(request)
+    if motivo_perfil:
+        profiling.preparar(contexto, motivo_perfil)
+    metodo = request.method
+    metrics.peticiones_en_curso.sumar(1, metodo)
+    inicio = time.perf_counter()
+    codigo = 500
+    try:
+        response = await call_next(request)
+        codigo = response.status_code
+    finally:
+        duracion = time.perf_counter() - inicio
+        metrics.peticiones_en_curso.sumar(-1, metodo)
+        metrics.peticiones_duracion.observar(
+            duracion, metodo, request_context.plantilla(contexto) or metrics.SIN_RUTA, str(codigo)
+        )
+    if contexto["planes"]:
+        response.headers["X-Query-Plan"] = " ; ".join(contexto["planes"])
+    if motivo_perfil:
+        perfil_id = profiling.guardar(contexto, request, duracion, codigo)
+        if perfil_id:
+            response.headers["X-Perfil-Id"] = perfil_id
+    arranque.registrar_respuesta(response.status_code)
+    return response
+
 # Endpoint raíz
 @app.get("/")
 def read_root():
@@ -45,6 +122,117 @@ def read_root():
         "documentacion": "/docs"
     }
 
+# Preparación para recibir tráfico: 503 hasta terminar el precalentamiento
+@app.get("/ready")
+def ready():
+    """Indica al balanceador si la instancia ya terminó de precalentarse"""
+    return JSONResponse(status_code=200 if warmup.listo() else 503, content=warmup.estado)
+
+# Métricas de peticiones, pools y consultas en formato Prometheus
+@app.get("/metrics", include_in_schema=False)
+def metricas():
+    return PlainTextResponse(
+        metrics.exponer(estadisticas_pools()),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+# Estado de la caché de respuestas
+@app.get("/admin/cache")
+def cache_estado():
+    return response_cache.estadisticas()
+
+
+@app.delete("/admin/cache", dependencies=[Depends(admin.requerir_admin)])
+def cache_vaciar(nombre: str = None):
+    """Vacía la caché de respuestas, o solo la de un endpoint"""
+    response_cache.cache.invalidar(nombre)
+    return {"vaciada": nombre or "todas"}
+
+# Estado de los pools de conexiones
+@app.get("/admin/pools")
+def pools_estado():
+    """Tamaño, uso y tiempos de espera de los pools de conexiones"""
+    return estadisticas_pools()
+
+# Tiempos del arranque en frío
+@app.get("/admin/arranque")
+def arranque_estado():
+    """Tiempo de importación por módulo y hitos del arranque (ms desde el inicio del proceso)"""
+    return arranque.reporte()
+
+# Consultas lentas recientes y sus planes
+metrics.observadores_consultas.append(slow_queries.observar)
+
+@app.get("/admin/consultas_lentas", dependencies=[Depends(admin.requerir_admin)])
+def consultas_lentas(
+    limite: int = Query(50, ge=1, le=1000),
+    huella: Optional[str] = Query(None, description="Solo las entradas de esta huella de SQL")
+):
+    """Sentencias que superaron CONSULTA_LENTA_MS, con el EXPLAIN de la primera aparición de cada huella"""
+    return slow_queries.recientes(limite, huella)
+
+@app.delete("/admin/consultas_lentas", dependencies=[Depends(admin.requerir_admin)])
+def limpiar_consultas_lentas():
+    slow_queries.limpiar()
+    return {"status": "ok"}
+
+# Perfiles de peticiones tomados con cProfile (PERFILADO_TOKEN / PERFILADO_MUESTREO)
+@app.get("/admin/perfiles", dependencies=[Depends(admin.requerir_admin)])
+def perfiles_lista():
+    """Perfiles guardados, del más reciente al más antiguo"""
+    return profiling.listar()
+
+@app.get("/admin/perfiles/{perfil_id}", dependencies=[Depends(admin.requerir_admin)])
+def perfil_resumen(
+    perfil_id: str,
+    orden: str = Query("cumulative", description="Orden de pstats: cumulative, tottime, calls, ..."),
+    lineas: int = Query(40, ge=1, le=500)
+):
+    """Funciones más costosas y sus llamadas, en texto"""
+    entrada = profiling.obtener(perfil_id)
+    if entrada is None:
+        raise HTTPException(status_code=404, detail="Perfil no encontrado")
+    try:
+        return PlainTextResponse(profiling.resumen(entrada, orden, lineas))
+    except KeyError:
+        raise HTTPException(status_code=400, detail=f"Orden no válido: {orden}")
+
+@app.get("/admin/perfiles/{perfil_id}/descarga", dependencies=[Depends(admin.requerir_admin)])
+def perfil_descarga(perfil_id: str):
+    """Estadísticas en formato pstats (.prof), para abrir con pstats o snakeviz"""
+    entrada = profiling.obtener(perfil_id)
+    if entrada is None:
+        raise HTTPException(status_code=404, detail="Perfil no encontrado")
+    return Response(
+        content=entrada["_stats"],
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": f'attachment; filename="{perfil_id}.prof"'}
+    )
+
+# Estado del almacén columnar en memoria
+@app.get("/admin/almacen")
+def almacen_estado():
+    """Ventana, filas y memoria usada por el almacén columnar de lecturas recientes"""
+    return columnar_store.estadisticas()
+
+# Estado del almacén Parquet de días cerrados
+@app.get("/admin/parquet")
+def parquet_estado():
+    """Días exportados, filas y espacio en disco del almacén Parquet"""
+    return parquet_store.estadisticas()
+
+# Particiones mensuales de LECTURAS
+@app.get("/admin/particiones")
+def particiones_estado():
+    """Particiones de LECTURAS con su rango y filas estimadas (vacío si no está particionada)"""
+    return partitions.estadisticas()
+
+# Retención de lecturas crudas
+@app.get("/admin/retencion")
+def retencion_estado():
+    """Hasta dónde están archivadas las lecturas crudas y tamaño de LECTURAS_ARCHIVO"""
+    return retention.estadisticas()
+
 # Función para importar el módulo MQTT con manejo de reintentos
 def get_mqtt_client():
     """Importa el módulo MQTT con recarga para permitir reinicio del servicio"""
@@ -89,43 +277,28 @@ async def start_or_restart_mqtt():
     logging.info(f"🔄 Servicio MQTT (re)iniciado (intento {mqtt_restart_count})")
     print(f"🔄 Servicio MQTT (re)iniciado (intento {mqtt_restart_count})", flush=True)
 
-# Cargar módulos de endpoints
-endpoints_path = os.path.join(os.path.dirname(__file__), "endpoints")
-os.makedirs(endpoints_path, exist_ok=True)
-if os.path.exists(os.path.join(endpoints_path, "mapa.py")):
-    try:
-        from app.endpoints import mapa
-        app.include_router(mapa.router, prefix="/mapa", tags=["Mapa"])
-        logging.info("✅ Módulo 'mapa' cargado correctamente")
-    except ImportError as e:
-        logging.error(f"❌ Error al importar 'mapa': {str(e)}")
-
-for module_name in ["stats", "sensors", "readings", "dashboard"]:
-    module_path = os.path.join(endpoints_path, f"{module_name}.py")
-    if not os.path.exists(module_path):
-        with open(module_path, "w") as f:
-            f.write(f"""from fastapi import APIRouter\n\nrouter = APIRouter()\n\n@router.get(\"/test\")\ndef test_endpoint():\n    return {{\"status\": \"ok\", \"message\": \"Endpoint de prueba para {module_name}\"}}\n""")
-    try:
-        module = importlib.import_module(f"app.endpoints.{module_name}")
-        app.include_router(module.router, prefix=f"/{module_name}", tags=[module_name.capitalize()])
-        logging.info(f"✅ Módulo '{module_name}' cargado correctamente")
-    except Exception as e:
-        logging.error(f"❌ Error al cargar módulo '{module_name}': {str(e)}")
+# Routers de endpoints
+ROUTERS = [
+    (stats.router, "/stats", "Stats"),
+    (sensors.router, "/sensors", "Sensors"),
+    (readings.router, "/readings", "Readings"),
+    (dashboard.router, "/dashboard", "Dashboard"),
+    (batch.router, "/batch", "Batch"),
+]
+for router, prefijo, etiqueta in ROUTERS:
+    app.include_router(router, prefix=prefijo, tags=[etiqueta])
 
 # Importar tipos y funciones de readings
-if 'app.endpoints.readings' in sys.modules:
-    del sys.modules['app.endpoints.readings']
-
 from app.endpoints.readings import LecturaResponse, ResumenResponse, GraficoDetalladoResponse
 from app.endpoints.readings import (
     obtener_comunas, obtener_ubicaciones, obtener_sentidos,
     consultar_lecturas, obtener_datos_grafico, obtener_datos_grafico_detallado,
-    obtener_resumen
+    obtener_resumen, abrir_lecturas_compat, iterar_lecturas_compat
 )
 
 # Endpoints de compatibilidad
 @app.get("/comunas")
-def comunas_compat(db: mysql.connector.connection.MySQLConnection = Depends(get_db)):
+def comunas_compat(db: mysql.connector.connection.MySQLConnection = Depends(get_db_lectura_diferida)):
     """Endpoint de compatibilidad para obtener comunas"""
     logging.info("Acceso a endpoint /comunas (compatibilidad)")
     return obtener_comunas(db)
@@ -133,7 +306,7 @@ def comunas_compat(db: mysql.connector.connection.MySQLConnection = Depends(get_
 @app.get("/ubicaciones")
 def ubicaciones_compat(
     comuna_id: Optional[int] = None,
-    db: mysql.connector.connection.MySQLConnection = Depends(get_db)
+    db: mysql.connector.connection.MySQLConnection = Depends(get_db_lectura_diferida)
 ):
     """Endpoint de compatibilidad para obtener ubicaciones"""
     logging.info(f"Acceso a endpoint /ubicaciones (compatibilidad) con comuna_id={comuna_id}")
@@ -142,13 +315,13 @@ def ubicaciones_compat(
 @app.get("/sentidos")
 def sentidos_compat(
     ubicacion_id: Optional[int] = None,
-    db: mysql.connector.connection.MySQLConnection = Depends(get_db)
+    db: mysql.connector.connection.MySQLConnection = Depends(get_db_lectura_diferida)
 ):
     """Endpoint de compatibilidad para obtener sentidos"""
     logging.info(f"Acceso a endpoint /sentidos (compatibilidad) con ubicacion_id={ubicacion_id}")
     return obtener_sentidos(ubicacion_id, db)
 
-@app.get("/consulta", response_model=LecturaResponse)
+@ruta_rapida(app.get("/consulta", response_model=LecturaResponse))
 def consulta_compat(
     comuna_id: Optional[int] = None,
     ubicacion_id: Optional[int] = None,
@@ -158,7 +331,7 @@ def consulta_compat(
     fecha_fin: Optional[str] = Query(None, description="Fecha de fin (YYYY-MM-DD)"),
     hora_inicio: Optional[str] = Query(None, description="Hora de inicio (HH:MM)"),
     hora_fin: Optional[str] = Query(None, description="Hora de fin (HH:MM)"),
-    db: mysql.connector.connection.MySQLConnection = Depends(get_db)
+    db: mysql.connector.connection.MySQLConnection = Depends(get_db_lectura)
 ):
     """Endpoint de compatibilidad para consulta de lecturas"""
     logging.info(f"Acceso a endpoint /consulta (compatibilidad) con periodo={periodo}")
@@ -167,7 +340,7 @@ def consulta_compat(
         fecha_inicio, fecha_fin, hora_inicio, hora_fin, db
     )
 
-@app.get("/grafico", response_model=ResumenResponse)
+@ruta_rapida(app.get("/grafico", response_model=ResumenResponse))
 def grafico_compat(
     comuna_id: Optional[int] = None,
     ubicacion_id: Optional[int] = None,
@@ -179,17 +352,18 @@ def grafico_compat(
     hora_fin: Optional[str] = Query(None, description="Hora de fin (HH:MM)"),
     agrupar_por: str = Query("auto", description="Campo por el cual agrupar: auto, hora, dia, semana, mes"),
     agrupar: bool = Query(False, description="Indica si los datos deben agruparse"),
-    db: mysql.connector.connection.MySQLConnection = Depends(get_db)
+    intervalo_minutos: Optional[int] = Query(None, ge=1, description="Tamaño de cubeta en minutos (p. ej. 15); reemplaza a agrupar_por"),
+    db: mysql.connector.connection.MySQLConnection = Depends(get_db_lectura_diferida)
 ):
     """Endpoint de compatibilidad para obtener datos agrupados para gráficos"""
     logging.info(f"Acceso a endpoint /grafico (compatibilidad) con periodo={periodo}, agrupar_por={agrupar_por}")
     return obtener_datos_grafico(
         comuna_id, ubicacion_id, sentidos, periodo,
         fecha_inicio, fecha_fin, hora_inicio, hora_fin,
-        agrupar_por, agrupar, db
+        agrupar_por, agrupar, db, intervalo_minutos
     )
 
-@app.get("/grafico_detallado", response_model=GraficoDetalladoResponse)
+@ruta_rapida(app.get("/grafico_detallado", response_model=GraficoDetalladoResponse))
 def grafico_detallado_compat(
     comuna_id: Optional[int] = None,
     ubicacion_id: Optional[int] = None,
@@ -201,18 +375,19 @@ def grafico_detallado_compat(
     hora_fin: Optional[str] = Query(None, description="Hora de fin (HH:MM)"),
     agrupar_por: str = Query("auto", description="Campo por el cual agrupar: auto, hora, dia, semana, mes"),
     agrupar: bool = Query(False, description="Indica si los datos deben agruparse"),
-    db: mysql.connector.connection.MySQLConnection = Depends(get_db)
+    intervalo_minutos: Optional[int] = Query(None, ge=1, description="Tamaño de cubeta en minutos (p. ej. 15); reemplaza a agrupar_por"),
+    db: mysql.connector.connection.MySQLConnection = Depends(get_db_lectura)
 ):
     """Endpoint de compatibilidad para obtener datos detallados por sentido para gráficos"""
     logging.info(f"Acceso a endpoint /grafico_detallado (compatibilidad) con periodo={periodo}, agrupar_por={agrupar_por}")
     return obtener_datos_grafico_detallado(
         comuna_id, ubicacion_id, sentidos, periodo,
         fecha_inicio, fecha_fin, hora_inicio, hora_fin,
-        agrupar_por, agrupar, db
+        agrupar_por, agrupar, db, intervalo_minutos
     )
 
 @app.get("/resumen")
-def resumen_compat(db: mysql.connector.connection.MySQLConnection = Depends(get_db)):
+def resumen_compat(db: mysql.connector.connection.MySQLConnection = Depends(get_db_lectura)):
     """Endpoint de compatibilidad para obtener el resumen estadístico"""
     logging.info("Acceso a endpoint /resumen (compatibilidad)")
     return obtener_resumen(db)
@@ -227,81 +402,131 @@ def lecturas_compat(
     fecha_fin: Optional[str] = Query(None, description="Fecha de fin (YYYY-MM-DD)"),
     hora_inicio: Optional[str] = Query(None, description="Hora de inicio (HH:MM)"),
     hora_fin: Optional[str] = Query(None, description="Hora de fin (HH:MM)"),
-    db: mysql.connector.connection.MySQLConnection = Depends(get_db)
+    db: mysql.connector.connection.MySQLConnection = Depends(get_db_lectura)
 ):
-    """Endpoint de compatibilidad para obtener lecturas"""
+    """
+    Endpoint de compatibilidad para obtener lecturas.
+    Se sirve con su propia proyección y se transmite por lotes a medida que se leen las filas.
+    """
+    logging.info(f"Acceso a endpoint /lecturas (compatibilidad) con periodo={periodo}")
     try:
-        logging.info(f"Acceso a endpoint /lecturas (compatibilidad) con periodo={periodo}")
-        result = consultar_lecturas(
-            comuna_id, ubicacion_id, sentidos, periodo,
-            fecha_inicio, fecha_fin, hora_inicio, hora_fin, db
+        cursor = abrir_lecturas_compat(
+            db, comuna_id, ubicacion_id, sentidos, periodo,
+            fecha_inicio, fecha_fin, hora_inicio, hora_fin
         )
-
-        lecturas_adaptadas = []
-
-        if result and hasattr(result, 'lecturas') and isinstance(result.lecturas, list):
-            for i, lectura in enumerate(result.lecturas):
-                try:
-                    fecha_partes = lectura.get('fecha', '').split('/')
-                    if len(fecha_partes) == 3:
-                        fecha_iso = f"{fecha_partes[2]}-{fecha_partes[1]}-{fecha_partes[0]}"
-                    else:
-                        fecha_iso = lectura.get('fecha', '')
-
-                    fecha_hora_iso = f"{fecha_iso}T{lectura.get('hora', '00:00')}:00"
-
-                    lecturas_adaptadas.append({
-                        "id": i + 1,
-                        "sensor_id": ubicacion_id or 1,
-                        "nombre_sensor": f"Sensor {ubicacion_id or 1}",
-                        "ubicacion": lectura.get("ubicacion", ""),
-                        "comuna": lectura.get("comuna", ""),
-                        "fecha_hora": fecha_hora_iso,
-                        "cantidad": lectura.get("cantidad", 1),
-                        "sentido": lectura.get("sentido", "")
-                    })
-                except Exception as e:
-                    logging.error(f"Error al procesar lectura individual: {str(e)}")
-                    continue
-        else:
-            if isinstance(result, dict) and 'lecturas' in result:
-                for i, lectura in enumerate(result['lecturas']):
-                    try:
-                        fecha_partes = lectura.get('fecha', '').split('/')
-                        if len(fecha_partes) == 3:
-                            fecha_iso = f"{fecha_partes[2]}-{fecha_partes[1]}-{fecha_partes[0]}"
-                        else:
-                            fecha_iso = lectura.get('fecha', '')
-
-                        fecha_hora_iso = f"{fecha_iso}T{lectura.get('hora', '00:00')}:00"
-
-                        lecturas_adaptadas.append({
-                            "id": i + 1,
-                            "sensor_id": ubicacion_id or 1,
-                            "nombre_sensor": f"Sensor {ubicacion_id or 1}",
-                            "ubicacion": lectura.get("ubicacion", ""),
-                            "comuna": lectura.get("comuna", ""),
-                            "fecha_hora": fecha_hora_iso,
-                            "cantidad": lectura.get("cantidad", 1),
-                            "sentido": lectura.get("sentido", "")
-                        })
-                    except Exception as e:
-                        logging.error(f"Error al procesar lectura individual: {str(e)}")
-                        continue
-
-        return lecturas_adaptadas
     except Exception as e:
         import traceback
         logging.error(f"Error en endpoint /lecturas: {str(e)}")
         logging.error(traceback.format_exc())
         return []
 
-# Startup y shutdown
-@app.on_event("startup")
-async def startup_event():
-    global mqtt_restart_count
+    return StreamingResponse(
+        arreglo_json(iterar_lecturas_compat(cursor, ubicacion_id)),
+        media_type="application/json"
+    )
+
+# Actualización periódica de los rollups de LECTURAS
+rollups_task = None
+
+async def rollups_loop():
+    while True:
+        try:
+            await asyncio.to_thread(rollups.actualizar_rollups)
+            query_planner.invalidar_marcas()
+        except Exception as e:
+            logging.error(f"Error al actualizar rollups: {e}")
+        await asyncio.sleep(rollups.ROLLUP_INTERVALO)
+
+# Carga inicial y recorte diario del almacén columnar
+almacen_task = None
+
+async def almacen_loop():
+    try:
+        await asyncio.to_thread(columnar_store.cargar_desde_pool)
+    except Exception as e:
+        logging.error(f"Error al cargar el almacén columnar: {e}")
+    while True:
+        await asyncio.sleep(3600)
+        try:
+            # Fuera del event loop: recortar copia los arreglos con el lock del almacén tomado
+            await asyncio.to_thread(columnar_store.almacen.recortar)
+        except Exception as e:
+            logging.error(f"Error al recortar el almacén columnar: {e}")
+
+# Exportación periódica de días cerrados al almacén Parquet
+parquet_task = None
+
+async def parquet_loop():
+    while True:
+        try:
+            await asyncio.to_thread(parquet_store.exportar_desde_pool)
+        except Exception as e:
+            logging.error(f"Error al exportar al almacén Parquet: {e}")
+        await asyncio.sleep(parquet_store.ALMACEN_PARQUET_INTERVALO)
+
+# Creación anticipada de las particiones mensuales de LECTURAS
+particiones_task = None
+
+async def particiones_loop():
+    while True:
+        try:
+            await asyncio.to_thread(partitions.asegurar_desde_pool)
+        except Exception as e:
+            logging.error(f"Error al crear particiones de LECTURAS: {e}")
+        await asyncio.sleep(partitions.PARTICIONES_INTERVALO)
+
+# Archivo periódico de lecturas crudas antiguas
+retencion_task = None
+
+async def retencion_loop():
+    while True:
+        try:
+            await asyncio.to_thread(retention.archivar_desde_pool)
+            query_planner.invalidar_marcas()
+        except Exception as e:
+            logging.error(f"Error al archivar lecturas: {e}")
+        await asyncio.sleep(retention.RETENCION_INTERVALO)
+
+pools_task = None
+
+async def preparar_pools():
+    """Precalienta los pools y después las cachés, en segundo plano"""
+    try:
+        if await asyncio.to_thread(iniciar_pools):
+            arranque.marcar("pools_listos")
+    except Exception as e:
+        logging.error(f"Error al iniciar pools de conexiones: {e}")
+    try:
+        # Tabla del registro de sensores: se crea y siembra aquí, no desde los endpoints
+        await asyncio.to_thread(sensor_registry.preparar_desde_pool)
+    except Exception as e:
+        logging.error(f"Error al preparar {sensor_registry.TABLA_ESTADO}: {e}")
+    await warmup.calentar()
+    arranque.marcar("calentado")
+
+async def iniciar_servicios():
+    global mqtt_restart_count, pools_task, rollups_task, almacen_task, parquet_task, particiones_task, retencion_task
+    configurar_logging()
     mqtt_restart_count = 0
 
+    # Los pools abren conexiones bajo demanda; el precalentamiento no retrasa el arranque
+    pools_task = asyncio.create_task(preparar_pools())
+
+    if rollups.ROLLUP_INTERVALO > 0:
+        rollups_task = asyncio.create_task(rollups_loop())
+
+    if columnar_store.activo():
+        almacen_task = asyncio.create_task(almacen_loop())
+
+    if parquet_store.iniciar() is not None:
+        parquet_task = asyncio.create_task(parquet_loop())
+
+    if partitions.PARTICIONES_INTERVALO > 0:
+        particiones_task = asyncio.create_task(particiones_loop())
+
+    if retention.activo():
+        retencion_task = asyncio.create_task(retencion_loop())
+
     mqtt_broker = os.getenv("MQTT_BROKER")
     if mqtt_broker:
         await start_or_restart_mqtt()
@@ -309,9 +534,11 @@ async def startup_event():
         logging.warning("⚠️ No se encontró configuración MQTT válida.")
         print("⚠️ No se encontró configuración MQTT válida.", flush=True)
 
-@app.on_event("shutdown")
-async def shutdown_event():
+async def detener_servicios():
     global mqtt_task
+    for tarea in (pools_task, rollups_task, almacen_task, parquet_task, particiones_task, retencion_task):
+        if tarea and not tarea.done():
+            tarea.cancel()
     if mqtt_task:
         mqtt_task.cancel()
         try:
@@ -323,6 +550,8 @@ async def shutdown_event():
         logging.info("🛑 Servicio MQTT detenido")
         print("🛑 Servicio MQTT detenido", flush=True)
 
+    cerrar_pools()
+
 # Entry point
 if __name__ == "__main__":
     import uvicorn
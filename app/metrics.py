@@ -0,0 +1,342 @@
+import bisect
+import hashlib
+import os
+import re
+import threading
+import time
+
+from app import request_context
+
+# Métricas de peticiones y de base de datos en formato de texto de Prometheus (/metrics).
+# Sin dependencias externas: contadores e histogramas en memoria protegidos por un lock,
+# pensados para dejarse siempre activos. Las consultas se agrupan por huella (el SQL
+# normalizado, sin literales), y se miden envolviendo los cursores que entregan los pools.
+
+# 0 desactiva la instrumentación (y /metrics queda vacío)
+METRICAS_ACTIVAS = os.getenv("METRICAS_ACTIVAS", "1") == "1"
+# Máximo de huellas de SQL distintas; las siguientes se agrupan en "otras"
+METRICAS_MAX_HUELLAS = int(os.getenv("METRICAS_MAX_HUELLAS", "500"))
+
+BUCKETS_PETICIONES = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BUCKETS_CONSULTAS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BUCKETS_ESPERA_POOL = (0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+SIN_RUTA = "<sin_ruta>"
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _etiquetas(nombres, valores, extra=""):
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+def _numero(valor):
+    if valor == float("inf"):
+        return "+Inf"
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return repr(valor) if isinstance(valor, float) else str(valor)
+
+
+class Contador:
+    tipo = "counter"
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def sumar(self, valor=1, *etiquetas):
+        with self._lock:
+            self._valores[etiquetas] = self._valores.get(etiquetas, 0) + valor
+
+    def lineas(self):
+        with self._lock:
+            valores = list(self._valores.items())
+        return [f"{self.nombre}{_etiquetas(self.etiquetas, clave)} {_numero(valor)}" for clave, valor in valores]
+
+
+class Medidor(Contador):
+    """Valor que sube y baja (gauge)"""
+    tipo = "gauge"
+
+    def fijar(self, valor, *etiquetas):
+        with self._lock:
+            self._valores[etiquetas] = valor
+
+
+class Histograma:
+    tipo = "histogram"
+
+    def __init__(self, nombre, ayuda, buckets, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.buckets = tuple(sorted(buckets))
+        self.etiquetas = tuple(etiquetas)
+        # etiquetas -> [conteos por bucket (no acumulados), suma, cantidad]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor, *etiquetas):
+        indice = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(etiquetas)
+            if serie is None:
+                serie = self._series[etiquetas] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            serie[0][indice] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def lineas(self):
+        with self._lock:
+            series = [(clave, list(conteos), suma, cantidad) for clave, (conteos, suma, cantidad) in self._series.items()]
+        lineas = []
+        for clave, conteos, suma, cantidad in series:
+            acumulado = 0
+            for limite, conteo in zip(self.buckets + (float("inf"),), conteos):
+                acumulado += conteo
+                etiquetas = _etiquetas(self.etiquetas, clave, f'le="{_numero(float(limite))}"')
+                lineas.append(f"{self.nombre}_bucket{etiquetas} {acumulado}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas(self.etiquetas, clave)} {_numero(suma)}")
+            lineas.append(f"{self.nombre}_count{_etiquetas(self.etiquetas, clave)} {cantidad}")
+        return lineas
+
+
+peticiones_duracion = Histograma(
+    "bicicla_http_peticion_segundos", "Duración de las peticiones HTTP por ruta",
+    BUCKETS_PETICIONES, ("metodo", "ruta", "codigo"))
+peticiones_en_curso = Medidor(
+    "bicicla_http_peticiones_en_curso", "Peticiones HTTP en curso", ("metodo",))
+pool_espera = Histograma(
+    "bicicla_db_pool_espera_segundos", "Espera por una conexión del pool (cola y préstamo)",
+    BUCKETS_ESPERA_POOL, ("pool",))
+pool_sin_conexion = Contador(
+    "bicicla_db_pool_sin_conexion_total", "Peticiones que no obtuvieron conexión a tiempo", ("pool",))
+consultas_duracion = Histograma(
+    "bicicla_db_consulta_segundos", "Duración de las consultas SQL (ejecución y lectura de filas) por huella",
+    BUCKETS_CONSULTAS, ("huella",))
+consultas_filas = Contador(
+    "bicicla_db_consulta_filas_total", "Filas devueltas por las consultas SQL por huella", ("huella",))
+consultas_por_ruta = Contador(
+    "bicicla_db_consultas_total", "Consultas SQL ejecutadas por ruta y huella", ("ruta", "huella"))
+consultas_tiempo_por_ruta = Contador(
+    "bicicla_db_consulta_segundos_por_ruta_total", "Tiempo en SQL acumulado por ruta", ("ruta",))
+
+METRICAS = [
+    peticiones_duracion, peticiones_en_curso, pool_espera, pool_sin_conexion,
+    consultas_duracion, consultas_filas, consultas_por_ruta, consultas_tiempo_por_ruta,
+]
+
+
+# --- Huellas de SQL ---
+_RE_CADENAS = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+_RE_NUMEROS = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_RE_MARCADORES = re.compile(r"%\(\w+\)s|%s")
+_RE_LISTAS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_RE_ESPACIOS = re.compile(r"\s+")
+
+# sql original -> (huella, sql normalizado); las consultas se arman con pocas variantes
+_huellas = {}
+_huellas_lock = threading.Lock()
+
+
+def normalizar_sql(sql):
+    """SQL sin literales ni marcadores (?), listas IN colapsadas y espacios simples"""
+    sql = _RE_CADENAS.sub("?", sql)
+    sql = _RE_MARCADORES.sub("?", sql)
+    sql = _RE_NUMEROS.sub("?", sql)
+    sql = _RE_LISTAS.sub("(?+)", sql)
+    return _RE_ESPACIOS.sub(" ", sql).strip()
+
+
+def huella(sql):
+    """Devuelve (huella corta, sql normalizado) de una sentencia"""
+    if isinstance(sql, (bytes, bytearray)):
+        sql = sql.decode("utf-8", "replace")
+    encontrada = _huellas.get(sql)
+    if encontrada is not None:
+        return encontrada
+    normalizado = normalizar_sql(sql)
+    encontrada = (hashlib.md5(normalizado.encode("utf-8")).hexdigest()[:12], normalizado)
+    with _huellas_lock:
+        if len(_huellas) >= METRICAS_MAX_HUELLAS * 4:
+            _huellas.clear()
+        _huellas[sql] = encontrada
+    return encontrada
+
+
+# huella -> sql normalizado (las que tienen métricas propias)
+catalogo_huellas = {}
+
+
+def _huella_registrada(clave, normalizado):
+    if clave in catalogo_huellas:
+        return clave
+    with _huellas_lock:
+        if clave not in catalogo_huellas and len(catalogo_huellas) >= METRICAS_MAX_HUELLAS:
+            return "otras"
+        catalogo_huellas[clave] = normalizado
+    return clave
+
+
+def ruta_actual():
+    """Plantilla de la ruta de la petición en curso (p. ej. /sensors/{sensor_id}), o None"""
+    contexto = request_context.actual()
+    if contexto is None:
+        return None
+    return request_context.plantilla(contexto) or SIN_RUTA
+
+
+# Observadores adicionales de consultas terminadas: funcion(huella, sql, params, segundos, filas, conexion)
+observadores_consultas = []
+
+
+def registrar_consulta(clave, normalizado, sql, params, segundos, filas, conexion):
+    clave = _huella_registrada(clave, normalizado)
+    consultas_duracion.observar(segundos, clave)
+    if filas:
+        consultas_filas.sumar(filas, clave)
+    ruta = ruta_actual() or "<fuera_de_peticion>"
+    consultas_por_ruta.sumar(1, ruta, clave)
+    consultas_tiempo_por_ruta.sumar(segundos, ruta)
+    for observador in observadores_consultas:
+        observador(clave, sql, params, segundos, filas, conexion)
+
+
+class CursorMedido:
+    """
+    Envuelve un cursor MySQL y mide cada sentencia: desde execute() hasta la siguiente
+    sentencia o el cierre, sumando el tiempo de lectura de filas.
+    """
+
+    __slots__ = ("_cursor", "_conexion", "_pendiente")
+
+    def __init__(self, cursor, conexion):
+        self._cursor = cursor
+        self._conexion = conexion
+        # [huella, sql normalizado, sql, params, segundos, filas]
+        self._pendiente = None
+
+    def __getattr__(self, nombre):
+        return getattr(self._cursor, nombre)
+
+    def _terminar(self):
+        pendiente = self._pendiente
+        if pendiente is not None:
+            self._pendiente = None
+            registrar_consulta(*pendiente, self._conexion)
+
+    def _medir(self, metodo, sql, *args, **kwargs):
+        self._terminar()
+        inicio = time.perf_counter()
+        try:
+            return metodo(sql, *args, **kwargs)
+        finally:
+            clave, normalizado = huella(sql)
+            params = args[0] if args else kwargs.get("params")
+            self._pendiente = [clave, normalizado, sql, params, time.perf_counter() - inicio, 0]
+
+    def execute(self, sql, *args, **kwargs):
+        return self._medir(self._cursor.execute, sql, *args, **kwargs)
+
+    def executemany(self, sql, *args, **kwargs):
+        return self._medir(self._cursor.executemany, sql, *args, **kwargs)
+
+    def _leer(self, metodo, *args):
+        inicio = time.perf_counter()
+        resultado = metodo(*args)
+        pendiente = self._pendiente
+        if pendiente is not None:
+            pendiente[4] += time.perf_counter() - inicio
+            if isinstance(resultado, list):
+                pendiente[5] += len(resultado)
+            elif resultado is not None:
+                pendiente[5] += 1
+        return resultado
+
+    def fetchall(self):
+        return self._leer(self._cursor.fetchall)
+
+    def fetchmany(self, *args):
+        return self._leer(self._cursor.fetchmany, *args)
+
+    def fetchone(self):
+        return self._leer(self._cursor.fetchone)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def close(self):
+        self._terminar()
+        return self._cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def envolver_cursor(cursor, conexion):
+    return CursorMedido(cursor, conexion) if METRICAS_ACTIVAS else cursor
+
+
+def observar_espera_pool(pool, segundos):
+    if METRICAS_ACTIVAS:
+        pool_espera.observar(segundos, pool)
+
+
+def contar_sin_conexion(pool):
+    if METRICAS_ACTIVAS:
+        pool_sin_conexion.sumar(1, pool)
+
+
+# --- Exposición ---
+def _bloque(nombre, tipo, ayuda, lineas):
+    return [f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} {tipo}"] + lineas
+
+
+def _lineas_pools(estadisticas):
+    metricas = [
+        ("bicicla_db_pool_conexiones_abiertas", "gauge", "Conexiones abiertas del pool", "abiertas"),
+        ("bicicla_db_pool_conexiones_en_uso", "gauge", "Conexiones prestadas del pool", "en_uso"),
+        ("bicicla_db_pool_conexiones_libres", "gauge", "Conexiones libres del pool", "libres"),
+        ("bicicla_db_pool_checkouts_total", "counter", "Préstamos de conexiones del pool", "checkouts"),
+        ("bicicla_db_pool_timeouts_total", "counter", "Préstamos que agotaron la espera del pool", "timeouts"),
+    ]
+    lineas = []
+    for nombre, tipo, ayuda, clave in metricas:
+        lineas += _bloque(nombre, tipo, ayuda, [
+            f'{nombre}{{pool="{_escapar(e["nombre"])}"}} {e[clave]}' for e in estadisticas
+        ])
+    lineas += _bloque("bicicla_db_pool_capacidad", "gauge", "Capacidad del pool (tamaño más desborde)", [
+        f'bicicla_db_pool_capacidad{{pool="{_escapar(e["nombre"])}"}} {e["tamano"] + e["desborde"]}' for e in estadisticas
+    ])
+    lineas += _bloque("bicicla_db_pool_utilizacion", "gauge", "Fracción de la capacidad del pool en uso", [
+        f'bicicla_db_pool_utilizacion{{pool="{_escapar(e["nombre"])}"}} '
+        f'{round(e["en_uso"] / (e["tamano"] + e["desborde"]), 4) if e["tamano"] + e["desborde"] else 0}'
+        for e in estadisticas
+    ])
+    return lineas
+
+
+def exponer(estadisticas_pools=()):
+    """Texto de todas las métricas en el formato de exposición de Prometheus"""
+    if not METRICAS_ACTIVAS:
+        return ""
+    lineas = []
+    for metrica in METRICAS:
+        lineas += _bloque(metrica.nombre, metrica.tipo, metrica.ayuda, metrica.lineas())
+    lineas += _lineas_pools(estadisticas_pools)
+    lineas += _bloque("bicicla_db_consulta_info", "gauge", "SQL normalizado de cada huella", [
+        f'bicicla_db_consulta_info{{huella="{clave}",sql="{_escapar(sql[:500])}"}} 1'
+        for clave, sql in list(catalogo_huellas.items())
+    ])
+    return "\n".join(lineas) + "\n"
@@ -45,8 +45,13 @@ print(f"🆔 Usando MQTT_CLIENT_ID: {MQTT_CLIENT_ID}")
 
 
 
-# Pool de conexiones a la base de datos
-from app.database import connection_pool
+# Pool de conexiones a la base de datos (separado del pool de la API)
+from app.database import ingesta_pool, escribir_heartbeat, replicas_configuradas
+
+# Heartbeat de replicación: fila con la hora del primario que las réplicas usan para medir su retraso
+HEARTBEAT_REPLICACION = os.getenv("HEARTBEAT_REPLICACION", "1" if replicas_configuradas() else "0") == "1"
+HEARTBEAT_INTERVALO = float(os.getenv("HEARTBEAT_INTERVALO", "1"))
+from app import columnar_store, compact_store, sensor_registry
 
 # --- Reinicio de aplicación ---
 def restart_application():
@@ -64,7 +69,7 @@ def get_db_connection():
     
     while True:
         try:
-            conn = connection_pool.get_connection()
+            conn = ingesta_pool.get_connection()
             db_failure_count = 0  # Reiniciar contador al tener éxito
             return conn
         except Exception as e:
@@ -166,6 +171,13 @@ def on_message(client, topic, payload, qos, properties):
             # Solo obtenemos conexión a DB para sensores que procesaremos
             # Usamos nuestra función mejorada con reintentos
             conn = get_db_connection()
+
+            # Cargar el registro de sensores antes de abrir la transacción (puede crear su tabla)
+            sensor_registry.preparar(conn)
+            sensor_registry.asegurar_cargado(conn)
+            if compact_store.compacto():
+                compact_store.asegurar_tabla(conn)
+
             cursor = conn.cursor(dictionary=True)
 
             # Iniciar transacción para evitar problemas de concurrencia
@@ -259,6 +271,7 @@ def on_message(client, topic, payload, qos, properties):
 
             if sentido_row:
                 # Usar sentido existente
+                id_sentido = sentido_row["ID"]
                 sentido_lectura = sentido_row["SENTIDO_LECTURA"]
                 print(f"🔍 Usando sentido existente: {sentido_lectura if sentido_lectura else 'NULL'}")
             else:
@@ -268,58 +281,74 @@ def on_message(client, topic, payload, qos, properties):
                     (ID_SENSOR, DIRECCION, SENTIDO_LECTURA)
                     VALUES (%s, %s, NULL)
                 """, (id_sensor, direction))
+                cursor.execute("SELECT LAST_INSERT_ID() as ID")
+                id_sentido = cursor.fetchone()["ID"]
                 sentido_lectura = None
                 print(f"🆕 Nuevo sentido creado para dirección: {direction}")
 
-            # 5. Verificar la estructura de la tabla LECTURAS
-            cursor.execute("DESCRIBE BICICLA.LECTURAS")
-            columnas_lecturas = cursor.fetchall()
-            print(f"Estructura de tabla LECTURAS: {[col['Field'] for col in columnas_lecturas]}")
+            if compact_store.compacto():
+                # 5-6. Modo conteos: se suma la bicicleta al minuto en LECTURAS_MINUTO
+                compact_store.registrar(cursor, id_ubicacion, id_sensor, id_sentido)
+                print(f"Conteo registrado: {sensor}, ID_SENSOR: {id_sensor}, ID_SENTIDO: {id_sentido}")
+            else:
+                # 5. Verificar la estructura de la tabla LECTURAS
+                cursor.execute("DESCRIBE BICICLA.LECTURAS")
+                columnas_lecturas = cursor.fetchall()
+                print(f"Estructura de tabla LECTURAS: {[col['Field'] for col in columnas_lecturas]}")
 
-            # Comprobar si existe campo FECHA_LECTURA
-            tiene_fecha_lectura = any(col['Field'] == 'FECHA_LECTURA' for col in columnas_lecturas)
+                # Comprobar si existe campo FECHA_LECTURA
+                tiene_fecha_lectura = any(col['Field'] == 'FECHA_LECTURA' for col in columnas_lecturas)
 
-            # 6. Insertar lectura (siempre se guardan todas las lecturas como histórico)
-            # MODIFICADO: Ahora incluimos ID_SENSOR en la inserción
-            print(f"Insertando lectura: {sensor}, ID_UBICACION: {id_ubicacion}, ID_SENSOR: {id_sensor}")
+                # 6. Insertar lectura (siempre se guardan todas las lecturas como histórico)
+                # MODIFICADO: Ahora incluimos ID_SENSOR en la inserción
+                print(f"Insertando lectura: {sensor}, ID_UBICACION: {id_ubicacion}, ID_SENSOR: {id_sensor}")
 
-            if tiene_fecha_lectura:
-                # Si la tabla tiene un campo FECHA_LECTURA, lo incluimos
+                if tiene_fecha_lectura:
+                    # Si la tabla tiene un campo FECHA_LECTURA, lo incluimos
                 
-                #MAIV: Agregar campos de tiempo real
+                    #MAIV: Agregar campos de tiempo real
                 
                 
-                valsTiempoReal = ""
+                    valsTiempoReal = ""
                 
-                cmpsTiempoReal = ", FECHA_REAL, HORA_REAL"
+                    cmpsTiempoReal = ", FECHA_REAL, HORA_REAL"
                 
-                if fecha_real!="":
-                    valsTiempoReal = ", %s, %s"
-                else:
-                    valsTiempoReal = ", CURDATE(),  CURTIME()"
+                    if fecha_real!="":
+                        valsTiempoReal = ", %s, %s"
+                    else:
+                        valsTiempoReal = ", CURDATE(),  CURTIME()"
                     
                 
-                SqlInsert = f"""
-                    INSERT INTO LECTURAS
-                    (NOMBRE_SENSOR, ID_UBICACION, ID_SENSOR, COMUNA, UBICACION_ENDPOINT, DIRECCION, SENTIDO_LECTURA, FECHA_LECTURA{cmpsTiempoReal})
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, NOW(){valsTiempoReal})
-                """
-                if fecha_real!="":
-                    cursor.execute(SqlInsert, (sensor, id_ubicacion, id_sensor, comuna, ubicacion_endpoint, direction, sentido_lectura, fecha_real, hora_real))
+                    SqlInsert = f"""
+                        INSERT INTO LECTURAS
+                        (NOMBRE_SENSOR, ID_UBICACION, ID_SENSOR, COMUNA, UBICACION_ENDPOINT, DIRECCION, SENTIDO_LECTURA, FECHA_LECTURA{cmpsTiempoReal})
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, NOW(){valsTiempoReal})
+                    """
+                    if fecha_real!="":
+                        cursor.execute(SqlInsert, (sensor, id_ubicacion, id_sensor, comuna, ubicacion_endpoint, direction, sentido_lectura, fecha_real, hora_real))
+                    else:
+                        cursor.execute(SqlInsert, (sensor, id_ubicacion, id_sensor, comuna, ubicacion_endpoint, direction, sentido_lectura))
                 else:
-                    cursor.execute(SqlInsert, (sensor, id_ubicacion, id_sensor, comuna, ubicacion_endpoint, direction, sentido_lectura))
-            else:
-                # Usar la consulta modificada incluyendo ID_SENSOR
-                cursor.execute("""
-                    INSERT INTO LECTURAS
-                    (NOMBRE_SENSOR, ID_UBICACION, ID_SENSOR, COMUNA, UBICACION_ENDPOINT, DIRECCION, SENTIDO_LECTURA)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s)
-                """, (sensor, id_ubicacion, id_sensor, comuna, ubicacion_endpoint, direction, sentido_lectura))
+                    # Usar la consulta modificada incluyendo ID_SENSOR
+                    cursor.execute("""
+                        INSERT INTO LECTURAS
+                        (NOMBRE_SENSOR, ID_UBICACION, ID_SENSOR, COMUNA, UBICACION_ENDPOINT, DIRECCION, SENTIDO_LECTURA)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s)
+                    """, (sensor, id_ubicacion, id_sensor, comuna, ubicacion_endpoint, direction, sentido_lectura))
 
-            print(f"Inserción ejecutada, filas afectadas: {cursor.rowcount}")
+                print(f"Inserción ejecutada, filas afectadas: {cursor.rowcount}")
+
+            # 7. Persistir el registro de actividad del sensor en la misma transacción
+            momento_registro = sensor_registry.registrar_lectura(sensor, cursor)
 
             # Confirmar transacción
             conn.commit()
+
+            # Solo con la lectura confirmada se actualiza el registro en memoria
+            sensor_registry.confirmar_lectura(sensor, momento_registro)
+
+            # 8. Agregar la lectura confirmada al almacén columnar en memoria (si está activo)
+            columnar_store.registrar_lectura(datetime.datetime.now(), id_ubicacion, id_sensor, comuna, sentido_lectura)
             print(f"✅ Procesamiento completo: Sensor {sensor} - Dirección: {direction}")
             
         elif len(parts) == 7 and parts[-2] == "control" and parts[-1] == "status":
@@ -491,8 +520,28 @@ async def connect_mqtt():
             print(f"🔄 Reintentando conexión MQTT inicial en {delay}s...")
             await asyncio.sleep(delay)
 
+# --- Heartbeat de replicación ---
+def _escribir_heartbeat():
+    conn = ingesta_pool.get_connection()
+    try:
+        escribir_heartbeat(conn)
+    finally:
+        conn.close()
+
+async def heartbeat_loop():
+    """Escribe periódicamente la fila de heartbeat en el primario"""
+    while True:
+        try:
+            await asyncio.to_thread(_escribir_heartbeat)
+        except Exception as e:
+            print(f"⚠️ Error al escribir heartbeat de replicación: {e}")
+        await asyncio.sleep(HEARTBEAT_INTERVALO)
+
 # Función para iniciar el cliente MQTT en background con mejor manejo de errores
 async def start_mqtt_client():
+    heartbeat_task = None
+    if HEARTBEAT_REPLICACION:
+        heartbeat_task = asyncio.create_task(heartbeat_loop())
     try:
         await connect_mqtt()
         # Bucle infinito para mantener la conexión y reiniciar si es necesario
@@ -514,6 +563,9 @@ async def start_mqtt_client():
         print(f"Detalles del error crítico: {traceback.format_exc()}")
         # Error no recuperable, reiniciamos todo
         restart_application()
+    finally:
+        if heartbeat_task is not None:
+            heartbeat_task.cancel()
 
 # --- Manejador de señales para cierre seguro ---
 def handle_exit_signals():
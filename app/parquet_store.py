@@ -0,0 +1,322 @@
+import json
+import logging
+import os
+import threading
+from datetime import date, datetime, time, timedelta
+
+import numpy as np
+
+try:
+    import duckdb
+except ImportError:  # duckdb es opcional; sin él el almacén Parquet queda desactivado
+    duckdb = None
+
+from app import compact_store, retention
+from app.database import ingesta_pool
+from app.query_planner import normalizar_hora
+
+# Almacén analítico de días cerrados (opcional).
+# Una tarea en segundo plano exporta cada día cerrado de LECTURAS a un archivo Parquet en
+# disco local, particionado por fecha (<dir>/lecturas/fecha=AAAA-MM-DD/datos.parquet), y un
+# DuckDB embebido cuenta sobre esos archivos las series de los gráficos e indicadores.
+# chart_engine.calcular_series toma de aquí el tramo del rango anterior a la marca de
+# exportación y deja a MySQL (o al almacén en memoria) solo la ventana abierta.
+# Todo es local: no hay servicios externos ni descargas de extensiones.
+
+# Directorio de los archivos; vacío desactiva el almacén
+ALMACEN_PARQUET_DIR = os.getenv("ALMACEN_PARQUET_DIR", "")
+# Cada cuántos segundos se buscan días cerrados por exportar
+ALMACEN_PARQUET_INTERVALO = int(os.getenv("ALMACEN_PARQUET_INTERVALO", "3600"))
+# Hilos de DuckDB por consulta
+ALMACEN_PARQUET_HILOS = int(os.getenv("ALMACEN_PARQUET_HILOS", "2"))
+
+DIA = timedelta(days=1)
+
+# Columna lógica de los filtros → columna del archivo Parquet
+COLUMNAS = {
+    "id_ubicacion": "ID_UBICACION",
+    "id_sensor": "ID_SENSOR",
+    "comuna": "COMUNA",
+    "sentido_lectura": "SENTIDO_LECTURA",
+}
+
+_SELECT_EXPORTACION = """
+    SELECT
+        CAST(FECHA_LECTURA AS TIMESTAMP) AS FECHA_LECTURA,
+        CAST(ID_UBICACION AS INTEGER) AS ID_UBICACION,
+        CAST(ID_SENSOR AS INTEGER) AS ID_SENSOR,
+        CAST(COMUNA AS VARCHAR) AS COMUNA,
+        CAST(SENTIDO_LECTURA AS VARCHAR) AS SENTIDO_LECTURA
+    FROM dia
+"""
+
+
+def _expresion_cubeta(cubeta, inicio):
+    """Índice de cubeta en SQL de DuckDB, equivalente a Cubeta.expresion_sql de MySQL"""
+    origen = cubeta.origen(inicio)
+    if cubeta.tipo == "minutos":
+        return "CAST(FLOOR((epoch(FECHA_LECTURA) - epoch(?::TIMESTAMP)) / ?) AS BIGINT)", [origen, cubeta.minutos * 60]
+    if cubeta.tipo == "dia":
+        return "date_diff('day', ?::DATE, CAST(FECHA_LECTURA AS DATE))", [origen.date()]
+    if cubeta.tipo == "semana":
+        return "CAST(FLOOR(date_diff('day', ?::DATE, CAST(FECHA_LECTURA AS DATE)) / 7) AS BIGINT)", [origen.date()]
+    if cubeta.tipo == "mes":
+        return "date_diff('month', ?::DATE, CAST(FECHA_LECTURA AS DATE))", [origen.date()]
+    return "hour(FECHA_LECTURA)", []
+
+
+class AlmacenParquet:
+    def __init__(self, directorio, hilos=ALMACEN_PARQUET_HILOS):
+        self.directorio = directorio
+        self.directorio_lecturas = os.path.join(directorio, "lecturas")
+        self.ruta_estado = os.path.join(directorio, "estado.json")
+        os.makedirs(self.directorio_lecturas, exist_ok=True)
+        self._lock = threading.Lock()
+        self._exportando = threading.Lock()
+        # Días exportados: [desde, hasta); las consultas solo usan lo anterior a `hasta`
+        self.desde = None
+        self.hasta = None
+        self.filas = 0
+        self.ultima_exportacion = None
+        self._cargar_estado()
+        self._duckdb = duckdb.connect(database=":memory:")
+        self._duckdb.execute(f"SET threads = {max(1, hilos)}")
+
+    # --- Estado ---
+    def _cargar_estado(self):
+        try:
+            with open(self.ruta_estado) as f:
+                estado = json.load(f)
+        except FileNotFoundError:
+            return
+        self.desde = date.fromisoformat(estado["desde"]) if estado.get("desde") else None
+        self.hasta = date.fromisoformat(estado["hasta"]) if estado.get("hasta") else None
+        self.filas = estado.get("filas", 0)
+
+    def _guardar_estado(self):
+        temporal = self.ruta_estado + ".tmp"
+        with open(temporal, "w") as f:
+            json.dump({
+                "desde": self.desde.isoformat() if self.desde else None,
+                "hasta": self.hasta.isoformat() if self.hasta else None,
+                "filas": self.filas,
+            }, f)
+        os.replace(temporal, self.ruta_estado)
+
+    def _ruta_dia(self, dia):
+        return os.path.join(self.directorio_lecturas, f"fecha={dia.isoformat()}", "datos.parquet")
+
+    # --- Exportación ---
+    def exportar_dia(self, conn, dia):
+        """Escribe (o reemplaza) el archivo de un día con sus lecturas de MySQL; devuelve las filas"""
+        inicio = datetime.combine(dia, time.min)
+        cursor = conn.cursor()
+        try:
+            # Los días ya archivados por la retención se leen también de LECTURAS_ARCHIVO
+            origen = retention.origen_lecturas(retention.corte_archivo(cursor), inicio)
+            cursor.execute(f"""
+                SELECT FECHA_LECTURA, ID_UBICACION, ID_SENSOR, COMUNA, SENTIDO_LECTURA, {compact_store.cantidad()}
+                FROM {origen} AS lecturas
+                WHERE FECHA_LECTURA >= %s AND FECHA_LECTURA < %s
+                ORDER BY FECHA_LECTURA
+            """, (inicio, inicio + DIA))
+            filas = cursor.fetchall()
+        finally:
+            cursor.close()
+
+        ruta = self._ruta_dia(dia)
+        if not filas:
+            if os.path.exists(ruta):
+                os.remove(ruta)
+            return 0
+
+        # En modo conteos cada fila de MySQL vale CANTIDAD bicicletas; el archivo guarda una por bicicleta
+        repeticiones = np.array([int(f[5]) for f in filas], dtype=np.int64)
+        columnas = {
+            "FECHA_LECTURA": np.repeat(np.array([f[0] for f in filas], dtype="datetime64[us]"), repeticiones),
+            "ID_UBICACION": np.repeat(np.array([f[1] for f in filas], dtype=object), repeticiones),
+            "ID_SENSOR": np.repeat(np.array([f[2] for f in filas], dtype=object), repeticiones),
+            "COMUNA": np.repeat(np.array([f[3] for f in filas], dtype=object), repeticiones),
+            "SENTIDO_LECTURA": np.repeat(np.array([f[4] for f in filas], dtype=object), repeticiones),
+        }
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        temporal = ruta + ".tmp"
+        cursor_duckdb = self._duckdb.cursor()
+        try:
+            cursor_duckdb.register("dia", columnas)
+            cursor_duckdb.execute(
+                f"COPY ({_SELECT_EXPORTACION}) TO '{_literal(temporal)}' (FORMAT parquet, COMPRESSION zstd)"
+            )
+        finally:
+            cursor_duckdb.close()
+        os.replace(temporal, ruta)
+        return int(repeticiones.sum())
+
+    def exportar_pendientes(self, conn, ahora=None):
+        """Exporta los días cerrados (anteriores a hoy) que faltan; devuelve los días exportados"""
+        if not self._exportando.acquire(blocking=False):
+            return 0
+        try:
+            hoy = (ahora or datetime.now()).date()
+            dia = self.hasta
+            if dia is None:
+                cursor = conn.cursor()
+                try:
+                    origen = retention.origen_lecturas(retention.corte_archivo(cursor))
+                    cursor.execute(f"SELECT MIN(FECHA_LECTURA) FROM {origen} AS lecturas")
+                    minimo = cursor.fetchone()[0]
+                finally:
+                    cursor.close()
+                if minimo is None:
+                    return 0
+                dia = minimo.date()
+            exportados = 0
+            while dia < hoy:
+                filas = self.exportar_dia(conn, dia)
+                with self._lock:
+                    self.desde = self.desde or dia
+                    self.hasta = dia + DIA
+                    self.filas += filas
+                    self._guardar_estado()
+                exportados += 1
+                dia += DIA
+            if exportados:
+                logging.info(f"Almacén Parquet exportado hasta {self.hasta}")
+            self.ultima_exportacion = datetime.now()
+            return exportados
+        finally:
+            self._exportando.release()
+
+    def reexportar(self, conn, desde, hasta):
+        """Vuelve a exportar los días [desde, hasta) ya exportados (p. ej. tras corregir datos)"""
+        with self._exportando:
+            dia = max(desde, self.desde) if self.desde else desde
+            fin = min(hasta, self.hasta) if self.hasta else dia
+            total = 0
+            while dia < fin:
+                total += self.exportar_dia(conn, dia)
+                dia += DIA
+            return total
+
+    # --- Consultas ---
+    def corte(self, inicio, fin):
+        """Fin del tramo [inicio, corte) que se responde desde Parquet, o None si no hay tramo"""
+        with self._lock:
+            hasta = self.hasta
+        if hasta is None:
+            return None
+        hasta = datetime.combine(hasta, time.min)
+        if inicio >= hasta:
+            return None
+        return min(fin, hasta)
+
+    def series(self, plan, filtros, columna_dimension, inicio, fin):
+        """
+        Filas (cubeta, clave, total) de [inicio, fin) con la cubeta del plan, como
+        AlmacenColumnar.series. Devuelve None si la consulta falla, para que el llamador
+        cuente ese tramo en MySQL.
+        """
+        expresion, params = _expresion_cubeta(plan.cubeta, plan.inicio)
+        clave = COLUMNAS[columna_dimension] if columna_dimension else "NULL"
+        condiciones = ["fecha >= ?", "fecha <= ?", "FECHA_LECTURA >= ?", "FECHA_LECTURA < ?"]
+        params += [inicio.date(), (fin - timedelta(microseconds=1)).date(), inicio, fin]
+        if plan.hora_inicio:
+            condiciones.append("CAST(FECHA_LECTURA AS TIME) >= ?::TIME")
+            params.append(normalizar_hora(plan.hora_inicio))
+        if plan.hora_fin:
+            condiciones.append("CAST(FECHA_LECTURA AS TIME) <= ?::TIME")
+            params.append(normalizar_hora(plan.hora_fin, fin=True))
+        for columna, valores in (
+            ("comuna", filtros.comunas),
+            ("id_ubicacion", filtros.ubicaciones),
+            ("sentido_lectura", filtros.sentidos_valores),
+            ("id_sensor", filtros.sensores),
+        ):
+            if valores:
+                condiciones.append(f"{COLUMNAS[columna]} IN ({', '.join(['?'] * len(valores))})")
+                params.extend(valores)
+
+        patron = _literal(os.path.join(self.directorio_lecturas, "fecha=*", "datos.parquet"))
+        sql = f"""
+            SELECT {expresion} AS cubeta, {clave} AS clave, COUNT(*) AS total
+            FROM read_parquet('{patron}', hive_partitioning = true)
+            WHERE {" AND ".join(condiciones)}
+            GROUP BY cubeta, clave
+        """
+        cursor = self._duckdb.cursor()
+        try:
+            return [(int(c), k, int(t)) for c, k, t in cursor.execute(sql, params).fetchall()]
+        except duckdb.IOException as e:
+            # Sin archivos (todos los días exportados estaban vacíos): no hay lecturas que contar
+            if "No files found" in str(e):
+                return []
+            logging.error(f"Error al consultar el almacén Parquet: {e}")
+            return None
+        except duckdb.Error as e:
+            logging.error(f"Error al consultar el almacén Parquet: {e}")
+            return None
+        finally:
+            cursor.close()
+
+    def estadisticas(self):
+        archivos = 0
+        bytes_disco = 0
+        for raiz, _, nombres in os.walk(self.directorio_lecturas):
+            for nombre in nombres:
+                if nombre.endswith(".parquet"):
+                    archivos += 1
+                    bytes_disco += os.path.getsize(os.path.join(raiz, nombre))
+        with self._lock:
+            return {
+                "activo": True,
+                "directorio": self.directorio,
+                "desde": self.desde.isoformat() if self.desde else None,
+                "hasta": self.hasta.isoformat() if self.hasta else None,
+                "filas": self.filas,
+                "archivos": archivos,
+                "bytes": bytes_disco,
+                "ultima_exportacion": self.ultima_exportacion.isoformat(timespec="seconds") if self.ultima_exportacion else None,
+            }
+
+
+def _literal(texto):
+    return texto.replace("'", "''")
+
+
+# Se crea en iniciar() (al arrancar los servicios), no al importar: crea directorios y abre DuckDB
+almacen = None
+_iniciar_lock = threading.Lock()
+
+
+def activo():
+    """Indica si el almacén está configurado y se puede usar (aunque aún no se haya iniciado)"""
+    return bool(ALMACEN_PARQUET_DIR) and duckdb is not None
+
+
+def iniciar():
+    """Crea el almacén si está configurado; devuelve el almacén o None"""
+    global almacen
+    with _iniciar_lock:
+        if almacen is None and ALMACEN_PARQUET_DIR:
+            if duckdb is None:
+                logging.warning("ALMACEN_PARQUET_DIR está definido pero duckdb no está instalado; almacén Parquet desactivado")
+            else:
+                almacen = AlmacenParquet(ALMACEN_PARQUET_DIR)
+        return almacen
+
+
+def exportar_desde_pool():
+    """Tarea periódica: exporta los días cerrados pendientes con una conexión del pool de ingesta"""
+    if almacen is None:
+        return 0
+    conn = ingesta_pool.get_connection()
+    try:
+        return almacen.exportar_pendientes(conn)
+    finally:
+        conn.close()
+
+
+def estadisticas():
+    if almacen is None:
+        return {"activo": False}
+    return almacen.estadisticas()
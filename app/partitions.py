@@ -0,0 +1,306 @@
+import logging
+import os
+from datetime import date, datetime, time
+
+from app.database import ingesta_pool
+
+# Particionado mensual de LECTURAS por FECHA_LECTURA (RANGE COLUMNS).
+# Cada mes vive en su partición pAAAAMM y una partición pmax (MAXVALUE) recibe lo que llegue
+# después de la última. Una tarea periódica crea con anticipación los meses siguientes
+# partiendo pmax, que normalmente está vacía, así que no copia filas.
+# Con predicados de rango sobre FECHA_LECTURA (nunca DATE(FECHA_LECTURA)) MySQL descarta las
+# particiones fuera del período, y quitar un mes completo es un DROP o EXCHANGE PARTITION,
+# que no depende de cuántas filas tenga, en vez de un DELETE.
+# La migración y el mantenimiento manual están en benchmarks/particiones.py.
+
+TABLA = "LECTURAS"
+COLUMNA = "FECHA_LECTURA"
+PARTICION_MAXIMA = "pmax"
+
+# Meses futuros que se mantienen creados y cada cuántos segundos se revisa (0 desactiva la tarea)
+PARTICIONES_MESES_FUTUROS = int(os.getenv("PARTICIONES_MESES_FUTUROS", "3"))
+PARTICIONES_INTERVALO = int(os.getenv("PARTICIONES_INTERVALO", "86400"))
+
+
+def _mes(dia):
+    return date(dia.year, dia.month, 1)
+
+
+def _sumar_meses(mes, meses):
+    total = mes.year * 12 + mes.month - 1 + meses
+    return date(total // 12, total % 12 + 1, 1)
+
+
+def nombre_particion(mes):
+    return f"p{mes:%Y%m}"
+
+
+def _definicion(mes):
+    return f"PARTITION {nombre_particion(mes)} VALUES LESS THAN ('{_sumar_meses(mes, 1):%Y-%m-%d}')"
+
+
+def _definicion_maxima():
+    return f"PARTITION {PARTICION_MAXIMA} VALUES LESS THAN (MAXVALUE)"
+
+
+def _meses(desde, hasta):
+    """Meses desde el de `desde` hasta el de `hasta`, ambos inclusive"""
+    mes = _mes(desde)
+    while mes <= _mes(hasta):
+        yield mes
+        mes = _sumar_meses(mes, 1)
+
+
+# --- Estado ---
+def _texto(valor):
+    # Según la versión del conector, information_schema puede devolver bytes
+    return valor.decode() if isinstance(valor, (bytes, bytearray)) else valor
+
+
+def particiones(cursor):
+    """
+    Particiones de LECTURAS en orden: [{'nombre', 'desde', 'hasta', 'filas'}].
+    `hasta` es None en pmax y `filas` es la estimación de InnoDB. Lista vacía si la
+    tabla no está particionada.
+    """
+    cursor.execute("""
+        SELECT PARTITION_NAME, PARTITION_DESCRIPTION, TABLE_ROWS
+        FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL
+        ORDER BY PARTITION_ORDINAL_POSITION
+    """, (TABLA,))
+    resultado = []
+    anterior = None
+    for nombre, descripcion, filas in cursor.fetchall():
+        nombre, descripcion = _texto(nombre), _texto(descripcion)
+        hasta = None
+        if descripcion and descripcion.upper() != "MAXVALUE":
+            hasta = datetime.fromisoformat(descripcion.strip("'"))
+        resultado.append({"nombre": nombre, "desde": anterior, "hasta": hasta, "filas": int(filas or 0)})
+        anterior = hasta
+    return resultado
+
+
+def tocadas(lista, inicio, fin):
+    """Nombres de las particiones que se cruzan con [inicio, fin)"""
+    return [
+        p["nombre"] for p in lista
+        if (p["hasta"] is None or inicio < p["hasta"]) and (p["desde"] is None or fin > p["desde"])
+    ]
+
+
+# --- Migración ---
+def _claves_unicas(cursor):
+    cursor.execute("""
+        SELECT INDEX_NAME, COLUMN_NAME
+        FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND NON_UNIQUE = 0
+        ORDER BY INDEX_NAME, SEQ_IN_INDEX
+    """, (TABLA,))
+    claves = {}
+    for indice, columna in cursor.fetchall():
+        claves.setdefault(_texto(indice), []).append(_texto(columna))
+    return claves
+
+
+def _claves_foraneas(cursor):
+    cursor.execute("""
+        SELECT CONSTRAINT_NAME, TABLE_NAME, REFERENCED_TABLE_NAME
+        FROM information_schema.KEY_COLUMN_USAGE
+        WHERE TABLE_SCHEMA = DATABASE() AND REFERENCED_TABLE_NAME IS NOT NULL
+          AND (TABLE_NAME = %s OR REFERENCED_TABLE_NAME = %s)
+    """, (TABLA, TABLA))
+    return sorted({f"{tabla}.{nombre} → {referida}" for nombre, tabla, referida in cursor.fetchall()})
+
+
+def plan_migracion(cursor, meses_futuros=PARTICIONES_MESES_FUTUROS, hoy=None):
+    """
+    Sentencia ALTER TABLE que particiona LECTURAS por mes, desde el mes de la lectura más
+    antigua hasta `meses_futuros` después del actual, más pmax.
+    MySQL exige que toda clave única incluya la columna de particionado: la clave primaria
+    se extiende con FECHA_LECTURA en la misma sentencia (el AUTO_INCREMENT la sigue haciendo
+    única). Otras claves únicas o claves foráneas impiden migrar y se informan como error.
+    """
+    hoy = hoy or datetime.now().date()
+    if particiones(cursor):
+        raise RuntimeError(f"{TABLA} ya está particionada")
+
+    foraneas = _claves_foraneas(cursor)
+    if foraneas:
+        raise RuntimeError(
+            "Las tablas particionadas no admiten claves foráneas; quítelas antes de migrar: "
+            + ", ".join(foraneas)
+        )
+
+    cursor.execute("""
+        SELECT DATA_TYPE, COLUMN_TYPE, IS_NULLABLE, COLUMN_DEFAULT
+        FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    """, (TABLA, COLUMNA))
+    columna = cursor.fetchone()
+    if columna is None:
+        raise RuntimeError(f"{TABLA}.{COLUMNA} no existe")
+    tipo, tipo_completo, nulable, por_defecto = (_texto(valor) for valor in columna)
+    if tipo.lower() not in ("datetime", "date"):
+        raise RuntimeError(f"{COLUMNA} es {tipo_completo}; RANGE COLUMNS requiere DATETIME o DATE")
+
+    alteraciones = []
+    if nulable == "YES":
+        # Las columnas de la clave primaria no pueden ser NULL
+        cursor.execute(f"SELECT COUNT(*) FROM {TABLA} WHERE {COLUMNA} IS NULL")
+        nulos = cursor.fetchone()[0]
+        if nulos:
+            raise RuntimeError(f"Hay {nulos} lecturas con {COLUMNA} NULL; corríjalas antes de migrar")
+        defecto = ""
+        if por_defecto:
+            es_funcion = por_defecto.upper().startswith("CURRENT_TIMESTAMP")
+            defecto = f" DEFAULT {por_defecto}" if es_funcion else f" DEFAULT '{por_defecto}'"
+        alteraciones.append(f"MODIFY COLUMN {COLUMNA} {tipo_completo} NOT NULL{defecto}")
+
+    for indice, columnas in _claves_unicas(cursor).items():
+        if COLUMNA in columnas:
+            continue
+        if indice != "PRIMARY":
+            raise RuntimeError(
+                f"La clave única {indice} ({', '.join(columnas)}) no incluye {COLUMNA}; "
+                "agréguela o conviértala en índice normal antes de migrar"
+            )
+        alteraciones.append("DROP PRIMARY KEY")
+        alteraciones.append(f"ADD PRIMARY KEY ({', '.join(columnas + [COLUMNA])})")
+
+    cursor.execute(f"SELECT MIN({COLUMNA}) FROM {TABLA}")
+    primera = cursor.fetchone()[0] or hoy
+    definiciones = [_definicion(mes) for mes in _meses(primera, _sumar_meses(_mes(hoy), meses_futuros))]
+    definiciones.append(_definicion_maxima())
+
+    sentencia = f"ALTER TABLE {TABLA}"
+    if alteraciones:
+        sentencia += "\n    " + ",\n    ".join(alteraciones)
+    sentencia += f"\nPARTITION BY RANGE COLUMNS ({COLUMNA}) (\n    " + ",\n    ".join(definiciones) + "\n)"
+    return sentencia
+
+
+def migrar(conn, meses_futuros=PARTICIONES_MESES_FUTUROS, aplicar=False):
+    """
+    Devuelve (y ejecuta si `aplicar`) la sentencia de migración. Reconstruye la tabla
+    completa: en producción conviene correrla en una ventana de mantenimiento.
+    """
+    cursor = conn.cursor()
+    try:
+        sentencia = plan_migracion(cursor, meses_futuros)
+        if aplicar:
+            cursor.execute(sentencia)
+            logging.info(f"{TABLA} particionada por mes")
+        return sentencia
+    finally:
+        cursor.close()
+
+
+# --- Mantenimiento ---
+def asegurar_futuras(conn, meses_futuros=PARTICIONES_MESES_FUTUROS, hoy=None):
+    """
+    Crea las particiones que falten hasta `meses_futuros` después del mes actual.
+    No hace nada si la tabla no está particionada. Devuelve los nombres creados.
+    """
+    hoy = hoy or datetime.now().date()
+    cursor = conn.cursor()
+    try:
+        lista = particiones(cursor)
+        if not lista:
+            return []
+        limites = [p["hasta"] for p in lista if p["hasta"] is not None]
+        objetivo = _sumar_meses(_mes(hoy), meses_futuros)
+        desde = limites[-1].date() if limites else _mes(hoy)
+        if desde > objetivo:
+            return []
+        meses = list(_meses(desde, objetivo))
+        definiciones = ", ".join(_definicion(mes) for mes in meses)
+        if lista[-1]["nombre"] == PARTICION_MAXIMA:
+            cursor.execute(
+                f"ALTER TABLE {TABLA} REORGANIZE PARTITION {PARTICION_MAXIMA} "
+                f"INTO ({definiciones}, {_definicion_maxima()})"
+            )
+        else:
+            cursor.execute(f"ALTER TABLE {TABLA} ADD PARTITION ({definiciones})")
+        creadas = [nombre_particion(mes) for mes in meses]
+        logging.info(f"Particiones de {TABLA} creadas: {', '.join(creadas)}")
+        return creadas
+    finally:
+        cursor.close()
+
+
+def anteriores(lista, antes_de):
+    """Particiones mensuales que terminan a más tardar en `antes_de` (nunca la del mes actual ni pmax)"""
+    limite = datetime.combine(min(_mes(antes_de), _mes(datetime.now().date())), time.min)
+    return [p["nombre"] for p in lista if p["hasta"] is not None and p["hasta"] <= limite]
+
+
+def eliminar_anteriores(conn, antes_de, aplicar=True):
+    """
+    Elimina con DROP PARTITION los meses completos anteriores a `antes_de`.
+    Los rollups de esos meses se conservan; no recalcularlos después, porque
+    rollups.recalcular los reconstruye a partir de LECTURAS.
+    """
+    cursor = conn.cursor()
+    try:
+        nombres = anteriores(particiones(cursor), antes_de)
+        if nombres and aplicar:
+            cursor.execute(f"ALTER TABLE {TABLA} DROP PARTITION {', '.join(nombres)}")
+            logging.info(f"Particiones de {TABLA} eliminadas: {', '.join(nombres)}")
+        return nombres
+    finally:
+        cursor.close()
+
+
+def intercambiar(conn, particion, tabla):
+    """
+    Mueve las filas de una partición a `tabla` (nueva, sin particionar) con EXCHANGE
+    PARTITION, que solo cambia los archivos de lugar. La partición queda vacía y se
+    puede eliminar después. Devuelve las filas estimadas que se movieron.
+    """
+    cursor = conn.cursor()
+    try:
+        lista = {p["nombre"]: p for p in particiones(cursor)}
+        if particion not in lista or particion == PARTICION_MAXIMA:
+            raise ValueError(f"{particion} no es una partición mensual de {TABLA}")
+        cursor.execute(f"CREATE TABLE {tabla} LIKE {TABLA}")
+        cursor.execute(f"ALTER TABLE {tabla} REMOVE PARTITIONING")
+        cursor.execute(f"ALTER TABLE {TABLA} EXCHANGE PARTITION {particion} WITH TABLE {tabla}")
+        logging.info(f"Partición {particion} de {TABLA} intercambiada con {tabla}")
+        return lista[particion]["filas"]
+    finally:
+        cursor.close()
+
+
+def asegurar_desde_pool():
+    """Tarea periódica: crea las particiones futuras con una conexión del pool de ingesta"""
+    conn = ingesta_pool.get_connection()
+    try:
+        return asegurar_futuras(conn)
+    finally:
+        conn.close()
+
+
+def estadisticas():
+    conn = ingesta_pool.get_connection()
+    try:
+        cursor = conn.cursor()
+        try:
+            lista = particiones(cursor)
+        finally:
+            cursor.close()
+    finally:
+        conn.close()
+    return {
+        "particionada": bool(lista),
+        "meses_futuros": PARTICIONES_MESES_FUTUROS,
+        "particiones": [
+            {
+                "nombre": p["nombre"],
+                "desde": p["desde"].isoformat() if p["desde"] else None,
+                "hasta": p["hasta"].isoformat() if p["hasta"] else None,
+                "filas": p["filas"],
+            }
+            for p in lista
+        ],
+    }
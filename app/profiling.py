@@ -0,0 +1,137 @@
+import cProfile
+import functools
+import io
+import itertools
+import marshal
+import os
+import pstats
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from urllib.parse import urlencode
+
+from app import request_context
+
+# Perfilado bajo demanda de peticiones individuales con cProfile.
+# El middleware decide si una petición se perfila (cabecera X-Perfilar o parámetro ?perfilar=
+# con el token de administración, o muestreo de 1 de cada N) y lo anota en el contexto de la
+# petición; el endpoint, que corre en un hilo del threadpool, se ejecuta bajo cProfile con
+# el decorador `perfilable` (ruta_rapida lo aplica a los endpoints de gráficos e indicadores,
+# así el perfil incluye la serialización). Sin token ni muestreo configurados no se hace nada.
+
+# Token que habilita el perfilado por cabecera o parámetro; vacío lo desactiva
+PERFILADO_TOKEN = os.getenv("PERFILADO_TOKEN", "")
+# Perfilar 1 de cada N peticiones a rutas perfilables; 0 lo desactiva
+PERFILADO_MUESTREO = int(os.getenv("PERFILADO_MUESTREO", "0"))
+# Perfiles que se conservan en memoria (los más antiguos se descartan)
+PERFILADO_MAX = int(os.getenv("PERFILADO_MAX", "50"))
+
+CABECERA = "x-perfilar"
+PARAMETRO = "perfilar"
+
+_RE_ID = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+HABILITADO = bool(PERFILADO_TOKEN) or PERFILADO_MUESTREO > 0
+
+perfiles = OrderedDict()
+_lock = threading.Lock()
+_turno = itertools.count(1)
+
+
+def solicitado(request):
+    """Motivo por el que se perfila la petición ("cabecera", "muestreo"), o None"""
+    if not HABILITADO:
+        return None
+    if PERFILADO_TOKEN:
+        valor = request.headers.get(CABECERA) or request.query_params.get(PARAMETRO)
+        if valor == PERFILADO_TOKEN:
+            return "cabecera"
+    if PERFILADO_MUESTREO > 0 and next(_turno) % PERFILADO_MUESTREO == 0:
+        return "muestreo"
+    return None
+
+
+def preparar(contexto, motivo):
+    """Marca la petición para que `perfilable` la ejecute bajo cProfile"""
+    contexto["perfil"] = {"motivo": motivo, "profile": None}
+
+
+def perfilable(funcion):
+    """Ejecuta el endpoint bajo cProfile si el middleware marcó la petición en curso"""
+    if not HABILITADO:
+        return funcion
+
+    @functools.wraps(funcion)
+    def envoltura(*args, **kwargs):
+        contexto = request_context.actual()
+        perfil = contexto.get("perfil") if contexto is not None else None
+        if perfil is None or perfil["profile"] is not None:
+            return funcion(*args, **kwargs)
+        profile = perfil["profile"] = cProfile.Profile()
+        return profile.runcall(funcion, *args, **kwargs)
+    return envoltura
+
+
+def guardar(contexto, request, duracion, codigo):
+    """Guarda el perfil de la petición, si se tomó; devuelve su id o None"""
+    perfil = contexto.get("perfil")
+    if perfil is None or perfil["profile"] is None:
+        return None
+    profile = perfil["profile"]
+    profile.create_stats()
+    perfil_id = request.headers.get("x-request-id", "")
+    if not _RE_ID.match(perfil_id):
+        perfil_id = uuid.uuid4().hex[:16]
+    entrada = {
+        "id": perfil_id,
+        "momento": datetime.now().isoformat(timespec="seconds"),
+        "metodo": request.method,
+        "ruta": request_context.plantilla(contexto) or request.url.path,
+        "query": urlencode([(k, v) for k, v in request.query_params.multi_items() if k != PARAMETRO]),
+        "codigo": codigo,
+        "motivo": perfil["motivo"],
+        "duracion_ms": round(duracion * 1000, 1),
+        "planes": list(contexto["planes"]),
+        "_stats": marshal.dumps(profile.stats),
+    }
+    with _lock:
+        perfiles[perfil_id] = entrada
+        perfiles.move_to_end(perfil_id)
+        while len(perfiles) > PERFILADO_MAX:
+            perfiles.popitem(last=False)
+    return perfil_id
+
+
+def listar():
+    with _lock:
+        return [{k: v for k, v in e.items() if not k.startswith("_")} for e in reversed(perfiles.values())]
+
+
+def obtener(perfil_id):
+    with _lock:
+        return perfiles.get(perfil_id)
+
+
+def resumen(entrada, orden="cumulative", lineas=40):
+    """Árbol de llamadas más costosas en el formato de texto de pstats"""
+    salida = io.StringIO()
+    stats = pstats.Stats(_StatsMarshal(entrada["_stats"]), stream=salida)
+    stats.strip_dirs().sort_stats(orden).print_stats(lineas)
+    stats.print_callees(lineas)
+    encabezado = (
+        f"{entrada['metodo']} {entrada['ruta']}?{entrada['query']} -> {entrada['codigo']} "
+        f"en {entrada['duracion_ms']} ms ({entrada['motivo']}, {entrada['momento']})\n"
+    )
+    return encabezado + salida.getvalue()
+
+
+class _StatsMarshal:
+    """Adaptador para que pstats.Stats cargue estadísticas guardadas con marshal"""
+
+    def __init__(self, datos):
+        self.stats = marshal.loads(datos)
+
+    def create_stats(self):
+        pass
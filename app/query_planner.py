@@ -0,0 +1,236 @@
+import os
+import threading
+import time as time_mod
+from datetime import datetime, timedelta
+
+import mysql.connector
+
+from app import compact_store, rollups
+
+# Planificador de consultas de conteo.
+# Dado un rango [inicio, fin), una cubeta y los filtros de hora, elige para cada tramo
+# del rango la fuente más gruesa que responde exactamente: rollup diario, rollup horario
+# o LECTURAS. Los bordes que no caen en días u horas completas (o que aún no están
+# agregados) se completan con la fuente siguiente, de modo que un gráfico de varios
+# años solo lee filas crudas para la hora en curso. Las filas crudas anteriores a la
+# marca de archivo (app.retention) se leen de LECTURAS_ARCHIVO.
+
+# Segundos que se reutilizan las marcas de completitud de los rollups
+PLANIFICADOR_CACHE_MARCAS = float(os.getenv("PLANIFICADOR_CACHE_MARCAS", "30"))
+
+
+class Fuente:
+    """Tabla de la que se pueden contar lecturas y cómo se expresan sus columnas"""
+
+    def __init__(self, nombre, tabla, columna_tiempo, conteo, columnas, paso=None):
+        self.nombre = nombre
+        self.tabla = tabla
+        self.columna_tiempo = columna_tiempo
+        self.conteo = conteo
+        self.columnas = columnas
+        self.paso = paso
+
+    def alinear_arriba(self, instante):
+        if self.paso is None:
+            return instante
+        base = _truncar(instante, self.paso)
+        return base if base == instante else base + self.paso
+
+    def alinear_abajo(self, instante):
+        if self.paso is None:
+            return instante
+        return _truncar(instante, self.paso)
+
+    def condiciones_horas(self, hora_inicio=None, hora_fin=None):
+        """Condiciones SQL del filtro de franja horaria (hora_inicio/hora_fin inclusivos)"""
+        condiciones = []
+        params = []
+        if self.paso is None:
+            if hora_inicio:
+                condiciones.append(f"TIME({self.columna_tiempo}) >= %s")
+                params.append(normalizar_hora(hora_inicio))
+            if hora_fin:
+                condiciones.append(f"TIME({self.columna_tiempo}) <= %s")
+                params.append(normalizar_hora(hora_fin, fin=True))
+            return condiciones, params
+        # Rollup horario: solo se usa si la franja son horas completas (ver admite)
+        if hora_inicio:
+            condiciones.append(f"HOUR({self.columna_tiempo}) >= %s")
+            params.append(int(normalizar_hora(hora_inicio)[:2]))
+        if hora_fin:
+            condiciones.append(f"HOUR({self.columna_tiempo}) <= %s")
+            params.append(int(normalizar_hora(hora_fin, fin=True)[:2]))
+        return condiciones, params
+
+    def admite(self, cubeta, inicio, hora_inicio=None, hora_fin=None):
+        """Indica si esta fuente responde exactamente a la cubeta y franja horaria pedidas"""
+        if self.paso is None:
+            return True
+        if self.paso == DIA:
+            if hora_inicio or hora_fin or cubeta.tipo == "hora_del_dia":
+                return False
+        else:
+            if hora_inicio and not normalizar_hora(hora_inicio).endswith(":00:00"):
+                return False
+            if hora_fin and not normalizar_hora(hora_fin, fin=True).endswith(":59:59"):
+                return False
+        if cubeta.tipo == "minutos":
+            paso_minutos = int(self.paso.total_seconds() // 60)
+            return cubeta.minutos % paso_minutos == 0 and _truncar(inicio, self.paso) == inicio
+        return True
+
+
+HORA = timedelta(hours=1)
+DIA = timedelta(days=1)
+
+# Lecturas crudas: LECTURAS o, en modo conteos, LECTURAS_MINUTO (ver compact_store)
+FUENTE_CRUDA = Fuente(
+    "cruda", f"{compact_store.ORIGEN} AS crudas", "fecha_lectura", compact_store.CONTEO,
+    {
+        "comuna": "comuna",
+        "id_ubicacion": "id_ubicacion",
+        "sentido_lectura": "sentido_lectura",
+        "id_sensor": "id_sensor",
+    },
+)
+
+# Lecturas crudas ya movidas al archivo (misma estructura que LECTURAS)
+FUENTE_ARCHIVO = Fuente(
+    "archivo", rollups.TABLA_ARCHIVO, "fecha_lectura", "COUNT(*)", FUENTE_CRUDA.columnas,
+)
+
+# Columnas sin envolver, para que los filtros IN (...) usen la clave primaria del rollup.
+# Los rollups guardan '' y 0 donde LECTURAS tiene NULL; chart_engine.pivotar trata igual
+# todas las claves vacías, así que un tramo de rollup y uno crudo dan la misma serie.
+_COLUMNAS_ROLLUP = {
+    "comuna": "COMUNA",
+    "id_ubicacion": "ID_UBICACION",
+    "sentido_lectura": "SENTIDO_LECTURA",
+    "id_sensor": "ID_SENSOR",
+}
+
+FUENTE_HORARIA = Fuente("hora", rollups.TABLA_HORA, "HORA", "SUM(CANTIDAD)", _COLUMNAS_ROLLUP, HORA)
+FUENTE_DIARIA = Fuente("dia", rollups.TABLA_DIA, "FECHA", "SUM(CANTIDAD)", _COLUMNAS_ROLLUP, DIA)
+
+# De la más gruesa a la más fina; la cruda siempre cierra el plan
+FUENTES_ROLLUP = [FUENTE_DIARIA, FUENTE_HORARIA]
+
+
+def _truncar(instante, paso):
+    if paso == DIA:
+        return instante.replace(hour=0, minute=0, second=0, microsecond=0)
+    return instante.replace(minute=0, second=0, microsecond=0)
+
+
+def normalizar_hora(valor, fin=False):
+    """
+    Lleva 'HH:MM' a 'HH:MM:SS'. Como límite final el minuto es inclusivo
+    ('08:59' incluye hasta las 08:59:59), igual que en los rollups horarios.
+    """
+    for formato in ('%H:%M:%S', '%H:%M'):
+        try:
+            hora = datetime.strptime(valor, formato).time()
+        except (TypeError, ValueError):
+            continue
+        if formato == '%H:%M' and fin:
+            hora = hora.replace(second=59)
+        return hora.strftime('%H:%M:%S')
+    return valor
+
+
+# --- Marcas de completitud ---
+_marcas_lock = threading.Lock()
+_marcas_cache = {"instante": 0.0, "marcas": {}}
+
+
+def obtener_marcas(cursor):
+    """Marcas de ROLLUP_ESTADO (cacheadas); sin rollups devuelve un diccionario vacío"""
+    ahora = time_mod.monotonic()
+    with _marcas_lock:
+        if ahora - _marcas_cache["instante"] < PLANIFICADOR_CACHE_MARCAS:
+            return _marcas_cache["marcas"]
+    try:
+        marcas = rollups.marcas(cursor)
+    except mysql.connector.Error:
+        marcas = {}
+    with _marcas_lock:
+        _marcas_cache["instante"] = ahora
+        _marcas_cache["marcas"] = marcas
+    return marcas
+
+
+def invalidar_marcas():
+    with _marcas_lock:
+        _marcas_cache["instante"] = 0.0
+
+
+# --- Planes ---
+class Segmento:
+    """Tramo [inicio, fin) del rango que se lee de una fuente"""
+
+    def __init__(self, fuente, inicio, fin):
+        self.fuente = fuente
+        self.inicio = inicio
+        self.fin = fin
+
+    def descripcion(self):
+        formato = '%Y-%m-%d' if self.fuente.paso == DIA else '%Y-%m-%d %H:%M'
+        return f"{self.fuente.nombre}[{self.inicio.strftime(formato)},{self.fin.strftime(formato)})"
+
+
+class PlanConsulta:
+    """Segmentos contiguos que cubren el rango pedido"""
+
+    def __init__(self, segmentos):
+        self.segmentos = segmentos
+
+    def fuentes(self):
+        return {segmento.fuente.nombre for segmento in self.segmentos}
+
+    def descripcion(self):
+        return " + ".join(segmento.descripcion() for segmento in self.segmentos) or "vacio"
+
+
+def _crudos(inicio, fin, marcas):
+    """Segmentos de filas crudas: del archivo antes de su marca y de LECTURAS desde ella"""
+    corte = marcas.get(rollups.MARCA_ARCHIVO)
+    # En modo conteos el histórico archivado ya está compactado en LECTURAS_MINUTO
+    if corte is None or corte <= inicio or compact_store.compacto():
+        return [Segmento(FUENTE_CRUDA, inicio, fin)]
+    if corte >= fin:
+        return [Segmento(FUENTE_ARCHIVO, inicio, fin)]
+    return [Segmento(FUENTE_ARCHIVO, inicio, corte), Segmento(FUENTE_CRUDA, corte, fin)]
+
+
+def _cubrir(inicio, fin, fuentes, marcas):
+    if inicio >= fin:
+        return []
+    if not fuentes:
+        return _crudos(inicio, fin, marcas)
+    fuente, resto = fuentes[0], fuentes[1:]
+    hasta = marcas.get(fuente.nombre)
+    if hasta is None:
+        return _cubrir(inicio, fin, resto, marcas)
+    interior_inicio = fuente.alinear_arriba(inicio)
+    interior_fin = min(fuente.alinear_abajo(fin), fuente.alinear_abajo(hasta))
+    if interior_inicio >= interior_fin:
+        return _cubrir(inicio, fin, resto, marcas)
+    return (
+        _cubrir(inicio, interior_inicio, resto, marcas)
+        + [Segmento(fuente, interior_inicio, interior_fin)]
+        + _cubrir(interior_fin, fin, resto, marcas)
+    )
+
+
+def planificar(cubeta, inicio, fin, hora_inicio=None, hora_fin=None, marcas=None, origen=None):
+    """
+    Elige las fuentes para contar lecturas de [inicio, fin) con la cubeta y franja dadas.
+    `origen` es el inicio del gráfico cuando [inicio, fin) es solo una parte de él
+    (la alineación de las cubetas se mide desde ahí).
+    """
+    marcas = marcas or {}
+    fuentes = [
+        fuente for fuente in FUENTES_ROLLUP
+        if fuente.admite(cubeta, origen or inicio, hora_inicio, hora_fin)
+    ]
+    return PlanConsulta(_cubrir(inicio, fin, fuentes, marcas))
@@ -0,0 +1,40 @@
+from contextvars import ContextVar
+from typing import Optional
+
+# Estado por petición HTTP compartido entre el middleware y el código de consultas
+# (el diccionario se comparte con el hilo del endpoint porque el contexto se copia por referencia).
+
+_contexto: ContextVar[Optional[dict]] = ContextVar("contexto_peticion", default=None)
+
+
+def iniciar(ruta, scope=None):
+    """Crea el contexto de la petición actual y lo devuelve"""
+    contexto = {"ruta": ruta, "planes": [], "scope": scope}
+    _contexto.set(contexto)
+    return contexto
+
+
+def actual():
+    """Contexto de la petición en curso, o None fuera de una petición"""
+    return _contexto.get()
+
+
+def registrar_plan(descripcion):
+    """Anota el plan de consulta elegido para exponerlo en la cabecera de depuración"""
+    contexto = _contexto.get()
+    if contexto is not None:
+        contexto["planes"].append(descripcion)
+
+
+def plantilla(contexto):
+    """
+    Ruta de la petición con sus parámetros de ruta como plantilla (p. ej. /sensors/{sensor_id}),
+    o None si ninguna ruta la atendió todavía
+    """
+    scope = contexto.get("scope")
+    if not scope or "route" not in scope:
+        return None
+    parametros = {str(valor): f"{{{nombre}}}" for nombre, valor in scope.get("path_params", {}).items()}
+    if not parametros:
+        return scope["path"]
+    return "/".join(parametros.get(segmento, segmento) for segmento in scope["path"].split("/"))
@@ -0,0 +1,318 @@
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from fastapi import HTTPException
+from fastapi import params as fastapi_params
+from pydantic.fields import FieldInfo
+
+from app.database import api_pool
+
+# Caché en memoria, con expiración, de resultados de endpoints de solo lectura.
+# La clave es el nombre del endpoint más sus parámetros normalizados (sin la conexión),
+# así que da igual si el endpoint se llama desde FastAPI, desde /batch, desde las
+# rutas de compatibilidad o desde el precalentamiento.
+
+# Segundos de validez de catálogos (comunas, ubicaciones, ...) y de gráficos/indicadores
+CACHE_TTL_CATALOGOS = float(os.getenv("CACHE_TTL_CATALOGOS", "300"))
+CACHE_TTL_GRAFICOS = float(os.getenv("CACHE_TTL_GRAFICOS", "30"))
+CACHE_MAX_ENTRADAS = int(os.getenv("CACHE_MAX_ENTRADAS", "1000"))
+# Segundos que una entrada vencida se sigue sirviendo mientras se recalcula en segundo plano
+# (stale-while-revalidate). 0 lo desactiva: al vencer, la petición espera el recálculo.
+CACHE_SWR = float(os.getenv("CACHE_SWR", "0"))
+# Espera máxima (s) de una petición por el cálculo idéntico en curso antes de calcular por su cuenta
+CACHE_ESPERA_VUELO = float(os.getenv("CACHE_ESPERA_VUELO", "5"))
+# Máximo de peticiones esperando a la vez un cálculo ajeno. Cada una ocupa un hilo del
+# threadpool de anyio (40 por omisión): pasado el límite se responde 503 en vez de agotarlo
+CACHE_MAX_ESPERANDO = int(os.getenv("CACHE_MAX_ESPERANDO", "16"))
+
+
+class CacheTTL:
+    def __init__(self, max_entradas, swr=0.0):
+        self.max_entradas = max_entradas
+        self.swr = swr
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.vencidas_servidas = 0
+
+    def obtener(self, clave):
+        """
+        Devuelve (True, valor, vigente) si hay una entrada vigente, o vencida hace menos
+        de `swr` segundos (vigente=False); si no, (False, None, False)
+        """
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None or entrada[0] + self.swr <= ahora:
+                if entrada is not None:
+                    del self._entradas[clave]
+                self.fallos += 1
+                return False, None, False
+            self._entradas.move_to_end(clave)
+            vigente = entrada[0] > ahora
+            if vigente:
+                self.aciertos += 1
+            else:
+                self.vencidas_servidas += 1
+            return True, entrada[1], vigente
+
+    def guardar(self, clave, valor, ttl):
+        with self._lock:
+            self._entradas[clave] = (time.monotonic() + ttl, valor)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+
+    def invalidar(self, nombre=None):
+        """Elimina todas las entradas, o solo las de un endpoint"""
+        with self._lock:
+            if nombre is None:
+                self._entradas.clear()
+            else:
+                for clave in [c for c in self._entradas if c[0] == nombre]:
+                    del self._entradas[clave]
+
+    def estadisticas(self):
+        with self._lock:
+            total = self.aciertos + self.fallos
+            return {
+                "entradas": len(self._entradas),
+                "max_entradas": self.max_entradas,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "tasa_aciertos": round(self.aciertos / total, 3) if total else 0,
+                "swr_segundos": self.swr,
+                "vencidas_servidas": self.vencidas_servidas,
+            }
+
+
+cache = CacheTTL(CACHE_MAX_ENTRADAS, CACHE_SWR)
+
+
+class Degradado(Exception):
+    """
+    La lanza un endpoint cacheado que responde un valor de reemplazo tras un error (p. ej. un
+    gráfico vacío): cacheado() devuelve `valor` sin guardarlo, salvo en modo estricto().
+    """
+
+    def __init__(self, valor, causa):
+        super().__init__(f"resultado degradado: {causa}")
+        self.valor = valor
+        self.causa = causa
+
+
+_modo = threading.local()
+
+
+class estricto:
+    """Dentro de este bloque, y en este hilo, los endpoints cacheados lanzan Degradado en vez de devolver el reemplazo"""
+
+    def __enter__(self):
+        self._anterior = getattr(_modo, "estricto", False)
+        _modo.estricto = True
+        return self
+
+    def __exit__(self, *exc):
+        _modo.estricto = self._anterior
+        return False
+
+
+class _Vuelo:
+    __slots__ = ("evento", "valor", "error", "esperando")
+
+    def __init__(self):
+        self.evento = threading.Event()
+        self.valor = None
+        self.error = None
+        self.esperando = 0
+
+
+class EsperaSaturada(Exception):
+    """Ya hay max_esperando peticiones esperando cálculos en curso"""
+
+
+class VueloUnico:
+    """
+    Agrupa llamadas idénticas concurrentes (single-flight): la primera con una clave
+    calcula y las que llegan mientras tanto esperan y comparten su resultado, o su error.
+    Como mucho `max_esperando` esperan a la vez; las demás reciben EsperaSaturada.
+    """
+
+    def __init__(self, espera_max, max_esperando):
+        self.espera_max = espera_max
+        self.max_esperando = max_esperando
+        self._vuelos = {}
+        self._lock = threading.Lock()
+        self._esperando = 0
+        self.calculos = 0
+        self.agrupadas = 0
+        self.esperas_agotadas = 0
+        self.rechazadas = 0
+
+    def en_curso(self, clave):
+        with self._lock:
+            return clave in self._vuelos
+
+    def ejecutar(self, clave, calcular):
+        with self._lock:
+            vuelo = self._vuelos.get(clave)
+            lider = vuelo is None
+            if lider:
+                vuelo = self._vuelos[clave] = _Vuelo()
+                self.calculos += 1
+            elif self._esperando >= self.max_esperando:
+                self.rechazadas += 1
+                raise EsperaSaturada(clave[0] if isinstance(clave, tuple) else clave)
+            else:
+                vuelo.esperando += 1
+                self._esperando += 1
+                self.agrupadas += 1
+
+        if not lider:
+            try:
+                terminado = vuelo.evento.wait(self.espera_max)
+            finally:
+                with self._lock:
+                    self._esperando -= 1
+            if not terminado:
+                # El cálculo en curso se está demorando demasiado: no se lo sigue esperando
+                with self._lock:
+                    self.esperas_agotadas += 1
+                return calcular()
+            if vuelo.error is not None:
+                raise vuelo.error
+            return vuelo.valor
+
+        try:
+            vuelo.valor = calcular()
+            return vuelo.valor
+        except BaseException as e:
+            vuelo.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._vuelos[clave]
+            vuelo.evento.set()
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "en_curso": len(self._vuelos),
+                "esperando": self._esperando,
+                "max_esperando": self.max_esperando,
+                "calculos": self.calculos,
+                "agrupadas": self.agrupadas,
+                "esperas_agotadas": self.esperas_agotadas,
+                "rechazadas": self.rechazadas,
+            }
+
+
+vuelos = VueloUnico(CACHE_ESPERA_VUELO, CACHE_MAX_ESPERANDO)
+
+
+def estadisticas():
+    return dict(cache.estadisticas(), vuelos=vuelos.estadisticas())
+
+
+def _valor_parametro(valor):
+    # Los defaults Query(...) sin resolver (llamadas directas) valen lo mismo que su default
+    return valor.default if isinstance(valor, FieldInfo) else valor
+
+
+def clave(nombre, params, por_dia=False):
+    """Clave de caché de un endpoint y sus parámetros"""
+    normalizados = {k: _valor_parametro(v) for k, v in params.items()}
+    if por_dia:
+        normalizados["__dia"] = datetime.now().date().isoformat()
+    return (nombre, json.dumps(normalizados, sort_keys=True, default=str))
+
+
+def _revalidar(clave_cache, calcular):
+    """Recalcula en segundo plano una entrada vencida, salvo que ya se esté calculando"""
+    if vuelos.en_curso(clave_cache):
+        return
+
+    def tarea():
+        try:
+            vuelos.ejecutar(clave_cache, calcular)
+        except Exception as e:
+            logging.warning(f"Caché: no se pudo revalidar {clave_cache[0]}: {e}")
+
+    threading.Thread(target=tarea, name=f"revalidar-{clave_cache[0]}", daemon=True).start()
+
+
+def _calcular_con_pool(funcion, argumentos, conexion):
+    """Ejecuta el endpoint con una conexión propia del pool de la API (fuera de una petición)"""
+    conn = api_pool.get_connection()
+    try:
+        kwargs = dict(argumentos.arguments)
+        for nombre_param in conexion:
+            kwargs[nombre_param] = conn
+        return funcion(**kwargs)
+    finally:
+        conn.close()
+
+
+def cacheado(nombre, ttl, por_dia=False):
+    """
+    Decorador para endpoints síncronos de solo lectura. Conserva la firma para FastAPI.
+    Con `por_dia` la clave incluye la fecha actual (resultados que dependen de "hoy").
+    Las llamadas idénticas concurrentes que no encuentran la entrada se agrupan en un
+    único cálculo; con CACHE_SWR > 0 una entrada recién vencida se sirve mientras
+    se recalcula en segundo plano con una conexión propia.
+    Para que las peticiones agrupadas no ocupen conexiones, el endpoint debe recibir
+    la conexión con get_db_lectura_diferida.
+    Si el endpoint lanza Degradado, se responde su valor de reemplazo y no se guarda.
+    """
+    def decorador(funcion):
+        firma = inspect.signature(funcion)
+        conexion = [
+            nombre_param for nombre_param, parametro in firma.parameters.items()
+            if isinstance(parametro.default, fastapi_params.Depends)
+        ]
+
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            argumentos = firma.bind(*args, **kwargs)
+            argumentos.apply_defaults()
+            params = {k: v for k, v in argumentos.arguments.items() if k not in conexion}
+            clave_cache = clave(nombre, params, por_dia)
+            encontrado, valor, vigente = cache.obtener(clave_cache)
+            if encontrado:
+                if not vigente:
+                    _revalidar(clave_cache, lambda: _calcular_y_guardar(
+                        clave_cache, ttl, lambda: _calcular_con_pool(funcion, argumentos, conexion)
+                    ))
+                return valor
+
+            try:
+                return vuelos.ejecutar(clave_cache, lambda: _calcular_y_guardar(
+                    clave_cache, ttl, lambda: funcion(*args, **kwargs)
+                ))
+            except Degradado as e:
+                if getattr(_modo, "estricto", False):
+                    raise
+                return e.valor
+            except EsperaSaturada:
+                raise HTTPException(
+                    status_code=503,
+                    detail="Servicio saturado: demasiadas peticiones esperando el mismo cálculo",
+                    headers={"Retry-After": "1"}
+                )
+
+        return envoltura
+    return decorador
+
+
+def _calcular_y_guardar(clave_cache, ttl, calcular):
+    valor = calcular()
+    cache.guardar(clave_cache, valor, ttl)
+    return valor
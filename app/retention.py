@@ -0,0 +1,254 @@
+import logging
+import os
+from datetime import datetime, timedelta
+
+import mysql.connector
+
+from app import columnar_store, compact_store, partitions, rollups
+from app.database import ingesta_pool
+
+# Retención escalonada de LECTURAS.
+# Las lecturas crudas con más de RETENCION_DIAS días se mueven por lotes a LECTURAS_ARCHIVO
+# (misma estructura, ROW_FORMAT=COMPRESSED), y solo después de comprobar que los rollups de
+# ese tramo existen y suman exactamente las filas que se van a mover. La marca 'archivo' de
+# ROLLUP_ESTADO indica hasta qué instante (exclusivo) LECTURAS ya no tiene filas.
+# Los gráficos históricos siguen saliendo de los rollups; lo que estos no resuelven por
+# debajo de la marca (franjas de minutos, intervalos que no son horas completas) lo lee el
+# planificador de LECTURAS_ARCHIVO, y las consultas de filas (/consulta, /lecturas,
+# /readings/exportar) unen el archivo a LECTURAS cuando su rango cruza la marca.
+
+TABLA_ARCHIVO = rollups.TABLA_ARCHIVO
+
+# Antigüedad (días) desde la que se archivan las lecturas crudas; 0 desactiva la retención
+RETENCION_DIAS = int(os.getenv("RETENCION_DIAS", "0"))
+# Cada cuántos segundos se busca qué archivar y cuántas horas se mueven por transacción
+RETENCION_INTERVALO = int(os.getenv("RETENCION_INTERVALO", "86400"))
+RETENCION_LOTE_HORAS = int(os.getenv("RETENCION_LOTE_HORAS", "6"))
+# Tamaño de página comprimida de LECTURAS_ARCHIVO (KB)
+RETENCION_KEY_BLOCK_SIZE = int(os.getenv("RETENCION_KEY_BLOCK_SIZE", "8"))
+
+# Columnas que se leen del archivo unido a LECTURAS (ver origen_lecturas)
+COLUMNAS = [
+    "NOMBRE_SENSOR", "ID_UBICACION", "ID_SENSOR", "COMUNA",
+    "UBICACION_ENDPOINT", "DIRECCION", "SENTIDO_LECTURA", "FECHA_LECTURA",
+]
+
+DIA = timedelta(days=1)
+
+
+def activo():
+    # En modo conteos LECTURAS ya no crece y LECTURAS_MINUTO es compacta: no hay nada que archivar
+    return RETENCION_DIAS > 0 and not compact_store.compacto()
+
+
+def origen_lecturas(corte, inicio=None):
+    """
+    Tabla (o tabla derivada) de la que leer lecturas crudas desde `inicio`: LECTURAS, o
+    LECTURAS unida al archivo si el rango empieza antes del corte (`inicio` None = sin límite).
+    En modo conteos es siempre compact_store.ORIGEN.
+    """
+    if compact_store.compacto():
+        return compact_store.ORIGEN
+    if corte is None or (inicio is not None and inicio >= corte):
+        return "LECTURAS"
+    columnas = ", ".join(COLUMNAS)
+    return f"(SELECT {columnas} FROM LECTURAS UNION ALL SELECT {columnas} FROM {TABLA_ARCHIVO})"
+
+
+def corte_archivo(cursor):
+    """Instante (exclusivo) hasta el que las lecturas están archivadas, o None"""
+    try:
+        return rollups.marcas(cursor).get(rollups.MARCA_ARCHIVO)
+    except mysql.connector.Error:
+        return None
+
+
+def _columnas_tabla(cursor, tabla):
+    cursor.execute("""
+        SELECT COLUMN_NAME FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+        ORDER BY ORDINAL_POSITION
+    """, (tabla,))
+    return [fila[0] for fila in cursor.fetchall()]
+
+
+def crear_tabla_archivo(cursor):
+    """Crea LECTURAS_ARCHIVO con la estructura de LECTURAS, sin particiones y comprimida"""
+    if _columnas_tabla(cursor, TABLA_ARCHIVO):
+        return
+    cursor.execute(f"CREATE TABLE {TABLA_ARCHIVO} LIKE LECTURAS")
+    cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL
+    """, (TABLA_ARCHIVO,))
+    if cursor.fetchone()[0]:
+        cursor.execute(f"ALTER TABLE {TABLA_ARCHIVO} REMOVE PARTITIONING")
+    cursor.execute(f"ALTER TABLE {TABLA_ARCHIVO} ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE={RETENCION_KEY_BLOCK_SIZE}")
+    logging.info(f"Tabla {TABLA_ARCHIVO} creada")
+
+
+def _conteos(cursor, desde, hasta):
+    """(lecturas crudas, suma de LECTURAS_HORA, suma de LECTURAS_DIA o None) de [desde, hasta)"""
+    cursor.execute(
+        "SELECT COUNT(*) FROM LECTURAS WHERE FECHA_LECTURA >= %s AND FECHA_LECTURA < %s",
+        (desde, hasta)
+    )
+    crudas = cursor.fetchone()[0]
+    cursor.execute(
+        f"SELECT COALESCE(SUM(CANTIDAD), 0) FROM {rollups.TABLA_HORA} WHERE HORA >= %s AND HORA < %s",
+        (desde, hasta)
+    )
+    horas = int(cursor.fetchone()[0])
+    dias = None
+    if desde.time() == hasta.time() == datetime.min.time():
+        cursor.execute(
+            f"SELECT COALESCE(SUM(CANTIDAD), 0) FROM {rollups.TABLA_DIA} WHERE FECHA >= %s AND FECHA < %s",
+            (desde.date(), hasta.date())
+        )
+        dias = int(cursor.fetchone()[0])
+    return crudas, horas, dias
+
+
+def _rollups_cuadran(cursor, desde, hasta):
+    crudas, horas, dias = _conteos(cursor, desde, hasta)
+    return crudas == horas and dias in (None, crudas), (crudas, horas, dias)
+
+
+def _verificar_dia(conn, cursor, desde, hasta):
+    """
+    Comprueba que los rollups de [desde, hasta) suman lo mismo que LECTURAS; si no, los
+    recalcula una vez (solo días completos) y vuelve a comprobar. Devuelve las lecturas crudas.
+    """
+    cuadran, conteos = _rollups_cuadran(cursor, desde, hasta)
+    if not cuadran and desde.time() == datetime.min.time():
+        logging.warning(f"Rollups de {desde.date()} no cuadran con LECTURAS {conteos}; se recalculan")
+        rollups.recalcular(conn, desde, hasta)
+        cuadran, conteos = _rollups_cuadran(cursor, desde, hasta)
+    if not cuadran:
+        raise RuntimeError(
+            f"Los rollups de [{desde}, {hasta}) no cuadran con LECTURAS "
+            f"(crudas, horas, días = {conteos}); no se archiva"
+        )
+    return conteos[0]
+
+
+def _mover(conn, cursor, columnas, desde, hasta):
+    """Copia [desde, hasta) al archivo, lo borra de LECTURAS y avanza la marca, en una transacción"""
+    lista = ", ".join(columnas)
+    conn.start_transaction()
+    try:
+        cursor.execute(f"""
+            INSERT INTO {TABLA_ARCHIVO} ({lista})
+            SELECT {lista} FROM LECTURAS
+            WHERE FECHA_LECTURA >= %s AND FECHA_LECTURA < %s
+        """, (desde, hasta))
+        copiadas = cursor.rowcount
+        cursor.execute("DELETE FROM LECTURAS WHERE FECHA_LECTURA >= %s AND FECHA_LECTURA < %s", (desde, hasta))
+        if cursor.rowcount != copiadas:
+            raise RuntimeError(f"Se copiaron {copiadas} lecturas de [{desde}, {hasta}) pero se borrarían {cursor.rowcount}")
+        rollups.guardar_marca(cursor, rollups.MARCA_ARCHIVO, hasta)
+        conn.commit()
+        return copiadas
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def limite_archivo(estado, ahora=None):
+    """
+    Hasta dónde se puede archivar: días con más de RETENCION_DIAS (y fuera de la ventana del
+    almacén columnar) que ya tienen rollup diario y horario.
+    """
+    ahora = ahora or datetime.now()
+    dias = max(RETENCION_DIAS, columnar_store.ALMACEN_COLUMNAR_DIAS + 1)
+    limite = ahora.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=dias)
+    for nombre in ("dia", "hora"):
+        marca = estado.get(nombre)
+        if marca is None:
+            return None
+        limite = min(limite, marca.replace(hour=0, minute=0, second=0, microsecond=0))
+    return limite
+
+
+def archivar(conn, ahora=None):
+    """
+    Mueve al archivo las lecturas anteriores a limite_archivo(), día por día y en lotes de
+    RETENCION_LOTE_HORAS horas, y elimina las particiones mensuales que quedaron vacías.
+    Devuelve {'filas', 'hasta'}.
+    """
+    cursor = conn.cursor()
+    try:
+        rollups.crear_tablas(cursor)
+        estado = rollups.marcas(cursor)
+        limite = limite_archivo(estado, ahora)
+        if limite is None:
+            logging.warning("Retención: sin rollups completos no se archivan lecturas")
+            return {"filas": 0, "hasta": estado.get(rollups.MARCA_ARCHIVO)}
+
+        desde = estado.get(rollups.MARCA_ARCHIVO)
+        if desde is None:
+            cursor.execute("SELECT MIN(FECHA_LECTURA) FROM LECTURAS")
+            minimo = cursor.fetchone()[0]
+            if minimo is None or minimo >= limite:
+                return {"filas": 0, "hasta": None}
+            desde = minimo.replace(hour=0, minute=0, second=0, microsecond=0)
+        if desde >= limite:
+            return {"filas": 0, "hasta": desde}
+
+        crear_tabla_archivo(cursor)
+        columnas = _columnas_tabla(cursor, TABLA_ARCHIVO)
+        lote = timedelta(hours=max(1, RETENCION_LOTE_HORAS))
+        total = 0
+        while desde < limite:
+            fin_dia = min(desde.replace(hour=0, minute=0, second=0, microsecond=0) + DIA, limite)
+            esperadas = _verificar_dia(conn, cursor, desde, fin_dia)
+            movidas = 0
+            while desde < fin_dia:
+                hasta = min(desde + lote, fin_dia)
+                movidas += _mover(conn, cursor, columnas, desde, hasta)
+                desde = hasta
+            if movidas != esperadas:
+                logging.warning(f"Retención: {movidas} lecturas archivadas hasta {fin_dia}, se esperaban {esperadas}")
+            total += movidas
+        logging.info(f"Retención: {total} lecturas archivadas hasta {desde}")
+
+        # Los meses ya archivados completos se sueltan sin DELETE si LECTURAS está particionada
+        partitions.eliminar_anteriores(conn, desde.date())
+        return {"filas": total, "hasta": desde}
+    finally:
+        cursor.close()
+
+
+def archivar_desde_pool():
+    """Tarea periódica: archiva con una conexión del pool de ingesta"""
+    conn = ingesta_pool.get_connection()
+    try:
+        return archivar(conn)
+    finally:
+        conn.close()
+
+
+def estadisticas():
+    conn = ingesta_pool.get_connection()
+    try:
+        cursor = conn.cursor()
+        try:
+            corte = corte_archivo(cursor)
+            tabla = None
+            if _columnas_tabla(cursor, TABLA_ARCHIVO):
+                cursor.execute("""
+                    SELECT TABLE_ROWS, DATA_LENGTH + INDEX_LENGTH FROM information_schema.TABLES
+                    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+                """, (TABLA_ARCHIVO,))
+                filas, bytes_ = cursor.fetchone()
+                tabla = {"filas_estimadas": int(filas or 0), "bytes": int(bytes_ or 0)}
+        finally:
+            cursor.close()
+    finally:
+        conn.close()
+    return {
+        "activa": activo(),
+        "dias": RETENCION_DIAS,
+        "archivado_hasta": corte.isoformat() if corte else None,
+        "archivo": tabla,
+    }
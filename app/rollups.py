@@ -0,0 +1,200 @@
+import logging
+import os
+from datetime import datetime, timedelta
+
+from app import compact_store
+from app.database import ingesta_pool
+
+# Tablas pre-agregadas de LECTURAS por hora y por día.
+# ROLLUP_ESTADO guarda, para cada una, hasta qué instante (exclusivo) están completas;
+# el planificador de consultas solo las usa por debajo de esa marca.
+
+TABLA_HORA = "LECTURAS_HORA"
+TABLA_DIA = "LECTURAS_DIA"
+TABLA_ESTADO = "ROLLUP_ESTADO"
+# ROLLUP_ESTADO también guarda hasta dónde se movieron las lecturas crudas a TABLA_ARCHIVO
+# (app.retention): por debajo de esa marca LECTURAS ya no tiene filas y los rollups no se recalculan
+TABLA_ARCHIVO = "LECTURAS_ARCHIVO"
+MARCA_ARCHIVO = "archivo"
+
+# Cada cuántos segundos se actualizan los rollups (0 los desactiva) y cuántos días se procesan por transacción
+ROLLUP_INTERVALO = int(os.getenv("ROLLUP_INTERVALO", "300"))
+ROLLUP_DIAS_POR_LOTE = int(os.getenv("ROLLUP_DIAS_POR_LOTE", "1"))
+
+DDL = [
+    f"""
+    CREATE TABLE IF NOT EXISTS {TABLA_HORA} (
+        HORA DATETIME NOT NULL,
+        ID_UBICACION INT NOT NULL,
+        ID_SENSOR INT NOT NULL,
+        COMUNA VARCHAR(100) NOT NULL,
+        SENTIDO_LECTURA VARCHAR(100) NOT NULL DEFAULT '',
+        CANTIDAD INT NOT NULL,
+        PRIMARY KEY (HORA, ID_UBICACION, ID_SENSOR, COMUNA, SENTIDO_LECTURA)
+    )
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS {TABLA_DIA} (
+        FECHA DATE NOT NULL,
+        ID_UBICACION INT NOT NULL,
+        ID_SENSOR INT NOT NULL,
+        COMUNA VARCHAR(100) NOT NULL,
+        SENTIDO_LECTURA VARCHAR(100) NOT NULL DEFAULT '',
+        CANTIDAD INT NOT NULL,
+        PRIMARY KEY (FECHA, ID_UBICACION, ID_SENSOR, COMUNA, SENTIDO_LECTURA)
+    )
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS {TABLA_ESTADO} (
+        NOMBRE VARCHAR(20) NOT NULL PRIMARY KEY,
+        HASTA DATETIME NOT NULL
+    )
+    """,
+]
+
+
+def crear_tablas(cursor):
+    for sentencia in DDL:
+        cursor.execute(sentencia)
+    # Los rollups se calculan desde LECTURAS_MINUTO en modo conteos, aunque aún no haya ingestión
+    if compact_store.compacto():
+        compact_store.crear_tabla(cursor)
+
+
+def marcas(cursor):
+    """Devuelve {'hora': datetime, 'dia': datetime} con las marcas de completitud registradas"""
+    cursor.execute(f"SELECT NOMBRE, HASTA FROM {TABLA_ESTADO}")
+    filas = cursor.fetchall()
+    return {
+        (fila['NOMBRE'] if isinstance(fila, dict) else fila[0]):
+        (fila['HASTA'] if isinstance(fila, dict) else fila[1])
+        for fila in filas
+    }
+
+
+def guardar_marca(cursor, nombre, hasta):
+    cursor.execute(f"""
+        INSERT INTO {TABLA_ESTADO} (NOMBRE, HASTA) VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE HASTA = VALUES(HASTA)
+    """, (nombre, hasta))
+
+
+def _recalcular_horas(cursor, desde, hasta):
+    """Recalcula LECTURAS_HORA para [desde, hasta) desde las lecturas crudas"""
+    cursor.execute(f"DELETE FROM {TABLA_HORA} WHERE HORA >= %s AND HORA < %s", (desde, hasta))
+    cursor.execute(f"""
+        INSERT INTO {TABLA_HORA}
+        (HORA, ID_UBICACION, ID_SENSOR, COMUNA, SENTIDO_LECTURA, CANTIDAD)
+        SELECT
+            DATE_FORMAT(FECHA_LECTURA, '%Y-%m-%d %H:00:00'),
+            COALESCE(ID_UBICACION, 0),
+            COALESCE(ID_SENSOR, 0),
+            COALESCE(COMUNA, ''),
+            COALESCE(SENTIDO_LECTURA, ''),
+            {compact_store.CONTEO}
+        FROM {compact_store.ORIGEN} AS crudas
+        WHERE FECHA_LECTURA >= %s AND FECHA_LECTURA < %s
+        GROUP BY 1, 2, 3, 4, 5
+    """, (desde, hasta))
+
+
+def _recalcular_dias(cursor, desde, hasta):
+    """Recalcula LECTURAS_DIA para [desde, hasta) desde LECTURAS_HORA"""
+    cursor.execute(f"DELETE FROM {TABLA_DIA} WHERE FECHA >= %s AND FECHA < %s", (desde.date(), hasta.date()))
+    cursor.execute(f"""
+        INSERT INTO {TABLA_DIA}
+        (FECHA, ID_UBICACION, ID_SENSOR, COMUNA, SENTIDO_LECTURA, CANTIDAD)
+        SELECT DATE(HORA), ID_UBICACION, ID_SENSOR, COMUNA, SENTIDO_LECTURA, SUM(CANTIDAD)
+        FROM {TABLA_HORA}
+        WHERE HORA >= %s AND HORA < %s
+        GROUP BY DATE(HORA), ID_UBICACION, ID_SENSOR, COMUNA, SENTIDO_LECTURA
+    """, (desde, hasta))
+
+
+def recalcular(conn, desde, hasta):
+    """Recalcula ambos rollups para el rango de días [desde, hasta) (p. ej. tras corregir datos)"""
+    desde = datetime.combine(desde.date() if isinstance(desde, datetime) else desde, datetime.min.time())
+    hasta = datetime.combine(hasta.date() if isinstance(hasta, datetime) else hasta, datetime.min.time())
+    cursor = conn.cursor(dictionary=True)
+    try:
+        archivado = marcas(cursor).get(MARCA_ARCHIVO)
+        if archivado is not None and desde < archivado:
+            # Los días archivados ya no están en LECTURAS: recalcularlos los dejaría en cero
+            logging.warning(f"Rollups anteriores a {archivado} no se recalculan: sus lecturas están archivadas")
+            dia = archivado.replace(hour=0, minute=0, second=0, microsecond=0)
+            desde = dia if dia == archivado else dia + timedelta(days=1)
+        actual = desde
+        while actual < hasta:
+            siguiente = min(actual + timedelta(days=ROLLUP_DIAS_POR_LOTE), hasta)
+            conn.start_transaction()
+            _recalcular_horas(cursor, actual, siguiente)
+            _recalcular_dias(cursor, actual, siguiente)
+            conn.commit()
+            actual = siguiente
+    finally:
+        cursor.close()
+
+
+def actualizar(conn, ahora=None):
+    """
+    Avanza los rollups hasta la última hora (LECTURAS_HORA) y el último día (LECTURAS_DIA)
+    cerrados, en lotes de ROLLUP_DIAS_POR_LOTE días. Devuelve las marcas resultantes.
+    """
+    ahora = ahora or datetime.now()
+    hora_cerrada = ahora.replace(minute=0, second=0, microsecond=0)
+    dia_cerrado = ahora.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    cursor = conn.cursor(dictionary=True)
+    try:
+        crear_tablas(cursor)
+        estado = marcas(cursor)
+
+        hora_desde = estado.get("hora")
+        if hora_desde is None:
+            cursor.execute(f"SELECT MIN(FECHA_LECTURA) as minimo FROM {compact_store.ORIGEN} AS crudas")
+            minimo = cursor.fetchone()['minimo']
+            if minimo is None:
+                return estado
+            hora_desde = minimo.replace(hour=0, minute=0, second=0, microsecond=0)
+            # Los días ya cubiertos por LECTURAS_HORA se agregan desde el mismo inicio
+            estado["dia"] = hora_desde
+
+        # 1. Horas cerradas
+        while hora_desde < hora_cerrada:
+            hora_hasta = min(hora_desde + timedelta(days=ROLLUP_DIAS_POR_LOTE), hora_cerrada)
+            conn.start_transaction()
+            _recalcular_horas(cursor, hora_desde, hora_hasta)
+            guardar_marca(cursor, "hora", hora_hasta)
+            conn.commit()
+            logging.info(f"Rollup horario actualizado hasta {hora_hasta}")
+            hora_desde = hora_hasta
+        estado["hora"] = hora_desde
+
+        # 2. Días cerrados (a partir de horas ya agregadas)
+        dia_desde = estado.get("dia") or hora_desde.replace(hour=0)
+        dia_limite = min(dia_cerrado, hora_desde.replace(hour=0, minute=0, second=0, microsecond=0))
+        while dia_desde < dia_limite:
+            dia_hasta = min(dia_desde + timedelta(days=ROLLUP_DIAS_POR_LOTE), dia_limite)
+            conn.start_transaction()
+            _recalcular_dias(cursor, dia_desde, dia_hasta)
+            guardar_marca(cursor, "dia", dia_hasta)
+            conn.commit()
+            dia_desde = dia_hasta
+        estado["dia"] = dia_desde
+
+        return estado
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def actualizar_rollups():
+    """Tarea periódica: actualiza los rollups con una conexión del pool de ingesta"""
+    conn = ingesta_pool.get_connection()
+    try:
+        return actualizar(conn)
+    finally:
+        conn.close()
@@ -0,0 +1,284 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+import mysql.connector
+from mysql.connector import errorcode
+
+from app import compact_store
+from app.database import ingesta_pool
+
+# Registro por sensor de la última lectura, el conteo de hoy y el de la última hora.
+# La ingesta MQTT lo mantiene al día en memoria y lo persiste en ESTADO_SENSORES,
+# de modo que las consultas de actividad no necesitan recorrer LECTURAS.
+# La tabla se crea y siembra una vez, al arrancar (preparar); los endpoints solo la leen.
+# La ingesta escribe el nuevo estado en su transacción y lo aplica en memoria recién
+# después del commit (confirmar_lectura), para que un rollback no deje conteos fantasma.
+
+TABLA_ESTADO = "ESTADO_SENSORES"
+
+# Si este proceso no recibe lecturas (API separada de la ingesta),
+# el registro se recarga desde la tabla cada este número de segundos
+REFRESCO_SEGUNDOS = int(os.getenv("REGISTRO_SENSORES_REFRESCO", "30"))
+
+DDL_ESTADO = f"""
+    CREATE TABLE IF NOT EXISTS {TABLA_ESTADO} (
+        NOMBRE_SENSOR VARCHAR(50) NOT NULL PRIMARY KEY,
+        ULTIMA_LECTURA DATETIME NULL,
+        FECHA_CONTEO DATE NULL,
+        CONTEO_HOY INT NOT NULL DEFAULT 0,
+        CONTEO_ULTIMA_HORA INT NOT NULL DEFAULT 0
+    )
+"""
+
+
+class EstadoSensor:
+    """Estado de actividad de un sensor"""
+
+    __slots__ = ("nombre", "ultima_lectura", "fecha_conteo", "conteo_hoy", "minutos")
+
+    def __init__(self, nombre, ultima_lectura=None, fecha_conteo=None, conteo_hoy=0):
+        self.nombre = nombre
+        self.ultima_lectura = ultima_lectura
+        self.fecha_conteo = fecha_conteo
+        self.conteo_hoy = conteo_hoy
+        # Pares [minuto, cantidad] de los últimos 60 minutos
+        self.minutos = deque()
+
+    def copia(self):
+        otro = EstadoSensor(self.nombre, self.ultima_lectura, self.fecha_conteo, self.conteo_hoy)
+        otro.minutos = deque([minuto, cantidad] for minuto, cantidad in self.minutos)
+        return otro
+
+    def registrar(self, momento, cantidad=1):
+        """Suma una lectura ocurrida en `momento`"""
+        if self.fecha_conteo != momento.date():
+            self.fecha_conteo = momento.date()
+            self.conteo_hoy = 0
+        self.conteo_hoy += cantidad
+
+        if self.ultima_lectura is None or momento > self.ultima_lectura:
+            self.ultima_lectura = momento
+
+        minuto = momento.replace(second=0, microsecond=0)
+        if self.minutos and self.minutos[-1][0] == minuto:
+            self.minutos[-1][1] += cantidad
+        else:
+            self.minutos.append([minuto, cantidad])
+        self._purgar(momento)
+
+    def _purgar(self, ahora):
+        limite = ahora - timedelta(hours=1)
+        while self.minutos and self.minutos[0][0] < limite:
+            self.minutos.popleft()
+
+    def conteo_de_hoy(self, ahora=None):
+        ahora = ahora or datetime.now()
+        return self.conteo_hoy if self.fecha_conteo == ahora.date() else 0
+
+    def conteo_ultima_hora(self, ahora=None):
+        ahora = ahora or datetime.now()
+        limite = ahora - timedelta(hours=1)
+        return sum(cantidad for minuto, cantidad in list(self.minutos) if minuto >= limite)
+
+    def activo(self, horas, ahora=None):
+        ahora = ahora or datetime.now()
+        return self.ultima_lectura is not None and self.ultima_lectura >= ahora - timedelta(hours=horas)
+
+    def como_dict(self, ahora=None):
+        ahora = ahora or datetime.now()
+        return {
+            "nombre_sensor": self.nombre,
+            "ultima_lectura": self.ultima_lectura.isoformat() if self.ultima_lectura else None,
+            "conteo_hoy": self.conteo_de_hoy(ahora),
+            "conteo_ultima_hora": self.conteo_ultima_hora(ahora)
+        }
+
+
+_lock = threading.Lock()
+_estados = {}
+_cargado_en = None
+_alimentado_localmente = False
+_preparado = False
+_preparar_lock = threading.Lock()
+
+
+def preparar(conn):
+    """
+    Crea ESTADO_SENSORES y, si está vacía, la siembra desde LECTURAS. Una vez por proceso:
+    al arrancar, y como resguardo antes de la primera lectura ingerida. Va al primario.
+    """
+    global _preparado
+    with _preparar_lock:
+        if _preparado:
+            return
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute(DDL_ESTADO)
+            cursor.execute(f"SELECT COUNT(*) as total FROM {TABLA_ESTADO}")
+            if cursor.fetchone()['total'] == 0:
+                _sembrar_desde_lecturas(cursor)
+                if conn.in_transaction:
+                    conn.commit()
+        finally:
+            cursor.close()
+        _preparado = True
+
+
+def preparar_desde_pool():
+    """Tarea de arranque: prepara la tabla con una conexión del pool de ingesta"""
+    conn = ingesta_pool.get_connection()
+    try:
+        preparar(conn)
+    finally:
+        conn.close()
+
+
+def _cargar_desde_tabla(conn):
+    """Reemplaza el registro en memoria con el contenido persistido (solo lectura)"""
+    global _cargado_en
+    cursor = conn.cursor(dictionary=True)
+    try:
+        try:
+            cursor.execute(f"""
+                SELECT NOMBRE_SENSOR, ULTIMA_LECTURA, FECHA_CONTEO, CONTEO_HOY, CONTEO_ULTIMA_HORA
+                FROM {TABLA_ESTADO}
+            """)
+            filas = cursor.fetchall()
+        except mysql.connector.Error as e:
+            if e.errno != errorcode.ER_NO_SUCH_TABLE:
+                raise
+            # Aún no se preparó (p. ej. la base no respondía al arrancar): registro vacío por ahora
+            logging.warning(f"{TABLA_ESTADO} no existe todavía; registro de sensores vacío")
+            filas = []
+    finally:
+        cursor.close()
+
+    nuevos = {}
+    for fila in filas:
+        estado = EstadoSensor(
+            fila['NOMBRE_SENSOR'],
+            fila['ULTIMA_LECTURA'],
+            fila['FECHA_CONTEO'],
+            fila['CONTEO_HOY'] or 0
+        )
+        # Sin detalle por minuto, el conteo de la última hora se ancla a la última lectura
+        if fila['CONTEO_ULTIMA_HORA'] and fila['ULTIMA_LECTURA']:
+            estado.minutos.append([
+                fila['ULTIMA_LECTURA'].replace(second=0, microsecond=0),
+                fila['CONTEO_ULTIMA_HORA']
+            ])
+        nuevos[fila['NOMBRE_SENSOR']] = estado
+
+    with _lock:
+        _estados.clear()
+        _estados.update(nuevos)
+        _cargado_en = time.monotonic()
+    logging.info(f"Registro de sensores cargado: {len(nuevos)} sensores")
+
+
+def _sembrar_desde_lecturas(cursor):
+    """Primera carga: inicializa ESTADO_SENSORES con un único recorrido agrupado de LECTURAS"""
+    hoy = datetime.now().date()
+    hace_una_hora = datetime.now() - timedelta(hours=1)
+    cursor.execute(f"""
+        INSERT INTO {TABLA_ESTADO}
+        (NOMBRE_SENSOR, ULTIMA_LECTURA, FECHA_CONTEO, CONTEO_HOY, CONTEO_ULTIMA_HORA)
+        SELECT
+            NOMBRE_SENSOR,
+            MAX(FECHA_LECTURA),
+            %s,
+            SUM((FECHA_LECTURA >= %s) * {compact_store.cantidad()}),
+            SUM((FECHA_LECTURA >= %s) * {compact_store.cantidad()})
+        FROM {compact_store.ORIGEN} AS crudas
+        WHERE NOMBRE_SENSOR IS NOT NULL
+        GROUP BY NOMBRE_SENSOR
+    """, (hoy, hoy, hace_una_hora))
+    logging.info(f"Registro de sensores sembrado desde LECTURAS ({cursor.rowcount} sensores)")
+
+
+def asegurar_cargado(conn):
+    """Carga el registro si aún no está en memoria o si está desactualizado"""
+    with _lock:
+        cargado_en = _cargado_en
+        local = _alimentado_localmente
+    if cargado_en is None:
+        _cargar_desde_tabla(conn)
+    elif not local and time.monotonic() - cargado_en > REFRESCO_SEGUNDOS:
+        _cargar_desde_tabla(conn)
+
+
+def registrar_lectura(nombre_sensor, cursor, momento=None):
+    """
+    Persiste, con el cursor de la transacción en curso, el estado que tendrá el sensor con
+    esta lectura, sin tocar la memoria. Devuelve el momento registrado, que se pasa a
+    confirmar_lectura() después del commit.
+    """
+    momento = momento or datetime.now()
+    with _lock:
+        actual = _estados.get(nombre_sensor)
+        estado = actual.copia() if actual is not None else EstadoSensor(nombre_sensor)
+    estado.registrar(momento)
+    valores = (
+        nombre_sensor,
+        estado.ultima_lectura,
+        estado.fecha_conteo,
+        estado.conteo_hoy,
+        estado.conteo_ultima_hora(momento)
+    )
+
+    cursor.execute(f"""
+        INSERT INTO {TABLA_ESTADO}
+        (NOMBRE_SENSOR, ULTIMA_LECTURA, FECHA_CONTEO, CONTEO_HOY, CONTEO_ULTIMA_HORA)
+        VALUES (%s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            ULTIMA_LECTURA = VALUES(ULTIMA_LECTURA),
+            FECHA_CONTEO = VALUES(FECHA_CONTEO),
+            CONTEO_HOY = VALUES(CONTEO_HOY),
+            CONTEO_ULTIMA_HORA = VALUES(CONTEO_ULTIMA_HORA)
+    """, valores)
+    return momento
+
+
+def confirmar_lectura(nombre_sensor, momento):
+    """Aplica en memoria una lectura ya confirmada en la base (ver registrar_lectura)"""
+    global _alimentado_localmente
+    with _lock:
+        _alimentado_localmente = True
+        estado = _estados.get(nombre_sensor)
+        if estado is None:
+            estado = EstadoSensor(nombre_sensor)
+            _estados[nombre_sensor] = estado
+        estado.registrar(momento)
+
+
+def obtener(nombre_sensor):
+    """Devuelve el estado de un sensor o None si nunca ha reportado"""
+    with _lock:
+        return _estados.get(nombre_sensor)
+
+
+def estados():
+    """Copia de todos los estados registrados, indexados por nombre de sensor"""
+    with _lock:
+        return dict(_estados)
+
+
+def sensores_activos(horas=3, ahora=None):
+    """Nombres de los sensores con lecturas en las últimas `horas` horas"""
+    ahora = ahora or datetime.now()
+    with _lock:
+        return sorted(nombre for nombre, estado in _estados.items() if estado.activo(horas, ahora))
+
+
+def sensores_inactivos(nombres_sensores, horas=3, ahora=None):
+    """Nombres de `nombres_sensores` sin lecturas en las últimas `horas` horas"""
+    ahora = ahora or datetime.now()
+    with _lock:
+        return sorted(
+            nombre for nombre in nombres_sensores
+            if nombre not in _estados or not _estados[nombre].activo(horas, ahora)
+        )
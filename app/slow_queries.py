@@ -0,0 +1,127 @@
+import logging
+import os
+import queue
+import re
+import threading
+from collections import deque
+from datetime import datetime
+
+from app import metrics
+from app.database import api_pool
+
+# Registro en memoria de consultas lentas. Cada sentencia medida por metrics.CursorMedido
+# que supera el umbral queda en un buffer circular con su huella, parámetros, ruta y duración.
+# La primera vez que aparece una huella se captura además su plan con EXPLAIN, en un hilo
+# aparte y con una conexión propia: la conexión de la petición puede tener aún filas sin leer.
+
+# Umbral en milisegundos; 0 desactiva el registro
+CONSULTA_LENTA_MS = float(os.getenv("CONSULTA_LENTA_MS", "500"))
+# Entradas que conserva el buffer circular
+CONSULTA_LENTA_MAX = int(os.getenv("CONSULTA_LENTA_MAX", "200"))
+# Máximo de parámetros guardados por entrada (las listas IN pueden ser largas)
+CONSULTA_LENTA_MAX_PARAMS = 50
+
+_RE_EXPLICABLE = re.compile(r"^\s*\(?\s*(SELECT|WITH)\b", re.IGNORECASE)
+
+entradas = deque(maxlen=CONSULTA_LENTA_MAX)
+# huella -> {"sql", "params", "capturado", "plan" | "error"}; None mientras está pendiente
+planes = {}
+_lock = threading.Lock()
+_pendientes = queue.Queue()
+_hilo = None
+
+
+def _params_guardables(params):
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {k: params[k] for k in list(params)[:CONSULTA_LENTA_MAX_PARAMS]}
+    return list(params)[:CONSULTA_LENTA_MAX_PARAMS]
+
+
+def observar(huella, sql, params, segundos, filas, conexion):
+    """Observador de metrics: registra la sentencia si superó el umbral"""
+    if CONSULTA_LENTA_MS <= 0 or segundos * 1000 < CONSULTA_LENTA_MS:
+        return
+    if isinstance(sql, (bytes, bytearray)):
+        sql = sql.decode("utf-8", "replace")
+    varias = isinstance(params, (list, tuple)) and params and isinstance(params[0], (list, tuple, dict))
+    entrada = {
+        "momento": datetime.now().isoformat(timespec="milliseconds"),
+        "huella": huella,
+        "ruta": metrics.ruta_actual(),
+        "duracion_ms": round(segundos * 1000, 1),
+        "filas": filas,
+        "sql": sql,
+        "params": None if varias else _params_guardables(params),
+    }
+    logging.warning(
+        f"Consulta lenta ({entrada['duracion_ms']} ms, huella {huella}, ruta {entrada['ruta']}): "
+        f"{metrics.normalizar_sql(sql)[:300]}"
+    )
+
+    explicar = False
+    with _lock:
+        entradas.append(entrada)
+        if (huella not in planes and not varias and len(planes) < metrics.METRICAS_MAX_HUELLAS
+                and _RE_EXPLICABLE.match(sql)):
+            planes[huella] = None
+            explicar = True
+    if explicar:
+        _pendientes.put((huella, sql, dict(params) if isinstance(params, dict) else list(params or ())))
+        _asegurar_hilo()
+
+
+def _asegurar_hilo():
+    global _hilo
+    with _lock:
+        if _hilo is None or not _hilo.is_alive():
+            _hilo = threading.Thread(target=_bucle_explain, name="explain-consultas-lentas", daemon=True)
+            _hilo.start()
+
+
+def _bucle_explain():
+    while True:
+        huella, sql, params = _pendientes.get()
+        planes[huella] = capturar_plan(sql, params)
+
+
+def capturar_plan(sql, params):
+    """Ejecuta EXPLAIN de la sentencia con sus parámetros, con una conexión propia del pool de la API"""
+    resultado = {"sql": sql, "params": _params_guardables(params), "capturado": datetime.now().isoformat(timespec="seconds")}
+    try:
+        conn = api_pool.get_connection()
+    except Exception as e:
+        resultado["error"] = f"Sin conexión para EXPLAIN: {e}"
+        return resultado
+    try:
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute(f"EXPLAIN {sql}", params or ())
+            resultado["plan"] = cursor.fetchall()
+        finally:
+            cursor.close()
+    except Exception as e:
+        resultado["error"] = str(e)
+    finally:
+        conn.close()
+    return resultado
+
+
+def recientes(limite=50, huella=None):
+    """Entradas más recientes primero, con el plan de su huella si ya se capturó"""
+    with _lock:
+        seleccion = [e for e in reversed(entradas) if huella is None or e["huella"] == huella][:limite]
+    return {
+        "umbral_ms": CONSULTA_LENTA_MS,
+        "capacidad": CONSULTA_LENTA_MAX,
+        "entradas": seleccion,
+        "planes": {e["huella"]: planes.get(e["huella"]) for e in seleccion if e["huella"] in planes},
+    }
+
+
+def limpiar():
+    """Vacía el buffer y olvida los planes (la siguiente aparición de cada huella se vuelve a explicar)"""
+    with _lock:
+        entradas.clear()
+        planes.clear()
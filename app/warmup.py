@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+
+from app import response_cache, sensor_registry
+from app.database import api_pool
+from app.endpoints import dashboard, readings, sensors
+from app.endpoints.batch import invocar
+
+# Precalentamiento tras el arranque: carga catálogos, contadores del día y los
+# resultados por defecto del dashboard y de los gráficos en la caché de respuestas,
+# y calienta de paso los buffers de MySQL. Mientras no termine, /ready responde 503
+# para que el balanceador no envíe tráfico a una instancia fría.
+
+# 0 desactiva el precalentamiento (la instancia queda lista de inmediato)
+CALENTAMIENTO_ACTIVO = os.getenv("CALENTAMIENTO_ACTIVO", "1") == "1"
+# Espera inicial y máxima (s) entre reintentos si algún paso falla
+CALENTAMIENTO_ESPERA = float(os.getenv("CALENTAMIENTO_ESPERA", "1"))
+CALENTAMIENTO_ESPERA_MAX = float(os.getenv("CALENTAMIENTO_ESPERA_MAX", "30"))
+# Tiempo máximo (s) de reintentos: pasado este plazo la instancia se declara lista aunque
+# falten pasos (quedan en estado["pendientes"]), para no sacarla del balanceador para siempre
+CALENTAMIENTO_MAX_SEGUNDOS = float(os.getenv("CALENTAMIENTO_MAX_SEGUNDOS", "300"))
+
+def _contadores(conn):
+    # Por si la base no respondía cuando main intentó preparar la tabla al arrancar
+    sensor_registry.preparar(conn)
+    sensor_registry.asegurar_cargado(conn)
+
+
+PASOS = [
+    ("comunas", lambda conn: invocar(readings.obtener_comunas, {}, conn)),
+    ("ubicaciones", lambda conn: invocar(readings.obtener_ubicaciones, {}, conn)),
+    ("sentidos", lambda conn: invocar(readings.obtener_sentidos, {}, conn)),
+    ("estados", lambda conn: invocar(sensors.get_estados, {}, conn)),
+    ("contadores_hoy", _contadores),
+    ("dashboard_summary", lambda conn: invocar(dashboard.get_dashboard_summary, {}, conn)),
+] + [
+    (f"grafico_{periodo}", lambda conn, periodo=periodo: invocar(readings.obtener_datos_grafico, {"periodo": periodo}, conn))
+    for periodo in ("hoy", "semana", "mes", "anio")
+]
+
+estado = {
+    "listo": not CALENTAMIENTO_ACTIVO,
+    "intentos": 0,
+    "inicio": None,
+    "fin": None,
+    "completo": False,
+    "pendientes": [],
+    "pasos": {},
+}
+
+
+def ejecutar_pasos(conn, pendientes):
+    """
+    Ejecuta los pasos pendientes; devuelve los nombres de los que fallaron. Un endpoint que
+    responde su valor de reemplazo tras un error (Degradado) cuenta como fallido.
+    """
+    fallidos = []
+    for nombre, paso in PASOS:
+        if nombre not in pendientes:
+            continue
+        t0 = time.perf_counter()
+        try:
+            with response_cache.estricto():
+                paso(conn)
+            estado["pasos"][nombre] = {"ok": True, "ms": round((time.perf_counter() - t0) * 1000, 1)}
+        except Exception as e:
+            logging.warning(f"Precalentamiento: falló el paso '{nombre}': {e}")
+            estado["pasos"][nombre] = {"ok": False, "error": str(e)}
+            fallidos.append(nombre)
+    return fallidos
+
+
+def _intento(pendientes):
+    conn = api_pool.get_connection()
+    try:
+        return ejecutar_pasos(conn, pendientes)
+    finally:
+        conn.close()
+
+
+async def calentar():
+    """
+    Repite los pasos que fallen, con espera creciente, hasta completarlos todos o hasta
+    CALENTAMIENTO_MAX_SEGUNDOS; en ambos casos la instancia queda lista.
+    """
+    if not CALENTAMIENTO_ACTIVO:
+        return
+    estado["inicio"] = datetime.now().isoformat()
+    limite = time.monotonic() + CALENTAMIENTO_MAX_SEGUNDOS
+    pendientes = {nombre for nombre, _ in PASOS}
+    espera = CALENTAMIENTO_ESPERA
+    while pendientes:
+        estado["intentos"] += 1
+        try:
+            pendientes = set(await asyncio.to_thread(_intento, pendientes))
+        except Exception as e:
+            logging.warning(f"Precalentamiento: sin conexión a la base de datos: {e}")
+        estado["pendientes"] = sorted(pendientes)
+        if not pendientes:
+            break
+        restante = limite - time.monotonic()
+        if restante <= 0:
+            break
+        await asyncio.sleep(min(espera, restante))
+        espera = min(espera * 2, CALENTAMIENTO_ESPERA_MAX)
+    estado["fin"] = datetime.now().isoformat()
+    estado["completo"] = not pendientes
+    estado["listo"] = True
+    if pendientes:
+        logging.warning(
+            f"Precalentamiento incompleto tras {estado['intentos']} intento(s); "
+            f"instancia lista sin: {', '.join(sorted(pendientes))}"
+        )
+    else:
+        logging.info(f"Precalentamiento completo en {estado['intentos']} intento(s)")
+
+
+def listo():
+    return estado["listo"]
@@ -0,0 +1,364 @@
+"""
+Prueba de carga con una mezcla de tráfico concurrente e ingesta MQTT simultánea.
+
+Uso:
+    python -m benchmarks.carga --url http://localhost:8000 --usuarios 30 --duracion 120
+        [--mqtt localhost:1883 --ritmo-mqtt 50] [--escenario escenario.json] [--salida carga.json]
+
+Cada usuario virtual es un hilo que elige una petición de la mezcla según su peso, la ejecuta
+y espera un tiempo de reflexión (exponencial, media --pausa). En paralelo, si se indica --mqtt,
+se publican lecturas y status sintéticos de benchmarks.generador al ritmo pedido, de modo que
+la ingesta compita por la base con las consultas.
+
+Se informa por petición de la mezcla: cantidad, rendimiento, errores y percentiles de latencia.
+Cuentan como error las respuestas HTTP >= 400, las excepciones de red y las respuestas vacías
+con que algunos endpoints encubren una falla (gráficos sin etiquetas, consultas sin lecturas,
+resumen en cero; ver respuesta_vacia). Al final se evalúan los SLO y el proceso termina con
+código 1 si alguno no se cumple.
+
+El escenario (JSON) puede reemplazar "mezcla" y "slo":
+    {
+      "mezcla": [{"nombre": "...", "peso": 5, "metodo": "GET", "ruta": "/readings/grafico",
+                  "params": {"periodo": "hoy", "ubicacion_id": "{ubicacion}"}}, ...],
+      "slo": {"global": {"error_max": 0.01, "p95_ms": 1500},
+              "peticiones": {"dashboard: resumen": {"p95_ms": 300, "p99_ms": 800}}}
+    }
+En "params", "{ubicacion}", "{ubicaciones}" (tres ids separados por coma) y "{sensor}" se
+reemplazan en cada petición por ids reales elegidos al azar.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from benchmarks import generador
+from benchmarks.endpoints import Cliente, percentil
+
+# Mezcla por omisión: sondeo del dashboard, vista de mapa, gráficos y exportaciones
+MEZCLA = [
+    {"nombre": "dashboard: resumen", "peso": 10, "ruta": "/dashboard/summary"},
+    {"nombre": "dashboard: hoy", "peso": 8, "ruta": "/stats/today"},
+    {"nombre": "dashboard: grafico hoy", "peso": 8, "ruta": "/readings/grafico", "params": {"periodo": "hoy"}},
+    {"nombre": "dashboard: tendencia", "peso": 3, "ruta": "/stats/weekly-trend"},
+    {"nombre": "mapa: sensores", "peso": 6, "ruta": "/sensors/map"},
+    {"nombre": "mapa: lista", "peso": 3, "ruta": "/sensors/list"},
+    {"nombre": "mapa: detalle", "peso": 2, "ruta": "/sensors/detail/{sensor}"},
+    {"nombre": "grafico: ubicacion semana", "peso": 5, "ruta": "/readings/grafico",
+     "params": {"periodo": "semana", "ubicacion_id": "{ubicacion}"}},
+    {"nombre": "grafico: detallado mes", "peso": 3, "ruta": "/readings/grafico_detallado",
+     "params": {"periodo": "mes", "agrupar_por": "dia", "ubicacion_id": "{ubicacion}"}},
+    {"nombre": "grafico: comparar anio", "peso": 2, "ruta": "/readings/comparar",
+     "params": {"periodo": "anio", "agrupar_por": "mes", "ubicaciones": "{ubicaciones}"}},
+    {"nombre": "exportar: consulta mes", "peso": 1, "ruta": "/readings/consulta",
+     "params": {"periodo": "mes", "ubicacion_id": "{ubicacion}"}},
+    {"nombre": "exportar: lecturas", "peso": 1, "ruta": "/lecturas",
+     "params": {"periodo": "semana", "ubicacion_id": "{ubicacion}"}},
+]
+
+SLO = {
+    "global": {"error_max": 0.01, "p95_ms": 2000},
+    "peticiones": {
+        "dashboard: resumen": {"p95_ms": 300},
+        "dashboard: hoy": {"p95_ms": 300},
+        "dashboard: grafico hoy": {"p95_ms": 500},
+        "mapa: sensores": {"p95_ms": 500},
+    },
+}
+
+# Métricas de /metrics cuya diferencia se informa junto al resultado
+METRICAS_POOL = (
+    "bicicla_db_pool_espera_segundos_sum",
+    "bicicla_db_pool_espera_segundos_count",
+    "bicicla_db_pool_sin_conexion_total",
+)
+
+_RE_METRICA = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{[^}]*\})?\s+(\S+)$")
+
+
+def respuesta_vacia(cuerpo):
+    """
+    True si la respuesta tiene la forma del resultado vacío que devuelven los endpoints al
+    capturar una excepción: gráficos sin etiquetas, consultas sin lecturas o resumen en cero.
+    En un dataset sembrado esas formas no aparecen con datos reales (un gráfico sin datos
+    igual trae sus etiquetas).
+    """
+    try:
+        datos = json.loads(cuerpo)
+    except ValueError:
+        return False
+    if isinstance(datos, dict):
+        if "etiquetas" in datos and not datos["etiquetas"]:
+            return True
+        if "lecturas" in datos and not datos["lecturas"] and not datos.get("total"):
+            return True
+        sensores = datos.get("sensores")
+        if "ciclistas_hoy" in datos and isinstance(sensores, dict) and not sensores.get("total"):
+            return True
+    return False
+
+
+class Registro:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.tiempos = defaultdict(list)
+        self.errores = defaultdict(int)
+        self.vacias = defaultdict(int)
+        self.codigos = defaultdict(lambda: defaultdict(int))
+
+    def anotar(self, nombre, ms, codigo, vacia):
+        with self._lock:
+            self.tiempos[nombre].append(ms)
+            self.codigos[nombre][codigo] += 1
+            if codigo is None or codigo >= 400 or vacia:
+                self.errores[nombre] += 1
+            if vacia:
+                self.vacias[nombre] += 1
+
+
+class Ids:
+    """Ids reales para rellenar los parámetros de la mezcla"""
+
+    def __init__(self, cliente):
+        self.ubicaciones = [u["id"] for u in cliente.json("/readings/ubicaciones")] or [1]
+        self.sensores = [s["id"] for s in cliente.json("/sensors/list")] or [1]
+
+    def rellenar(self, valor, rng):
+        if not isinstance(valor, str):
+            return valor
+        return (valor
+                .replace("{ubicaciones}", ",".join(str(u) for u in rng.sample(self.ubicaciones, min(3, len(self.ubicaciones)))))
+                .replace("{ubicacion}", str(rng.choice(self.ubicaciones)))
+                .replace("{sensor}", str(rng.choice(self.sensores))))
+
+
+def usuario(cliente, ids, mezcla, pesos, pausa, inicio_medicion, fin, registro, semilla):
+    rng = random.Random(semilla)
+    while time.monotonic() < fin:
+        peticion = rng.choices(mezcla, pesos)[0]
+        ruta = ids.rellenar(peticion["ruta"], rng)
+        params = {k: ids.rellenar(v, rng) for k, v in peticion.get("params", {}).items()}
+        momento = time.monotonic()
+        try:
+            codigo, contenido, segundos = cliente.pedir(peticion.get("metodo", "GET"), ruta, params, peticion.get("cuerpo"))
+            vacia = codigo == 200 and respuesta_vacia(contenido)
+        except Exception:
+            codigo, segundos, vacia = None, time.monotonic() - momento, False
+        if momento >= inicio_medicion:
+            registro.anotar(peticion["nombre"], segundos * 1000, codigo, vacia)
+        if pausa > 0:
+            time.sleep(rng.expovariate(1 / pausa))
+
+
+def ingesta(broker, puerto, ritmo, duracion, semilla, detener, resultado):
+    """Publica lecturas y status sintéticos del día de hoy durante la prueba"""
+    hoy = date.today()
+    gen = generador.Generador(
+        generador.Red(semilla=semilla), eventos=max(1, int(ritmo * duracion * 2)),
+        desde=hoy, hasta=hoy + timedelta(days=1), semilla=semilla,
+        ahora=datetime.combine(hoy, datetime.max.time())
+    )
+    inicio = time.perf_counter()
+    try:
+        resultado["publicados"] = asyncio.run(generador.publicar(
+            gen.mensajes(), broker, puerto, ritmo, os.getenv("MQTT_USER", ""), os.getenv("MQTT_PASSWORD", ""), detener
+        ))
+    except Exception as e:
+        resultado["error"] = str(e)
+    resultado["segundos"] = time.perf_counter() - inicio
+
+
+def leer_metricas(cliente):
+    """Valores de METRICAS_POOL sumados sobre sus etiquetas, o None si /metrics no responde"""
+    try:
+        codigo, contenido, _ = cliente.pedir("GET", "/metrics")
+    except Exception:
+        return None
+    if codigo != 200:
+        return None
+    valores = defaultdict(float)
+    for linea in contenido.decode("utf-8", "replace").splitlines():
+        coincidencia = _RE_METRICA.match(linea)
+        if coincidencia and coincidencia.group(1) in METRICAS_POOL:
+            valores[coincidencia.group(1)] += float(coincidencia.group(3))
+    return valores
+
+
+def resumir(registro, duracion):
+    filas = []
+    for nombre in sorted(registro.tiempos):
+        tiempos = registro.tiempos[nombre]
+        filas.append({
+            "peticion": nombre,
+            "cantidad": len(tiempos),
+            "por_segundo": round(len(tiempos) / duracion, 2),
+            "errores": registro.errores[nombre],
+            "vacias": registro.vacias[nombre],
+            "tasa_error": round(registro.errores[nombre] / len(tiempos), 4),
+            "p50_ms": round(percentil(tiempos, 0.5), 1),
+            "p90_ms": round(percentil(tiempos, 0.9), 1),
+            "p95_ms": round(percentil(tiempos, 0.95), 1),
+            "p99_ms": round(percentil(tiempos, 0.99), 1),
+            "max_ms": round(max(tiempos), 1),
+            "codigos": {str(k): v for k, v in registro.codigos[nombre].items()},
+        })
+    todos = [t for lista in registro.tiempos.values() for t in lista]
+    errores = sum(registro.errores.values())
+    total = {
+        "cantidad": len(todos),
+        "por_segundo": round(len(todos) / duracion, 2),
+        "errores": errores,
+        "vacias": sum(registro.vacias.values()),
+        "tasa_error": round(errores / len(todos), 4) if todos else 0,
+        "p50_ms": round(percentil(todos, 0.5), 1) if todos else None,
+        "p95_ms": round(percentil(todos, 0.95), 1) if todos else None,
+        "p99_ms": round(percentil(todos, 0.99), 1) if todos else None,
+    }
+    return filas, total
+
+
+def evaluar_slo(slo, filas, total):
+    """Lista de (objetivo, límite, valor, cumple)"""
+    resultados = []
+
+    def comparar(etiqueta, limites, valores):
+        for clave, limite in limites.items():
+            campo = "tasa_error" if clave == "error_max" else clave
+            valor = valores.get(campo)
+            if valor is None:
+                continue
+            resultados.append((f"{etiqueta} {clave}", limite, valor, valor <= limite))
+
+    comparar("global", slo.get("global", {}), total)
+    por_nombre = {f["peticion"]: f for f in filas}
+    for nombre, limites in slo.get("peticiones", {}).items():
+        if nombre in por_nombre:
+            comparar(nombre, limites, por_nombre[nombre])
+        else:
+            resultados.append((f"{nombre} (sin peticiones)", None, None, False))
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--usuarios", type=int, default=20, help="Usuarios virtuales concurrentes")
+    parser.add_argument("--duracion", type=float, default=60, help="Segundos medidos")
+    parser.add_argument("--calentamiento", type=float, default=10, help="Segundos iniciales que no se miden")
+    parser.add_argument("--pausa", type=float, default=1.0, help="Tiempo medio de reflexión entre peticiones (s)")
+    parser.add_argument("--mqtt", metavar="HOST[:PUERTO]", help="Broker donde publicar la ingesta concurrente")
+    parser.add_argument("--ritmo-mqtt", type=float, default=20, help="Mensajes MQTT por segundo")
+    parser.add_argument("--escenario", help="JSON con la mezcla y/o los SLO")
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--salida", help="Archivo JSON de resultados")
+    args = parser.parse_args()
+
+    mezcla, slo = MEZCLA, SLO
+    if args.escenario:
+        with open(args.escenario) as f:
+            escenario = json.load(f)
+        mezcla = escenario.get("mezcla", mezcla)
+        slo = escenario.get("slo", slo)
+    pesos = [p.get("peso", 1) for p in mezcla]
+
+    cliente = Cliente(args.url, timeout=60)
+    ids = Ids(cliente)
+    registro = Registro()
+    metricas_antes = leer_metricas(cliente)
+
+    ahora = time.monotonic()
+    inicio_medicion = ahora + args.calentamiento
+    fin = inicio_medicion + args.duracion
+
+    detener = threading.Event()
+    ingesta_resultado = {}
+    hilo_ingesta = None
+    if args.mqtt:
+        host, _, puerto = args.mqtt.partition(":")
+        hilo_ingesta = threading.Thread(
+            target=ingesta, name="ingesta-mqtt", daemon=True,
+            args=(host, int(puerto or 1883), args.ritmo_mqtt, args.calentamiento + args.duracion, args.semilla,
+                  detener, ingesta_resultado)
+        )
+        hilo_ingesta.start()
+
+    hilos = [
+        threading.Thread(
+            target=usuario, name=f"usuario-{i}", daemon=True,
+            args=(cliente, ids, mezcla, pesos, args.pausa, inicio_medicion, fin, registro, args.semilla * 1000 + i)
+        )
+        for i in range(args.usuarios)
+    ]
+    print(f"{args.usuarios} usuarios durante {args.calentamiento:.0f}s + {args.duracion:.0f}s"
+          + (f", ingesta {args.ritmo_mqtt:g} msg/s en {args.mqtt}" if args.mqtt else ""), flush=True)
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    detener.set()
+    if hilo_ingesta is not None:
+        hilo_ingesta.join(timeout=10)
+    metricas_despues = leer_metricas(cliente)
+
+    filas, total = resumir(registro, args.duracion)
+    print(f"\n{'peticion':32} {'n':>6} {'req/s':>7} {'err':>5} {'vacías':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for f in filas:
+        print(f"{f['peticion'][:32]:32} {f['cantidad']:>6} {f['por_segundo']:>7.1f} {f['errores']:>5} {f['vacias']:>6} "
+              f"{f['p50_ms']:>8.1f} {f['p95_ms']:>8.1f} {f['p99_ms']:>8.1f} {f['max_ms']:>8.1f}")
+    print(f"{'TOTAL':32} {total['cantidad']:>6} {total['por_segundo']:>7.1f} {total['errores']:>5} {total['vacias']:>6} "
+          f"{total['p50_ms'] or 0:>8.1f} {total['p95_ms'] or 0:>8.1f} {total['p99_ms'] or 0:>8.1f}")
+
+    pool = None
+    if metricas_antes is not None and metricas_despues is not None:
+        delta = {k: metricas_despues[k] - metricas_antes[k] for k in METRICAS_POOL}
+        esperas = delta["bicicla_db_pool_espera_segundos_count"]
+        pool = {
+            "esperas": int(esperas),
+            "espera_media_ms": round(delta["bicicla_db_pool_espera_segundos_sum"] / esperas * 1000, 2) if esperas else 0,
+            "sin_conexion": int(delta["bicicla_db_pool_sin_conexion_total"]),
+        }
+        print(f"\nPool: {pool['esperas']} adquisiciones, espera media {pool['espera_media_ms']} ms, "
+              f"{pool['sin_conexion']} sin conexión")
+    if args.mqtt:
+        publicados = ingesta_resultado.get("publicados", 0)
+        segundos = ingesta_resultado.get("segundos") or 1
+        print(f"Ingesta: {publicados:,} mensajes ({publicados / segundos:.1f}/s)"
+              + (f", error: {ingesta_resultado['error']}" if "error" in ingesta_resultado else ""))
+
+    evaluacion = evaluar_slo(slo, filas, total)
+    print("\nSLO:")
+    for objetivo, limite, valor, cumple in evaluacion:
+        print(f"  {'OK   ' if cumple else 'FALLA'} {objetivo}: {valor} (límite {limite})")
+
+    if args.salida:
+        with open(args.salida, "w") as f:
+            json.dump({
+                "meta": {
+                    "fecha": datetime.now().isoformat(timespec="seconds"),
+                    "url": args.url,
+                    "usuarios": args.usuarios,
+                    "duracion": args.duracion,
+                    "pausa": args.pausa,
+                    "mqtt": args.mqtt,
+                    "ritmo_mqtt": args.ritmo_mqtt if args.mqtt else None,
+                },
+                "peticiones": filas,
+                "total": total,
+                "pool": pool,
+                "ingesta": ingesta_resultado or None,
+                "slo": [{"objetivo": o, "limite": l, "valor": v, "cumple": c} for o, l, v, c in evaluacion],
+            }, f, indent=2, ensure_ascii=False)
+        print(f"\nResultados en {args.salida}")
+
+    if not all(c for *_, c in evaluacion):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
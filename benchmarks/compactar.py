@@ -0,0 +1,193 @@
+"""
+Pasa el histórico de LECTURAS (y LECTURAS_ARCHIVO, si existe) a LECTURAS_MINUTO, la tabla
+de conteos por minuto del modo LECTURAS_MODO=conteos (app.compact_store).
+
+Uso:
+    python -m benchmarks.compactar estado
+    python -m benchmarks.compactar migrar [--lote-horas 24] [--aplicar]
+
+Usa la configuración MYSQL_* de la aplicación. Cada lote agrupa las lecturas de un tramo por
+(minuto, ubicación, sensor, sentido) y las suma a LECTURAS_MINUTO, y en la misma transacción
+avanza la marca 'compactado' de ROLLUP_ESTADO: si se interrumpe, se retoma donde quedó sin
+contar dos veces. La suma (y no el reemplazo) permite migrar con la ingestión ya en modo
+conteos: el minuto del cambio junta lo que quedó en LECTURAS con lo que llegó después.
+
+Orden sugerido: `migrar --aplicar` con la aplicación aún en modo filas, reiniciar con
+LECTURAS_MODO=conteos y, pasado un minuto, repetir `migrar --aplicar` para el último tramo
+(la migración nunca pasa del minuto en curso). LECTURAS no se borra; una vez comprobados los
+totales de `estado` se puede vaciar a mano. FECHA_REAL y HORA_REAL no se conservan.
+"""
+import argparse
+import sys
+from datetime import datetime, timedelta
+
+import mysql.connector
+
+from app import compact_store, retention, rollups
+from app.database import MYSQL_DB, MYSQL_HOST, MYSQL_PASSWORD, MYSQL_PORT, MYSQL_USER
+
+# Un sentido por (sensor, dirección), como lo resuelve la ingestión
+SENTIDOS = """(
+    SELECT ID_SENSOR, DIRECCION, MIN(ID) AS ID
+    FROM SENTIDOS_SENSOR
+    GROUP BY ID_SENSOR, DIRECCION
+)"""
+
+
+def conectar():
+    return mysql.connector.connect(
+        host=MYSQL_HOST, port=MYSQL_PORT, user=MYSQL_USER, password=MYSQL_PASSWORD,
+        database=MYSQL_DB, autocommit=True
+    )
+
+
+def tablas_origen(cursor):
+    """LECTURAS y, si existe, LECTURAS_ARCHIVO"""
+    tablas = ["LECTURAS"]
+    if retention._columnas_tabla(cursor, retention.TABLA_ARCHIVO):
+        tablas.append(retention.TABLA_ARCHIVO)
+    return tablas
+
+
+def tamanios(cursor, tablas):
+    """{tabla: (filas estimadas, bytes de datos e índices)}"""
+    marcadores = ", ".join(["%s"] * len(tablas))
+    cursor.execute(f"""
+        SELECT TABLE_NAME, TABLE_ROWS, DATA_LENGTH + INDEX_LENGTH FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN ({marcadores})
+    """, tablas)
+    return {nombre: (int(filas or 0), int(bytes_ or 0)) for nombre, filas, bytes_ in cursor.fetchall()}
+
+
+def totales(cursor, tablas):
+    """(lecturas en las tablas de origen, bicicletas en LECTURAS_MINUTO)"""
+    lecturas = 0
+    for tabla in tablas:
+        cursor.execute(f"SELECT COUNT(*) FROM {tabla}")
+        lecturas += cursor.fetchone()[0]
+    cursor.execute(f"SELECT COALESCE(SUM(CANTIDAD), 0) FROM {compact_store.TABLA_CONTEOS}")
+    return lecturas, int(cursor.fetchone()[0])
+
+
+def _sumar(conn, cursor, tablas, desde, hasta):
+    """Suma [desde, hasta) de las tablas de origen a LECTURAS_MINUTO y avanza la marca"""
+    conn.start_transaction()
+    try:
+        filas = 0
+        for tabla in tablas:
+            cursor.execute(f"""
+                INSERT INTO {compact_store.TABLA_CONTEOS} (MINUTO, ID_UBICACION, ID_SENSOR, ID_SENTIDO, CANTIDAD)
+                SELECT
+                    DATE_FORMAT(l.FECHA_LECTURA, '%Y-%m-%d %H:%i:00') AS MINUTO,
+                    COALESCE(l.ID_UBICACION, 0) AS UBICACION,
+                    COALESCE(l.ID_SENSOR, 0) AS SENSOR,
+                    COALESCE(ss.ID, 0) AS SENTIDO,
+                    COUNT(*) AS TOTAL
+                FROM {tabla} l
+                LEFT JOIN {SENTIDOS} ss ON ss.ID_SENSOR = l.ID_SENSOR AND ss.DIRECCION = l.DIRECCION
+                WHERE l.FECHA_LECTURA >= %s AND l.FECHA_LECTURA < %s
+                GROUP BY MINUTO, UBICACION, SENSOR, SENTIDO
+                ON DUPLICATE KEY UPDATE CANTIDAD = CANTIDAD + VALUES(CANTIDAD)
+            """, (desde, hasta))
+            filas += cursor.rowcount
+        rollups.guardar_marca(cursor, compact_store.MARCA_COMPACTACION, hasta)
+        conn.commit()
+        return filas
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def migrar(conn, lote_horas, aplicar):
+    cursor = conn.cursor()
+    try:
+        rollups.crear_tablas(cursor)
+        compact_store.crear_tabla(cursor)
+        tablas = tablas_origen(cursor)
+        antes = tamanios(cursor, tablas + [compact_store.TABLA_CONTEOS])
+
+        desde = rollups.marcas(cursor).get(compact_store.MARCA_COMPACTACION)
+        if desde is None:
+            minimos = []
+            for tabla in tablas:
+                cursor.execute(f"SELECT MIN(FECHA_LECTURA) FROM {tabla}")
+                minimos.append(cursor.fetchone()[0])
+            minimos = [m for m in minimos if m is not None]
+            if not minimos:
+                print("No hay lecturas que compactar")
+                return
+            desde = min(minimos).replace(second=0, microsecond=0)
+        # Nunca el minuto en curso: puede seguir recibiendo lecturas en modo filas
+        hasta = datetime.now().replace(second=0, microsecond=0)
+        if desde >= hasta:
+            print(f"Compactado hasta {desde}; nada pendiente")
+            return
+        print(f"Pendiente: [{desde}, {hasta}) desde {', '.join(tablas)}")
+        if not aplicar:
+            print("Repita con --aplicar para compactar")
+            return
+
+        lote = timedelta(hours=max(1, lote_horas))
+        total = 0
+        while desde < hasta:
+            fin = min(desde + lote, hasta)
+            total += _sumar(conn, cursor, tablas, desde, fin)
+            desde = fin
+            print(f"  hasta {desde}", flush=True)
+        print(f"Compactado hasta {desde} ({total:,} filas de conteo escritas o actualizadas)")
+
+        cursor.execute(f"ANALYZE TABLE {compact_store.TABLA_CONTEOS}")
+        cursor.fetchall()
+        mostrar_tamanios(antes, tamanios(cursor, tablas + [compact_store.TABLA_CONTEOS]))
+    finally:
+        cursor.close()
+
+
+def mostrar_tamanios(antes, despues):
+    for tabla, (filas, bytes_) in despues.items():
+        filas_antes, bytes_antes = antes.get(tabla, (0, 0))
+        print(f"{tabla:18s}{filas_antes:>14,} → {filas:<14,}{bytes_antes / 2**20:>10.1f} → {bytes_ / 2**20:.1f} MB")
+
+
+def mostrar_estado(conn):
+    cursor = conn.cursor()
+    try:
+        compact_store.crear_tabla(cursor)
+        rollups.crear_tablas(cursor)
+        tablas = tablas_origen(cursor)
+        marca = rollups.marcas(cursor).get(compact_store.MARCA_COMPACTACION)
+        lecturas, bicicletas = totales(cursor, tablas)
+        actuales = tamanios(cursor, tablas + [compact_store.TABLA_CONTEOS])
+    finally:
+        cursor.close()
+    print(f"Modo de la aplicación: {compact_store.LECTURAS_MODO}")
+    print(f"Compactado hasta: {marca or '-'}")
+    print(f"Lecturas en {' + '.join(tablas)}: {lecturas:,}; bicicletas en {compact_store.TABLA_CONTEOS}: {bicicletas:,}")
+    for tabla, (filas, bytes_) in actuales.items():
+        print(f"{tabla:18s}{filas:>14,}{bytes_ / 2**20:>10.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    comandos = parser.add_subparsers(dest="comando", required=True)
+    comandos.add_parser("estado", help="Marca de compactación, totales y tamaños de las tablas")
+    migrar_ = comandos.add_parser("migrar", help="Suma a LECTURAS_MINUTO las lecturas aún no compactadas")
+    migrar_.add_argument("--lote-horas", type=int, default=24, help="Horas de lecturas por transacción")
+    migrar_.add_argument("--aplicar", action="store_true", help="Compacta en vez de solo mostrar el tramo pendiente")
+    args = parser.parse_args()
+
+    conn = conectar()
+    try:
+        if args.comando == "estado":
+            mostrar_estado(conn)
+        else:
+            try:
+                migrar(conn, args.lote_horas, args.aplicar)
+            except mysql.connector.Error as e:
+                sys.exit(f"Error al compactar: {e}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
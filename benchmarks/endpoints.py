@@ -0,0 +1,306 @@
+"""
+Mide la latencia de los endpoints públicos contra una instancia en ejecución.
+
+Uso:
+    python -m benchmarks.endpoints --url http://localhost:8000 [--repeticiones 20]
+        [--salida resultados.json] [--base base.json] [--tolerancia 0.2]
+
+Cada caso (ruta + parámetros) se ejecuta --calentamiento veces sin medir y luego
+--repeticiones veces. Se registran p50/p95/media y, si hay acceso a MySQL con la
+configuración MYSQL_* de la aplicación, las consultas y filas examinadas por petición
+(diferencias de SHOW GLOBAL STATUS: Questions e Innodb_rows_read).
+
+Para que las cifras sean del trabajo real, por omisión se vacía la caché de respuestas
+(DELETE /admin/cache, con --admin-token o ADMIN_TOKEN) antes de cada petición, fuera de la
+medición; --con-cache lo evita.
+Conviene arrancar la instancia sin MQTT ni rollups en segundo plano (sin MQTT_BROKER y con
+ROLLUP_INTERVALO=0) para que otras consultas no ensucien los contadores globales.
+
+Con --base se compara con resultados anteriores: un caso empeora si su p50 supera el de
+la base en más de --tolerancia (proporción) y en más de 1 ms. Si alguno empeora el
+proceso termina con código 1.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import date, datetime, timedelta
+
+PERIODOS = ["hoy", "semana", "mes", "anio", "personalizado"]
+AGRUPACIONES = ["auto", "hora", "dia", "semana", "mes"]
+
+# Estado global de MySQL que se compara antes y después de cada caso
+VARIABLES_ESTADO = ("Questions", "Innodb_rows_read")
+
+
+class Cliente:
+    def __init__(self, url, timeout=120, admin_token=None):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.admin_token = admin_token
+
+    def pedir(self, metodo, ruta, params=None, cuerpo=None):
+        """Devuelve (código, bytes de respuesta, segundos)"""
+        url = self.url + ruta
+        if params:
+            url += "?" + urllib.parse.urlencode(params)
+        datos = json.dumps(cuerpo).encode() if cuerpo is not None else None
+        peticion = urllib.request.Request(url, data=datos, method=metodo)
+        if datos is not None:
+            peticion.add_header("Content-Type", "application/json")
+        if self.admin_token and ruta.startswith("/admin/"):
+            peticion.add_header("X-Admin-Token", self.admin_token)
+        inicio = time.perf_counter()
+        try:
+            with urllib.request.urlopen(peticion, timeout=self.timeout) as respuesta:
+                contenido = respuesta.read()
+                codigo = respuesta.status
+        except urllib.error.HTTPError as e:
+            contenido = e.read()
+            codigo = e.code
+        return codigo, contenido, time.perf_counter() - inicio
+
+    def json(self, ruta, params=None):
+        codigo, contenido, _ = self.pedir("GET", ruta, params)
+        if codigo != 200:
+            raise RuntimeError(f"GET {ruta} respondió {codigo}")
+        return json.loads(contenido)
+
+
+class EstadoMySQL:
+    """Lee contadores globales de MySQL; si no hay acceso, queda desactivado"""
+
+    def __init__(self):
+        self.conn = None
+        try:
+            import mysql.connector
+            from app.database import MYSQL_DB, MYSQL_HOST, MYSQL_PASSWORD, MYSQL_PORT, MYSQL_USER
+            self.conn = mysql.connector.connect(
+                host=MYSQL_HOST, port=MYSQL_PORT, user=MYSQL_USER, password=MYSQL_PASSWORD,
+                database=MYSQL_DB, autocommit=True
+            )
+        except Exception as e:
+            print(f"Sin acceso a MySQL para contar consultas y filas: {e}", file=sys.stderr)
+
+    def leer(self):
+        if self.conn is None:
+            return None
+        cursor = self.conn.cursor()
+        try:
+            marcadores = ", ".join(["%s"] * len(VARIABLES_ESTADO))
+            cursor.execute(f"SHOW GLOBAL STATUS WHERE Variable_name IN ({marcadores})", VARIABLES_ESTADO)
+            return {nombre: int(valor) for nombre, valor in cursor.fetchall()}
+        finally:
+            cursor.close()
+
+    def filas_lecturas(self):
+        if self.conn is None:
+            return None
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("""
+                SELECT TABLE_ROWS FROM information_schema.TABLES
+                WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'LECTURAS'
+            """)
+            fila = cursor.fetchone()
+            return int(fila[0]) if fila and fila[0] is not None else None
+        finally:
+            cursor.close()
+
+
+def _parametros_periodo(periodo):
+    if periodo != "personalizado":
+        return {"periodo": periodo}
+    hoy = date.today()
+    return {"periodo": periodo, "fecha_inicio": (hoy - timedelta(days=730)).isoformat(), "fecha_fin": hoy.isoformat()}
+
+
+def casos(cliente):
+    """Lista de (nombre, método, ruta, parámetros, cuerpo) de todos los endpoints públicos"""
+    ubicaciones = [u["id"] for u in cliente.json("/readings/ubicaciones")]
+    sensores = [s["id"] for s in cliente.json("/sensors/list")]
+    ubicacion = ubicaciones[0] if ubicaciones else 1
+    sensor = sensores[0] if sensores else 1
+    varias = ",".join(str(u) for u in ubicaciones[:3]) or "1"
+
+    lista = []
+
+    def agregar(ruta, params=None, metodo="GET", cuerpo=None, nombre=None):
+        # Las fechas del período personalizado dependen del día: no forman parte del nombre,
+        # que se usa para comparar con la base
+        visibles = {k: v for k, v in (params or {}).items() if k not in ("fecha_inicio", "fecha_fin")}
+        etiqueta = nombre or (ruta + ("?" + urllib.parse.urlencode(visibles) if visibles else ""))
+        lista.append((etiqueta, metodo, ruta, params or {}, cuerpo))
+
+    # Catálogos e indicadores
+    for ruta in ("/readings/comunas", "/readings/ubicaciones", "/readings/sentidos",
+                 "/readings/resumen", "/readings/summary",
+                 "/stats/today", "/stats/daily-average", "/stats/monthly", "/stats/weekly-trend",
+                 "/dashboard/summary",
+                 "/sensors/list", "/sensors/map", "/sensors/actividad", "/sensors/estados"):
+        agregar(ruta)
+    agregar(f"/sensors/detail/{sensor}", nombre="/sensors/detail/{sensor_id}")
+    agregar(f"/sensors/auditoria/{sensor}", nombre="/sensors/auditoria/{sensor_id}")
+    agregar("/stats/today", {"ubicacion_id": ubicacion})
+
+    # Gráficos por período y agrupación
+    for periodo in PERIODOS:
+        base = _parametros_periodo(periodo)
+        agregar("/readings/consulta", base)
+        agregar("/readings/consulta", dict(base, ubicacion_id=ubicacion))
+        for agrupar_por in AGRUPACIONES:
+            params = dict(base, agrupar_por=agrupar_por)
+            agregar("/readings/grafico", params)
+            agregar("/readings/grafico", dict(params, ubicacion_id=ubicacion))
+            agregar("/readings/grafico_detallado", params)
+            agregar("/readings/comparar", dict(params, ubicaciones=varias))
+
+    # Lote típico del dashboard
+    agregar("/batch", metodo="POST", nombre="/batch (dashboard)", cuerpo={"peticiones": [
+        {"nombre": "resumen", "ruta": "/dashboard/summary", "params": {}},
+        {"nombre": "semana", "ruta": "/readings/grafico", "params": {"periodo": "semana"}},
+        {"nombre": "detalle", "ruta": "/readings/grafico_detallado", "params": {"periodo": "mes", "agrupar_por": "dia"}},
+    ]})
+
+    # Rutas de compatibilidad
+    for ruta in ("/comunas", "/ubicaciones", "/sentidos", "/resumen"):
+        agregar(ruta)
+    for periodo in PERIODOS:
+        base = _parametros_periodo(periodo)
+        agregar("/consulta", base)
+        agregar("/lecturas", base)
+        agregar("/grafico", dict(base, agrupar_por="auto"))
+        agregar("/grafico_detallado", dict(base, agrupar_por="auto"))
+    return lista
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    if not ordenados:
+        return None
+    k = (len(ordenados) - 1) * p
+    i = int(k)
+    j = min(i + 1, len(ordenados) - 1)
+    return ordenados[i] + (ordenados[j] - ordenados[i]) * (k - i)
+
+
+def medir_caso(cliente, estado, caso, calentamiento, repeticiones, limpiar_cache):
+    nombre, metodo, ruta, params, cuerpo = caso
+
+    def una():
+        if limpiar_cache:
+            cliente.pedir("DELETE", "/admin/cache")
+        return cliente.pedir(metodo, ruta, params, cuerpo)
+
+    for _ in range(calentamiento):
+        una()
+
+    tiempos, errores, bytes_respuesta = [], 0, 0
+    antes = estado.leer()
+    for _ in range(repeticiones):
+        codigo, contenido, segundos = una()
+        tiempos.append(segundos * 1000)
+        bytes_respuesta = len(contenido)
+        if codigo >= 400:
+            errores += 1
+    despues = estado.leer()
+
+    resultado = {
+        "caso": nombre,
+        "metodo": metodo,
+        "ruta": ruta,
+        "params": params,
+        "repeticiones": repeticiones,
+        "errores": errores,
+        "bytes": bytes_respuesta,
+        "p50_ms": round(percentil(tiempos, 0.5), 2),
+        "p95_ms": round(percentil(tiempos, 0.95), 2),
+        "media_ms": round(sum(tiempos) / len(tiempos), 2),
+        "max_ms": round(max(tiempos), 2),
+        "consultas": None,
+        "filas_examinadas": None,
+    }
+    if antes and despues:
+        # Questions cuenta también el SHOW GLOBAL STATUS de cierre
+        resultado["consultas"] = round((despues["Questions"] - antes["Questions"] - 1) / repeticiones, 1)
+        resultado["filas_examinadas"] = round((despues["Innodb_rows_read"] - antes["Innodb_rows_read"]) / repeticiones)
+    return resultado
+
+
+def comparar(resultados, base, tolerancia):
+    """Imprime la comparación con la base y devuelve los casos que empeoraron"""
+    anteriores = {r["caso"]: r for r in base.get("casos", [])}
+    empeorados = []
+    print(f"\n{'caso':70} {'base p50':>9} {'p50':>9} {'cambio':>8}")
+    for r in resultados:
+        anterior = anteriores.get(r["caso"])
+        if anterior is None:
+            continue
+        cambio = (r["p50_ms"] - anterior["p50_ms"]) / anterior["p50_ms"] if anterior["p50_ms"] else 0
+        marca = ""
+        if cambio > tolerancia and r["p50_ms"] - anterior["p50_ms"] > 1:
+            marca = "  EMPEORA"
+            empeorados.append(r["caso"])
+        print(f"{r['caso'][:70]:70} {anterior['p50_ms']:>9.1f} {r['p50_ms']:>9.1f} {cambio:>+7.0%}{marca}")
+    return empeorados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=os.getenv("BENCH_URL", "http://localhost:8000"))
+    parser.add_argument("--repeticiones", type=int, default=20)
+    parser.add_argument("--calentamiento", type=int, default=2)
+    parser.add_argument("--con-cache", action="store_true", help="No vaciar la caché de respuestas entre peticiones")
+    parser.add_argument("--admin-token", default=os.getenv("ADMIN_TOKEN"), help="Token para vaciar la caché (X-Admin-Token)")
+    parser.add_argument("--filtro", help="Solo los casos cuyo nombre contenga este texto")
+    parser.add_argument("--salida", help="Archivo JSON de resultados (por omisión benchmarks/resultados/endpoints_<fecha>.json)")
+    parser.add_argument("--base", help="Resultados anteriores con los que comparar")
+    parser.add_argument("--tolerancia", type=float, default=0.2)
+    args = parser.parse_args()
+
+    cliente = Cliente(args.url, admin_token=args.admin_token)
+    if not args.con_cache:
+        codigo, _, _ = cliente.pedir("DELETE", "/admin/cache")
+        if codigo != 200:
+            sys.exit(f"DELETE /admin/cache respondió {codigo}: pase --admin-token (o ADMIN_TOKEN), o use --con-cache")
+    estado = EstadoMySQL()
+    lista = [c for c in casos(cliente) if not args.filtro or args.filtro in c[0]]
+
+    resultados = []
+    for i, caso in enumerate(lista, 1):
+        r = medir_caso(cliente, estado, caso, args.calentamiento, args.repeticiones, not args.con_cache)
+        resultados.append(r)
+        extra = f" {r['consultas']} consultas, {r['filas_examinadas']:,} filas" if r["consultas"] is not None else ""
+        error = f" ({r['errores']} errores)" if r["errores"] else ""
+        print(f"[{i}/{len(lista)}] {r['caso'][:70]:70} p50 {r['p50_ms']:8.1f} ms  p95 {r['p95_ms']:8.1f} ms{extra}{error}", flush=True)
+
+    salida = args.salida or os.path.join(
+        "benchmarks", "resultados", f"endpoints_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(salida) or ".", exist_ok=True)
+    with open(salida, "w") as f:
+        json.dump({
+            "meta": {
+                "fecha": datetime.now().isoformat(timespec="seconds"),
+                "url": args.url,
+                "repeticiones": args.repeticiones,
+                "con_cache": args.con_cache,
+                "filas_lecturas": estado.filas_lecturas(),
+            },
+            "casos": resultados,
+        }, f, indent=2, ensure_ascii=False)
+    print(f"\nResultados en {salida}")
+
+    if args.base:
+        with open(args.base) as f:
+            empeorados = comparar(resultados, json.load(f), args.tolerancia)
+        if empeorados:
+            print(f"\n{len(empeorados)} caso(s) empeoraron más de {args.tolerancia:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
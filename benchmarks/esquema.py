@@ -0,0 +1,158 @@
+"""
+Esquema mínimo de BICICLA para la base de benchmarks.
+
+Se infiere de las consultas de la aplicación (endpoints, ingesta MQTT y vistas que usan)
+y no reemplaza al esquema de producción: tiene solo las columnas que la API lee o escribe.
+Las tablas propias de la aplicación (rollups, ESTADO_SENSORES, heartbeat) las crea la
+aplicación misma al arrancar.
+"""
+
+TABLAS = [
+    """
+    CREATE TABLE UBICACIONES (
+        ID_UBICACION INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        COMUNA VARCHAR(100) NULL,
+        UBICACION_ENDPOINT VARCHAR(100) NOT NULL,
+        TIPO_EQUIPO VARCHAR(50) NULL,
+        NOMBRE_FORMAL VARCHAR(150) NULL,
+        KEY idx_ubicacion_endpoint (UBICACION_ENDPOINT)
+    )
+    """,
+    """
+    CREATE TABLE SENSORES (
+        ID_SENSOR INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        NOMBRE_SENSOR VARCHAR(50) NOT NULL,
+        ID_UBICACION INT NOT NULL,
+        NOMBRE_FORMAL VARCHAR(150) NULL,
+        SENTIDO_LECTURA VARCHAR(100) NULL,
+        ESTADO_SENSOR VARCHAR(20) NOT NULL DEFAULT 'active',
+        LAT_SENSOR DECIMAL(10, 7) NULL,
+        LNG_SENSOR DECIMAL(10, 7) NULL,
+        KEY idx_sensor_nombre (NOMBRE_SENSOR, ID_UBICACION)
+    )
+    """,
+    """
+    CREATE TABLE SENTIDOS_SENSOR (
+        ID INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        ID_SENSOR INT NOT NULL,
+        DIRECCION VARCHAR(50) NOT NULL,
+        SENTIDO_LECTURA VARCHAR(100) NULL,
+        KEY idx_sentido_sensor (ID_SENSOR, DIRECCION)
+    )
+    """,
+    """
+    CREATE TABLE ESTADOS (
+        CODIGO_ESTADO VARCHAR(20) NOT NULL PRIMARY KEY,
+        DESCRIPCION_ESTADO VARCHAR(100) NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE CAMBIOS_SENSORES (
+        ID_CAMBIO INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        ID_SENSOR INT NOT NULL,
+        CAMPO_MODIFICADO VARCHAR(100) NOT NULL,
+        VALOR_ANTERIOR VARCHAR(255) NULL,
+        VALOR_NUEVO VARCHAR(255) NULL,
+        USUARIO VARCHAR(100) NULL,
+        FECHA_CAMBIO DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        KEY idx_cambios_sensor (ID_SENSOR, FECHA_CAMBIO)
+    )
+    """,
+    """
+    CREATE TABLE UBICACION_STATUS (
+        ID INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        ID_UBICACION INT NOT NULL,
+        MQTT_CONNECTED TINYINT NOT NULL DEFAULT 0,
+        TIMESTAMP VARCHAR(40) NULL,
+        DEVICE VARCHAR(100) NULL,
+        UPTIME VARCHAR(50) NULL,
+        SDASHBOARD_ENABLED VARCHAR(1) NOT NULL DEFAULT '1'
+    )
+    """,
+    """
+    CREATE TABLE LECTURAS (
+        ID_LECTURA BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        NOMBRE_SENSOR VARCHAR(50) NOT NULL,
+        ID_UBICACION INT NULL,
+        ID_SENSOR INT NULL,
+        COMUNA VARCHAR(100) NULL,
+        UBICACION_ENDPOINT VARCHAR(100) NULL,
+        DIRECCION VARCHAR(50) NULL,
+        SENTIDO_LECTURA VARCHAR(100) NULL,
+        FECHA_LECTURA DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        FECHA_REAL DATE NULL,
+        HORA_REAL TIME NULL
+    )
+    """,
+]
+
+# Índices secundarios de LECTURAS: se crean después de la carga masiva, que así es mucho más rápida
+INDICES_LECTURAS = [
+    "ALTER TABLE LECTURAS ADD INDEX idx_lecturas_fecha (FECHA_LECTURA)",
+    "ALTER TABLE LECTURAS ADD INDEX idx_lecturas_ubicacion_fecha (ID_UBICACION, FECHA_LECTURA)",
+    "ALTER TABLE LECTURAS ADD INDEX idx_lecturas_sensor_fecha (NOMBRE_SENSOR, FECHA_LECTURA)",
+]
+
+VISTAS = [
+    """
+    CREATE VIEW VISTA_SENSORES_UBICACIONES AS
+    SELECT
+        s.ID_SENSOR,
+        s.NOMBRE_SENSOR,
+        s.NOMBRE_FORMAL AS NOMBRE_SENSOR_FORMAL,
+        s.ID_UBICACION,
+        u.COMUNA,
+        u.NOMBRE_FORMAL AS NOMBRE_UBICACION,
+        u.TIPO_EQUIPO,
+        s.LAT_SENSOR,
+        s.LNG_SENSOR,
+        s.SENTIDO_LECTURA,
+        s.ESTADO_SENSOR,
+        ss.ID AS ID_SENTIDO,
+        ss.DIRECCION
+    FROM SENSORES s
+    JOIN UBICACIONES u ON u.ID_UBICACION = s.ID_UBICACION
+    LEFT JOIN SENTIDOS_SENSOR ss ON ss.ID_SENSOR = s.ID_SENSOR
+    """,
+]
+
+ESTADOS = [
+    ("active", "Activo"),
+    ("inactive", "Inactivo"),
+    ("maintenance", "En mantención"),
+]
+
+# Tablas que borra crear_esquema(), incluidas las derivadas que mantiene la aplicación
+TABLAS_A_BORRAR = [
+    "LECTURAS", "UBICACION_STATUS", "CAMBIOS_SENSORES", "SENTIDOS_SENSOR", "SENSORES",
+    "UBICACIONES", "ESTADOS", "LECTURAS_HORA", "LECTURAS_DIA", "ROLLUP_ESTADO", "ESTADO_SENSORES",
+    "LECTURAS_ARCHIVO", "LECTURAS_MINUTO",
+]
+
+
+def crear_esquema(conn, indices_lecturas=False):
+    """Borra y vuelve a crear las tablas de benchmark (destructivo)"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DROP VIEW IF EXISTS VISTA_SENSORES_UBICACIONES")
+        for tabla in TABLAS_A_BORRAR:
+            cursor.execute(f"DROP TABLE IF EXISTS {tabla}")
+        for ddl in TABLAS:
+            cursor.execute(ddl)
+        for ddl in VISTAS:
+            cursor.execute(ddl)
+        cursor.executemany("INSERT INTO ESTADOS (CODIGO_ESTADO, DESCRIPCION_ESTADO) VALUES (%s, %s)", ESTADOS)
+        if indices_lecturas:
+            crear_indices_lecturas(conn)
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+def crear_indices_lecturas(conn):
+    cursor = conn.cursor()
+    try:
+        for ddl in INDICES_LECTURAS:
+            cursor.execute(ddl)
+    finally:
+        cursor.close()
@@ -0,0 +1,433 @@
+"""
+Generador de tráfico sintético de conteo de bicicletas.
+
+Uso:
+    python -m benchmarks.generador --eventos 10M --anios 3 --formato lecturas --salida lecturas.tsv
+    python -m benchmarks.generador --eventos 200k --dias 7 --formato mqtt --salida -
+    python -m benchmarks.generador --eventos 50k --dias 1 --formato mqtt --publicar localhost:1883 --ritmo 200
+
+Modelo (determinista para una misma semilla y parámetros):
+  - Red de ubicaciones (Totem / Contador) en varias comunas, con 1-3 sensores BCxx cada una y
+    1-3 direcciones por sensor; algunas direcciones quedan sin sentido asignado, como las que
+    crea la ingesta MQTT.
+  - Volumen por dirección log-normal (pocas ubicaciones concentran la mayor parte del tráfico).
+  - Perfil horario con puntas de mañana y tarde en días laborales y una curva de mediodía los
+    fines de semana; ubicaciones recreativas con más tráfico en fin de semana.
+  - Estacionalidad mensual (hemisferio sur), ruido diario, días de lluvia y ruido por ubicación.
+  - Respaldos de sincronización: algunas ubicaciones quedan desconectadas unas horas y al
+    reconectarse envían de golpe las lecturas pendientes con reading_date/reading_time; en
+    LECTURAS quedan con FECHA_LECTURA = momento de llegada y FECHA_REAL/HORA_REAL = momento real.
+
+Formatos:
+  lecturas  Filas de LECTURAS separadas por tabulador, en el orden de columnas de COLUMNAS_LECTURAS
+            y con \\N para NULL, listas para
+            LOAD DATA LOCAL INFILE 'lecturas.tsv' INTO TABLE LECTURAS (<COLUMNAS_LECTURAS>)
+            Los ID_UBICACION / ID_SENSOR coinciden con los que crea benchmarks.sembrar con la misma
+            semilla y parámetros de red.
+  mqtt      Un JSON por línea {"momento", "topic", "payload"} con los tópicos reales
+            Bramal/Bicicla/<tipo>/<comuna>/<ubicacion>/<BCxx> y .../<ubicacion>/control/status.
+
+Todo se genera día a día y se escribe por lotes: la memoria no depende del total de eventos.
+"""
+import argparse
+import asyncio
+import heapq
+import json
+import os
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+COMUNAS = [
+    "Santiago", "Providencia", "Ñuñoa", "Las Condes", "Vitacura", "La Reina",
+    "Macul", "San Miguel", "Independencia", "Recoleta", "Estación Central", "Maipú",
+]
+
+DIRECCIONES = [
+    ("Norte", "Hacia el norte"), ("Sur", "Hacia el sur"),
+    ("Oriente", "Hacia el oriente"), ("Poniente", "Hacia el poniente"),
+]
+
+COLUMNAS_LECTURAS = (
+    "NOMBRE_SENSOR", "ID_UBICACION", "ID_SENSOR", "COMUNA", "UBICACION_ENDPOINT", "DIRECCION",
+    "SENTIDO_LECTURA", "FECHA_LECTURA", "FECHA_REAL", "HORA_REAL",
+)
+
+# Perfiles horarios relativos (se normalizan): laboral con puntas de ida y vuelta al trabajo,
+# fin de semana con una curva amplia de mediodía
+PERFIL_LABORAL = np.array([
+    0.6, 0.3, 0.2, 0.2, 0.4, 1.5, 5, 11, 13, 7, 4.5, 4.5,
+    5, 5.5, 5, 5, 6.5, 10, 12, 8, 5, 3, 2, 1.2,
+])
+PERFIL_FIN_SEMANA = np.array([
+    1.2, 0.8, 0.5, 0.3, 0.2, 0.3, 0.8, 1.8, 3.5, 6, 8.5, 10,
+    10, 9.5, 9, 8.5, 8, 7, 5.5, 4, 3, 2.2, 1.8, 1.5,
+])
+PERFIL_LABORAL = PERFIL_LABORAL / PERFIL_LABORAL.sum()
+PERFIL_FIN_SEMANA = PERFIL_FIN_SEMANA / PERFIL_FIN_SEMANA.sum()
+
+# Lunes a domingo, para ubicaciones de uso cotidiano
+FACTOR_DIA_SEMANA = np.array([1.0, 1.05, 1.05, 1.0, 0.95, 0.55, 0.45])
+# Enero a diciembre: menos tráfico en invierno y en febrero (vacaciones)
+FACTOR_MES = np.array([0.9, 0.7, 1.0, 1.0, 0.9, 0.75, 0.7, 0.75, 0.9, 1.05, 1.1, 1.0])
+
+PROB_LLUVIA = 0.08
+FACTOR_LLUVIA = 0.35
+# Desviación del ruido diario de toda la ciudad y del de cada ubicación
+RUIDO_DIA = 0.12
+RUIDO_UBICACION = 0.2
+
+# Probabilidad de que una ubicación quede desconectada en un día, y duración del corte en horas
+PROB_RESPALDO = 0.02
+HORAS_RESPALDO = (1, 6)
+# Lecturas por segundo que envía un equipo al vaciar su respaldo
+RITMO_RESPALDO = 20
+
+STATUS_CADA = 300
+
+LOTE = 5000
+
+
+class Sensor:
+    def __init__(self, id, nombre, direcciones):
+        self.id = id
+        self.nombre = nombre
+        # [(id del sentido, DIRECCION, SENTIDO_LECTURA o None)]
+        self.direcciones = direcciones
+
+
+class Ubicacion:
+    def __init__(self, id, comuna, endpoint, tipo, nombre_formal, recreativa, sensores):
+        self.id = id
+        self.comuna = comuna
+        self.endpoint = endpoint
+        self.tipo = tipo
+        self.nombre_formal = nombre_formal
+        self.recreativa = recreativa
+        self.sensores = sensores
+
+    def topic(self, sensor=None):
+        base = f"Bramal/Bicicla/{self.tipo}/{self.comuna}/{self.endpoint}"
+        return f"{base}/{sensor}" if sensor else f"{base}/control/status"
+
+
+class Red:
+    """Ubicaciones, sensores y direcciones, con ids secuenciales desde 1"""
+
+    def __init__(self, ubicaciones=40, sensores_por_ubicacion=(1, 3), direcciones_por_sensor=(1, 3), semilla=42):
+        rng = np.random.default_rng([semilla, 0])
+        self.ubicaciones = []
+        id_sensor = id_sentido = 0
+        for i in range(ubicaciones):
+            comuna = COMUNAS[i % len(COMUNAS)]
+            sensores = []
+            for _ in range(int(rng.integers(sensores_por_ubicacion[0], sensores_por_ubicacion[1] + 1))):
+                id_sensor += 1
+                cantidad = int(rng.integers(direcciones_por_sensor[0], direcciones_por_sensor[1] + 1))
+                direcciones = []
+                for j in rng.choice(len(DIRECCIONES), min(cantidad, len(DIRECCIONES)), replace=False).tolist():
+                    id_sentido += 1
+                    direccion, sentido = DIRECCIONES[j]
+                    # Como en producción, parte de las direcciones nunca recibe un sentido asignado
+                    direcciones.append((id_sentido, direccion, sentido if rng.random() > 0.15 else None))
+                sensores.append(Sensor(id_sensor, f"BC{id_sensor:02d}", direcciones))
+            self.ubicaciones.append(Ubicacion(
+                id=i + 1,
+                comuna=comuna,
+                endpoint=f"{comuna.lower().replace(' ', '_')}_{i + 1:03d}",
+                tipo="Totem" if i % 3 == 0 else "Contador",
+                nombre_formal=f"{comuna} punto {i + 1}",
+                recreativa=bool(rng.random() < 0.25),
+                sensores=sensores,
+            ))
+
+        # Canales: una fila por (ubicación, sensor, dirección), que es la unidad que genera lecturas
+        self.canales = []
+        indice_ubicacion = []
+        for k, u in enumerate(self.ubicaciones):
+            for s in u.sensores:
+                for _, direccion, sentido in s.direcciones:
+                    self.canales.append((s.nombre, u.id, s.id, u.comuna, u.endpoint, direccion, sentido))
+                    indice_ubicacion.append(k)
+        self.indice_ubicacion = np.array(indice_ubicacion, dtype=np.int64)
+        pesos = rng.lognormal(0, 1.0, len(self.canales))
+        self.pesos = pesos / pesos.sum()
+        # Factor de fin de semana por canal: las ubicaciones recreativas suben en vez de bajar
+        recreativas = np.array([u.recreativa for u in self.ubicaciones])
+        self.factor_fin_semana = np.where(recreativas[self.indice_ubicacion], 2.6, 1.0)
+
+
+class Generador:
+    """
+    Genera las lecturas de una Red entre [desde, hasta), día a día.
+
+    `eventos` es el total esperado: la escala del modelo se calibra para que la suma de
+    intensidades del período sea ese número (el total real varía por el ruido de Poisson).
+    """
+
+    def __init__(self, red, eventos, desde, hasta, semilla=42, prob_respaldo=PROB_RESPALDO, ahora=None):
+        self.red = red
+        self.desde = desde
+        self.hasta = hasta
+        self.semilla = semilla
+        self.prob_respaldo = prob_respaldo
+        self.ahora = np.datetime64(ahora or datetime.now(), "s")
+        self.dias = max(1, (hasta - desde).days)
+
+        esperado = 0.0
+        fin_semana = float(np.dot(red.pesos, red.factor_fin_semana))
+        for d in range(self.dias):
+            dia = desde + timedelta(days=d)
+            base = self._factor_calendario(dia) * (1 - PROB_LLUVIA * (1 - FACTOR_LLUVIA))
+            esperado += base * (fin_semana if dia.weekday() >= 5 else 1.0)
+        self.escala = eventos / esperado if esperado else 0.0
+
+    @staticmethod
+    def _factor_calendario(dia):
+        return FACTOR_DIA_SEMANA[dia.weekday()] * FACTOR_MES[dia.month - 1]
+
+    def dias_generados(self):
+        """
+        Por cada día, (dia, canal, real, llegada, respaldo, cortes), con las lecturas ordenadas
+        por llegada. `cortes` es {índice de ubicación: (inicio, reconexión)} en segundos del día.
+        """
+        red = self.red
+        for d in range(self.dias):
+            dia = self.desde + timedelta(days=d)
+            # Un generador por día: el resultado de un día no depende de los anteriores
+            rng = np.random.default_rng([self.semilla, 1, dia.toordinal()])
+            inicio_dia = np.datetime64(dia, "s")
+            if inicio_dia > self.ahora:
+                break
+
+            fin_semana = dia.weekday() >= 5
+            factor = self.escala * self._factor_calendario(dia) * rng.lognormal(-RUIDO_DIA ** 2 / 2, RUIDO_DIA)
+            if rng.random() < PROB_LLUVIA:
+                factor *= FACTOR_LLUVIA
+            ruido_ubicacion = rng.lognormal(-RUIDO_UBICACION ** 2 / 2, RUIDO_UBICACION, len(red.ubicaciones))[red.indice_ubicacion]
+            por_canal = factor * red.pesos * ruido_ubicacion
+            if fin_semana:
+                por_canal = por_canal * red.factor_fin_semana
+            perfil = PERFIL_FIN_SEMANA if fin_semana else PERFIL_LABORAL
+            conteos = rng.poisson(np.outer(por_canal, perfil)).ravel()
+
+            celdas = np.repeat(np.arange(conteos.size), conteos)
+            canal = celdas // 24
+            segundos = (celdas % 24) * 3600 + rng.integers(0, 3600, celdas.size)
+            llegada_seg = segundos.copy()
+            respaldo = np.zeros(celdas.size, dtype=bool)
+
+            # Cortes de conexión: las lecturas del corte llegan juntas al reconectarse
+            cortes = {}
+            for k in np.flatnonzero(rng.random(len(red.ubicaciones)) < self.prob_respaldo).tolist():
+                horas = int(rng.integers(HORAS_RESPALDO[0], HORAS_RESPALDO[1] + 1))
+                inicio = int(rng.integers(0, 23 - horas)) * 3600 + int(rng.integers(0, 3600))
+                reconexion = inicio + horas * 3600 + int(rng.integers(60, 900))
+                cortes[k] = (inicio, reconexion)
+                en_corte = (red.indice_ubicacion[canal] == k) & (segundos >= inicio) & (segundos < reconexion)
+                posiciones = np.flatnonzero(en_corte)
+                posiciones = posiciones[np.argsort(segundos[posiciones], kind="stable")]
+                llegada_seg[posiciones] = reconexion + np.arange(posiciones.size) // RITMO_RESPALDO
+                respaldo[posiciones] = True
+
+            orden = np.argsort(llegada_seg, kind="stable")
+            canal, segundos, llegada_seg, respaldo = canal[orden], segundos[orden], llegada_seg[orden], respaldo[orden]
+            real = inicio_dia + segundos.astype("timedelta64[s]")
+            llegada = inicio_dia + llegada_seg.astype("timedelta64[s]")
+            visibles = llegada <= self.ahora
+            if not visibles.all():
+                canal, real, llegada, respaldo = canal[visibles], real[visibles], llegada[visibles], respaldo[visibles]
+            yield dia, canal, real, llegada, respaldo, cortes
+
+    def filas_lecturas(self, lote=LOTE):
+        """Lotes de tuplas en el orden de COLUMNAS_LECTURAS, ordenadas por FECHA_LECTURA"""
+        canales = self.red.canales
+        pendiente = []
+        for _, canal, real, llegada, _, _ in self.dias_generados():
+            fechas = real.astype("datetime64[D]")
+            horas = (real - fechas).astype("timedelta64[s]")
+            for c, momento, fecha, hora in zip(canal.tolist(), llegada.tolist(), fechas.tolist(), horas.tolist()):
+                pendiente.append(canales[c] + (momento, fecha, hora))
+                if len(pendiente) >= lote:
+                    yield pendiente
+                    pendiente = []
+        if pendiente:
+            yield pendiente
+
+    def mensajes(self, status_cada=STATUS_CADA):
+        """
+        (momento de llegada, topic, payload JSON) en orden de llegada, incluidos los status que
+        los Totem envían cada `status_cada` segundos (0 los omite)
+        """
+        red = self.red
+        totems = [k for k, u in enumerate(red.ubicaciones) if u.tipo == "Totem"] if status_cada > 0 else []
+        conectado_desde = {k: np.datetime64(self.desde, "s") for k in totems}
+        for dia, canal, real, llegada, respaldo, cortes in self.dias_generados():
+            inicio_dia = np.datetime64(dia, "s")
+            lecturas = self._mensajes_lecturas(canal, real, llegada, respaldo)
+            status = []
+            for k in totems:
+                u = red.ubicaciones[k]
+                momentos = np.arange(k * 7 % status_cada, 86400, status_cada)
+                if k in cortes:
+                    inicio, reconexion = cortes[k]
+                    momentos = momentos[(momentos < inicio) | (momentos >= reconexion)]
+                    momentos = np.unique(np.append(momentos, reconexion))
+                for segundo in momentos.tolist():
+                    momento = inicio_dia + np.timedelta64(segundo, "s")
+                    if momento > self.ahora:
+                        break
+                    if k in cortes and segundo == cortes[k][1]:
+                        conectado_desde[k] = momento
+                    payload = {
+                        "dashboard_enabled": True,
+                        "mqtt_connected": True,
+                        "timestamp": str(momento),
+                        "device": f"totem-{u.endpoint}",
+                        "uptime": int((momento - conectado_desde[k]) / np.timedelta64(1, "s")),
+                    }
+                    status.append((momento.item(), u.topic(), json.dumps(payload)))
+            status.sort(key=lambda m: m[0])
+            yield from heapq.merge(lecturas, status, key=lambda m: m[0])
+
+    def _mensajes_lecturas(self, canal, real, llegada, respaldo):
+        red = self.red
+        topics = [red.ubicaciones[red.indice_ubicacion[c]].topic(nombre) for c, (nombre, *_) in enumerate(red.canales)]
+        normales = [json.dumps({"direction": c[5]}) for c in red.canales]
+        for c, momento_real, momento, es_respaldo in zip(canal.tolist(), real.tolist(), llegada.tolist(), respaldo.tolist()):
+            if es_respaldo:
+                payload = json.dumps({
+                    "direction": red.canales[c][5],
+                    "reading_date": momento_real.date().isoformat(),
+                    "reading_time": momento_real.time().isoformat(),
+                })
+            else:
+                payload = normales[c]
+            yield momento, topics[c], payload
+
+
+def cantidad(valor):
+    """Acepta 1000000, 1M, 10M, 500k..."""
+    valor = valor.strip().lower().replace("_", "")
+    multiplicador = {"k": 1_000, "m": 1_000_000}.get(valor[-1:], 1)
+    if multiplicador != 1:
+        valor = valor[:-1]
+    return int(float(valor) * multiplicador)
+
+
+def agregar_argumentos_red(parser):
+    """Parámetros de la red y del período, compartidos con benchmarks.sembrar"""
+    parser.add_argument("--eventos", "--lecturas", dest="eventos", type=cantidad, default=cantidad("1M"),
+                        help="Lecturas esperadas en el período (1M, 10M, 50M...)")
+    parser.add_argument("--anios", type=float, default=3, help="Años de historia hasta hoy")
+    parser.add_argument("--dias", type=int, help="Días de historia hasta hoy (reemplaza a --anios)")
+    parser.add_argument("--ubicaciones", type=int, default=40)
+    parser.add_argument("--prob-respaldo", type=float, default=PROB_RESPALDO,
+                        help="Probabilidad diaria de corte con respaldo por ubicación")
+    parser.add_argument("--semilla", type=int, default=42)
+
+
+def generador_desde_argumentos(args):
+    hasta = date.today() + timedelta(days=1)
+    dias = args.dias if args.dias else max(1, round(args.anios * 365))
+    red = Red(args.ubicaciones, semilla=args.semilla)
+    return Generador(red, args.eventos, hasta - timedelta(days=dias), hasta, args.semilla, args.prob_respaldo)
+
+
+def _valor_tsv(valor):
+    if valor is None:
+        return "\\N"
+    return str(valor).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+
+
+def escribir_lecturas(generador, salida):
+    # Las columnas fijas de cada canal se formatean una sola vez y las fechas con numpy, día a día
+    prefijos = ["\t".join(_valor_tsv(v) for v in c) + "\t" for c in generador.red.canales]
+    total = 0
+    for _, canal, real, llegada, _, _ in generador.dias_generados():
+        salida.write("".join([
+            f"{prefijos[c]}{l[:10]} {l[11:]}\t{r[:10]}\t{r[11:]}\n"
+            for c, l, r in zip(
+                canal.tolist(),
+                np.datetime_as_string(llegada, unit="s").tolist(),
+                np.datetime_as_string(real, unit="s").tolist(),
+            )
+        ]))
+        total += len(canal)
+    return total
+
+
+def escribir_mensajes(generador, salida, status_cada=STATUS_CADA):
+    total = 0
+    for momento, topic, payload in generador.mensajes(status_cada):
+        salida.write(json.dumps({"momento": momento.isoformat(), "topic": topic, "payload": payload}, ensure_ascii=False) + "\n")
+        total += 1
+    return total
+
+
+async def publicar(mensajes, broker, puerto=1883, ritmo=100, usuario="", clave="", detener=None):
+    """
+    Publica (momento, topic, payload) en un broker MQTT a `ritmo` mensajes por segundo
+    (0 = tan rápido como se pueda). Devuelve la cantidad publicada.
+    """
+    from gmqtt import Client as MQTTClient
+
+    cliente = MQTTClient(f"bicicla-generador-{time.time_ns()}")
+    if usuario and clave:
+        cliente.set_auth_credentials(usuario, clave)
+    await cliente.connect(broker, puerto, version=4)
+    total = 0
+    inicio = time.perf_counter()
+    try:
+        for _, topic, payload in mensajes:
+            if detener is not None and detener.is_set():
+                break
+            cliente.publish(topic, payload, qos=0)
+            total += 1
+            if ritmo > 0:
+                atraso = total / ritmo - (time.perf_counter() - inicio)
+                if atraso > 0:
+                    await asyncio.sleep(atraso)
+            elif total % 1000 == 0:
+                await asyncio.sleep(0)
+    finally:
+        await cliente.disconnect()
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    agregar_argumentos_red(parser)
+    parser.add_argument("--formato", choices=("lecturas", "mqtt"), default="lecturas")
+    parser.add_argument("--salida", default="-", help="Archivo de salida, o - para la salida estándar")
+    parser.add_argument("--publicar", metavar="HOST[:PUERTO]", help="Publica los mensajes en un broker en vez de escribirlos")
+    parser.add_argument("--ritmo", type=float, default=100, help="Mensajes por segundo al publicar (0 = sin límite)")
+    parser.add_argument("--status-cada", type=int, default=STATUS_CADA,
+                        help="Segundos entre mensajes de status de cada Totem (0 = sin status)")
+    args = parser.parse_args()
+
+    generador = generador_desde_argumentos(args)
+    t0 = time.perf_counter()
+    if args.publicar:
+        host, _, puerto = args.publicar.partition(":")
+        total = asyncio.run(publicar(
+            generador.mensajes(args.status_cada), host, int(puerto or 1883), args.ritmo,
+            os.getenv("MQTT_USER", ""), os.getenv("MQTT_PASSWORD", "")
+        ))
+    else:
+        salida = sys.stdout if args.salida == "-" else open(args.salida, "w", encoding="utf-8", newline="")
+        try:
+            if args.formato == "lecturas":
+                total = escribir_lecturas(generador, salida)
+            else:
+                total = escribir_mensajes(generador, salida, args.status_cada)
+        finally:
+            if salida is not sys.stdout:
+                salida.close()
+    print(f"{total:,} eventos en {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Migración y mantenimiento del particionado mensual de LECTURAS (app.partitions).
+
+Uso:
+    python -m benchmarks.particiones estado
+    python -m benchmarks.particiones migrar [--meses-futuros 3] [--aplicar]
+    python -m benchmarks.particiones futuras
+    python -m benchmarks.particiones eliminar --antes 2022-01-01 [--aplicar]
+    python -m benchmarks.particiones archivar --particion p202101 --tabla LECTURAS_202101
+    python -m benchmarks.particiones verificar
+
+Usa la configuración MYSQL_* de la aplicación. `migrar` y `eliminar` sin --aplicar solo
+muestran lo que harían. `migrar` reconstruye la tabla entera (extiende la clave primaria
+con FECHA_LECTURA y la particiona), así que en producción va en una ventana de mantenimiento.
+
+`verificar` ejecuta EXPLAIN sobre las consultas de LECTURAS de /consulta y de los gráficos
+(tramo crudo) para hoy, semana, mes y año, y compara la columna `partitions` con las
+particiones que cruza cada rango. Como referencia muestra también el filtro antiguo con
+DATE(FECHA_LECTURA), que no permite descartar particiones. Termina con código 1 si alguna
+consulta lee particiones de más.
+"""
+import argparse
+import sys
+from datetime import date, timedelta
+
+import mysql.connector
+
+from app import partitions
+from app.chart_engine import Filtros, _consulta_segmento, planificar_periodo
+from app.database import MYSQL_DB, MYSQL_HOST, MYSQL_PASSWORD, MYSQL_PORT, MYSQL_USER
+from app.endpoints.readings import _filtros_consulta, rango_consulta
+from app.query_planner import FUENTE_CRUDA, Segmento
+
+PERIODOS = ["hoy", "semana", "mes", "anio"]
+
+
+def conectar():
+    return mysql.connector.connect(
+        host=MYSQL_HOST, port=MYSQL_PORT, user=MYSQL_USER, password=MYSQL_PASSWORD,
+        database=MYSQL_DB, autocommit=True
+    )
+
+
+def particiones_explain(cursor, sql, params):
+    """Particiones que EXPLAIN dice que se leen de LECTURAS"""
+    cursor.execute("EXPLAIN " + sql, params)
+    filas = cursor.fetchall()
+    columnas = [c[0].lower() for c in cursor.description]
+    for fila in filas:
+        registro = dict(zip(columnas, fila))
+        if registro.get("table") in ("l", "crudas", partitions.TABLA):
+            return [p for p in (registro.get("partitions") or "").split(",") if p]
+    return []
+
+
+def consultas_verificacion(conn):
+    """(nombre, sql, params, inicio, fin, se_exige_poda) de las consultas que se verifican"""
+    consultas = []
+    for periodo in PERIODOS:
+        condiciones, params = _filtros_consulta(conn, None, None, None, periodo, None, None, None, None)
+        inicio, fin = rango_consulta(periodo)
+        sql = f"""
+            SELECT l.fecha_lectura, l.comuna, l.ubicacion_endpoint, l.sentido_lectura
+            FROM LECTURAS l
+            JOIN UBICACIONES u ON l.id_ubicacion = u.id_ubicacion
+            WHERE 1=1{condiciones}
+            ORDER BY l.fecha_lectura DESC
+            LIMIT 1000
+        """
+        consultas.append((f"consulta {periodo}", sql, params, inicio, fin, True))
+
+        plan = planificar_periodo(periodo)
+        sql, params = _consulta_segmento(plan, Segmento(FUENTE_CRUDA, plan.inicio, plan.fin), Filtros(), "sentido_lectura")
+        consultas.append((f"grafico {periodo}", sql, params, plan.inicio, plan.fin, True))
+
+    inicio, fin = rango_consulta("mes")
+    sql = "SELECT COUNT(*) FROM LECTURAS WHERE DATE(FECHA_LECTURA) >= %s AND DATE(FECHA_LECTURA) <= %s"
+    consultas.append(("referencia DATE() mes", sql, [inicio.date(), (fin - timedelta(days=1)).date()], inicio, fin, False))
+    return consultas
+
+
+def verificar(conn):
+    cursor = conn.cursor()
+    try:
+        lista = partitions.particiones(cursor)
+        if not lista:
+            sys.exit(f"{partitions.TABLA} no está particionada; ejecute primero `migrar --aplicar`")
+        print(f"{len(lista)} particiones: {lista[0]['nombre']} … {lista[-1]['nombre']}\n")
+
+        fallas = 0
+        for nombre, sql, params, inicio, fin, exigir in consultas_verificacion(conn):
+            leidas = particiones_explain(cursor, sql, params)
+            esperadas = partitions.tocadas(lista, inicio, fin)
+            sobrantes = sorted(set(leidas) - set(esperadas))
+            if not exigir:
+                estado = "ref"
+            elif sobrantes:
+                estado = "FALLA"
+                fallas += 1
+            else:
+                estado = "ok"
+            print(f"{estado:6s}{nombre:24s}{len(leidas):4d}/{len(lista)}  {','.join(leidas) or '-'}")
+            if sobrantes and exigir:
+                print(f"{'':30s}de más: {','.join(sobrantes)}")
+    finally:
+        cursor.close()
+    if fallas:
+        sys.exit(f"\n{fallas} consultas leen particiones fuera de su rango")
+
+
+def mostrar_estado(conn):
+    cursor = conn.cursor()
+    try:
+        lista = partitions.particiones(cursor)
+    finally:
+        cursor.close()
+    if not lista:
+        print(f"{partitions.TABLA} no está particionada")
+        return
+    for p in lista:
+        desde = p["desde"].date().isoformat() if p["desde"] else "-"
+        hasta = p["hasta"].date().isoformat() if p["hasta"] else "MAXVALUE"
+        print(f"{p['nombre']:10s}{desde:>12s} → {hasta:<10s}{p['filas']:>14,}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    comandos = parser.add_subparsers(dest="comando", required=True)
+    comandos.add_parser("estado", help="Lista las particiones y sus filas estimadas")
+    migrar = comandos.add_parser("migrar", help="Particiona LECTURAS por mes")
+    migrar.add_argument("--meses-futuros", type=int, default=partitions.PARTICIONES_MESES_FUTUROS)
+    migrar.add_argument("--aplicar", action="store_true", help="Ejecuta la sentencia en vez de solo mostrarla")
+    comandos.add_parser("futuras", help="Crea las particiones de los meses siguientes")
+    eliminar = comandos.add_parser("eliminar", help="Elimina los meses completos anteriores a una fecha")
+    eliminar.add_argument("--antes", type=date.fromisoformat, required=True, metavar="AAAA-MM-DD")
+    eliminar.add_argument("--aplicar", action="store_true", help="Elimina en vez de solo listar")
+    archivar = comandos.add_parser("archivar", help="Mueve una partición a una tabla nueva (EXCHANGE PARTITION)")
+    archivar.add_argument("--particion", required=True)
+    archivar.add_argument("--tabla", required=True)
+    comandos.add_parser("verificar", help="Comprueba con EXPLAIN que las consultas por período descartan particiones")
+    args = parser.parse_args()
+
+    conn = conectar()
+    try:
+        if args.comando == "estado":
+            mostrar_estado(conn)
+        elif args.comando == "migrar":
+            try:
+                sentencia = partitions.migrar(conn, args.meses_futuros, aplicar=args.aplicar)
+            except RuntimeError as e:
+                sys.exit(str(e))
+            print(sentencia)
+            print("\nAplicada" if args.aplicar else "\nRepita con --aplicar para ejecutarla")
+        elif args.comando == "futuras":
+            creadas = partitions.asegurar_futuras(conn)
+            print(f"Creadas: {', '.join(creadas)}" if creadas else "No faltaban particiones")
+        elif args.comando == "eliminar":
+            nombres = partitions.eliminar_anteriores(conn, args.antes, aplicar=args.aplicar)
+            if not nombres:
+                print("No hay meses completos anteriores a esa fecha")
+            else:
+                print(("Eliminadas: " if args.aplicar else "Se eliminarían (repita con --aplicar): ") + ", ".join(nombres))
+        elif args.comando == "archivar":
+            filas = partitions.intercambiar(conn, args.particion, args.tabla)
+            print(f"~{filas:,} filas de {args.particion} ahora están en {args.tabla}; la partición quedó vacía")
+        else:
+            verificar(conn)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
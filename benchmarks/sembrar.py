@@ -0,0 +1,149 @@
+"""
+Carga una base MySQL local con datos sintéticos para los benchmarks.
+
+Uso:
+    python -m benchmarks.sembrar --lecturas 10M --anios 3 --confirmar
+
+Usa la configuración MYSQL_* de la aplicación. Es destructivo: borra y vuelve a crear
+LECTURAS, SENSORES, UBICACIONES, SENTIDOS_SENSOR y las tablas derivadas, así que solo
+corre contra localhost salvo que se pase --permitir-remoto. Los índices secundarios de
+LECTURAS se crean al final de la carga y luego se calculan los rollups. Con --particionar
+LECTURAS queda particionada por mes, como después de `python -m benchmarks.particiones migrar`.
+
+Las ubicaciones, sensores y lecturas salen de benchmarks.generador (mismos parámetros de red,
+período y semilla), así que la base queda igual que lo que ese generador escribe en archivo.
+
+La base debe llamarse BICICLA (MYSQL_DB): algunos endpoints califican las tablas con ese esquema.
+
+Volúmenes de referencia: 1M, 10M y 50M lecturas repartidas en varios años.
+"""
+import argparse
+import sys
+import time
+
+import mysql.connector
+import numpy as np
+
+from app import partitions, rollups
+from app.database import MYSQL_DB, MYSQL_HOST, MYSQL_PASSWORD, MYSQL_PORT, MYSQL_USER
+from benchmarks import esquema, generador
+
+HOSTS_LOCALES = {"localhost", "127.0.0.1", "::1"}
+
+SQL_LECTURA = f"""
+    INSERT INTO LECTURAS ({", ".join(generador.COLUMNAS_LECTURAS)})
+    VALUES ({", ".join(["%s"] * len(generador.COLUMNAS_LECTURAS))})
+"""
+
+
+def conectar():
+    return mysql.connector.connect(
+        host=MYSQL_HOST, port=MYSQL_PORT, user=MYSQL_USER, password=MYSQL_PASSWORD,
+        database=MYSQL_DB, autocommit=False
+    )
+
+
+def sembrar_dimensiones(conn, red, semilla):
+    """Crea ubicaciones, sensores y sentidos de la red con sus mismos ids"""
+    rng = np.random.default_rng([semilla, 2])
+    cursor = conn.cursor()
+    try:
+        for u in red.ubicaciones:
+            cursor.execute(
+                """
+                INSERT INTO UBICACIONES (ID_UBICACION, COMUNA, UBICACION_ENDPOINT, TIPO_EQUIPO, NOMBRE_FORMAL)
+                VALUES (%s, %s, %s, %s, %s)
+                """,
+                (u.id, u.comuna, u.endpoint, u.tipo, u.nombre_formal)
+            )
+            for s in u.sensores:
+                cursor.execute(
+                    """
+                    INSERT INTO SENSORES (ID_SENSOR, NOMBRE_SENSOR, ID_UBICACION, NOMBRE_FORMAL, SENTIDO_LECTURA, ESTADO_SENSOR, LAT_SENSOR, LNG_SENSOR)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                    """,
+                    (s.id, s.nombre, u.id, f"Sensor {s.nombre}",
+                     "Bidireccional" if len(s.direcciones) > 1 else s.direcciones[0][2],
+                     "active" if rng.random() > 0.1 else "inactive",
+                     round(-33.45 + rng.normal(0, 0.05), 7), round(-70.65 + rng.normal(0, 0.05), 7))
+                )
+                cursor.executemany(
+                    "INSERT INTO SENTIDOS_SENSOR (ID, ID_SENSOR, DIRECCION, SENTIDO_LECTURA) VALUES (%s, %s, %s, %s)",
+                    [(id_sentido, s.id, direccion, sentido) for id_sentido, direccion, sentido in s.direcciones]
+                )
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+def cargar_lecturas(conn, filas_por_lote):
+    cursor = conn.cursor()
+    cursor.execute("SET SESSION unique_checks = 0")
+    cursor.execute("SET SESSION foreign_key_checks = 0")
+    total = 0
+    inicio = time.perf_counter()
+    try:
+        for lote in filas_por_lote:
+            cursor.executemany(SQL_LECTURA, lote)
+            conn.commit()
+            total += len(lote)
+            if total % 500_000 < len(lote):
+                velocidad = total / (time.perf_counter() - inicio)
+                print(f"  {total:,} lecturas ({velocidad:,.0f}/s)", flush=True)
+    finally:
+        cursor.close()
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    generador.agregar_argumentos_red(parser)
+    parser.add_argument("--particionar", action="store_true", help="Particiona LECTURAS por mes (app.partitions)")
+    parser.add_argument("--sin-rollups", action="store_true", help="No calcular LECTURAS_HORA / LECTURAS_DIA")
+    parser.add_argument("--confirmar", action="store_true", help="Confirma que se pueden borrar las tablas")
+    parser.add_argument("--permitir-remoto", action="store_true", help="Permite un MYSQL_HOST distinto de localhost")
+    args = parser.parse_args()
+
+    destino = f"{MYSQL_USER}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DB}"
+    if MYSQL_HOST not in HOSTS_LOCALES and not args.permitir_remoto:
+        sys.exit(f"{destino} no es local; use --permitir-remoto si de verdad es una base de pruebas")
+    if not args.confirmar:
+        sys.exit(f"Esto borra las tablas de {destino}; repita con --confirmar")
+
+    gen = generador.generador_desde_argumentos(args)
+
+    conn = conectar()
+    try:
+        print(f"Creando esquema en {destino}")
+        esquema.crear_esquema(conn)
+        sembrar_dimensiones(conn, gen.red, args.semilla)
+        print(f"{len(gen.red.ubicaciones)} ubicaciones, {len(gen.red.canales)} sentidos")
+
+        print(f"Cargando ~{args.eventos:,} lecturas entre {gen.desde} y {gen.hasta}")
+        t0 = time.perf_counter()
+        total = cargar_lecturas(conn, gen.filas_lecturas())
+        print(f"{total:,} lecturas en {time.perf_counter() - t0:.0f}s")
+
+        print("Creando índices de LECTURAS")
+        t0 = time.perf_counter()
+        esquema.crear_indices_lecturas(conn)
+        print(f"Índices en {time.perf_counter() - t0:.0f}s")
+
+        if args.particionar:
+            print("Particionando LECTURAS por mes")
+            t0 = time.perf_counter()
+            partitions.migrar(conn, aplicar=True)
+            print(f"Particiones en {time.perf_counter() - t0:.0f}s")
+
+        if not args.sin_rollups:
+            print("Calculando rollups")
+            t0 = time.perf_counter()
+            conn.autocommit = True
+            rollups.actualizar(conn)
+            print(f"Rollups en {time.perf_counter() - t0:.0f}s")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
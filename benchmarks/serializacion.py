@@ -0,0 +1,163 @@
+"""
+Compara el costo de serializar las respuestas grandes por la ruta estándar de FastAPI
+(validación contra response_model + jsonable_encoder + JSONResponse) y por RespuestaRapida.
+
+Uso:
+    python -m benchmarks.serializacion [--repeticiones 20] [--json salida.json]
+
+Las cargas son sintéticas pero con la forma y el tamaño de respuestas reales:
+gráficos de un año en cubetas de 15 minutos, la consulta de 1000 lecturas,
+la lista de sensores y el resumen del dashboard.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from datetime import datetime, timedelta
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute, serialize_response
+
+from app.endpoints import dashboard, readings, sensors
+from app.fast_response import RespuestaRapida
+
+
+def _ruta(router, path):
+    for ruta in router.routes:
+        if isinstance(ruta, APIRoute) and ruta.path == path:
+            return ruta
+    raise KeyError(path)
+
+
+def carga_grafico(cubetas):
+    return {
+        "etiquetas": [f"{i // 96:03d} {(i % 96) // 4:02d}:{(i % 4) * 15:02d}" for i in range(cubetas)],
+        "datos": [random.randint(0, 500) for _ in range(cubetas)],
+        "total": 0,
+    }
+
+
+def carga_grafico_detallado(cubetas, series):
+    return {
+        "etiquetas": [f"{i // 96:03d} {(i % 96) // 4:02d}:{(i % 4) * 15:02d}" for i in range(cubetas)],
+        "series": [
+            {"nombre": f"Sentido {s}", "datos": [random.randint(0, 200) for _ in range(cubetas)], "color": "#4f46e5"}
+            for s in range(series)
+        ],
+        "total": 0,
+    }
+
+
+def carga_consulta(filas):
+    inicio = datetime(2025, 1, 1)
+    lecturas = []
+    for i in range(filas):
+        momento = inicio + timedelta(minutes=i)
+        lecturas.append({
+            "fecha": momento.strftime('%d/%m/%Y'),
+            "hora": momento.strftime('%H:%M'),
+            "comuna": "Providencia",
+            "ubicacion": f"ubicacion_{i % 20}",
+            "sentido": random.choice(["Norte", "Sur", None]),
+            "cantidad": 1,
+        })
+    return {"lecturas": lecturas, "total": filas}
+
+
+def carga_sensores(cantidad):
+    return [
+        {
+            "id": i,
+            "nombre_sensor_formal": f"Sensor {i}",
+            "ubicacion": {"id": i % 40, "comuna": "Santiago", "nombre": f"Ubicación {i % 40}", "tipo_equipo": "Totem"},
+            "latitud": -33.4 - i / 1000,
+            "longitud": -70.6 - i / 1000,
+            "sentido_lectura": "Norte",
+            "conteo_hoy": random.randint(0, 3000),
+            "estado": {"codigo": "active", "descripcion": "Activo"},
+            "ultima_lectura": datetime(2025, 1, 1, 12, 0, i % 60).isoformat(),
+        }
+        for i in range(cantidad)
+    ]
+
+
+def carga_dashboard():
+    return {
+        "ciclistas_hoy": {"total": 1234, "variacion_porcentual": 3.2},
+        "promedio_diario": {"total": 1100.5, "variacion_porcentual": -1.0},
+        "ciclistas_mes": {"total": 30000, "variacion_porcentual": 5.5},
+        "sensores": {"total": 80, "activos": 75, "inactivos": 5},
+        "tendencia_semanal": {
+            "periodo": "semana actual",
+            "datos": [{"dia": d, "fecha": f"2025-01-0{i + 1}", "total": 1000 + i} for i, d in enumerate(["Lun", "Mar", "Mié", "Jue", "Vie", "Sáb", "Dom"])],
+        },
+        "top_comunas": [{"COMUNA": f"Comuna {i}", "total": 500 - i} for i in range(5)],
+        "sensores_top": [{"id": i, "nombre": f"BC{i:02d}", "conteo_hoy": 300 - i, "estado": "active"} for i in range(5)],
+    }
+
+
+def casos():
+    return [
+        ("/readings/grafico (1 año, 15 min)", _ruta(readings.router, "/grafico"), carga_grafico(35040)),
+        ("/readings/grafico_detallado (1 año, 15 min, 4 series)", _ruta(readings.router, "/grafico_detallado"), carga_grafico_detallado(35040, 4)),
+        ("/readings/grafico_detallado (semana, 3 series)", _ruta(readings.router, "/grafico_detallado"), carga_grafico_detallado(7, 3)),
+        ("/readings/consulta (1000 lecturas)", _ruta(readings.router, "/consulta"), carga_consulta(1000)),
+        ("/sensors/list (200 sensores)", _ruta(sensors.router, "/list"), carga_sensores(200)),
+        ("/dashboard/summary", _ruta(dashboard.router, "/summary"), carga_dashboard()),
+    ]
+
+
+async def _ruta_estandar(ruta, contenido):
+    datos = await serialize_response(field=ruta.response_field, response_content=contenido)
+    return JSONResponse(datos).body
+
+
+def _medir(funcion, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - t0)
+    tiempos.sort()
+    return tiempos[len(tiempos) // 2] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeticiones", type=int, default=20)
+    parser.add_argument("--json", help="Archivo donde guardar los resultados")
+    args = parser.parse_args()
+
+    random.seed(42)
+    loop = asyncio.new_event_loop()
+    resultados = []
+    for nombre, ruta, contenido in casos():
+        estandar = loop.run_until_complete(_ruta_estandar(ruta, contenido))
+        rapida = RespuestaRapida(contenido).body
+        if json.loads(estandar) != json.loads(rapida):
+            raise SystemExit(f"Las dos rutas no producen el mismo JSON para {nombre}")
+
+        ms_estandar = _medir(lambda: loop.run_until_complete(_ruta_estandar(ruta, contenido)), args.repeticiones)
+        ms_rapida = _medir(lambda: RespuestaRapida(contenido).body, args.repeticiones)
+        resultados.append({
+            "endpoint": nombre,
+            "bytes": len(rapida),
+            "estandar_ms": round(ms_estandar, 3),
+            "rapida_ms": round(ms_rapida, 3),
+            "ahorro_ms": round(ms_estandar - ms_rapida, 3),
+            "aceleracion": round(ms_estandar / ms_rapida, 1) if ms_rapida else None,
+        })
+    loop.close()
+
+    print(f"{'endpoint':58} {'bytes':>9} {'estándar ms':>12} {'rápida ms':>10} {'x':>6}")
+    for r in resultados:
+        print(f"{r['endpoint']:58} {r['bytes']:>9} {r['estandar_ms']:>12.3f} {r['rapida_ms']:>10.3f} {r['aceleracion']:>6}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(resultados, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+from datetime import datetime
+
+import pytest
+
+from app import compact_store, query_planner, rollups
+from app.chart_engine import Cubeta
+from app.query_planner import (
+    FUENTE_ARCHIVO, FUENTE_CRUDA, FUENTE_DIARIA, FUENTE_HORARIA, planificar,
+)
+
+
+def tramos(plan):
+    return [(s.fuente.nombre, s.inicio, s.fin) for s in plan.segmentos]
+
+
+def assert_contiguo(plan, inicio, fin):
+    """Los segmentos cubren [inicio, fin) sin huecos ni solapes"""
+    assert plan.segmentos[0].inicio == inicio
+    assert plan.segmentos[-1].fin == fin
+    for anterior, siguiente in zip(plan.segmentos, plan.segmentos[1:]):
+        assert anterior.fin == siguiente.inicio
+    assert all(s.inicio < s.fin for s in plan.segmentos)
+
+
+MARCAS = {
+    FUENTE_DIARIA.nombre: datetime(2024, 1, 4),
+    FUENTE_HORARIA.nombre: datetime(2024, 1, 5, 13),
+}
+
+
+def test_sin_marcas_todo_crudo():
+    inicio, fin = datetime(2024, 1, 1), datetime(2024, 2, 1)
+    plan = planificar(Cubeta("dia"), inicio, fin)
+    assert tramos(plan) == [("cruda", inicio, fin)]
+
+
+def test_bordes_con_horas_y_crudo():
+    inicio, fin = datetime(2024, 1, 1, 10, 30), datetime(2024, 1, 5, 14, 15)
+    plan = planificar(Cubeta("dia"), inicio, fin, marcas=MARCAS)
+    assert tramos(plan) == [
+        ("cruda", inicio, datetime(2024, 1, 1, 11)),
+        ("hora", datetime(2024, 1, 1, 11), datetime(2024, 1, 2)),
+        ("dia", datetime(2024, 1, 2), datetime(2024, 1, 4)),
+        ("hora", datetime(2024, 1, 4), datetime(2024, 1, 5, 13)),
+        ("cruda", datetime(2024, 1, 5, 13), fin),
+    ]
+    assert_contiguo(plan, inicio, fin)
+
+
+def test_rango_alineado_sin_crudo():
+    inicio, fin = datetime(2024, 1, 1), datetime(2024, 1, 3)
+    plan = planificar(Cubeta("dia"), inicio, fin, marcas=MARCAS)
+    assert tramos(plan) == [("dia", inicio, fin)]
+
+
+def test_rango_posterior_a_las_marcas():
+    inicio, fin = datetime(2024, 1, 6), datetime(2024, 1, 7)
+    plan = planificar(Cubeta("dia"), inicio, fin, marcas=MARCAS)
+    assert tramos(plan) == [("cruda", inicio, fin)]
+
+
+def test_rango_menor_que_una_hora():
+    inicio, fin = datetime(2024, 1, 2, 10, 5), datetime(2024, 1, 2, 10, 50)
+    plan = planificar(Cubeta("dia"), inicio, fin, marcas=MARCAS)
+    assert tramos(plan) == [("cruda", inicio, fin)]
+
+
+def test_hora_del_dia_no_usa_rollup_diario():
+    inicio, fin = datetime(2024, 1, 1), datetime(2024, 1, 4)
+    plan = planificar(Cubeta("hora_del_dia"), inicio, fin, marcas=MARCAS)
+    assert plan.fuentes() == {"hora"}
+    assert_contiguo(plan, inicio, fin)
+
+
+@pytest.mark.parametrize("hora_inicio, hora_fin, fuentes", [
+    ("08:00", "17:59", {"hora"}),
+    ("08:30", "17:59", {"cruda"}),
+    ("08:00", "17:30", {"cruda"}),
+])
+def test_franja_horaria(hora_inicio, hora_fin, fuentes):
+    inicio, fin = datetime(2024, 1, 1), datetime(2024, 1, 4)
+    plan = planificar(Cubeta("dia"), inicio, fin, hora_inicio, hora_fin, marcas=MARCAS)
+    assert plan.fuentes() == fuentes
+    assert_contiguo(plan, inicio, fin)
+
+
+@pytest.mark.parametrize("minutos, origen, fuentes", [
+    (15, datetime(2024, 1, 2), {"cruda"}),
+    (60, datetime(2024, 1, 2), {"hora"}),
+    (60, datetime(2024, 1, 2, 0, 30), {"cruda"}),
+    (1440, datetime(2024, 1, 2), {"dia"}),
+])
+def test_cubetas_de_minutos(minutos, origen, fuentes):
+    inicio, fin = datetime(2024, 1, 2), datetime(2024, 1, 4)
+    plan = planificar(Cubeta("minutos", minutos), inicio, fin, marcas=MARCAS, origen=origen)
+    assert plan.fuentes() == fuentes
+
+
+def test_crudo_dividido_en_la_marca_de_archivo():
+    marcas = {rollups.MARCA_ARCHIVO: datetime(2024, 1, 10, 12)}
+    inicio, fin = datetime(2024, 1, 10), datetime(2024, 1, 11)
+    plan = planificar(Cubeta("dia"), inicio, fin, marcas=marcas)
+    assert [s.fuente for s in plan.segmentos] == [FUENTE_ARCHIVO, FUENTE_CRUDA]
+    assert_contiguo(plan, inicio, fin)
+
+
+def test_crudo_entero_en_el_archivo():
+    marcas = {rollups.MARCA_ARCHIVO: datetime(2024, 2, 1)}
+    inicio, fin = datetime(2024, 1, 10, 10, 30), datetime(2024, 1, 10, 10, 45)
+    plan = planificar(Cubeta("dia"), inicio, fin, marcas=marcas)
+    assert tramos(plan) == [("archivo", inicio, fin)]
+
+
+def test_modo_conteos_ignora_el_archivo(monkeypatch):
+    monkeypatch.setattr(compact_store, "LECTURAS_MODO", "conteos")
+    marcas = {rollups.MARCA_ARCHIVO: datetime(2024, 1, 10, 12)}
+    inicio, fin = datetime(2024, 1, 10), datetime(2024, 1, 11)
+    plan = planificar(Cubeta("dia"), inicio, fin, marcas=marcas)
+    assert tramos(plan) == [("cruda", inicio, fin)]
+
+
+def test_columnas_de_rollup_sin_envolver():
+    # Los filtros IN (...) sobre los rollups deben poder usar su clave primaria
+    for fuente in query_planner.FUENTES_ROLLUP:
+        assert all(columna.isidentifier() for columna in fuente.columnas.values())